@@ -0,0 +1,261 @@
+# coding=utf-8
+
+from dataclasses import dataclass
+from datetime import date
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+from eventsourcing.application import AggregateNotFound, Application
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import IntegrityError
+from eventsourcing.utils import get_topic
+from numpy.typing import NDArray
+
+from banking.domainmodel import Account, AccountShard, InterestAccrual
+from banking.projections import NotifiedEvent, Projection, event_topics
+
+if TYPE_CHECKING:  # pragma: no cover
+    from banking.applicationmodel import Bank
+
+DAYS_PER_YEAR = 365
+
+
+class AccountLedger(Projection):
+    """
+    The balance, overdraft limit, closed flag and version of
+    every account, as the account itself has them, and the
+    credits held by its shards, which are not yet swept into
+    the account. They are kept in arrays indexed in the order
+    the accounts were opened, so that they can be computed on
+    all at once.
+
+    It is kept in memory, and built from the start of the log
+    when it is constructed.
+    """
+
+    topics = event_topics(Account) + (
+        get_topic(AccountShard.Opened),
+        get_topic(AccountShard.Credited),
+        get_topic(AccountShard.Swept),
+    )
+
+    def __init__(self, app: Application, capacity: int = 1024):
+        self.index: Dict[UUID, int] = {}
+        self.shard_index: Dict[UUID, int] = {}
+        self.account_ids: List[UUID] = []
+        self.balances = np.zeros(capacity, dtype=np.int64)
+        self.shard_balances = np.zeros(capacity, dtype=np.int64)
+        self.overdraft_limits = np.zeros(capacity, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.is_closed = np.zeros(capacity, dtype=bool)
+        super().__init__(app)
+
+    def __len__(self) -> int:
+        return len(self.account_ids)
+
+    def load_position(self) -> int:
+        return 0
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        for _, event in events:
+            if isinstance(event, AccountShard.Opened):
+                self.shard_index[event.originator_id] = self.index[
+                    event.account_id
+                ]
+                continue
+            if isinstance(event, AccountShard.Credited):
+                self.shard_balances[
+                    self.index[event.account_id]
+                ] += event.amount_in_cents
+                continue
+            if isinstance(event, AccountShard.Swept):
+                self.shard_balances[
+                    self.shard_index[event.originator_id]
+                ] -= event.amount_in_cents
+                continue
+            if isinstance(event, Account.Opened):
+                i = self._append(event.originator_id)
+            else:
+                i = self.index[event.originator_id]
+                if isinstance(event, (Account.Credited, Account.CreditsSwept)):
+                    self.balances[i] += event.amount_in_cents
+                elif isinstance(event, Account.Debited):
+                    self.balances[i] -= event.amount_in_cents
+                elif isinstance(event, Account.OverdraftLimitChanged):
+                    self.overdraft_limits[i] = event.amount_in_cents
+                elif isinstance(event, Account.Closed):
+                    self.is_closed[i] = True
+            # Every event of an account counts, to know the
+            # version the account's next event is saved at.
+            self.versions[i] = event.originator_version
+        self.position = position
+
+    def _append(self, account_id: UUID) -> int:
+        i = len(self.account_ids)
+        if i == len(self.balances):
+            for name in (
+                "balances",
+                "shard_balances",
+                "overdraft_limits",
+                "versions",
+                "is_closed",
+            ):
+                array = getattr(self, name)
+                setattr(
+                    self, name, np.concatenate([array, np.zeros_like(array)])
+                )
+        self.index[account_id] = i
+        self.account_ids.append(account_id)
+        return i
+
+
+@dataclass
+class AccrualReport:
+    day: str
+    accounts: int = 0
+    credited: int = 0
+    debited: int = 0
+    interest_in_cents: int = 0
+    fees_in_cents: int = 0
+    conflicts: int = 0
+    seconds: float = 0.0
+
+
+class AccrualEngine:
+    """
+    Pays a day of interest on the credit balances of a bank's
+    accounts, and charges a day of fees on their overdrawn
+    balances, computed for a batch of accounts at a time with
+    NumPy, from the arrays of an AccountLedger, rather than by
+    loading each account.
+
+    The accrued amounts are recorded as the accounts' Credited
+    and Debited events, saved at the versions the ledger has
+    for the accounts, with the day's InterestAccrual, in one
+    transaction per batch. A batch with an account that moved
+    on since the ledger read it is computed again, after the
+    ledger has caught up, at most `attempts` times.
+    """
+
+    def __init__(
+        self, app: "Bank", batch_size: int = 10_000, attempts: int = 5
+    ):
+        if batch_size <= 0 or attempts <= 0:
+            raise ValueError("An accrual needs a batch size and attempts")
+        self.app = app
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.ledger = AccountLedger(app)
+
+    def run(
+        self, day: date, interest_rate: float, overdraft_rate: float
+    ) -> AccrualReport:
+        """
+        Accrues the day's interest at the annual interest_rate,
+        and fees at the annual overdraft_rate, both rounded down
+        to the cent. A fee never takes an account past its
+        overdraft limit. Closed accounts accrue nothing.
+
+        An accrual of a day that was already started is resumed
+        after its last batch, and its rates can't be changed.
+        """
+        started = perf_counter()
+        self.ledger.pull()
+        rates = (interest_rate, overdraft_rate)
+        accrual = self._get_accrual(day.isoformat(), *rates)
+        report = AccrualReport(accrual.day, accounts=accrual.accounts)
+        conflicts = 0
+        while accrual.posted < accrual.accounts:
+            start = accrual.posted
+            stop = min(start + self.batch_size, accrual.accounts)
+            interest, fees = self._amounts(accrual, start, stop)
+            events = self._events(start, interest, Account.Credited)
+            events += self._events(start, fees, Account.Debited)
+            accrual.post(stop - start)
+            try:
+                self.app.save(*events, accrual)
+            except IntegrityError:
+                # Saved since by another command or process.
+                conflicts += 1
+                report.conflicts += 1
+                if conflicts >= self.attempts:
+                    raise
+                self.ledger.pull()
+                accrual = self._get_accrual(accrual.day, *rates)
+                continue
+            conflicts = 0
+            report.credited += int(np.count_nonzero(interest))
+            report.debited += int(np.count_nonzero(fees))
+            report.interest_in_cents += int(interest.sum())
+            report.fees_in_cents += int(fees.sum())
+        report.seconds = perf_counter() - started
+        return report
+
+    def _get_accrual(
+        self, day: str, interest_rate: float, overdraft_rate: float
+    ) -> InterestAccrual:
+        try:
+            accrual: InterestAccrual = self.app.repository.get(
+                InterestAccrual.create_id(day)
+            )
+        except AggregateNotFound:
+            return InterestAccrual(
+                day, len(self.ledger), interest_rate, overdraft_rate
+            )
+        if (accrual.interest_rate, accrual.overdraft_rate) != (
+            interest_rate,
+            overdraft_rate,
+        ):
+            raise ValueError(
+                f"The accrual of {day} was started with other rates"
+            )
+        return accrual
+
+    def _amounts(
+        self, accrual: InterestAccrual, start: int, stop: int
+    ) -> Tuple[NDArray[np.int64], NDArray[np.int64]]:
+        ledger = self.ledger
+        # Interest and fees are on the balance with the credits
+        # held by the account's shards.
+        balances = (
+            ledger.balances[start:stop] + ledger.shard_balances[start:stop]
+        )
+        is_open = ~ledger.is_closed[start:stop]
+        interest = np.floor(
+            np.maximum(balances, 0) * (accrual.interest_rate / DAYS_PER_YEAR)
+        ).astype(np.int64)
+        fees = np.floor(
+            np.maximum(-balances, 0) * (accrual.overdraft_rate / DAYS_PER_YEAR)
+        ).astype(np.int64)
+        # Account.debit refuses to take the account's own balance
+        # past the overdraft limit, also when the event is replayed.
+        headroom = np.maximum(
+            ledger.balances[start:stop] + ledger.overdraft_limits[start:stop],
+            0,
+        )
+        fees = np.minimum(fees, headroom)
+        return interest * is_open, fees * is_open
+
+    def _events(
+        self,
+        start: int,
+        amounts: NDArray[np.int64],
+        event_class: type,
+    ) -> List[DomainEventProtocol]:
+        (nonzero,) = np.nonzero(amounts)
+        timestamp = Account.Event.create_timestamp()
+        account_ids = self.ledger.account_ids
+        versions = self.ledger.versions[nonzero + start].tolist()
+        return [
+            event_class(
+                originator_id=account_ids[start + i],
+                originator_version=version + 1,
+                timestamp=timestamp,
+                amount_in_cents=amount,
+            )
+            for i, version, amount in zip(
+                nonzero.tolist(), versions, amounts[nonzero].tolist()
+            )
+        ]
@@ -1,196 +1,105 @@
 # coding=utf-8
-# flake8: noqa E402
 
 import logging
-from typing import Dict, Tuple
-from uuid import UUID
-from eventsourcing.application import AggregateNotFound
-from flask import Flask, Response, request, jsonify
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity  # type: ignore
-from flask_restful import Resource, Api  # type: ignore
+import os
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Mapping, Optional
 
+if TYPE_CHECKING:  # pragma: no cover
+    from flask import Flask
 
-from banking.applicationmodel import Bank
-from banking.utils.http_errors import handler
-
-from banking.domainmodel import Account, AccountClosedError, BadCredentials
+    from banking.applicationmodel import Bank
 
 logging.basicConfig(level=logging.INFO)
 
-
-app = Flask(__name__)
-app.config["SECRET_KEY"] = "super-secret"
-app.config["JWT_EXPIRATION_DELTA"] = 3600
-app.config["JWT_DEFAULT_REALM"] = "Login Required"
-jwt = JWTManager(app)
-
-api = Api(app, prefix="/api/v1")
-
-_bank = Bank()
-
-
-def bank() -> Bank:
-    return _bank
-
-
-class User:
-    def __init__(self, id: str):
-        self.id = id
-
-
-def user() -> User:
-    account = bank().get_account(UUID(get_jwt_identity()))
-    return User(id=str(account.id))
-
-
-class AccountResource(Resource):
-    @jwt_required()
-    @handler
-    def get(self) -> Tuple[Dict[str, str], int]:
-        account = bank().get_account(UUID(user().id))
-        return {
-            "balance": str(account.balance),
-            "identity": user().id,
-        }, 200
-
-
-class DepositResource(Resource):
-    @jwt_required()
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        amount = data["amount"]
-        account = bank().get_account(UUID(user().id))
-        bank().deposit_funds(account.id, amount)
-        return {
-            "amount": str(amount),
-        }, 200
-
-
-class WithdrawResource(Resource):
-    @jwt_required()
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        amount = data["amount"]
-        account = bank().get_account(UUID(user().id))
-        bank().withdraw_funds(account.id, amount)
-        return {
-            "message": "success",
-        }, 200
-
-
-class TransferResource(Resource):
-    @jwt_required()
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        amount = data["amount"]
-        to_account_id = UUID(data["to_account_id"])
-        account = bank().get_account(UUID(user().id))
-        try:
-            bank().transfer_funds(account.id, to_account_id, amount)
-            return {
-                "message": "success",
-            }, 200
-        except:
-            return {
-                "error": "Transfer failed",
-            }, 400
-
-class CloseAccountResource(Resource):
-    @jwt_required()
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        account = bank().get_account(UUID(user().id))
-        bank().close_account(account.id)
-        return {
-            "message": "success",
-        }, 200
-
-
-class AccountGetBalanceResource(Resource):
-    @jwt_required()
-    @handler
-    def get(self) -> Tuple[Dict[str, str], int]:
-        account = bank().get_account(UUID(user().id))
-        return {
-            "balance": str(account.balance),
-        }, 200
-
-
-class AccountGetOverdraftLimitResource(Resource):
-    @jwt_required()
-    @handler
-    def get(self) -> Tuple[Dict[str, str], int]:
-        account = bank().get_account(UUID(user().id))
-        return {
-            "overdraft_limit": str(account.overdraft_limit),
-        }, 200
-
-
-class AccountSetOverdraftLimitResource(Resource):
-    @jwt_required()
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        overdraft_limit = data["overdraft_limit"]
-        account = bank().get_account(UUID(user().id))
-        bank().set_overdraft_limit(account.id, overdraft_limit)
-        return {
-            "message": "success",
-        }, 200
-
-
-class AuthResource(Resource):
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        email_address = data["email_address"]
-        password = data["password"]
-        account_id = bank().authenticate(email_address, password)
-        return {
-            "message": "success",
-            "access_token": create_access_token(identity=str(account_id)),
-        }, 200
-
-
-class SignUpResource(Resource):
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        full_name = data["full_name"]
-        email_address = data["email_address"]
-        password = data["password"]
-        account_id = bank().open_account(full_name, email_address, password)
-        return {
-            "message": "created",
-            "account_id": str(account_id),
-        }, 201
-
-
-class ChangePasswordResource(Resource):
-    @jwt_required()
-    @handler
-    def post(self) -> Tuple[Dict[str, str], int]:
-        data = request.get_json()
-        old_password = data["old_password"]
-        new_password = data["new_password"]
-        account = bank().get_account(UUID(user().id))
-        bank().change_password(account.id, old_password, new_password)
-        return {
-            "message": "success",
-        }, 200
-
-
-api.add_resource(AccountResource, "/account")
-api.add_resource(DepositResource, "/deposit")
-api.add_resource(WithdrawResource, "/withdraw")
-api.add_resource(TransferResource, "/transfer")
-api.add_resource(AuthResource, "/auth")
-api.add_resource(SignUpResource, "/signup")
-api.add_resource(CloseAccountResource, "/close_account")
-api.add_resource(AccountGetBalanceResource, "/account/balance")
-api.add_resource(AccountGetOverdraftLimitResource, "/account/overdraft_limit")
-api.add_resource(AccountSetOverdraftLimitResource, "/account/overdraft_limit")
-api.add_resource(ChangePasswordResource, "/account/change_password")
+SECRET_KEY = "super-secret"
+
+
+_app: Optional["Flask"] = None
+_app_lock = Lock()
+_bank: Optional["Bank"] = None
+_bank_lock = Lock()
+
+
+def __getattr__(name: str) -> Any:
+    # The app is created when it is first used, rather than
+    # when the module is imported, as banking.api.app.
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_app() -> "Flask":
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+        return _app
+
+
+def bank() -> "Bank":
+    global _bank
+    with _bank_lock:
+        if _bank is None:
+            from banking.applicationmodel import Bank
+
+            _bank = Bank()
+        return _bank
+
+
+def reset_bank() -> None:
+    """
+    Forgets the bank, so that the next call to bank()
+    constructs a new one. A forked worker calls this
+    rather than use the bank of its parent process.
+    """
+    global _bank
+    with _bank_lock:
+        _bank = None
+
+
+def create_app(config: Optional[Mapping[str, Any]] = None) -> "Flask":
+    """
+    Creates the Flask app of the API, configured from the
+    environment and then from config. The app gets its Bank
+    from bank(), which constructs it for the first request.
+    """
+    # Flask, its extensions and the resources, which import the
+    # Bank, are imported with the first app, so that importing
+    # this module, as the workers and the CLI do, stays quick.
+    from eventsourcing.utils import strtobool
+    from flask import Flask
+    from flask_jwt_extended import JWTManager  # type: ignore
+
+    from banking.resources import (
+        RESOURCES,
+        JWTApi,
+        close_request_scope,
+        is_token_revoked,
+        open_request_scope,
+        report_event_store_stats,
+    )
+
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = SECRET_KEY
+    app.config["JWT_EXPIRATION_DELTA"] = 3600
+    app.config["JWT_DEFAULT_REALM"] = "Login Required"
+    # Answer every request with what it asked of the event store, in an
+    # X-Event-Store header, for debugging slow requests. The same line is
+    # logged at DEBUG level regardless.
+    app.config["EVENT_STORE_STATS_HEADER"] = strtobool(
+        os.getenv("EVENT_STORE_STATS_HEADER", "n")
+    )
+    # The key that admin requests send in an X-Admin-Key header.
+    # The admin endpoints refuse every request without one.
+    app.config["ADMIN_API_KEY"] = os.getenv("ADMIN_API_KEY")
+    app.config.update(config or {})
+    jwt = JWTManager(app)
+    jwt.token_in_blocklist_loader(is_token_revoked)
+    app.before_request(open_request_scope)
+    app.after_request(report_event_store_stats)
+    app.teardown_request(close_request_scope)
+    api = JWTApi(app, prefix="/api/v1")
+    for resource, path in RESOURCES:
+        api.add_resource(resource, path)
+    return app
@@ -1,12 +1,175 @@
 # coding=utf-8
 
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from copy import deepcopy
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+from threading import Lock
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
 from uuid import NAMESPACE_URL, UUID, uuid5
 
-from eventsourcing.application import AggregateNotFound, Application
+from eventsourcing.application import (
+    AggregateNotFound,
+    Application,
+    ProcessingEvent,
+)
+from eventsourcing.domain import (
+    Aggregate,
+    DomainEventProtocol,
+    MutableOrImmutableAggregate,
+)
+from eventsourcing.persistence import (
+    InfrastructureFactory,
+    IntegrityError,
+    Mapper,
+    Recording,
+    Transcoder,
+)
+from eventsourcing.utils import EnvType, Environment, strtobool
 
-from banking.domainmodel import Account, AccountClosedError, BadCredentials
+from banking.concurrency import LockStripes, RetryPolicy, RetryStats, command
+from banking.domainmodel import (
+    Account,
+    AccountClosedError,
+    AccountShard,
+    BadCredentials,
+    InsufficientFundsError,
+    InvalidAmount,
+    StandingOrder,
+    TransactionError,
+)
+from banking.projections import (
+    AccountBalance,
+    BalanceProjection,
+    EmailIndex,
+    TokenRevocations,
+    TransactionHistory,
+    TransactionPage,
+    construct_balance_view,
+    construct_email_view,
+    construct_transaction_view,
+)
+from banking.repository import (
+    EventStoreStats,
+    InstrumentedMapper,
+    InstrumentedRepository,
+    track_mapping,
+)
+from banking.idempotency import construct_idempotency_store
+from banking.transcoding import construct_transcoder
+from banking.utils.bloom import BloomFilter
+from banking.utils.metrics import COUNT_BUCKETS, Metrics
+from banking.utils.passwords import Passwords, construct_password_hasher
 
-from hashlib import sha512
+if TYPE_CHECKING:  # pragma: no cover
+    from banking.scheduling import StandingOrderScheduler
+    from banking.sharding import ShardSweeper
+    from banking.snapshotting import SnapshotWriter
+
+
+@dataclass(frozen=True)
+class Transfer:
+    debit_account_id: UUID
+    credit_account_id: UUID
+    amount_in_cents: int
+
+
+@dataclass(frozen=True)
+class TransferResult:
+    transfer: Transfer
+    transaction_id: UUID
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class StandingOrderResult:
+    order_id: UUID
+    transaction_id: UUID
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class NewAccount:
+    full_name: str
+    email_address: str
+    password: str
+
+
+@dataclass
+class BulkOpenReport:
+    """
+    Counts of the accounts opened and of the duplicates skipped,
+    with the email addresses of the first MAX_SAMPLE duplicates,
+    so that importing a stream of any length reports in bounded
+    memory.
+    """
+
+    MAX_SAMPLE: ClassVar[int] = 100
+
+    opened: int = 0
+    duplicates: int = 0
+    duplicate_sample: List[str] = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        return self.opened + self.duplicates
+
+    def add_duplicate(self, email_address: str) -> None:
+        self.duplicates += 1
+        if len(self.duplicate_sample) < self.MAX_SAMPLE:
+            self.duplicate_sample.append(email_address)
+
+
+class BankProcessingEvent(ProcessingEvent):
+    """
+    Collects the events to record from what is given to
+    Bank.save(). The aggregates and events of the domain model
+    are told apart by their classes, which is much cheaper than
+    the runtime protocol checks ProcessingEvent makes, and which
+    are still made for anything else.
+    """
+
+    def collect_events(
+        self,
+        *objs: Optional[
+            Union[MutableOrImmutableAggregate, DomainEventProtocol]
+        ],
+        **kwargs: Any,
+    ) -> None:
+        for obj in objs:
+            if isinstance(obj, Aggregate):
+                self.events.extend(obj.collect_events())
+                self.aggregates[obj.id] = obj
+            elif isinstance(obj, Aggregate.Event):
+                self.events.append(obj)
+            else:
+                super().collect_events(obj)
+        self.saved_kwargs.update(kwargs)
 
 
 class Bank(Application):
@@ -27,8 +190,441 @@ class Bank(Application):
 
     To save any aggregates run:
       self.save(account1, account2, new_account)
+
+    Inside request_scope() each account is loaded from
+    the repository at most once, and the same object is
+    handed to every command that runs in that scope.
+
+    Snapshotting is configured with environment variables:
+      SNAPSHOTTING_INTERVAL  snapshot an account every N events
+                             as part of saving it
+      SNAPSHOTTING_THRESHOLD run a background SnapshotWriter that
+                             snapshots accounts that have grown by
+                             N events since their last snapshot
+      SNAPSHOTTING_PERIOD    seconds between SnapshotWriter passes
+
+    Caching of accounts is configured with:
+      AGGREGATE_CACHE_MAXSIZE  number of cached accounts (0 is unbounded)
+      AGGREGATE_CACHE_POLICY   eviction policy, "lru" (default) or "fifo"
+    Cached accounts are fast-forwarded with the events recorded
+    after the cached version, so several processes can share
+    one SQLite store.
+
+    The balance read model is configured with:
+      BALANCE_VIEW           keep balances in memory ("y")
+      BALANCE_VIEW_DBNAME    keep balances in this SQLite database,
+                             resuming from its saved position
+    With a read model, get_balance and get_overdraft_limit read
+    the materialized row unless called with consistent=True.
+
+    Email addresses of opened accounts are kept in an index, so
+    signing up and logging in never replay an account to find
+    out whether it exists. It is configured with:
+      EMAIL_INDEX_DBNAME          keep the index in this SQLite
+                                  database instead of in memory
+      EMAIL_INDEX_BLOOM_CAPACITY  front the index with a Bloom
+                                  filter sized for N addresses
+
+    Credits, debits and transfers are kept in a transaction
+    history, read a page at a time with get_transactions(),
+    which builds it when it is first called, in memory, or with:
+      TRANSACTION_HISTORY_DBNAME  keep the history in this SQLite
+                                  database, resuming from its
+                                  saved position
+    Processes that serve the history should keep it in SQLite,
+    so that they don't hold it all in memory, or replay it.
+
+    Access tokens are checked against TokenRevocations, which
+    knows the closed accounts and the password version of every
+    account, with is_token_revoked(), rather than by replaying
+    the account.
+
+    Passwords are hashed with:
+      PASSWORD_HASHER        "scrypt" (default) or "sha512"
+      PASSWORD_HASH_WORKERS  hash and verify in a pool of N processes
+                             instead of on the calling thread
+    Hashes made with another hasher are still verified, and are
+    replaced with a new hash when their owner next logs in.
+
+    Commands that lose a race to save an account are run again
+    with the account reloaded (see banking.concurrency):
+      COMMAND_RETRY_ATTEMPTS  attempts before giving up (default 5)
+      COMMAND_RETRY_BACKOFF   seconds of the first backoff, doubled
+                              for every attempt (default 0.005)
+      ACCOUNT_LOCK_STRIPES    serialize commands on the same account
+                              in this process with N striped locks
+    Conflicts and retries are counted in retry_stats.
+
+    Commands, repository gets and saves are timed in metrics,
+    see collect_metrics(). The events replayed by each get, and
+    the time spent deserializing them and inserting new ones,
+    are recorded there too, and in the EventStoreStats yielded
+    by request_scope(). repository.heaviest() finds the accounts
+    whose histories take longest to load.
+
+    Event state is recorded as JSON, or with:
+      EVENT_TRANSCODER             "compact" to record it in the
+                                   binary form of CompactTranscoder,
+                                   which still reads JSON state
+      EVENT_COMPRESSION_THRESHOLD  compress compact state of at
+                                   least N bytes with zlib
+    Existing events can also be rewritten in a new store with
+    banking.transcoding.migrate_events().
+
+    Deposits, withdrawals and transfers made through the API
+    with an Idempotency-Key header are answered once, and their
+    responses kept for requests made again with the same key,
+    in idempotency_keys (see banking.idempotency):
+      IDEMPOTENCY_KEYS_DBNAME  keep the keys in this SQLite
+                               database, which processes serving
+                               the same accounts should share
+      IDEMPOTENCY_KEY_TTL      seconds a key is kept after its
+                               request was answered (default 86400)
+
+    Accounts that take many concurrent credits can be sharded
+    with shard_account(). Their credits are recorded in shards
+    (see AccountShard) and swept into the account before it is
+    debited, by sweep_account(), or in the background with:
+      SHARD_SWEEP_PERIOD  seconds between ShardSweeper passes
+
+    Standing orders (see StandingOrder) are transfers due on a
+    schedule, made when they are due by execute_standing_orders(),
+    called by a StandingOrderScheduler, which runs in the
+    background with:
+      STANDING_ORDER_PERIOD   seconds between scheduler runs
+      STANDING_ORDER_WORKERS  threads that run the due orders,
+                              a batch of debit accounts each
+                              (default 4)
+
+    Interest and overdraft fees are accrued over every account
+    at once by banking.accrual.AccrualEngine, which records them
+    as the accounts' Credited and Debited events, without loading
+    the accounts. The balances are reconciled with the events by
+    banking.reconciliation.Reconciler, which folds ranges of the
+    notification log in a pool of processes.
     """
 
+    log_section_size = 500
+
+    SNAPSHOTTING_INTERVAL = "SNAPSHOTTING_INTERVAL"
+    SNAPSHOTTING_THRESHOLD = "SNAPSHOTTING_THRESHOLD"
+    SNAPSHOTTING_PERIOD = "SNAPSHOTTING_PERIOD"
+    AGGREGATE_CACHE_POLICY = "AGGREGATE_CACHE_POLICY"
+    BALANCE_VIEW = "BALANCE_VIEW"
+    BALANCE_VIEW_DBNAME = "BALANCE_VIEW_DBNAME"
+    EMAIL_INDEX_DBNAME = "EMAIL_INDEX_DBNAME"
+    EMAIL_INDEX_BLOOM_CAPACITY = "EMAIL_INDEX_BLOOM_CAPACITY"
+    TRANSACTION_HISTORY_DBNAME = "TRANSACTION_HISTORY_DBNAME"
+    PASSWORD_HASHER = "PASSWORD_HASHER"
+    PASSWORD_HASH_WORKERS = "PASSWORD_HASH_WORKERS"
+    COMMAND_RETRY_ATTEMPTS = "COMMAND_RETRY_ATTEMPTS"
+    COMMAND_RETRY_BACKOFF = "COMMAND_RETRY_BACKOFF"
+    ACCOUNT_LOCK_STRIPES = "ACCOUNT_LOCK_STRIPES"
+    SHARD_SWEEP_PERIOD = "SHARD_SWEEP_PERIOD"
+    STANDING_ORDER_PERIOD = "STANDING_ORDER_PERIOD"
+    STANDING_ORDER_WORKERS = "STANDING_ORDER_WORKERS"
+    EVENT_TRANSCODER = "EVENT_TRANSCODER"
+    EVENT_COMPRESSION_THRESHOLD = "EVENT_COMPRESSION_THRESHOLD"
+    IDEMPOTENCY_KEYS_DBNAME = "IDEMPOTENCY_KEYS_DBNAME"
+    IDEMPOTENCY_KEY_TTL = "IDEMPOTENCY_KEY_TTL"
+
+    def __init__(self, env: Optional[EnvType] = None) -> None:
+        # Before super().__init__(), which constructs the repository.
+        self.metrics = Metrics()
+        super().__init__(env)
+        self._identity_map: ContextVar[Optional[Dict[UUID, Account]]] = (
+            ContextVar(f"identity_map_{id(self)}", default=None)
+        )
+        interval = self.env.get(self.SNAPSHOTTING_INTERVAL)
+        if interval:
+            self.snapshotting_intervals = {Account: int(interval)}
+        self.snapshot_writer: Optional["SnapshotWriter"] = None
+        threshold = self.env.get(self.SNAPSHOTTING_THRESHOLD)
+        if threshold:
+            # The background jobs are imported only when they
+            # are configured, to keep the API's cold start short.
+            from banking.snapshotting import SnapshotWriter
+
+            self.snapshot_writer = SnapshotWriter(
+                self,
+                threshold=int(threshold),
+                period=float(self.env.get(self.SNAPSHOTTING_PERIOD, "60")),
+            )
+            self.snapshot_writer.start()
+        self.balances: Optional[BalanceProjection] = None
+        balance_view_dbname = self.env.get(self.BALANCE_VIEW_DBNAME)
+        if balance_view_dbname or strtobool(
+            self.env.get(self.BALANCE_VIEW, "n")
+        ):
+            self.balances = BalanceProjection(
+                self, construct_balance_view(balance_view_dbname)
+            )
+            self.balances.pull()
+        # Neither of these is caught up here, to keep the cold
+        # start short: lookups that miss, authenticate(),
+        # password_version() and is_token_revoked() pull before
+        # they answer, and the first save catches them up.
+        bloom_capacity = self.env.get(self.EMAIL_INDEX_BLOOM_CAPACITY)
+        self.email_index = EmailIndex(
+            self,
+            construct_email_view(self.env.get(self.EMAIL_INDEX_DBNAME)),
+            BloomFilter(int(bloom_capacity)) if bloom_capacity else None,
+        )
+        self.token_revocations = TokenRevocations(self)
+        # Built when it is first read, see transaction_history.
+        self._transaction_history: Optional[TransactionHistory] = None
+        self._transaction_history_lock = Lock()
+        self.passwords = Passwords(
+            construct_password_hasher(
+                self.env.get(self.PASSWORD_HASHER, "scrypt")
+            ),
+            workers=int(self.env.get(self.PASSWORD_HASH_WORKERS, "0")),
+        )
+        self.retry_policy = RetryPolicy(
+            attempts=int(self.env.get(self.COMMAND_RETRY_ATTEMPTS, "5")),
+            backoff=float(self.env.get(self.COMMAND_RETRY_BACKOFF, "0.005")),
+        )
+        self.retry_stats = RetryStats()
+        self.idempotency_keys = construct_idempotency_store(
+            self.env.get(self.IDEMPOTENCY_KEYS_DBNAME),
+            ttl=float(self.env.get(self.IDEMPOTENCY_KEY_TTL, "86400")),
+        )
+        lock_stripes = int(self.env.get(self.ACCOUNT_LOCK_STRIPES, "0"))
+        self.account_locks = (
+            LockStripes(lock_stripes) if lock_stripes else None
+        )
+        self.shard_sweeper: Optional["ShardSweeper"] = None
+        sweep_period = self.env.get(self.SHARD_SWEEP_PERIOD)
+        if sweep_period:
+            from banking.sharding import ShardSweeper
+
+            self.shard_sweeper = ShardSweeper(self, period=float(sweep_period))
+            self.shard_sweeper.start()
+        self.standing_order_scheduler: Optional["StandingOrderScheduler"] = (
+            None
+        )
+        standing_order_period = self.env.get(self.STANDING_ORDER_PERIOD)
+        if standing_order_period:
+            from banking.scheduling import StandingOrderScheduler
+
+            self.standing_order_scheduler = StandingOrderScheduler(
+                self,
+                workers=int(self.env.get(self.STANDING_ORDER_WORKERS, "4")),
+                period=float(standing_order_period),
+            )
+            self.standing_order_scheduler.start()
+
+    def construct_env(
+        self, name: str, env: Optional[EnvType] = None
+    ) -> Environment:
+        _env = super().construct_env(name, env)
+        if _env.get(self.SNAPSHOTTING_INTERVAL) or _env.get(
+            self.SNAPSHOTTING_THRESHOLD
+        ):
+            _env[InfrastructureFactory.IS_SNAPSHOTTING_ENABLED] = "y"
+        return _env
+
+    def construct_transcoder(self) -> Transcoder:
+        threshold = self.env.get(self.EVENT_COMPRESSION_THRESHOLD)
+        transcoder = construct_transcoder(
+            self.env.get(self.EVENT_TRANSCODER, "json"),
+            int(threshold) if threshold else None,
+        )
+        self.register_transcodings(transcoder)
+        return transcoder
+
+    def construct_mapper(self) -> Mapper:
+        mapper = super().construct_mapper()
+        return InstrumentedMapper(
+            transcoder=mapper.transcoder,
+            compressor=mapper.compressor,
+            cipher=mapper.cipher,
+        )
+
+    def construct_repository(self) -> InstrumentedRepository:
+        cache_maxsize_envvar = self.env.get(self.AGGREGATE_CACHE_MAXSIZE)
+        return InstrumentedRepository(
+            event_store=self.events,
+            snapshot_store=self.snapshots,
+            cache_maxsize=(
+                int(cache_maxsize_envvar) if cache_maxsize_envvar else None
+            ),
+            cache_policy=self.env.get(self.AGGREGATE_CACHE_POLICY, "lru"),
+            metrics=self.metrics,
+            fastforward=strtobool(
+                self.env.get(self.AGGREGATE_CACHE_FASTFORWARD, "y")
+            ),
+            fastforward_skipping=strtobool(
+                self.env.get(self.AGGREGATE_CACHE_FASTFORWARD_SKIPPING, "n")
+            ),
+            deepcopy_from_cache=strtobool(
+                self.env.get(self.DEEPCOPY_FROM_AGGREGATE_CACHE, "y")
+            ),
+        )
+
+    @property
+    def repository(self) -> InstrumentedRepository:
+        assert isinstance(self._repository, InstrumentedRepository)
+        return self._repository
+
+    def _record(self, processing_event: ProcessingEvent) -> List[Recording]:
+        started = perf_counter()
+        with track_mapping() as serializing:
+            try:
+                recordings = super()._record(processing_event)
+            finally:
+                # Time the insert alone, without the serializing.
+                insert_seconds = (
+                    perf_counter() - started - serializing.seconds
+                )
+                self.metrics.observe(
+                    "banking_recorder_insert_duration_seconds", insert_seconds
+                )
+                stats = self.repository.request_stats.get()
+                if stats is not None:
+                    stats.saves += 1
+                    stats.events_saved += len(processing_event.events)
+                    stats.insert_seconds += insert_seconds
+                    stats.aggregates.update(processing_event.aggregates)
+        # Keep the cache current with what was just saved. Copies are
+        # cached because callers may go on mutating their aggregates.
+        if self.repository.cache is not None and self.repository.fastforward:
+            for aggregate_id, aggregate in processing_event.aggregates.items():
+                self.repository.cache.put(aggregate_id, deepcopy(aggregate))
+        return recordings
+
+    @contextmanager
+    def request_scope(self) -> Iterator[EventStoreStats]:
+        """
+        Opens an identity map for the current context, so
+        that accounts are loaded at most once per request,
+        and yields the stats of what the request asks of
+        the event store.
+        """
+        stats = EventStoreStats()
+        token = self._identity_map.set({})
+        stats_token = self.repository.request_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            self.repository.request_stats.reset(stats_token)
+            self._identity_map.reset(token)
+            self.metrics.observe(
+                "banking_aggregates_per_request",
+                len(stats.aggregates),
+                buckets=COUNT_BUCKETS,
+            )
+
+    def save(
+        self,
+        *objs: Optional[
+            Union[MutableOrImmutableAggregate, DomainEventProtocol]
+        ],
+        **kwargs: Any,
+    ) -> List[Recording]:
+        started = perf_counter()
+        try:
+            # As Application.save(), with a cheaper ProcessingEvent.
+            processing_event = BankProcessingEvent()
+            processing_event.collect_events(*objs, **kwargs)
+            recordings = self._record(processing_event)
+            self._take_snapshots(processing_event)
+            self._notify(recordings)
+            self.notify(processing_event.events)
+            return recordings
+        except Exception:
+            # The events were collected but not recorded, so the
+            # mapped objects may be ahead of the store. Forget them.
+            identity_map = self._identity_map.get()
+            if identity_map is not None:
+                identity_map.clear()
+            raise
+        finally:
+            self.metrics.observe(
+                "banking_save_duration_seconds", perf_counter() - started
+            )
+
+    def collect_metrics(self) -> Metrics:
+        """
+        Copies the retry and cache counters, and the load times
+        of the heaviest aggregates, into the metrics, which
+        already time commands, repository gets and saves.
+        """
+        stats = self.retry_stats
+        with stats.lock:
+            counts = {
+                "banking_commands_total": stats.commands,
+                "banking_command_attempts_total": stats.attempts,
+                "banking_command_conflicts_total": stats.conflicts,
+                "banking_command_retried_total": stats.retried,
+                "banking_command_exhausted_total": stats.exhausted,
+            }
+        cache_stats = self.repository.cache_stats
+        if cache_stats is not None:
+            counts["banking_aggregate_cache_hits_total"] = cache_stats.hits
+            counts["banking_aggregate_cache_misses_total"] = cache_stats.misses
+            counts["banking_aggregate_cache_evictions_total"] = (
+                cache_stats.evictions
+            )
+        for name, count in counts.items():
+            self.metrics.set(name, count)
+        # Only the few slowest, so the series stay few.
+        self.metrics.remove("banking_heaviest_aggregate_get_seconds")
+        self.metrics.remove("banking_heaviest_aggregate_events_replayed")
+        for aggregate_id, events, seconds in self.repository.heaviest(10):
+            labels = (("aggregate_id", str(aggregate_id)),)
+            self.metrics.set(
+                "banking_heaviest_aggregate_get_seconds", seconds, labels
+            )
+            self.metrics.set(
+                "banking_heaviest_aggregate_events_replayed", events, labels
+            )
+        return self.metrics
+
+    @property
+    def transaction_history(self) -> TransactionHistory:
+        """
+        The transaction history, which is only constructed, and
+        caught up with the log, when it is first read, so that
+        processes that never read it don't replay every credit
+        and debit when they start.
+        """
+        with self._transaction_history_lock:
+            if self._transaction_history is None:
+                history = TransactionHistory(
+                    self,
+                    construct_transaction_view(
+                        self.env.get(self.TRANSACTION_HISTORY_DBNAME)
+                    ),
+                )
+                history.pull()
+                self._transaction_history = history
+            return self._transaction_history
+
+    def _notify(self, recordings: List[Recording]) -> None:
+        self.email_index.receive(recordings)
+        if self._transaction_history is not None:
+            self._transaction_history.receive(recordings)
+        self.token_revocations.receive(recordings)
+        if self.balances is not None:
+            self.balances.receive(recordings)
+
+    def close(self) -> None:
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.stop()
+        if self.shard_sweeper is not None:
+            self.shard_sweeper.stop()
+        if self.standing_order_scheduler is not None:
+            self.standing_order_scheduler.stop()
+        if self.balances is not None:
+            self.balances.view.close()
+        self.email_index.view.close()
+        if self._transaction_history is not None:
+            self._transaction_history.view.close()
+        self.idempotency_keys.close()
+        self.passwords.close()
+        super().close()
+
     # Account actions
     def open_account(
         self,
@@ -40,106 +636,546 @@ class Bank(Application):
         The first few lines of this function are
         completed, but there is more to do.
         """
-        password = sha512(password.encode()).hexdigest()
+        if self.email_index.lookup(email_address) is not None:
+            raise EmailAlreadyRegistered(email_address)
         account = Account(
             self.get_account_id_by_email(email_address),
             full_name=full_name,
             email_address=email_address,
-            password=password,
+            password=self.passwords.hash(password),
         )
-            
-                
-        self.save(account)
+        try:
+            self.save(account)
+        except IntegrityError:
+            # Opened by another process since the index was updated.
+            raise EmailAlreadyRegistered(email_address)
 
         return account.id
 
-    def get_account_id_by_email(self, email_address: str) -> UUID:
-        account_id = uuid5(NAMESPACE_URL, email_address)
+    def open_accounts_bulk(
+        self,
+        accounts: Iterable[NewAccount],
+        batch_size: int = 1000,
+        hash_workers: int = 0,
+        progress: Optional[Callable[[BulkOpenReport], None]] = None,
+    ) -> BulkOpenReport:
+        """
+        Opens accounts from a stream, batch_size at a time, so
+        memory stays flat however long the stream is. Each batch
+        checks which accounts exist in the email index, hashes
+        passwords in a pool of hash_workers processes (inline if
+        fewer than two), and records the new accounts in one
+        transaction. Emails that already have an account, or
+        repeat in the stream, are skipped and counted as
+        duplicates. Calls progress with the report after each
+        batch.
+        """
+        from concurrent.futures import ProcessPoolExecutor
 
+        report = BulkOpenReport()
+        pool = ProcessPoolExecutor(hash_workers) if hash_workers > 1 else None
         try:
-            account = self.repository.get(account_id)
-            return account.id
-        except AggregateNotFound:
-            return account_id
+            iterator = iter(accounts)
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    break
+                new_accounts = self._new_accounts(batch, report)
+                passwords = [a.password for a in new_accounts]
+                if pool is not None:
+                    hashed_passwords = pool.map(
+                        self.passwords.hasher.hash,
+                        passwords,
+                        chunksize=max(1, len(passwords) // hash_workers),
+                    )
+                else:
+                    hashed_passwords = map(self.passwords.hash, passwords)
+                self.save(
+                    *(
+                        Account(
+                            uuid5(NAMESPACE_URL, a.email_address),
+                            full_name=a.full_name,
+                            email_address=a.email_address,
+                            password=hashed_password,
+                        )
+                        for a, hashed_password in zip(
+                            new_accounts, hashed_passwords
+                        )
+                    )
+                )
+                report.opened += len(new_accounts)
+                if progress is not None:
+                    progress(report)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return report
+
+    def _new_accounts(
+        self, batch: List[NewAccount], report: BulkOpenReport
+    ) -> List[NewAccount]:
+        # Caught up once, and checked in one read, for the batch.
+        self.email_index.pull()
+        existing = self.email_index.get_many(
+            [new_account.email_address for new_account in batch]
+        )
+        new_accounts = []
+        seen: Set[str] = set()
+        for new_account in batch:
+            email_address = new_account.email_address
+            if email_address in existing or email_address in seen:
+                report.add_duplicate(email_address)
+            else:
+                seen.add(email_address)
+                new_accounts.append(new_account)
+        return new_accounts
+
+    def get_account_id_by_email(self, email_address: str) -> UUID:
+        return uuid5(NAMESPACE_URL, email_address)
 
+    @command
     def close_account(self, account_id: UUID) -> None:
         account = self.get_account(account_id)
         account.close()
         self.save(account)
 
     def authenticate(self, email_address: str, password: str) -> UUID:
-        account_id = self.get_account_id_by_email(email_address)
+        # Caught up, as the account may have just been opened
+        # by another process.
+        account_id = self.email_index.lookup(email_address, catch_up=True)
+        if account_id is None:
+            raise BadCredentials(email_address)
         account = self.get_account(account_id)
         try:
-            account.authenticate(email_address, password)
+            account.authenticate(
+                email_address, password, self.passwords.verify
+            )
         except BadCredentials:
             raise BadCredentials(email_address)
+        if self.passwords.needs_rehash(account.password):
+            account.rehash_password(self.passwords.hash(password))
+            try:
+                self.save(account)
+            except IntegrityError:
+                # Changed by another request, the next login rehashes.
+                pass
         return account_id
 
     def validate_password(self, account_id: UUID, password: str) -> bool:
         account = self.get_account(account_id)
-        hashed_password = sha512(password.encode()).hexdigest()
-        if hashed_password != account.password:
+        if not self.passwords.verify(password, account.password):
             raise BadCredentials(account.email_address)
         return True
 
+    @command
     def change_password(self, account_id: UUID, password: str, new_password: str) -> None:
         if self.validate_password(account_id, password):
             account = self.get_account(account_id)
-            account.change_password(new_password)
+            account.change_password(self.passwords.hash(new_password))
             self.save(account)
 
-    def get_balance(self, account_id: UUID) -> int:
+    def password_version(self, account_id: UUID) -> int:
+        """
+        The version to put in a new access token of the
+        account, after catching up with password changes
+        made by other processes.
+        """
+        self.token_revocations.pull()
+        return self.token_revocations.password_version(account_id)
+
+    def is_token_revoked(
+        self, account_id: UUID, password_version: int
+    ) -> bool:
+        """
+        Whether a token of the account with the given password
+        version was revoked, by closing the account or changing
+        its password, in this process or another.
+        """
+        self.token_revocations.pull()
+        return self.token_revocations.is_revoked(account_id, password_version)
 
+    def get_balance(self, account_id: UUID, consistent: bool = False) -> int:
+        if self.balances is not None and not consistent:
+            return self._get_balance_row(account_id).balance
         try:
             account = self.get_account(account_id)
-            return account.balance
+            return account.balance + sum(
+                shard.balance for shard in self._get_shards(account)
+            )
         except AggregateNotFound:
             raise AccountNotFoundError(account_id)
 
+    @command
     def deposit_funds(self, credit_account_id: UUID, amount_in_cents: int) -> None:
         try:
             account = self.get_account(credit_account_id)
             if account.check_is_closed():
                 raise AccountClosedError(credit_account_id)
-            account.credit(amount_in_cents)
-            self.save(account)
+            self.save(self._credit(account, amount_in_cents))
 
         except AggregateNotFound:
             raise AccountNotFoundError(credit_account_id)
 
+    @command
     def withdraw_funds(self, debit_account_id: UUID, amount_in_cents: int) -> None:
         try:
             account = self.get_account(debit_account_id)
             if account.check_is_closed():
                 raise AccountClosedError(debit_account_id)
+            shards = self._sweep(account)
             account.debit(amount_in_cents)
-            self.save(account)
+            self.save(account, *shards)
         except AggregateNotFound:
             raise AccountNotFoundError(debit_account_id)
 
-    def transfer_funds(self, debit_account_id: UUID, credit_account_id: UUID, amount_in_cents: int) -> None:
-        transaction_id = uuid5(NAMESPACE_URL, f"{debit_account_id}{credit_account_id}{amount_in_cents}")
-        
+    @command
+    def transfer_funds(
+        self,
+        debit_account_id: UUID,
+        credit_account_id: UUID,
+        amount_in_cents: int,
+        idempotency_key: Optional[str] = None,
+    ) -> None:
+        # Transfers of the same amount between the same accounts
+        # have the same transaction_id, unless they are made with
+        # an idempotency key, which tells them apart.
+        if idempotency_key is None:
+            transaction_id = uuid5(
+                NAMESPACE_URL,
+                f"{debit_account_id}{credit_account_id}{amount_in_cents}",
+            )
+        else:
+            transaction_id = uuid5(debit_account_id, idempotency_key)
+
         try:
             from_account = self.get_account(debit_account_id)
             to_account = self.get_account(credit_account_id)
-            from_account.transfer_validation(to_account.id, amount_in_cents, transaction_id)
-            from_account.debit(amount_in_cents)
-            to_account.credit(amount_in_cents)
-            self.save(from_account, to_account)
+            shards = self._sweep(from_account)
+            from_account.transfer_validation(
+                to_account.id, amount_in_cents, transaction_id
+            )
+            from_account.debit(amount_in_cents, transaction_id)
+            credited = self._credit(
+                to_account, amount_in_cents, transaction_id
+            )
+            self.save(from_account, credited, *shards)
 
         except AggregateNotFound:
             raise AccountNotFoundError(debit_account_id)
 
+    def transfer_funds_batch(
+        self,
+        transfers: Sequence[Transfer],
+        chunk_size: Optional[int] = None,
+    ) -> List[TransferResult]:
+        """
+        Applies the transfers in order, loading each distinct
+        account once per chunk, and records them in one
+        transaction, or in one transaction per chunk_size
+        transfers. A transfer
+        that fails validation is reported in its result and
+        doesn't stop the others. A chunk whose save conflicts is
+        run again with its accounts reloaded, as a command is.
+        If a chunk can't be recorded after earlier chunks were,
+        BatchIncomplete is raised with the results of the
+        recorded transfers, so that only the rest are retried.
+        """
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError(f"Invalid chunk size {chunk_size}")
+        size = chunk_size or len(transfers) or 1
+        results: List[TransferResult] = []
+        for start in range(0, len(transfers), size):
+            try:
+                chunk = transfers[start : start + size]
+                results += self._transfer_chunk(chunk)
+            except Exception as err:
+                if not results:
+                    raise
+                raise BatchIncomplete(results, err) from err
+        return results
+
+    @command
+    def _transfer_chunk(
+        self, transfers: Sequence[Transfer]
+    ) -> List[TransferResult]:
+        accounts: Dict[UUID, Account] = {}
+        shards: List[AccountShard] = []
+        events: List[DomainEventProtocol] = []
+        results = []
+        for transfer in transfers:
+            transaction_id = uuid5(
+                NAMESPACE_URL,
+                f"{transfer.debit_account_id}{transfer.credit_account_id}"
+                f"{transfer.amount_in_cents}",
+            )
+            try:
+                from_account = self._get_batch_account(
+                    accounts, shards, transfer.debit_account_id
+                )
+                to_account = self._get_batch_account(
+                    accounts, shards, transfer.credit_account_id
+                )
+                self._transfer(
+                    from_account,
+                    to_account,
+                    transfer.amount_in_cents,
+                    transaction_id,
+                )
+            except TRANSFER_ERRORS as err:
+                results.append(TransferResult(transfer, transaction_id, err))
+            else:
+                results.append(TransferResult(transfer, transaction_id))
+            self._collect_events(
+                events,
+                accounts,
+                transfer.debit_account_id,
+                transfer.credit_account_id,
+            )
+        self.save(*events, *accounts.values(), *shards)
+        return results
+
+    def _get_batch_account(
+        self,
+        accounts: Dict[UUID, Account],
+        shards: List[AccountShard],
+        account_id: UUID,
+    ) -> Account:
+        try:
+            return accounts[account_id]
+        except KeyError:
+            try:
+                account = accounts[account_id] = self.get_account(account_id)
+            except AggregateNotFound:
+                raise AccountNotFoundError(account_id)
+            # The batch credits sharded accounts directly, and
+            # debits them after sweeping their shards once.
+            shards.extend(self._sweep(account))
+            return account
+
+    @staticmethod
+    def _collect_events(
+        events: List[DomainEventProtocol],
+        accounts: Dict[UUID, Account],
+        *account_ids: UUID,
+    ) -> None:
+        # Batches record the events of their transfers in the
+        # order they happened, rather than grouped by account,
+        # so that every transfer is recorded before the credit
+        # that goes with it.
+        for account_id in account_ids:
+            account = accounts.get(account_id)
+            if account is not None:
+                events.extend(account.collect_events())
+
+    @staticmethod
+    def _transfer(
+        from_account: Account,
+        to_account: Account,
+        amount_in_cents: int,
+        transaction_id: UUID,
+    ) -> None:
+        from_account.transfer_validation(
+            to_account.id, amount_in_cents, transaction_id
+        )
+        from_account.debit(amount_in_cents, transaction_id)
+        to_account.credit(amount_in_cents, transaction_id)
+
+    @command
+    def create_standing_order(
+        self,
+        debit_account_id: UUID,
+        credit_account_id: UUID,
+        amount_in_cents: int,
+        interval_seconds: int,
+        first_due_at: datetime,
+    ) -> UUID:
+        """
+        Orders a transfer of the amount from the debit account
+        to the credit account at first_due_at, and every
+        interval_seconds after that, until it is cancelled.
+        """
+        if debit_account_id == credit_account_id:
+            raise ValueError("A standing order needs two accounts")
+        for account_id in (debit_account_id, credit_account_id):
+            try:
+                account = self.get_account(account_id)
+            except AggregateNotFound:
+                raise AccountNotFoundError(account_id)
+            if account.is_closed:
+                raise AccountClosedError(account_id)
+        order = StandingOrder(
+            debit_account_id,
+            credit_account_id,
+            amount_in_cents,
+            interval_seconds,
+            first_due_at,
+        )
+        self.save(order)
+        return order.id
+
+    def get_standing_order(self, order_id: UUID) -> StandingOrder:
+        try:
+            return self.repository.get(order_id)
+        except AggregateNotFound:
+            raise StandingOrderNotFoundError(order_id)
+
+    @command
+    def cancel_standing_order(self, order_id: UUID) -> None:
+        order = self.get_standing_order(order_id)
+        if not order.is_cancelled:
+            order.cancel()
+            self.save(order)
+
+    @command
+    def execute_standing_orders(
+        self, debit_account_id: UUID, order_ids: Sequence[UUID], now: datetime
+    ) -> List[StandingOrderResult]:
+        """
+        Makes the transfers of the standing orders of the debit
+        account that are due at now, loading each account once,
+        and records them, and the orders, in one transaction.
+        An order that fails for want of funds is due again at
+        its next due time. One that can never be made, from or
+        to an account that is closed or not found, is cancelled.
+        Orders run, or cancelled, since they were found due are
+        skipped.
+        """
+        accounts: Dict[UUID, Account] = {}
+        shards: List[AccountShard] = []
+        orders: List[StandingOrder] = []
+        events: List[DomainEventProtocol] = []
+        results = []
+        for order_id in order_ids:
+            order = self.get_standing_order(order_id)
+            if order.is_cancelled or order.next_due_at > now:
+                continue
+            transaction_id = order.next_transaction_id()
+            try:
+                from_account = self._get_batch_account(
+                    accounts, shards, debit_account_id
+                )
+                to_account = self._get_batch_account(
+                    accounts, shards, order.credit_account_id
+                )
+                for account in (from_account, to_account):
+                    if account.is_closed:
+                        raise AccountClosedError(account.id)
+                self._transfer(
+                    from_account,
+                    to_account,
+                    order.amount_in_cents,
+                    transaction_id,
+                )
+            except TRANSFER_ERRORS as err:
+                order.fail(str(err))
+                if not isinstance(err, InsufficientFundsError):
+                    order.cancel()
+                results.append(
+                    StandingOrderResult(order_id, transaction_id, err)
+                )
+            else:
+                order.execute(transaction_id)
+                results.append(StandingOrderResult(order_id, transaction_id))
+            self._collect_events(
+                events, accounts, debit_account_id, order.credit_account_id
+            )
+            orders.append(order)
+        self.save(*events, *accounts.values(), *shards, *orders)
+        return results
 
-    def get_overdraft_limit(self, account_id: UUID) -> int:
+    @command
+    def shard_account(self, account_id: UUID, shards: int) -> None:
+        """
+        Spreads later credits to the account over the given
+        number of shards. The number can be raised later, but
+        not lowered.
+        """
+        try:
+            account = self.get_account(account_id)
+        except AggregateNotFound:
+            raise AccountNotFoundError(account_id)
+        opened = account.shards
+        account.shard(shards)
+        self.save(
+            account,
+            *(
+                AccountShard(account_id, index)
+                for index in range(opened, shards)
+            ),
+        )
+
+    @command
+    def sweep_account(self, account_id: UUID) -> int:
+        """
+        Moves the credits held by the account's shards into
+        the account, and returns the amount moved.
+        """
+        account = self.get_account(account_id)
+        balance = account.balance
+        shards = self._sweep(account)
+        self.save(account, *shards)
+        return account.balance - balance
+
+    def _get_shards(self, account: Account) -> List[AccountShard]:
+        return [
+            self.repository.get(AccountShard.create_id(account.id, index))
+            for index in range(account.shards)
+        ]
+
+    def _sweep(self, account: Account) -> List[AccountShard]:
+        shards = [
+            shard for shard in self._get_shards(account) if shard.balance
+        ]
+        if shards:
+            account.sweep_credits(sum(shard.balance for shard in shards))
+            for shard in shards:
+                shard.sweep(shard.balance)
+        return shards
+
+    def _credit(
+        self,
+        account: Account,
+        amount_in_cents: int,
+        transaction_id: Optional[UUID] = None,
+    ) -> Aggregate:
+        if not account.shards:
+            account.credit(amount_in_cents, transaction_id)
+            return account
+        shard: AccountShard = self.repository.get(
+            AccountShard.create_id(
+                account.id, random.randrange(account.shards)
+            )
+        )
+        shard.credit(account.id, amount_in_cents, transaction_id)
+        return shard
+
+    def get_transactions(
+        self,
+        account_id: UUID,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+    ) -> TransactionPage:
+        """
+        Returns a page of the account's transactions, latest
+        first. Pass the page's next_cursor to get the page of
+        transactions before it. Catches up with transactions
+        recorded by other processes first.
+        """
+        self.transaction_history.pull()
+        return self.transaction_history.page(account_id, cursor, limit)
+
+    def get_overdraft_limit(
+        self, account_id: UUID, consistent: bool = False
+    ) -> int:
+        if self.balances is not None and not consistent:
+            return self._get_balance_row(account_id).overdraft_limit
         try:
             account = self.get_account(account_id)
             return account.overdraft_limit
         except AggregateNotFound:
             raise AccountNotFoundError(account_id)
 
+    @command
     def set_overdraft_limit(self, account_id: UUID, amount_in_cents: int) -> None:
         try:
             account = self.get_account(account_id)
@@ -150,11 +1186,58 @@ class Bank(Application):
         except AggregateNotFound:
             raise AccountNotFoundError(account_id)
 
+    def _get_balance_row(self, account_id: UUID) -> AccountBalance:
+        assert self.balances is not None
+        row = self.balances.get(account_id)
+        if row is None:
+            raise AccountNotFoundError(account_id)
+        return row
+
     def get_account(self, account_id: UUID) -> Account:
-        return self.repository.get(account_id)
+        identity_map = self._identity_map.get()
+        if identity_map is None:
+            return self.repository.get(account_id)
+        account = identity_map.get(account_id)
+        # An account left with pending events by a failed
+        # command is reloaded rather than reused.
+        if account is None or account.pending_events:
+            account = self.repository.get(account_id)
+            identity_map[account_id] = account
+        return account
+
+
+class EmailAlreadyRegistered(Exception):
+    def __init__(self, email_address: str):
+        super().__init__(f"Email {email_address} is already registered")
+        self.email_address = email_address
 
 
 class AccountNotFoundError(Exception):
     def __init__(self, account_id: UUID):
         super().__init__(f"Account {account_id} not found")
         self.account_id = account_id
+
+
+class BatchIncomplete(Exception):
+    def __init__(self, results: List[TransferResult], error: Exception):
+        super().__init__(
+            f"Only the first {len(results)} transfers were recorded: "
+            f"{error!r}"
+        )
+        self.results = results
+        self.error = error
+
+
+class StandingOrderNotFoundError(Exception):
+    def __init__(self, order_id: UUID):
+        super().__init__(f"Standing order {order_id} not found")
+        self.order_id = order_id
+
+
+TRANSFER_ERRORS = (
+    AccountNotFoundError,
+    AccountClosedError,
+    InsufficientFundsError,
+    InvalidAmount,
+    TransactionError,
+)
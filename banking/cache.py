@@ -0,0 +1,106 @@
+# coding=utf-8
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock, RLock
+from typing import Any, Dict, Optional, Tuple, Type, Union
+from uuid import UUID
+
+from eventsourcing.application import Cache, LRUCache
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class CountingLRUCache(LRUCache[UUID, Any]):
+    """
+    Bounded cache that evicts the least recently used
+    aggregate, and counts hits, misses and evictions.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        # Reentrant, so the counts are updated under the lock
+        # that LRUCache takes to update its links.
+        self.lock = RLock()  # type: ignore
+        self.stats = CacheStats()
+
+    def get(self, key: UUID, evict: bool = False) -> Any:
+        with self.lock:
+            try:
+                value = super().get(key, evict)
+            except KeyError:
+                self.stats.misses += 1
+                raise
+            self.stats.hits += 1
+            return value
+
+    def put(self, key: UUID, value: Any) -> Tuple[Optional[UUID], Any]:
+        with self.lock:
+            evicted_key, evicted_value = super().put(key, value)
+            if evicted_key is not None:
+                self.stats.evictions += 1
+        return evicted_key, evicted_value
+
+
+class FIFOCache(Cache[UUID, Any]):
+    """
+    Cache that evicts the aggregate that was put first,
+    regardless of reads, and counts hits, misses and
+    evictions. Hits don't reorder anything, so they are
+    cheaper than with the LRU policy. A maxsize of zero
+    or less means the cache is unbounded.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+        self.cache: Dict[UUID, Any] = OrderedDict()
+        self.lock = Lock()
+        self.stats = CacheStats()
+
+    def get(self, key: UUID, evict: bool = False) -> Any:
+        with self.lock:
+            try:
+                value = self.cache.pop(key) if evict else self.cache[key]
+            except KeyError:
+                self.stats.misses += 1
+                raise
+            self.stats.hits += 1
+            return value
+
+    def put(self, key: UUID, value: Any) -> Tuple[Optional[UUID], Any]:
+        evicted: Tuple[Optional[UUID], Any] = (None, None)
+        with self.lock:
+            if key not in self.cache and 0 < self.maxsize <= len(self.cache):
+                evicted = self.cache.popitem(last=False)  # type: ignore
+                self.stats.evictions += 1
+            self.cache[key] = value
+        return evicted
+
+
+CACHE_POLICIES: Dict[str, Type[Union[CountingLRUCache, FIFOCache]]] = {
+    "lru": CountingLRUCache,
+    "fifo": FIFOCache,
+}
+
+
+def construct_cache(
+    maxsize: int, policy: str = "lru"
+) -> Union[CountingLRUCache, FIFOCache]:
+    """
+    Constructs an aggregate cache with the named eviction
+    policy. An unbounded cache never evicts, so it ignores
+    the policy.
+    """
+    try:
+        cache_class = CACHE_POLICIES[policy.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown cache policy {policy!r}") from None
+    if maxsize <= 0:
+        return FIFOCache(maxsize=0)
+    return cache_class(maxsize=maxsize)
@@ -0,0 +1,269 @@
+# coding=utf-8
+
+import argparse
+import os
+import sys
+from datetime import date, datetime, timezone
+from typing import IO, Iterable, Optional, Sequence
+
+from eventsourcing.persistence import InfrastructureFactory, Mapper
+from eventsourcing.utils import Environment
+
+from banking.accrual import AccrualEngine
+from banking.applicationmodel import Bank, BulkOpenReport
+from banking.exporting import export_events, gzip_chunks, resume_point
+from banking.importing import FORMATS, read_accounts
+from banking.reconciliation import LogReader, Reconciler
+from banking.transcoding import (
+    TRANSCODERS,
+    construct_transcoder,
+    migrate_events,
+)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Command line entry point. The Bank is configured from
+    the environment, as it is when running the API.
+    """
+    parser = argparse.ArgumentParser(prog="banking")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import-accounts", help="open accounts from a CSV or JSONL file"
+    )
+    import_parser.add_argument("path")
+    import_parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        help="file format (default: from the file extension)",
+    )
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    import_parser.add_argument("--hash-workers", type=int, default=0)
+    import_parser.set_defaults(func=import_accounts)
+
+    export_parser = subparsers.add_parser(
+        "export-events",
+        help="write the event log as JSONL, one event per line",
+    )
+    export_parser.add_argument("path", help="output file, or - for stdout")
+    export_parser.add_argument(
+        "--start", type=int, default=1, help="first notification id to export"
+    )
+    export_parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="compress the output (default: if the path ends with .gz)",
+    )
+    export_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="append to the file after the last event it has",
+    )
+    export_parser.set_defaults(func=export_event_log)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-events",
+        help="copy the events to a new SQLite store, encoded afresh",
+    )
+    migrate_parser.add_argument("dbname", help="SQLite file of the new store")
+    migrate_parser.add_argument(
+        "--transcoder", choices=TRANSCODERS, default="compact"
+    )
+    migrate_parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        help="compress compact state of at least this many bytes",
+    )
+    migrate_parser.set_defaults(func=migrate_event_store)
+
+    accrue_parser = subparsers.add_parser(
+        "accrue-interest",
+        help="pay a day of interest, and charge a day of overdraft fees",
+    )
+    accrue_parser.add_argument(
+        "--interest-rate", type=float, required=True, help="annual, e.g. 0.02"
+    )
+    accrue_parser.add_argument(
+        "--overdraft-rate", type=float, required=True, help="annual, e.g. 0.2"
+    )
+    accrue_parser.add_argument(
+        "--day",
+        type=date.fromisoformat,
+        help="day to accrue, as YYYY-MM-DD (default: today, in UTC)",
+    )
+    accrue_parser.add_argument("--batch-size", type=int, default=10_000)
+    accrue_parser.set_defaults(func=accrue_interest)
+
+    reconcile_parser = subparsers.add_parser(
+        "reconcile",
+        help="check the balances and overdrafts against the event log",
+    )
+    reconcile_parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes folding the log, with a SQLite file store",
+    )
+    reconcile_parser.set_defaults(func=reconcile)
+
+    args = parser.parse_args(argv)
+    return int(args.func(args))
+
+
+def import_accounts(args: argparse.Namespace) -> int:
+    format = args.format or os.path.splitext(args.path)[1].lstrip(".")
+    app = Bank()
+    try:
+        with open(args.path, newline="") as file:
+            report = app.open_accounts_bulk(
+                read_accounts(file, format),
+                batch_size=args.batch_size,
+                hash_workers=args.hash_workers,
+                progress=print_progress,
+            )
+    finally:
+        app.close()
+    for email_address in report.duplicate_sample:
+        print(f"duplicate: {email_address}", file=sys.stderr)
+    if report.duplicates > len(report.duplicate_sample):
+        print(
+            f"and {report.duplicates - len(report.duplicate_sample)}"
+            " more duplicates",
+            file=sys.stderr,
+        )
+    print_progress(report, file=sys.stdout)
+    return 0
+
+
+def export_event_log(args: argparse.Namespace) -> int:
+    compressed = args.gzip or args.path.endswith(".gz")
+    start = args.start
+    length = 0
+    if args.resume and os.path.exists(args.path):
+        with open(args.path, "rb") as file:
+            try:
+                last_id, length = resume_point(file, compressed)
+            except ValueError as e:
+                print(
+                    f"{e}, export from --start into a new file",
+                    file=sys.stderr,
+                )
+                return 1
+        if last_id is not None:
+            start = last_id + 1
+    # Only reads the log, so without the projections of a Bank.
+    reader = LogReader()
+    try:
+        chunks = export_events(reader, start)
+        if compressed:
+            chunks = gzip_chunks(chunks)
+        if args.path == "-":
+            write_chunks(chunks, sys.stdout.buffer)
+        else:
+            with open(args.path, "r+b" if length else "wb") as file:
+                file.truncate(length)
+                file.seek(length)
+                write_chunks(chunks, file)
+    finally:
+        reader.close()
+    return 0
+
+
+def write_chunks(chunks: Iterable[bytes], file: IO[bytes]) -> None:
+    # Flushed as each section is written, so that an export
+    # that is cut short can be resumed from what it wrote.
+    for chunk in chunks:
+        file.write(chunk)
+        file.flush()
+
+
+def migrate_event_store(args: argparse.Namespace) -> int:
+    app = Bank()
+    factory = InfrastructureFactory.construct(
+        Environment(app.name, {**app.env, "SQLITE_DBNAME": args.dbname})
+    )
+    transcoder = construct_transcoder(
+        args.transcoder, args.compression_threshold
+    )
+    app.register_transcodings(transcoder)
+    mapper = Mapper(
+        transcoder=transcoder,
+        compressor=app.mapper.compressor,
+        cipher=app.mapper.cipher,
+    )
+    copied = 0
+    try:
+        for copied in migrate_events(
+            app, factory.application_recorder(), mapper
+        ):
+            print(f"{copied} events copied", file=sys.stderr)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        factory.close()
+        app.close()
+    print(f"{copied} events copied")
+    return 0
+
+
+def accrue_interest(args: argparse.Namespace) -> int:
+    day = args.day or datetime.now(timezone.utc).date()
+    app = Bank()
+    try:
+        engine = AccrualEngine(app, batch_size=args.batch_size)
+        report = engine.run(day, args.interest_rate, args.overdraft_rate)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        app.close()
+    print(
+        f"{report.day}: {report.accounts} accounts, "
+        f"{report.credited} credited {report.interest_in_cents} in interest, "
+        f"{report.debited} debited {report.fees_in_cents} in fees"
+    )
+    return 0
+
+
+def reconcile(args: argparse.Namespace) -> int:
+    app = Bank()
+    try:
+        report = Reconciler(app, workers=args.workers).run()
+    finally:
+        app.close()
+    for discrepancy in report.discrepancies:
+        print(
+            f"{discrepancy.account_id}: {discrepancy.kind} "
+            f"expected {discrepancy.expected}, was {discrepancy.actual}",
+            file=sys.stderr,
+        )
+        for event in discrepancy.events:
+            print(
+                f"  v{event.version} {event.kind} {event.amount_in_cents}"
+                f" balance {event.balance} limit {event.overdraft_limit}"
+                f" at {event.timestamp.isoformat()}",
+                file=sys.stderr,
+            )
+    print(
+        f"{report.position} notifications, {report.accounts} accounts: "
+        f"{report.credits_in_cents} credited - {report.debits_in_cents} "
+        f"debited = {report.balances_in_cents} in balances, "
+        f"{len(report.discrepancies)} discrepancies"
+    )
+    return 0 if report.ok else 1
+
+
+def print_progress(
+    report: BulkOpenReport, file: Optional[IO[str]] = None
+) -> None:
+    print(
+        f"{report.processed} processed, {report.opened} opened, "
+        f"{report.duplicates} duplicates",
+        file=file or sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# coding=utf-8
+
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from threading import Lock, RLock
+from typing import Any, Callable, Iterable, Iterator, Mapping, TypeVar, cast
+from uuid import UUID
+
+from eventsourcing.persistence import IntegrityError
+
+T = TypeVar("T", bound=Callable[..., Any])
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How often a command is attempted when saving it conflicts
+    with events recorded concurrently, and how long to wait
+    between attempts. The wait is drawn uniformly from zero to
+    backoff doubled for every attempt made, up to max_backoff,
+    so that conflicting callers spread out.
+    """
+
+    attempts: int = 5
+    backoff: float = 0.005
+    max_backoff: float = 0.1
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2**attempt)
+        )
+
+
+@dataclass
+class RetryStats:
+    commands: int = 0
+    attempts: int = 0
+    conflicts: int = 0
+    retried: int = 0
+    exhausted: int = 0
+    lock: Lock = field(default_factory=Lock, repr=False, compare=False)
+
+    @property
+    def conflict_rate(self) -> float:
+        """Fraction of attempts that conflicted."""
+        return self.conflicts / self.attempts if self.attempts else 0.0
+
+    @property
+    def retry_rate(self) -> float:
+        """Fraction of commands that needed more than one attempt."""
+        return self.retried / self.commands if self.commands else 0.0
+
+
+class LockStripes:
+    """
+    A fixed number of locks shared by all accounts, so that
+    commands on the same account in this process take turns
+    instead of conflicting when they save. Locks for several
+    accounts are taken in stripe order, so commands on pairs
+    of accounts can't deadlock.
+    """
+
+    def __init__(self, stripes: int):
+        if stripes <= 0:
+            raise ValueError(f"Invalid number of lock stripes {stripes}")
+        self.locks = [RLock() for _ in range(stripes)]
+
+    @contextmanager
+    def lock(self, account_ids: Iterable[UUID]) -> Iterator[None]:
+        stripes = sorted({a.int % len(self.locks) for a in account_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self.locks[stripe])
+            yield
+
+
+def command(method: T) -> T:
+    """
+    Decorates a Bank command so that a save that conflicts
+    with concurrently recorded events runs the command again
+    with the accounts reloaded, following the bank's
+    retry_policy. The UUID arguments of the command are the
+    accounts it locks, when the bank has account_locks.
+    The time taken, retries included, is observed in the
+    bank's metrics.
+    """
+    labels = (("command", method.__name__),)
+
+    @wraps(method)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return _attempt(self, *args, **kwargs)
+        finally:
+            self.metrics.observe(
+                "banking_command_duration_seconds",
+                time.perf_counter() - started,
+                labels,
+            )
+
+    def _attempt(self: Any, *args: Any, **kwargs: Any) -> Any:
+        account_ids = [
+            a for a in (*args, *kwargs.values()) if isinstance(a, UUID)
+        ]
+        policy: RetryPolicy = self.retry_policy
+        stats: RetryStats = self.retry_stats
+        attempt = 0
+        while True:
+            try:
+                if self.account_locks is not None:
+                    with self.account_locks.lock(account_ids):
+                        result = method(self, *args, **kwargs)
+                else:
+                    result = method(self, *args, **kwargs)
+            except IntegrityError:
+                # The failed save has already forgotten the accounts
+                # in the identity map, so the next attempt reloads.
+                attempt += 1
+                with stats.lock:
+                    stats.attempts += 1
+                    stats.conflicts += 1
+                    if attempt == 1:
+                        stats.commands += 1
+                    if attempt >= policy.attempts:
+                        stats.exhausted += 1
+                        raise
+                    if attempt == 1:
+                        stats.retried += 1
+                time.sleep(policy.delay(attempt))
+            else:
+                with stats.lock:
+                    stats.attempts += 1
+                    if attempt == 0:
+                        stats.commands += 1
+                return result
+
+    return cast(T, wrapper)
+
+
+def is_shared_store(env: Mapping[str, str]) -> bool:
+    """
+    Whether the event store configured by env can be shared
+    by several processes, as a SQLite file can.
+    """
+    db_name = env.get("SQLITE_DBNAME", "")
+    return (
+        env.get("PERSISTENCE_MODULE") == "eventsourcing.sqlite"
+        and db_name not in ("", ":memory:")
+        and "mode=memory" not in db_name
+    )
@@ -1,10 +1,10 @@
 # coding=utf-8
 
 from hashlib import sha512
+from datetime import datetime, timedelta
 from re import fullmatch
-from tabnanny import check
-from uuid import UUID, uuid4
-from typing import Tuple
+from uuid import NAMESPACE_URL, UUID, uuid4, uuid5
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from eventsourcing.domain import Aggregate, event
 
@@ -36,6 +36,7 @@ class Account(Aggregate):
         self.balance = 0
         self.is_closed = False
         self.overdraft_limit = 0
+        self.shards = 0
 
         # complete this function and others below as needed
 
@@ -44,14 +45,28 @@ class Account(Aggregate):
         self.is_closed = True
 
 
-    @event("Credited")
-    def credit(self, amount_in_cents: int) -> None:
+    class Credited(Aggregate.Event):
+        amount_in_cents: int
+        # The transfer the credit is part of. Credits recorded
+        # before they carried it are read without one.
+        transaction_id: Optional[UUID] = None
+
+    @event(Credited)
+    def credit(
+        self, amount_in_cents: int, transaction_id: Optional[UUID] = None
+    ) -> None:
         if amount_in_cents <= 0:
             raise InvalidDeposit(amount_in_cents)
         self.balance += amount_in_cents
 
-    @event("Debited")
-    def debit(self, amount_in_cents: int) -> None:
+    class Debited(Aggregate.Event):
+        amount_in_cents: int
+        transaction_id: Optional[UUID] = None
+
+    @event(Debited)
+    def debit(
+        self, amount_in_cents: int, transaction_id: Optional[UUID] = None
+    ) -> None:
         if amount_in_cents <= 0:
             raise ValueError("Invalid amount")
         if self.balance - amount_in_cents < -self.overdraft_limit:
@@ -83,22 +98,175 @@ class Account(Aggregate):
         self.check_is_closed()
 
 
-    def authenticate(self, email_address: str, password: str) -> bool:
+    def authenticate(
+        self,
+        email_address: str,
+        password: str,
+        verify: Callable[[str, str], bool],
+    ) -> bool:
         if not fullmatch("[^@]+@[^@]+\.[^@]+", email_address):
             raise BadCredentials(email_address)
 
-        hashed_password = sha512(password.encode()).hexdigest()
-
-        if self.email_address != email_address or self.password != hashed_password:
+        if self.email_address != email_address or not verify(
+            password, self.password
+        ):
             raise BadCredentials(email_address)
         return True
 
-    @event("PasswordChanged")
-    def change_password(self, new_password: str) -> None:
-        self.password = sha512(new_password.encode()).hexdigest()
+    class PasswordChanged(Aggregate.Event):
+        password_hash: str
+
+        # Version 1 recorded the new password itself, and
+        # hashed it with unsalted SHA-512 when applied.
+        class_version = 2
+
+        @staticmethod
+        def upcast_v1_v2(state: Dict[str, Any]) -> None:
+            new_password = state.pop("new_password")
+            state["password_hash"] = sha512(new_password.encode()).hexdigest()
+
+    @event(PasswordChanged)
+    def change_password(self, password_hash: str) -> None:
+        self.password = password_hash
+
+    @event("PasswordRehashed")
+    def rehash_password(self, password_hash: str) -> None:
+        self.password = password_hash
+
     def check_is_closed(self) -> bool:
         return self.is_closed
 
+    @event("Sharded")
+    def shard(self, shards: int) -> None:
+        if shards < max(1, self.shards):
+            raise ValueError(f"Invalid number of shards {shards}")
+        self.shards = shards
+
+    @event("CreditsSwept")
+    def sweep_credits(self, amount_in_cents: int) -> None:
+        self.balance += amount_in_cents
+
+
+class AccountShard(Aggregate):
+    """
+    Sub-ledger that takes credits for a sharded account, so
+    that concurrent credits to a busy account are recorded
+    in the sequences of its shards rather than all in the
+    sequence of the account. The credits are swept into the
+    account from time to time, and before the account is
+    debited.
+    """
+
+    @staticmethod
+    def create_id(account_id: UUID, index: int) -> UUID:
+        return uuid5(account_id, f"shard-{index}")
+
+    @event("Opened")
+    def __init__(self, account_id: UUID, index: int):
+        self.account_id = account_id
+        self.index = index
+        self.balance = 0
+
+    class Credited(Aggregate.Event):
+        account_id: UUID
+        amount_in_cents: int
+        transaction_id: Optional[UUID] = None
+
+    @event(Credited)
+    def credit(
+        self,
+        account_id: UUID,
+        amount_in_cents: int,
+        transaction_id: Optional[UUID] = None,
+    ) -> None:
+        if amount_in_cents <= 0:
+            raise InvalidDeposit(amount_in_cents)
+        self.balance += amount_in_cents
+
+    @event("Swept")
+    def sweep(self, amount_in_cents: int) -> None:
+        self.balance -= amount_in_cents
+
+
+class StandingOrder(Aggregate):
+    """
+    A transfer of a fixed amount from one account to another,
+    due every interval_seconds from next_due_at on, until the
+    order is cancelled. Each due transfer is recorded as
+    Executed, or as Failed when it couldn't be made, and moves
+    the order on to its next due time.
+    """
+
+    @event("Created")
+    def __init__(
+        self,
+        debit_account_id: UUID,
+        credit_account_id: UUID,
+        amount_in_cents: int,
+        interval_seconds: int,
+        next_due_at: datetime,
+    ):
+        if amount_in_cents <= 0:
+            raise InvalidAmount(amount_in_cents)
+        if interval_seconds <= 0:
+            raise ValueError(f"Invalid interval {interval_seconds}")
+        self.debit_account_id = debit_account_id
+        self.credit_account_id = credit_account_id
+        self.amount_in_cents = amount_in_cents
+        self.interval_seconds = interval_seconds
+        self.next_due_at = next_due_at
+        self.is_cancelled = False
+
+    @event("Executed")
+    def execute(self, transaction_id: UUID) -> None:
+        self.next_due_at += timedelta(seconds=self.interval_seconds)
+
+    @event("Failed")
+    def fail(self, reason: str) -> None:
+        self.next_due_at += timedelta(seconds=self.interval_seconds)
+
+    @event("Cancelled")
+    def cancel(self) -> None:
+        self.is_cancelled = True
+
+    def next_transaction_id(self) -> UUID:
+        # The same for every attempt at the transfer that is
+        # due next, and different for every due transfer.
+        return uuid5(self.id, self.next_due_at.isoformat())
+
+
+class InterestAccrual(Aggregate):
+    """
+    The interest and overdraft fees of a day, posted to the
+    accounts that were open when the accrual started, a batch
+    of accounts at a time, in the order they were opened. It
+    is saved with each batch, so that an accrual that stopped
+    is resumed after its last batch, and accruals of the same
+    day in several processes conflict rather than post twice.
+    """
+
+    @staticmethod
+    def create_id(day: str) -> UUID:
+        return uuid5(NAMESPACE_URL, f"/interest_accruals/{day}")
+
+    @event("Started")
+    def __init__(
+        self,
+        day: str,
+        accounts: int,
+        interest_rate: float,
+        overdraft_rate: float,
+    ):
+        self.day = day
+        self.accounts = accounts
+        self.interest_rate = interest_rate
+        self.overdraft_rate = overdraft_rate
+        self.posted = 0
+
+    @event("Posted")
+    def post(self, accounts: int) -> None:
+        self.posted += accounts
+
 
 class TransactionError(Exception):
     def __init__(self, transaction_id: UUID):
@@ -0,0 +1,150 @@
+# coding=utf-8
+
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import Notification
+from eventsourcing.utils import resolve_topic
+
+CONTENT_TYPE = "application/x-ndjson"
+GZIP_CONTENT_TYPE = "application/gzip"
+
+# Fields of the events that hold secrets, the password hashes
+# of accounts, which are left out of exports.
+REDACTED = frozenset({"password", "password_hash", "new_password"})
+
+# The names, in the types of a line, of the types of the state
+# that JSON doesn't have, and how each is read back.
+_TYPES: Dict[type, str] = {datetime: "datetime", UUID: "uuid"}
+_READERS: Dict[str, Callable[[str], Any]] = {
+    "datetime": datetime.fromisoformat,
+    "uuid": UUID,
+}
+
+
+def export_events(app: Application, start: int = 1) -> Iterator[bytes]:
+    """
+    Lazily reads the notification log of the app from the
+    notification with id start, a section at a time, and
+    yields each section as lines of JSON, one per event,
+    with the id of the notification, the originator_id,
+    originator_version and topic of the event, its state,
+    less the fields in REDACTED, and the types of the values
+    of the state that were written as strings. Only one
+    section is held in memory at a time.
+
+    An export that was cut short resumes from the id
+    after the id of its last line.
+    """
+    section_size = app.notification_log.section_size
+    while True:
+        notifications = app.notification_log.select(
+            start=start, limit=section_size
+        )
+        if not notifications:
+            return
+        yield "".join(
+            _line(app, notification) for notification in notifications
+        ).encode()
+        if len(notifications) < section_size:
+            return
+        start = notifications[-1].id + 1
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Compresses the chunks into one gzip stream, flushing
+    after each chunk, so that everything yielded so far
+    can be decompressed even if the stream is cut short.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def resume_point(
+    file: IO[bytes], compressed: bool
+) -> Tuple[Optional[int], int]:
+    """
+    Where to resume the export written to the file: the
+    notification id of its last complete line, or None if
+    there is none, and the length of the file up to the end
+    of that line. The file is read to the end a line at a
+    time. A compressed export that was cut short can't be
+    appended to, so it raises ValueError.
+    """
+    last_id = None
+    if not compressed:
+        length = 0
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            last_id = json.loads(line)["id"]
+            length += len(line)
+        return last_id, length
+    try:
+        for line in gzip.GzipFile(fileobj=file):
+            last_id = json.loads(line)["id"]
+    except EOFError:
+        raise ValueError(
+            f"The compressed export is cut short after notification {last_id}"
+        ) from None
+    return last_id, file.seek(0, io.SEEK_END)
+
+
+def read_event(record: Dict[str, Any]) -> DomainEventProtocol:
+    """
+    The domain event of a line of an export. The values of
+    the state written as strings are read back as the types
+    the line gives for them, such as datetimes and UUIDs. The
+    fields in REDACTED aren't in the event.
+    """
+    types = record.get("types", {})
+    event = object.__new__(resolve_topic(record["topic"]))
+    event.__dict__.update(
+        {
+            key: _READERS[types[key]](value) if key in types else value
+            for key, value in record["state"].items()
+        },
+        originator_id=UUID(record["originator_id"]),
+        originator_version=record["originator_version"],
+    )
+    return event
+
+
+def _line(app: Application, notification: Notification) -> str:
+    state = {
+        key: value
+        for key, value in app.mapper.to_domain_event(
+            notification
+        ).__dict__.items()
+        if key not in REDACTED
+        and key not in ("originator_id", "originator_version")
+    }
+    record = {
+        "id": notification.id,
+        "originator_id": str(notification.originator_id),
+        "originator_version": notification.originator_version,
+        "topic": notification.topic,
+        "state": state,
+        "types": {
+            key: _TYPES[type(value)]
+            for key, value in state.items()
+            if type(value) in _TYPES
+        },
+    }
+    return json.dumps(record, default=_default, separators=(",", ":")) + "\n"
+
+
+def _default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
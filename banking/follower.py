@@ -0,0 +1,312 @@
+# coding=utf-8
+
+import json
+import time
+import urllib.request
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from uuid import UUID
+
+from flask import Flask, request
+from flask_jwt_extended import (  # type: ignore
+    JWTManager,
+    get_jwt_identity,
+    jwt_required,
+)
+from flask_restful import Resource  # type: ignore
+
+from banking import api
+from banking.exporting import read_event
+from banking.projections import (
+    AccountBalance,
+    BalanceProjection,
+    InMemoryBalanceView,
+    TokenRevocations,
+)
+from banking.reconciliation import LogReader
+from banking.resources import JWTApi, consistent_read
+from banking.utils.http_errors import handler
+from banking.utils.periodic import PeriodicJob
+
+
+class Replica(LogReader):
+    """
+    Read-only copy of the state of a Bank, kept by a follower:
+    the balance, overdraft limit and closed flag of every
+    account, and the revoked access tokens, folded from the
+    events of the bank's notification log.
+
+    Constructed with the environment of the bank, it reads
+    the bank's own event store. Constructed with the default
+    in-memory persistence, it reads the events an EventStream
+    copies into it from the bank's export endpoint.
+    """
+
+    def __init__(self, env: Optional[Mapping[str, str]] = None):
+        super().__init__(env)
+        self.balances = BalanceProjection(self, InMemoryBalanceView())
+        self.token_revocations = TokenRevocations(self)
+
+    def pull(self) -> int:
+        count = self.balances.pull()
+        self.token_revocations.pull()
+        return count
+
+
+class EventStream:
+    """
+    Copies the events of a primary, from the event log it
+    streams to admins at /api/v1/admin/events, into a Replica,
+    a section at a time. The position is the notification
+    id, in the log of the primary, of the last event copied,
+    and each call carries on from there.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        admin_key: str,
+        section_size: int = 500,
+        timeout: float = 10.0,
+    ):
+        self.url = url.rstrip("/")
+        self.admin_key = admin_key
+        self.section_size = section_size
+        self.timeout = timeout
+        self.position = 0
+
+    def copy_to(self, replica: Replica) -> int:
+        """
+        Copies the events recorded after the position, and
+        returns the id of the last event the primary had
+        recorded when it started streaming them.
+        """
+        req = urllib.request.Request(
+            f"{self.url}/api/v1/admin/events?start={self.position + 1}",
+            headers={"X-Admin-Key": self.admin_key},
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            head = int(response.headers["X-Notification-Head"])
+            records: List[Dict[str, Any]] = []
+            for line in response:
+                records.append(json.loads(line))
+                if len(records) == self.section_size:
+                    self._insert(replica, records)
+            self._insert(replica, records)
+        return head
+
+    def _insert(self, replica: Replica, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        replica.recorder.insert_events(
+            [replica.mapper.to_stored_event(read_event(r)) for r in records]
+        )
+        self.position = records[-1]["id"]
+        records.clear()
+
+
+@dataclass(frozen=True)
+class ReplicationLag:
+    # The notification id, in the log of the primary, up to
+    # which the replica is current, and the last id the
+    # primary is known to have recorded.
+    position: int
+    head: int
+    # The seconds since the replica last had every event the
+    # primary had recorded, or None if it never has.
+    seconds: Optional[float]
+
+    @property
+    def notifications(self) -> int:
+        return self.head - self.position
+
+
+class Follower(PeriodicJob):
+    """
+    Keeps a Replica up to date with the notification log of
+    a primary, read from their shared event store, or copied
+    from the primary by an EventStream when there is one, and
+    tracks how far behind the primary it is. The replica's
+    projections do the reading, so a pass only reads what was
+    recorded since they last did.
+    """
+
+    def __init__(
+        self,
+        replica: Replica,
+        stream: Optional[EventStream] = None,
+        period: float = 0.5,
+    ):
+        super().__init__(period)
+        self.replica = replica
+        self.stream = stream
+        self.lock = Lock()
+        self.position = 0
+        self.head = 0
+        self.caught_up_at: Optional[float] = None
+
+    def run_once(self) -> int:
+        """
+        Folds the events recorded since the previous pass into
+        the replica. Returns the number of notifications read.
+        """
+        if self.stream is not None:
+            head = self.stream.copy_to(self.replica)
+            count = self.replica.pull()
+            position = self.stream.position
+        else:
+            head = self.replica.recorder.max_notification_id()
+            count = self.replica.pull()
+            position = self.replica.balances.position
+        with self.lock:
+            self.position = position
+            self.head = max(head, position)
+            if position >= head:
+                self.caught_up_at = time.monotonic()
+        return count
+
+    def lag(self) -> ReplicationLag:
+        with self.lock:
+            return ReplicationLag(
+                position=self.position,
+                head=self.head,
+                seconds=(
+                    time.monotonic() - self.caught_up_at
+                    if self.caught_up_at is not None
+                    else None
+                ),
+            )
+
+    def get(self, account_id: UUID) -> Optional[AccountBalance]:
+        return self.replica.balances.get(account_id)
+
+
+class FollowerResource(Resource):
+    """
+    Serves a read from the replica of a follower, unless the
+    client asks for ?consistent=true, the replica has fallen
+    more than max_lag seconds behind, or the account isn't in
+    it yet, in which case the client is redirected to the
+    primary, with a 307 so that it repeats the same request.
+    """
+
+    def __init__(self, follower: Follower, primary_url: str, max_lag: float):
+        self.follower = follower
+        self.primary_url = primary_url.rstrip("/")
+        self.max_lag = max_lag
+
+    def account(self) -> Tuple[UUID, Optional[AccountBalance]]:
+        account_id = UUID(get_jwt_identity())
+        if consistent_read():
+            return account_id, None
+        seconds = self.follower.lag().seconds
+        if seconds is None or seconds > self.max_lag:
+            return account_id, None
+        return account_id, self.follower.get(account_id)
+
+    def redirect(self) -> Tuple[Dict[str, str], int, Dict[str, str]]:
+        location = self.primary_url + request.full_path.rstrip("?")
+        return {"location": location}, 307, {"Location": location}
+
+
+class FollowerAccountResource(FollowerResource):
+    @jwt_required()
+    @handler
+    def get(self) -> Any:
+        account_id, row = self.account()
+        if row is None:
+            return self.redirect()
+        return {"balance": str(row.balance), "identity": str(account_id)}, 200
+
+
+class FollowerBalanceResource(FollowerResource):
+    @jwt_required()
+    @handler
+    def get(self) -> Any:
+        _, row = self.account()
+        if row is None:
+            return self.redirect()
+        return {"balance": str(row.balance)}, 200
+
+
+class FollowerOverdraftLimitResource(FollowerResource):
+    @jwt_required()
+    @handler
+    def get(self) -> Any:
+        _, row = self.account()
+        if row is None:
+            return self.redirect()
+        return {"overdraft_limit": str(row.overdraft_limit)}, 200
+
+
+class ReplicationResource(Resource):
+    def __init__(self, follower: Follower):
+        self.follower = follower
+
+    def get(self) -> Tuple[Dict[str, Any], int]:
+        lag = self.follower.lag()
+        return {
+            "position": lag.position,
+            "head": lag.head,
+            "lag_notifications": lag.notifications,
+            "lag_seconds": lag.seconds,
+        }, 200
+
+
+class FollowerReadinessResource(Resource):
+    def __init__(self, follower: Follower):
+        self.follower = follower
+
+    def get(self) -> Tuple[Dict[str, bool], int]:
+        # Ready once the replica has caught up with the primary.
+        if self.follower.lag().seconds is None:
+            return {"ready": False}, 503
+        return {"ready": True}, 200
+
+
+def create_follower_app(
+    follower: Follower, primary_url: str, max_lag: float = 5.0
+) -> Flask:
+    """
+    The API of a follower: the GET resources of an account,
+    served from its replica, its replication lag at
+    /api/v1/replication, and its readiness. Access tokens are
+    issued by the primary, and checked with the same key
+    against the tokens revoked in the replica.
+    """
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = api.SECRET_KEY
+    jwt = JWTManager(app)
+
+    @jwt.token_in_blocklist_loader
+    def is_token_revoked(
+        jwt_header: Dict[str, Any], jwt_payload: Dict[str, Any]
+    ) -> bool:
+        return follower.replica.token_revocations.is_revoked(
+            UUID(jwt_payload["sub"]), jwt_payload.get("pv", 0)
+        )
+
+    follower_api = JWTApi(app, prefix="/api/v1")
+    kwargs = {
+        "follower": follower,
+        "primary_url": primary_url,
+        "max_lag": max_lag,
+    }
+    for resource, path in (
+        (FollowerAccountResource, "/account"),
+        (FollowerBalanceResource, "/account/balance"),
+        (FollowerOverdraftLimitResource, "/account/overdraft_limit"),
+    ):
+        follower_api.add_resource(resource, path, resource_class_kwargs=kwargs)
+    follower_api.add_resource(
+        ReplicationResource,
+        "/replication",
+        resource_class_kwargs={"follower": follower},
+    )
+    follower_api.add_resource(
+        FollowerReadinessResource,
+        "/ready",
+        resource_class_kwargs={"follower": follower},
+    )
+    return app
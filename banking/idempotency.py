@@ -0,0 +1,205 @@
+# coding=utf-8
+
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+
+@dataclass(frozen=True)
+class IdempotentResult:
+    """
+    What a request made with an idempotency key was answered
+    with. The fingerprint identifies the request, so the key
+    can't be replayed with another. The status is None while
+    the request is being processed.
+    """
+
+    fingerprint: str
+    status: Optional[int]
+    body: str
+
+
+class IdempotencyStore(ABC):
+    """
+    The idempotency keys of an account's requests, each with
+    the result of its request, kept for ttl seconds after the
+    request was answered. A key is reserved while its request
+    is processed, for at most lease seconds, so that a retry
+    that arrives meanwhile isn't processed as well.
+    """
+
+    def __init__(self, ttl: float, lease: float):
+        self.ttl = ttl
+        self.lease = lease
+
+    @abstractmethod
+    def reserve(
+        self, account_id: UUID, key: str, fingerprint: str
+    ) -> Optional[IdempotentResult]:
+        """
+        Reserves the key and returns None, or, if the key is
+        already reserved or answered, returns its result.
+        """
+
+    @abstractmethod
+    def complete(
+        self, account_id: UUID, key: str, result: IdempotentResult
+    ) -> None:
+        """
+        Records the result of the request of a reserved key.
+        """
+
+    @abstractmethod
+    def release(self, account_id: UUID, key: str) -> None:
+        """
+        Forgets a reserved key, so that the request can be
+        made again, after it failed without a result.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, ttl: float, lease: float):
+        super().__init__(ttl, lease)
+        self.lock = Lock()
+        # Kept in the order they expire, apart from reserved
+        # keys, which expire sooner than those answered before
+        # them, and are only dropped once those are.
+        self.results: Dict[
+            Tuple[UUID, str], Tuple[float, IdempotentResult]
+        ] = OrderedDict()
+
+    def reserve(
+        self, account_id: UUID, key: str, fingerprint: str
+    ) -> Optional[IdempotentResult]:
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            entry = self.results.get((account_id, key))
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            self.results[(account_id, key)] = (
+                now + self.lease,
+                IdempotentResult(fingerprint, None, ""),
+            )
+            return None
+
+    def complete(
+        self, account_id: UUID, key: str, result: IdempotentResult
+    ) -> None:
+        with self.lock:
+            # Moved to the end, with the keys that expire last.
+            self.results.pop((account_id, key), None)
+            self.results[(account_id, key)] = (
+                time.monotonic() + self.ttl,
+                result,
+            )
+
+    def release(self, account_id: UUID, key: str) -> None:
+        with self.lock:
+            self.results.pop((account_id, key), None)
+
+    def _expire(self, now: float) -> None:
+        while self.results:
+            scope, (expires, _) = next(iter(self.results.items()))
+            if expires > now:
+                return
+            del self.results[scope]
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """
+    Keys kept in a SQLite database that several processes
+    share, so that a retry is recognized by whichever of them
+    it reaches. Expired keys are deleted as keys are reserved,
+    by their indexed expiry time.
+    """
+
+    def __init__(self, db_name: str, ttl: float, lease: float):
+        super().__init__(ttl, lease)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(
+            db_name, check_same_thread=False, isolation_level=None
+        )
+        with self.lock, self.connection as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "account_id TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "fingerprint TEXT NOT NULL, "
+                "status INTEGER, "
+                "body TEXT NOT NULL, "
+                "expires REAL NOT NULL, "
+                "PRIMARY KEY (account_id, key))"
+            )
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idempotency_keys_expires "
+                "ON idempotency_keys (expires)"
+            )
+
+    def reserve(
+        self, account_id: UUID, key: str, fingerprint: str
+    ) -> Optional[IdempotentResult]:
+        # Wall-clock time, which the processes sharing the
+        # database agree on.
+        now = time.time()
+        with self.lock, self.connection as c:
+            c.execute("BEGIN IMMEDIATE")
+            c.execute(
+                "DELETE FROM idempotency_keys WHERE expires <= ?", (now,)
+            )
+            row = c.execute(
+                "SELECT fingerprint, status, body FROM idempotency_keys "
+                "WHERE account_id=? AND key=?",
+                (str(account_id), key),
+            ).fetchone()
+            if row is not None:
+                return IdempotentResult(*row)
+            c.execute(
+                "INSERT INTO idempotency_keys VALUES (?, ?, ?, NULL, '', ?)",
+                (str(account_id), key, fingerprint, now + self.lease),
+            )
+            return None
+
+    def complete(
+        self, account_id: UUID, key: str, result: IdempotentResult
+    ) -> None:
+        with self.lock, self.connection as c:
+            c.execute(
+                "INSERT OR REPLACE INTO idempotency_keys"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    str(account_id),
+                    key,
+                    result.fingerprint,
+                    result.status,
+                    result.body,
+                    time.time() + self.ttl,
+                ),
+            )
+
+    def release(self, account_id: UUID, key: str) -> None:
+        with self.lock, self.connection as c:
+            c.execute(
+                "DELETE FROM idempotency_keys WHERE account_id=? AND key=?",
+                (str(account_id), key),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def construct_idempotency_store(
+    db_name: Optional[str], ttl: float, lease: float = 30.0
+) -> IdempotencyStore:
+    if db_name:
+        return SQLiteIdempotencyStore(db_name, ttl, lease)
+    return InMemoryIdempotencyStore(ttl, lease)
@@ -0,0 +1,37 @@
+# coding=utf-8
+
+import csv
+import json
+from typing import IO, Iterator, Mapping
+
+from banking.applicationmodel import NewAccount
+
+FORMATS = ("csv", "jsonl")
+
+
+def read_accounts(file: IO[str], format: str) -> Iterator[NewAccount]:
+    """
+    Lazily reads accounts to open from a CSV file with a
+    header row, or from a file with one JSON object per
+    line. Both have the fields full_name, email_address
+    and password.
+    """
+    if format == "csv":
+        for row in csv.DictReader(file):
+            yield _new_account(row)
+    elif format == "jsonl":
+        for line in file:
+            if line.strip():
+                yield _new_account(json.loads(line))
+    else:
+        raise ValueError(
+            f"Unknown format {format!r}, expected one of {FORMATS}"
+        )
+
+
+def _new_account(row: Mapping[str, str]) -> NewAccount:
+    return NewAccount(
+        full_name=row["full_name"],
+        email_address=row["email_address"],
+        password=row["password"],
+    )
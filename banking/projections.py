@@ -0,0 +1,1078 @@
+# coding=utf-8
+
+import sqlite3
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from datetime import datetime
+from threading import Lock
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.domain import Aggregate, DomainEventProtocol
+from eventsourcing.persistence import Notification, Recording
+from eventsourcing.utils import get_topic
+
+from banking.domainmodel import Account, AccountShard
+from banking.utils.bloom import BloomFilter
+
+NotifiedEvent = Tuple[Notification, DomainEventProtocol]
+
+
+def event_topics(aggregate_class: type) -> Tuple[str, ...]:
+    """
+    The topics of all the event classes of an aggregate class.
+    """
+    return tuple(
+        sorted(
+            {
+                get_topic(value)
+                for value in vars(aggregate_class).values()
+                if isinstance(value, type)
+                and issubclass(value, Aggregate.Event)
+            }
+        )
+    )
+
+
+class Projection(ABC):
+    """
+    Follows the notification log of an application and
+    folds the recorded events into a materialized view.
+
+    The view stores the position (the last processed
+    notification ID) together with the rows it updated, so
+    a projection resumes where it stopped after a restart.
+
+    Call pull() to catch up from the saved position, and
+    receive() with the recordings returned by a save, which
+    are applied without reading them back from the store
+    when they follow on directly from the saved position.
+
+    Several processes may maintain one shared view: a view
+    refuses updates from a position it has already moved
+    past, and the projection then reloads the position and
+    carries on from there.
+
+    Set topics to only read and process the notifications
+    of those event classes. Recordings received with none of
+    them move the position on in memory only, and the view
+    records it with its next update.
+    """
+
+    topics: Sequence[str] = ()
+
+    def __init__(self, app: Application):
+        self.app = app
+        self.lock = Lock()
+        # The position the view has recorded, which the position
+        # is ahead of after receiving none of the topics.
+        self.position = self.saved_position = self.load_position()
+
+    @abstractmethod
+    def load_position(self) -> int:
+        """
+        Returns the ID of the last notification processed
+        into the view.
+        """
+
+    @abstractmethod
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        """
+        Updates the view with the given events and moves the
+        position it has recorded on from saved_position to
+        position. Raises ProjectionConflict if the view has
+        moved on from saved_position.
+        """
+
+    def pull(self) -> int:
+        """
+        Processes the notifications recorded after the saved
+        position. Returns the number of notifications the
+        position moved on by.
+        """
+        with self.lock:
+            return self._pull()
+
+    def receive(self, recordings: Sequence[Recording]) -> None:
+        with self.lock:
+            if (
+                recordings
+                and recordings[0].notification.id == self.position + 1
+            ):
+                events = [
+                    (r.notification, r.domain_event)
+                    for r in recordings
+                    if self._is_processed(r.notification)
+                ]
+                position = recordings[-1].notification.id
+                if not events:
+                    self.position = position
+                    return
+                try:
+                    self._process(events, position)
+                    return
+                except ProjectionConflict:
+                    self._reload_position()
+            self._pull()
+
+    def _pull(self) -> int:
+        section_size = self.app.notification_log.section_size
+        count = 0
+        while True:
+            # The store only returns notifications of the topics,
+            # up to the last one recorded now, which the position
+            # moves on to once they have all been read.
+            head = self.app.recorder.max_notification_id()
+            notifications = self.app.notification_log.select(
+                start=self.position + 1,
+                limit=section_size,
+                stop=head,
+                topics=self.topics,
+            )
+            read_all = len(notifications) < section_size
+            position = head if read_all else notifications[-1].id
+            previous_position = self.position
+            if position > previous_position:
+                try:
+                    self._process(
+                        [
+                            (n, self.app.mapper.to_domain_event(n))
+                            for n in notifications
+                        ],
+                        position,
+                    )
+                except ProjectionConflict:
+                    self._reload_position()
+                    continue
+                count += position - previous_position
+            if read_all:
+                return count
+
+    def _process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        self.process(events, position)
+        self.saved_position = position
+
+    def _reload_position(self) -> None:
+        self.position = self.saved_position = self.load_position()
+
+    def _is_processed(self, notification: Notification) -> bool:
+        return not self.topics or notification.topic in self.topics
+
+
+class ProjectionConflict(Exception):
+    def __init__(self, expected: int, actual: int):
+        super().__init__(
+            f"View is at position {actual}, expected position {expected}"
+        )
+
+
+@dataclass(frozen=True)
+class AccountBalance:
+    account_id: UUID
+    balance: int
+    overdraft_limit: int
+    is_closed: bool
+    version: int
+
+
+class BalanceView(ABC):
+    """
+    Materialized table of account_id -> AccountBalance.
+    """
+
+    @abstractmethod
+    def get(self, account_id: UUID) -> Optional[AccountBalance]:
+        pass
+
+    @abstractmethod
+    def get_position(self) -> int:
+        pass
+
+    @abstractmethod
+    def put(
+        self,
+        rows: Iterable[AccountBalance],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        """
+        Atomically upserts the rows and moves the recorded
+        position on from previous_position to position.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryBalanceView(BalanceView):
+    def __init__(self) -> None:
+        self.rows: Dict[UUID, AccountBalance] = {}
+        self.position = 0
+
+    def get(self, account_id: UUID) -> Optional[AccountBalance]:
+        return self.rows.get(account_id)
+
+    def get_position(self) -> int:
+        return self.position
+
+    def put(
+        self,
+        rows: Iterable[AccountBalance],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        if self.position != previous_position:
+            raise ProjectionConflict(previous_position, self.position)
+        self.rows.update((row.account_id, row) for row in rows)
+        self.position = position
+
+
+class SQLiteView:
+    """
+    Base class for views kept in their own SQLite database,
+    so that they survive restarts of the processes that
+    maintain them. Positions of several views can share
+    the projection_positions table of one database.
+    """
+
+    def __init__(self, db_name: str, name: str, schema: Sequence[str]):
+        self.name = name
+        self.lock = Lock()
+        self.connection = sqlite3.connect(
+            db_name, check_same_thread=False, isolation_level=None
+        )
+        with self.lock, self.connection as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            for statement in schema:
+                c.execute(statement)
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS projection_positions ("
+                "name TEXT PRIMARY KEY, position INTEGER NOT NULL)"
+            )
+
+    def get_position(self) -> int:
+        with self.lock:
+            return self._select_position(self.connection)
+
+    def _select_position(self, c: sqlite3.Connection) -> int:
+        row = c.execute(
+            "SELECT position FROM projection_positions WHERE name=?",
+            (self.name,),
+        ).fetchone()
+        return row[0] if row else 0
+
+    @contextmanager
+    def _update(
+        self, position: int, previous_position: int
+    ) -> Iterator[sqlite3.Connection]:
+        """
+        Transaction that moves the position on from
+        previous_position to position.
+        """
+        with self.lock, self.connection as c:
+            c.execute("BEGIN IMMEDIATE")
+            actual = self._select_position(c)
+            if actual != previous_position:
+                raise ProjectionConflict(previous_position, actual)
+            yield c
+            c.execute(
+                "INSERT OR REPLACE INTO projection_positions VALUES (?, ?)",
+                (self.name, position),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class SQLiteBalanceView(SQLiteView, BalanceView):
+    def __init__(self, db_name: str, name: str = "balances"):
+        super().__init__(
+            db_name,
+            name,
+            [
+                "CREATE TABLE IF NOT EXISTS account_balances ("
+                "account_id TEXT PRIMARY KEY, "
+                "balance INTEGER NOT NULL, "
+                "overdraft_limit INTEGER NOT NULL, "
+                "is_closed INTEGER NOT NULL, "
+                "version INTEGER NOT NULL)"
+            ],
+        )
+
+    def get(self, account_id: UUID) -> Optional[AccountBalance]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT balance, overdraft_limit, is_closed, version "
+                "FROM account_balances WHERE account_id=?",
+                (account_id.hex,),
+            ).fetchone()
+        if row is None:
+            return None
+        return AccountBalance(
+            account_id=account_id,
+            balance=row[0],
+            overdraft_limit=row[1],
+            is_closed=bool(row[2]),
+            version=row[3],
+        )
+
+    def put(
+        self,
+        rows: Iterable[AccountBalance],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        with self._update(position, previous_position) as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO account_balances "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        row.account_id.hex,
+                        row.balance,
+                        row.overdraft_limit,
+                        int(row.is_closed),
+                        row.version,
+                    )
+                    for row in rows
+                ],
+            )
+
+
+class BalanceProjection(Projection):
+    """
+    Keeps the balance, overdraft limit, closed flag and
+    version of every account in a BalanceView, so they
+    can be read without replaying the account's events.
+    Only the events of accounts, and the credits of their
+    shards, are folded into it.
+    """
+
+    topics = event_topics(Account) + (get_topic(AccountShard.Credited),)
+
+    def __init__(self, app: Application, view: BalanceView):
+        self.view = view
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        return self.view.get_position()
+
+    def get(self, account_id: UUID) -> Optional[AccountBalance]:
+        return self.view.get(account_id)
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        changed: Dict[UUID, AccountBalance] = {}
+        for _, event in events:
+            if isinstance(event, AccountShard.Credited):
+                # Shard credits count towards the account, and are
+                # not counted again when they are swept into it.
+                account_id = event.account_id
+            else:
+                account_id = event.originator_id
+            row = changed.get(account_id) or self.view.get(account_id)
+            if isinstance(event, Account.Opened):
+                row = AccountBalance(
+                    account_id=account_id,
+                    balance=0,
+                    overdraft_limit=0,
+                    is_closed=False,
+                    version=event.originator_version,
+                )
+            else:
+                assert row is not None, f"Account {account_id} not opened"
+                row = self._apply(row, event)
+            changed[account_id] = row
+        self.view.put(changed.values(), position, self.saved_position)
+        self.position = position
+
+    @staticmethod
+    def _apply(
+        row: AccountBalance, event: Union[Account.Event, AccountShard.Credited]
+    ) -> AccountBalance:
+        if isinstance(event, AccountShard.Credited):
+            return replace(row, balance=row.balance + event.amount_in_cents)
+        version = event.originator_version
+        if isinstance(event, Account.Credited):
+            return replace(
+                row,
+                balance=row.balance + event.amount_in_cents,
+                version=version,
+            )
+        if isinstance(event, Account.Debited):
+            return replace(
+                row,
+                balance=row.balance - event.amount_in_cents,
+                version=version,
+            )
+        if isinstance(event, Account.OverdraftLimitChanged):
+            return replace(
+                row, overdraft_limit=event.amount_in_cents, version=version
+            )
+        if isinstance(event, Account.Closed):
+            return replace(row, is_closed=True, version=version)
+        return replace(row, version=version)
+
+
+def construct_balance_view(db_name: Optional[str]) -> BalanceView:
+    if db_name:
+        return SQLiteBalanceView(db_name)
+    return InMemoryBalanceView()
+
+
+class EmailView(ABC):
+    """
+    Materialized table of email_address -> account_id.
+    """
+
+    @abstractmethod
+    def get(self, email_address: str) -> Optional[UUID]:
+        pass
+
+    @abstractmethod
+    def get_many(self, email_addresses: Sequence[str]) -> Dict[str, UUID]:
+        """
+        The account IDs of those of the email addresses that
+        have an account.
+        """
+
+    @abstractmethod
+    def email_addresses(self) -> Iterator[str]:
+        pass
+
+    @abstractmethod
+    def get_position(self) -> int:
+        pass
+
+    @abstractmethod
+    def put(
+        self,
+        entries: Dict[str, UUID],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        """
+        Atomically inserts the entries and moves the recorded
+        position on from previous_position to position.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryEmailView(EmailView):
+    def __init__(self) -> None:
+        self.entries: Dict[str, UUID] = {}
+        self.position = 0
+
+    def get(self, email_address: str) -> Optional[UUID]:
+        return self.entries.get(email_address)
+
+    def get_many(self, email_addresses: Sequence[str]) -> Dict[str, UUID]:
+        return {
+            email_address: self.entries[email_address]
+            for email_address in email_addresses
+            if email_address in self.entries
+        }
+
+    def email_addresses(self) -> Iterator[str]:
+        return iter(list(self.entries))
+
+    def get_position(self) -> int:
+        return self.position
+
+    def put(
+        self,
+        entries: Dict[str, UUID],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        if self.position != previous_position:
+            raise ProjectionConflict(previous_position, self.position)
+        self.entries.update(entries)
+        self.position = position
+
+
+class SQLiteEmailView(SQLiteView, EmailView):
+    def __init__(self, db_name: str, name: str = "emails"):
+        super().__init__(
+            db_name,
+            name,
+            [
+                "CREATE TABLE IF NOT EXISTS account_emails ("
+                "email_address TEXT PRIMARY KEY, "
+                "account_id TEXT NOT NULL)"
+            ],
+        )
+
+    def get(self, email_address: str) -> Optional[UUID]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT account_id FROM account_emails WHERE email_address=?",
+                (email_address,),
+            ).fetchone()
+        return UUID(row[0]) if row else None
+
+    def get_many(self, email_addresses: Sequence[str]) -> Dict[str, UUID]:
+        found = {}
+        # Under the limit of parameters of older SQLite versions.
+        for i in range(0, len(email_addresses), 500):
+            chunk = email_addresses[i : i + 500]
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT email_address, account_id FROM account_emails"
+                    f" WHERE email_address IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            found.update((row[0], UUID(row[1])) for row in rows)
+        return found
+
+    def email_addresses(self) -> Iterator[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT email_address FROM account_emails"
+            ).fetchall()
+        return (row[0] for row in rows)
+
+    def put(
+        self,
+        entries: Dict[str, UUID],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        with self._update(position, previous_position) as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO account_emails VALUES (?, ?)",
+                [
+                    (email, account_id.hex)
+                    for email, account_id in entries.items()
+                ],
+            )
+
+
+class EmailIndex(Projection):
+    """
+    Index of the email address of every opened account,
+    so existence checks never replay an account's events.
+    It is built from Account.Opened events, and rebuilt
+    from the start of the log when its view is empty.
+
+    An optional Bloom filter in front of the view answers
+    most lookups of unknown addresses without reading the
+    view at all. It is refilled from the view whenever
+    another process has moved a shared view on.
+    """
+
+    topics = (get_topic(Account.Opened),)
+
+    def __init__(
+        self,
+        app: Application,
+        view: EmailView,
+        bloom_filter: Optional[BloomFilter] = None,
+    ):
+        self.view = view
+        self.bloom_filter = bloom_filter
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        # Read the position first, so the filter has at least
+        # every address recorded up to that position.
+        position = self.view.get_position()
+        if self.bloom_filter is not None:
+            for email_address in self.view.email_addresses():
+                self.bloom_filter.add(email_address)
+        return position
+
+    def get(self, email_address: str) -> Optional[UUID]:
+        if (
+            self.bloom_filter is not None
+            and email_address not in self.bloom_filter
+        ):
+            return None
+        return self.view.get(email_address)
+
+    def get_many(self, email_addresses: Sequence[str]) -> Dict[str, UUID]:
+        """
+        The account IDs of those of the email addresses that
+        have an account, read from the view in one go.
+        """
+        if self.bloom_filter is not None:
+            email_addresses = [
+                email_address
+                for email_address in email_addresses
+                if email_address in self.bloom_filter
+            ]
+        return self.view.get_many(email_addresses) if email_addresses else {}
+
+    def lookup(
+        self, email_address: str, catch_up: bool = False
+    ) -> Optional[UUID]:
+        """
+        Returns the ID of the account with the given email
+        address, or None. On a miss, catches up with accounts
+        opened by other processes before answering, unless the
+        Bloom filter rules the address out and catch_up is
+        false. Callers that don't catch up must cope with an
+        account opened by another process since, as saving a
+        new account with the same ID then fails.
+        """
+        account_id = self.get(email_address)
+        if account_id is None and (
+            catch_up
+            or self.bloom_filter is None
+            or email_address in self.bloom_filter
+        ):
+            position = self.position
+            self.pull()
+            if self.position != position:
+                account_id = self.get(email_address)
+        return account_id
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        entries = {
+            event.email_address: event.originator_id for _, event in events
+        }
+        self.view.put(entries, position, self.saved_position)
+        if self.bloom_filter is not None:
+            for email_address in entries:
+                self.bloom_filter.add(email_address)
+        self.position = position
+
+
+def construct_email_view(db_name: Optional[str]) -> EmailView:
+    if db_name:
+        return SQLiteEmailView(db_name)
+    return InMemoryEmailView()
+
+
+class TokenRevocations(Projection):
+    """
+    The accounts whose access tokens are no longer accepted,
+    so that a token is checked against its claims without
+    replaying the account. A closed account's tokens are all
+    revoked. A token carries the password version of its
+    account, the version of the account's last PasswordChanged
+    event, and is revoked by a later change of password.
+    Rehashing a password at login changes nothing.
+
+    It is small, so it is kept in memory, and built from the
+    start of the log when the application is constructed.
+    """
+
+    topics = (get_topic(Account.Closed), get_topic(Account.PasswordChanged))
+
+    def __init__(self, app: Application):
+        self.closed: Set[UUID] = set()
+        self.password_versions: Dict[UUID, int] = {}
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        # Only this process updates the sets, so there is
+        # never a conflict to reload the position after.
+        return 0
+
+    def password_version(self, account_id: UUID) -> int:
+        return self.password_versions.get(account_id, 0)
+
+    def is_revoked(self, account_id: UUID, password_version: int) -> bool:
+        return (
+            account_id in self.closed
+            or password_version < self.password_version(account_id)
+        )
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        for _, event in events:
+            if isinstance(event, Account.Closed):
+                self.closed.add(event.originator_id)
+            else:
+                self.password_versions[event.originator_id] = (
+                    event.originator_version
+                )
+        self.position = position
+
+
+@dataclass(frozen=True)
+class TransactionEntry:
+    """
+    A line of an account's transaction history. The position
+    is the ID of the notification it was made from, so entries
+    sort in the order they were recorded. A transfer is entered
+    in both accounts' histories, and stays pending until the
+    debit or credit that goes with it has been processed.
+    """
+
+    account_id: UUID
+    position: int
+    kind: str
+    amount_in_cents: int
+    timestamp: datetime
+    counterparty_id: Optional[UUID] = None
+    transaction_id: Optional[UUID] = None
+    pending: bool = False
+
+
+@dataclass(frozen=True)
+class TransactionPage:
+    entries: List[TransactionEntry]
+    # Position to read the next, older, page before, if there is one.
+    next_cursor: Optional[int]
+
+
+class TransactionView(ABC):
+    """
+    Materialized table of (account_id, position) ->
+    TransactionEntry.
+    """
+
+    @abstractmethod
+    def page(
+        self, account_id: UUID, before: Optional[int], limit: int
+    ) -> List[TransactionEntry]:
+        """
+        Returns up to limit entries of the account, latest
+        first, that come before the given position.
+        """
+
+    @abstractmethod
+    def pending(self, account_id: UUID) -> List[TransactionEntry]:
+        """Returns the account's pending entries, earliest first."""
+
+    @abstractmethod
+    def get_position(self) -> int:
+        pass
+
+    @abstractmethod
+    def put(
+        self,
+        entries: Iterable[TransactionEntry],
+        settled: Iterable[Tuple[UUID, int]],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        """
+        Atomically inserts the entries, clears the pending flag
+        of the settled (account_id, position) entries, and moves
+        the recorded position on from previous_position to
+        position.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryTransactionView(TransactionView):
+    def __init__(self) -> None:
+        self.entries: Dict[UUID, List[TransactionEntry]] = {}
+        self.positions: Dict[UUID, List[int]] = {}
+        self.pending_entries: Dict[UUID, Dict[int, TransactionEntry]] = {}
+        self.position = 0
+
+    def page(
+        self, account_id: UUID, before: Optional[int], limit: int
+    ) -> List[TransactionEntry]:
+        entries = self.entries.get(account_id, [])
+        positions = self.positions.get(account_id, [])
+        end = (
+            len(positions)
+            if before is None
+            else bisect_left(positions, before)
+        )
+        return entries[max(0, end - limit) : end][::-1]
+
+    def pending(self, account_id: UUID) -> List[TransactionEntry]:
+        # Most accounts have none, so don't sort for them.
+        entries = self.pending_entries.get(account_id)
+        if not entries:
+            return []
+        return sorted(entries.values(), key=lambda entry: entry.position)
+
+    def get_position(self) -> int:
+        return self.position
+
+    def put(
+        self,
+        entries: Iterable[TransactionEntry],
+        settled: Iterable[Tuple[UUID, int]],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        if self.position != previous_position:
+            raise ProjectionConflict(previous_position, self.position)
+        for account_id, entry_position in settled:
+            del self.pending_entries[account_id][entry_position]
+            i = bisect_left(self.positions[account_id], entry_position)
+            account_entries = self.entries[account_id]
+            account_entries[i] = replace(account_entries[i], pending=False)
+        for entry in entries:
+            self.entries.setdefault(entry.account_id, []).append(entry)
+            self.positions.setdefault(entry.account_id, []).append(
+                entry.position
+            )
+            if entry.pending:
+                self.pending_entries.setdefault(entry.account_id, {})[
+                    entry.position
+                ] = entry
+        self.position = position
+
+
+class SQLiteTransactionView(SQLiteView, TransactionView):
+    def __init__(self, db_name: str, name: str = "transactions"):
+        super().__init__(
+            db_name,
+            name,
+            [
+                "CREATE TABLE IF NOT EXISTS account_transactions ("
+                "account_id TEXT NOT NULL, "
+                "position INTEGER NOT NULL, "
+                "kind TEXT NOT NULL, "
+                "amount_in_cents INTEGER NOT NULL, "
+                "timestamp TEXT NOT NULL, "
+                "counterparty_id TEXT, "
+                "transaction_id TEXT, "
+                "pending INTEGER NOT NULL, "
+                "PRIMARY KEY (account_id, position)) WITHOUT ROWID",
+                "CREATE INDEX IF NOT EXISTS account_transactions_pending "
+                "ON account_transactions (account_id, position) "
+                "WHERE pending=1",
+            ],
+        )
+
+    def page(
+        self, account_id: UUID, before: Optional[int], limit: int
+    ) -> List[TransactionEntry]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM account_transactions "
+                "WHERE account_id=? AND position<? "
+                "ORDER BY position DESC LIMIT ?",
+                (
+                    account_id.hex,
+                    before if before is not None else 2**63 - 1,
+                    limit,
+                ),
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def pending(self, account_id: UUID) -> List[TransactionEntry]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM account_transactions "
+                "WHERE account_id=? AND pending=1 ORDER BY position",
+                (account_id.hex,),
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row: Sequence[Any]) -> TransactionEntry:
+        return TransactionEntry(
+            account_id=UUID(row[0]),
+            position=row[1],
+            kind=row[2],
+            amount_in_cents=row[3],
+            timestamp=datetime.fromisoformat(row[4]),
+            counterparty_id=UUID(row[5]) if row[5] else None,
+            transaction_id=UUID(row[6]) if row[6] else None,
+            pending=bool(row[7]),
+        )
+
+    def put(
+        self,
+        entries: Iterable[TransactionEntry],
+        settled: Iterable[Tuple[UUID, int]],
+        position: int,
+        previous_position: int,
+    ) -> None:
+        with self._update(position, previous_position) as c:
+            c.executemany(
+                "UPDATE account_transactions SET pending=0 "
+                "WHERE account_id=? AND position=?",
+                [
+                    (account_id.hex, entry_position)
+                    for account_id, entry_position in settled
+                ],
+            )
+            c.executemany(
+                "INSERT INTO account_transactions "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        e.account_id.hex,
+                        e.position,
+                        e.kind,
+                        e.amount_in_cents,
+                        e.timestamp.isoformat(),
+                        e.counterparty_id.hex if e.counterparty_id else None,
+                        e.transaction_id.hex if e.transaction_id else None,
+                        int(e.pending),
+                    )
+                    for e in entries
+                ],
+            )
+
+
+class TransactionHistory(Projection):
+    """
+    Keeps the credits, debits and transfers of every account
+    in a TransactionView indexed by account and position, so
+    a page of an account's history is read without replaying
+    the account, in time proportional to the page size.
+
+    A transfer is recorded as a Transferred event on the
+    debited account, followed in the same transaction by a
+    Debited event on it and a credit of the other account,
+    which carry the transfer's transaction ID. The transfer
+    is entered in both histories, pending, and the debit and
+    credit with its ID are taken as settling it rather than
+    entered again.
+    """
+
+    topics = (
+        get_topic(Account.Transferred),
+        get_topic(Account.Debited),
+        get_topic(Account.Credited),
+        get_topic(AccountShard.Credited),
+    )
+
+    def __init__(self, app: Application, view: TransactionView):
+        self.view = view
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        return self.view.get_position()
+
+    def page(
+        self, account_id: UUID, cursor: Optional[int] = None, limit: int = 50
+    ) -> TransactionPage:
+        """
+        Returns up to limit entries of the account's history,
+        latest first, from before the cursor of the previous
+        page, or from the latest if there is no cursor.
+        """
+        entries = self.view.page(account_id, cursor, limit + 1)
+        if len(entries) > limit:
+            return TransactionPage(
+                entries[:limit], entries[limit - 1].position
+            )
+        return TransactionPage(entries, None)
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        entries: Dict[Tuple[UUID, int], TransactionEntry] = {}
+        settled: List[Tuple[UUID, int]] = []
+        pending: Dict[UUID, List[TransactionEntry]] = {}
+
+        def pending_entries(account_id: UUID) -> List[TransactionEntry]:
+            if account_id not in pending:
+                pending[account_id] = self.view.pending(account_id)
+            return pending[account_id]
+
+        def add(entry: TransactionEntry) -> None:
+            entries[(entry.account_id, entry.position)] = entry
+            if entry.pending:
+                pending_entries(entry.account_id).append(entry)
+
+        def settle(
+            account_id: UUID,
+            kind: str,
+            event: Union[
+                Account.Debited, Account.Credited, AccountShard.Credited
+            ],
+            position: int,
+        ) -> bool:
+            entry = next(
+                (
+                    entry
+                    for entry in pending_entries(account_id)
+                    if entry.kind == kind
+                    and self._settles(event, position, entry)
+                ),
+                None,
+            )
+            if entry is None:
+                return False
+            pending[account_id].remove(entry)
+            key = (account_id, entry.position)
+            if key in entries:
+                entries[key] = replace(entry, pending=False)
+            else:
+                settled.append(key)
+            return True
+
+        for notification, event in events:
+            if isinstance(event, Account.Transferred):
+                for account_id, counterparty_id, kind in (
+                    (event.originator_id, event.to_account_id, "transfer_out"),
+                    (event.to_account_id, event.originator_id, "transfer_in"),
+                ):
+                    add(
+                        TransactionEntry(
+                            account_id=account_id,
+                            position=notification.id,
+                            kind=kind,
+                            amount_in_cents=event.amount_in_cents,
+                            timestamp=event.timestamp,
+                            counterparty_id=counterparty_id,
+                            transaction_id=event.transaction_id,
+                            pending=True,
+                        )
+                    )
+                continue
+            if isinstance(event, Account.Debited):
+                account_id, kind = event.originator_id, "debit"
+                settling = "transfer_out"
+            elif isinstance(event, AccountShard.Credited):
+                account_id, kind = event.account_id, "credit"
+                settling = "transfer_in"
+            else:
+                account_id, kind = event.originator_id, "credit"
+                settling = "transfer_in"
+            if not settle(account_id, settling, event, notification.id):
+                add(
+                    TransactionEntry(
+                        account_id=account_id,
+                        position=notification.id,
+                        kind=kind,
+                        amount_in_cents=event.amount_in_cents,
+                        timestamp=event.timestamp,
+                    )
+                )
+        self.view.put(entries.values(), settled, position, self.saved_position)
+        self.position = position
+
+    @staticmethod
+    def _settles(
+        event: Union[Account.Debited, Account.Credited, AccountShard.Credited],
+        position: int,
+        entry: TransactionEntry,
+    ) -> bool:
+        """
+        Whether the debit or credit, recorded at position,
+        settles the pending transfer entry.
+        """
+        if event.transaction_id is not None:
+            return entry.transaction_id == event.transaction_id
+        # Recorded before debits and credits carried the ID of
+        # their transfer, directly after the transfer.
+        return (
+            entry.amount_in_cents == event.amount_in_cents
+            and position - entry.position <= 2
+        )
+
+
+def construct_transaction_view(db_name: Optional[str]) -> TransactionView:
+    if db_name:
+        return SQLiteTransactionView(db_name)
+    return InMemoryTransactionView()
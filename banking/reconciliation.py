@@ -0,0 +1,451 @@
+# coding=utf-8
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from math import inf
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import Transcoder
+from eventsourcing.utils import get_topic
+
+from banking.concurrency import is_shared_store
+from banking.domainmodel import Account, AccountShard, InsufficientFundsError
+from banking.transcoding import CompactTranscoder
+
+if TYPE_CHECKING:  # pragma: no cover
+    from banking.applicationmodel import Bank
+
+ACCOUNT_TOPIC_PREFIX = get_topic(Account) + "."
+SHARD_TOPICS = (
+    get_topic(AccountShard.Credited),
+    get_topic(AccountShard.Swept),
+)
+SECTION_SIZE = 1000
+
+
+@dataclass
+class AccountFold:
+    """
+    What a range of the log did to an account: the amounts
+    credited to it, directly and through its shards, debited
+    from it, and swept into it from its shards, and the
+    version of its last event in the range.
+
+    So that folds of consecutive ranges can be merged without
+    knowing the balance or the overdraft limit at the start of
+    a range, the account's own balance after each debit is
+    kept as the lowest, relative to the start of the range,
+    until the limit is changed in the range, and from then
+    on as the lowest balance plus the limit at that debit.
+    """
+
+    credited: int = 0
+    shard_credited: int = 0
+    debited: int = 0
+    swept: int = 0
+    version: int = 0
+    lowest: float = inf
+    lowest_over_limit: float = inf
+    overdraft_limit: Optional[int] = None
+
+    @property
+    def net(self) -> int:
+        # Of the account's own balance, without its shards.
+        return self.credited + self.swept - self.debited
+
+    @property
+    def balance(self) -> int:
+        # As Bank.get_balance() has it, with its shards.
+        return self.credited + self.shard_credited - self.debited
+
+    @property
+    def went_past_overdraft_limit(self) -> bool:
+        # From a balance and a limit of zero when opened.
+        return self.lowest < 0 or self.lowest_over_limit < 0
+
+    def add(self, event: DomainEventProtocol) -> None:
+        if isinstance(event, AccountShard.Credited):
+            self.shard_credited += event.amount_in_cents
+            return
+        if isinstance(event, Account.Credited):
+            self.credited += event.amount_in_cents
+        elif isinstance(event, Account.CreditsSwept):
+            self.swept += event.amount_in_cents
+        elif isinstance(event, Account.Debited):
+            self.debited += event.amount_in_cents
+            if self.overdraft_limit is None:
+                self.lowest = min(self.lowest, self.net)
+            else:
+                self.lowest_over_limit = min(
+                    self.lowest_over_limit, self.net + self.overdraft_limit
+                )
+        elif isinstance(event, Account.OverdraftLimitChanged):
+            self.overdraft_limit = event.amount_in_cents
+        self.version = event.originator_version
+
+    def merge(self, later: "AccountFold") -> None:
+        """
+        Adds the fold of the range that follows this one.
+        """
+        if self.overdraft_limit is None:
+            self.lowest = min(self.lowest, self.net + later.lowest)
+            self.lowest_over_limit = self.net + later.lowest_over_limit
+        else:
+            self.lowest_over_limit = min(
+                self.lowest_over_limit,
+                self.net + later.lowest + self.overdraft_limit,
+                self.net + later.lowest_over_limit,
+            )
+        if later.overdraft_limit is not None:
+            self.overdraft_limit = later.overdraft_limit
+        self.credited += later.credited
+        self.shard_credited += later.shard_credited
+        self.debited += later.debited
+        self.swept += later.swept
+        self.version = later.version or self.version
+
+
+@dataclass
+class RangeFold:
+    """
+    The folds of the accounts with events in a range of the
+    notification log, from start to stop, both included, and
+    the amount swept out of shards in the range, which isn't
+    known by account.
+    """
+
+    start: int
+    stop: int
+    accounts: Dict[UUID, AccountFold] = field(default_factory=dict)
+    shard_swept: int = 0
+
+    def merge(self, later: "RangeFold") -> None:
+        for account_id, fold in later.accounts.items():
+            try:
+                self.accounts[account_id].merge(fold)
+            except KeyError:
+                self.accounts[account_id] = fold
+        self.shard_swept += later.shard_swept
+        self.stop = later.stop
+
+
+def fold_range(app: Application, start: int, stop: int) -> RangeFold:
+    """
+    Folds the account and shard events of the notifications
+    of the app from start to stop, both included.
+    """
+    fold = RangeFold(start, stop)
+    position = start
+    while position <= stop:
+        notifications = app.recorder.select_notifications(
+            position, SECTION_SIZE, stop=stop
+        )
+        for notification in notifications:
+            topic = notification.topic
+            if not topic.startswith(ACCOUNT_TOPIC_PREFIX) and (
+                topic not in SHARD_TOPICS
+            ):
+                continue
+            event = app.mapper.to_domain_event(notification)
+            if isinstance(event, AccountShard.Swept):
+                fold.shard_swept += event.amount_in_cents
+                continue
+            if isinstance(event, AccountShard.Credited):
+                account_id = event.account_id
+            else:
+                account_id = event.originator_id
+            try:
+                account = fold.accounts[account_id]
+            except KeyError:
+                account = fold.accounts[account_id] = AccountFold()
+            account.add(event)
+        if len(notifications) < SECTION_SIZE:
+            break
+        position = notifications[-1].id + 1
+    return fold
+
+
+class LogReader(Application):
+    """
+    Reads the notification log of a Bank, from the event store
+    configured by its environment, without the projections a
+    Bank keeps, so it is quick to construct in each process of
+    a pool, or to export the log from. A follower's Replica is
+    one with the projections it serves reads from.
+    """
+
+    name = "Bank"
+
+    def construct_transcoder(self) -> Transcoder:
+        # Decodes the events of a store written as JSON, as
+        # compact events, or as both.
+        transcoder = CompactTranscoder()
+        self.register_transcodings(transcoder)
+        return transcoder
+
+
+_reader: Optional[LogReader] = None
+
+
+def _open_reader(env: Mapping[str, str]) -> None:  # pragma: no cover
+    global _reader
+    _reader = LogReader(env)
+
+
+def _fold_range_in_reader(
+    start: int, stop: int
+) -> RangeFold:  # pragma: no cover
+    assert _reader is not None
+    return fold_range(_reader, start, stop)
+
+
+@dataclass(frozen=True)
+class LedgerEvent:
+    """
+    An event of an account, with the account's own balance,
+    and its overdraft limit, after the event.
+    """
+
+    version: int
+    kind: str
+    amount_in_cents: int
+    balance: int
+    overdraft_limit: int
+    timestamp: datetime
+
+
+@dataclass(frozen=True)
+class Discrepancy:
+    """
+    An account whose state isn't what its events add up to,
+    of one of the kinds:
+      balance    the balance isn't the sum of its credits
+                 minus its debits
+      version    the state hasn't got the account's latest
+                 events, which are listed
+      overdraft  a debit took the account past its overdraft
+                 limit; expected is the lowest balance the
+                 limit allowed, actual the balance after the
+                 first such debit, and the debits are listed
+    """
+
+    account_id: UUID
+    kind: str
+    expected: int
+    actual: int
+    events: List[LedgerEvent]
+
+
+@dataclass
+class ReconciliationReport:
+    # The log is reconciled up to this notification id.
+    position: int = 0
+    accounts: int = 0
+    credits_in_cents: int = 0
+    debits_in_cents: int = 0
+    balances_in_cents: int = 0
+    swept_in_cents: int = 0
+    swept_from_shards_in_cents: int = 0
+    # Accounts that moved on since the position, whose
+    # balances weren't checked.
+    skipped: int = 0
+    discrepancies: List[Discrepancy] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return (
+            not self.discrepancies
+            and self.credits_in_cents - self.debits_in_cents
+            == self.balances_in_cents
+            and self.swept_in_cents == self.swept_from_shards_in_cents
+        )
+
+
+class Reconciler:
+    """
+    Proves that the credits of a bank's accounts, less their
+    debits, add up to their balances, and that no debit took
+    an account past its overdraft limit.
+
+    The notification log is split into ranges, and each range
+    is folded into an AccountFold per account, in a pool of
+    `workers` processes when the bank's event store is shared
+    by processes, or in this process if not. The folds are
+    merged in log order, and compared with the balance and
+    version of each account, in the bank's balance read model
+    if it has one, or else in the account and its shards. The
+    events of the accounts that don't agree are then read, to
+    list the ones behind each discrepancy. Accounts that moved
+    on while they were reconciled are skipped, and checked the
+    next time.
+    """
+
+    def __init__(
+        self, app: "Bank", workers: int = 0, ranges_per_worker: int = 4
+    ):
+        self.app = app
+        self.workers = workers
+        self.ranges_per_worker = ranges_per_worker
+
+    def run(self) -> ReconciliationReport:
+        started = perf_counter()
+        report = ReconciliationReport(
+            position=self.app.recorder.max_notification_id()
+        )
+        fold = self.fold(report.position)
+        if self.app.balances is not None:
+            self.app.balances.pull()
+        balances = {}
+        discrepancies = []
+        for account_id, account in fold.accounts.items():
+            state = self._state(account_id)
+            balances[account_id] = state[0] if state else account.balance
+            discrepancies += self._discrepancies(account_id, account, state)
+        # The state of accounts with events after the position
+        # is newer than the fold, and isn't compared with it.
+        moved_on: Dict[UUID, AccountFold] = {}
+        last = self.app.recorder.max_notification_id()
+        if last > report.position:
+            moved_on = fold_range(self.app, report.position + 1, last).accounts
+        for account_id, account in fold.accounts.items():
+            report.accounts += 1
+            report.credits_in_cents += (
+                account.credited + account.shard_credited
+            )
+            report.debits_in_cents += account.debited
+            report.swept_in_cents += account.swept
+            if account_id in moved_on:
+                report.skipped += 1
+                report.balances_in_cents += account.balance
+            else:
+                report.balances_in_cents += balances[account_id]
+        report.discrepancies = [
+            d
+            for d in discrepancies
+            if d.kind == "overdraft" or d.account_id not in moved_on
+        ]
+        report.swept_from_shards_in_cents = fold.shard_swept
+        report.seconds = perf_counter() - started
+        return report
+
+    def fold(self, stop: int) -> RangeFold:
+        """
+        Folds the log up to stop, a range at a time.
+        """
+        parts = max(1, self.workers) * self.ranges_per_worker
+        size = -(-stop // parts) or 1
+        ranges = [
+            (start, min(start + size - 1, stop))
+            for start in range(1, stop + 1, size)
+        ]
+        fold = RangeFold(1, stop)
+        if self.workers > 1 and is_shared_store(self.app.env):
+            with ProcessPoolExecutor(
+                self.workers,
+                initializer=_open_reader,
+                initargs=(dict(self.app.env),),
+            ) as pool:
+                folds = pool.map(_fold_range_in_reader, *zip(*ranges))
+                for range_fold in folds:
+                    fold.merge(range_fold)
+        else:
+            for start, range_stop in ranges:
+                fold.merge(fold_range(self.app, start, range_stop))
+        return fold
+
+    def _state(self, account_id: UUID) -> Optional[Tuple[int, int]]:
+        if self.app.balances is not None:
+            row = self.app.balances.get(account_id)
+            if row is None:
+                return 0, 0
+            return row.balance, row.version
+        try:
+            account = self.app.get_account(account_id)
+        except InsufficientFundsError:
+            # A debit past the overdraft limit can't be replayed,
+            # and is reported as an overdraft discrepancy.
+            return None
+        shards = [
+            self.app.repository.get(AccountShard.create_id(account_id, index))
+            for index in range(account.shards)
+        ]
+        balance = account.balance + sum(shard.balance for shard in shards)
+        return balance, account.version
+
+    def _discrepancies(
+        self,
+        account_id: UUID,
+        account: AccountFold,
+        state: Optional[Tuple[int, int]],
+    ) -> List[Discrepancy]:
+        discrepancies = []
+        balance, version = state or (account.balance, account.version)
+        if version < account.version:
+            events = [
+                e for e in self._statement(account_id) if e.version > version
+            ]
+            discrepancies.append(
+                Discrepancy(
+                    account_id, "version", account.version, version, events
+                )
+            )
+        elif balance != account.balance:
+            discrepancies.append(
+                Discrepancy(
+                    account_id,
+                    "balance",
+                    account.balance,
+                    balance,
+                    self._statement(account_id),
+                )
+            )
+        if account.went_past_overdraft_limit:
+            events = [
+                e
+                for e in self._statement(account_id)
+                if e.kind == "Debited" and e.balance < -e.overdraft_limit
+            ]
+            discrepancies.append(
+                Discrepancy(
+                    account_id,
+                    "overdraft",
+                    -events[0].overdraft_limit,
+                    events[0].balance,
+                    events,
+                )
+            )
+        return discrepancies
+
+    def _statement(self, account_id: UUID) -> List[LedgerEvent]:
+        """
+        The account's events that change its balance or its
+        overdraft limit, read from the event store.
+        """
+        statement = []
+        balance = overdraft_limit = 0
+        for event in self.app.events.get(account_id):
+            if isinstance(event, (Account.Credited, Account.CreditsSwept)):
+                balance += event.amount_in_cents
+            elif isinstance(event, Account.Debited):
+                balance -= event.amount_in_cents
+            elif isinstance(event, Account.OverdraftLimitChanged):
+                overdraft_limit = event.amount_in_cents
+            else:
+                continue
+            statement.append(
+                LedgerEvent(
+                    version=event.originator_version,
+                    kind=type(event).__name__,
+                    amount_in_cents=event.amount_in_cents,
+                    balance=balance,
+                    overdraft_limit=overdraft_limit,
+                    timestamp=event.timestamp,
+                )
+            )
+        return statement
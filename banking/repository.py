@@ -0,0 +1,210 @@
+# coding=utf-8
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Iterator, List, Optional, Set, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Repository
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import Mapper, StoredEvent
+
+from banking.cache import CacheStats, construct_cache
+from banking.utils.metrics import COUNT_BUCKETS, Metrics
+
+
+@dataclass
+class MappingStats:
+    """Events mapped to or from stored events, and the time it took."""
+
+    events: int = 0
+    seconds: float = 0.0
+
+
+_mapping: ContextVar[Optional[MappingStats]] = ContextVar(
+    "mapping", default=None
+)
+
+
+@contextmanager
+def track_mapping() -> Iterator[MappingStats]:
+    """
+    Counts the events that InstrumentedMapper maps in this
+    context, and times the mapping, until the block exits.
+    """
+    stats = MappingStats()
+    token = _mapping.set(stats)
+    try:
+        yield stats
+    finally:
+        _mapping.reset(token)
+
+
+class InstrumentedMapper(Mapper):
+    """
+    Mapper that counts and times the events it serializes
+    and deserializes inside track_mapping().
+    """
+
+    def to_domain_event(
+        self, stored_event: StoredEvent
+    ) -> DomainEventProtocol:
+        stats = _mapping.get()
+        if stats is None:
+            return super().to_domain_event(stored_event)
+        started = perf_counter()
+        try:
+            return super().to_domain_event(stored_event)
+        finally:
+            stats.events += 1
+            stats.seconds += perf_counter() - started
+
+    def to_stored_event(
+        self, domain_event: DomainEventProtocol
+    ) -> StoredEvent:
+        stats = _mapping.get()
+        if stats is None:
+            return super().to_stored_event(domain_event)
+        started = perf_counter()
+        try:
+            return super().to_stored_event(domain_event)
+        finally:
+            stats.events += 1
+            stats.seconds += perf_counter() - started
+
+
+@dataclass
+class EventStoreStats:
+    """
+    What a request asked of the event store: the aggregates
+    it loaded, the events replayed to load them, and the time
+    spent deserializing them, and the events it saved, and
+    the time spent inserting them. The time of a get includes
+    the time it spent deserializing.
+    """
+
+    gets: int = 0
+    events_replayed: int = 0
+    get_seconds: float = 0.0
+    deserialize_seconds: float = 0.0
+    saves: int = 0
+    events_saved: int = 0
+    insert_seconds: float = 0.0
+    aggregates: Set[UUID] = field(default_factory=set)
+    replayed: "Counter[UUID]" = field(default_factory=Counter)
+
+    def summary(self) -> str:
+        """
+        One line of key=value pairs, for a response header or
+        a log line, ending with the aggregate that had the most
+        events replayed.
+        """
+        items = [
+            f"gets={self.gets}",
+            f"replayed={self.events_replayed}",
+            f"get_ms={self.get_seconds * 1e3:.3f}",
+            f"deserialize_ms={self.deserialize_seconds * 1e3:.3f}",
+            f"saves={self.saves}",
+            f"saved={self.events_saved}",
+            f"insert_ms={self.insert_seconds * 1e3:.3f}",
+            f"aggregates={len(self.aggregates)}",
+        ]
+        if self.replayed:
+            aggregate_id, events = self.replayed.most_common(1)[0]
+            items.append(f"heaviest={aggregate_id}:{events}")
+        return "; ".join(items)
+
+
+class InstrumentedRepository(Repository):
+    """
+    Repository that counts how many times each aggregate
+    has been loaded from the event store, so that tests
+    and diagnostics can see how often a code path hits
+    the repository. Call gets.clear() to reset.
+
+    The optional aggregate cache evicts with the given
+    policy (see banking.cache) and counts hits, misses
+    and evictions. A cache hit only fetches the events
+    recorded after the cached version.
+
+    Each get also counts the events it replayed, snapshots
+    included, and times itself, both per aggregate, so that
+    heaviest() can find the aggregates whose histories cost
+    the most to load, and in the EventStoreStats of the
+    current request, if there is one. With metrics, the
+    time taken, the events replayed and the time spent
+    deserializing them are observed for every get.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        cache_maxsize: Optional[int] = None,
+        cache_policy: str = "lru",
+        metrics: Optional[Metrics] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        if cache_maxsize is not None:
+            self.cache = construct_cache(cache_maxsize, cache_policy)
+        self.gets: "Counter[UUID]" = Counter()
+        self.replayed: "Counter[UUID]" = Counter()
+        self.get_seconds: "Counter[UUID]" = Counter()
+        self.metrics = metrics
+        self.request_stats: ContextVar[Optional[EventStoreStats]] = ContextVar(
+            f"request_stats_{id(self)}", default=None
+        )
+
+    @property
+    def cache_stats(self) -> Optional[CacheStats]:
+        return getattr(self.cache, "stats", None)
+
+    def get(self, aggregate_id: UUID, *args: Any, **kwargs: Any) -> Any:
+        self.gets[aggregate_id] += 1
+        started = perf_counter()
+        with track_mapping() as mapping:
+            try:
+                return super().get(aggregate_id, *args, **kwargs)
+            finally:
+                self._record_get(
+                    aggregate_id, mapping, perf_counter() - started
+                )
+
+    def _record_get(
+        self, aggregate_id: UUID, mapping: MappingStats, seconds: float
+    ) -> None:
+        self.replayed[aggregate_id] += mapping.events
+        self.get_seconds[aggregate_id] += seconds
+        stats = self.request_stats.get()
+        if stats is not None:
+            stats.gets += 1
+            stats.events_replayed += mapping.events
+            stats.get_seconds += seconds
+            stats.deserialize_seconds += mapping.seconds
+            stats.aggregates.add(aggregate_id)
+            stats.replayed[aggregate_id] += mapping.events
+        if self.metrics is not None:
+            self.metrics.observe(
+                "banking_repository_get_duration_seconds", seconds
+            )
+            self.metrics.observe(
+                "banking_events_replayed",
+                mapping.events,
+                buckets=COUNT_BUCKETS,
+            )
+            self.metrics.observe(
+                "banking_deserialize_duration_seconds", mapping.seconds
+            )
+
+    def heaviest(self, n: int = 10) -> List[Tuple[UUID, int, float]]:
+        """
+        The n aggregates that have taken the longest to load in
+        total, with the events replayed and the seconds taken.
+        """
+        return [
+            (aggregate_id, self.replayed[aggregate_id], seconds)
+            for aggregate_id, seconds in self.get_seconds.most_common(n)
+        ]
@@ -0,0 +1,542 @@
+# coding=utf-8
+"""
+The resources of the API, and the hooks its app runs around
+every request. They are imported by banking.api.create_app(),
+with Flask and the Bank, when the first app is created.
+"""
+
+import hmac
+import json
+import logging
+from functools import wraps
+from hashlib import sha256
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.persistence import IntegrityError
+from flask import Response, current_app, g, request
+from flask_jwt_extended import (  # type: ignore
+    create_access_token,
+    get_jwt_identity,
+    jwt_required,
+)
+from flask_jwt_extended.exceptions import JWTExtendedException  # type: ignore
+from flask_restful import Api, Resource  # type: ignore
+from jwt import PyJWTError
+
+from banking.api import bank
+from banking.applicationmodel import (
+    TRANSFER_ERRORS,
+    BatchIncomplete,
+    Transfer,
+    TransferResult,
+)
+from banking.domainmodel import AccountClosedError, BadCredentials
+from banking.exporting import (
+    CONTENT_TYPE as EXPORT_CONTENT_TYPE,
+    GZIP_CONTENT_TYPE,
+    export_events,
+    gzip_chunks,
+)
+from banking.idempotency import IdempotentResult
+from banking.utils import metrics
+from banking.utils.http_errors import handler, record_request, request_labels
+
+logger = logging.getLogger(__name__)
+
+
+class JWTApi(Api):
+    def handle_error(self, e: Exception) -> Any:
+        # Left to the handlers of the JWTManager, which answer
+        # missing, invalid, expired and revoked tokens with 401
+        # and 422, rather than turned into a 500 here.
+        if isinstance(e, (JWTExtendedException, PyJWTError)):
+            raise e
+        return super().handle_error(e)
+
+
+def open_request_scope() -> None:
+    g.request_scope = bank().request_scope()
+    g.event_store_stats = g.request_scope.__enter__()
+
+
+def report_event_store_stats(response: Response) -> Response:
+    summary = g.event_store_stats.summary()
+    logger.debug("%s %s %s", request.method, request.path, summary)
+    if current_app.config["EVENT_STORE_STATS_HEADER"]:
+        response.headers["X-Event-Store"] = summary
+    return response
+
+
+def close_request_scope(exc: Optional[BaseException]) -> None:
+    g.request_scope.__exit__(None, None, None)
+
+
+class User:
+    def __init__(self, id: str):
+        self.id = id
+
+
+def user() -> User:
+    # The token was checked against the revoked tokens of
+    # closed accounts and changed passwords when it was
+    # verified, so the account needn't be loaded here.
+    return User(id=get_jwt_identity())
+
+
+def access_token(account_id: UUID) -> str:
+    return create_access_token(
+        identity=str(account_id),
+        additional_claims={"pv": bank().password_version(account_id)},
+    )
+
+
+def is_token_revoked(
+    jwt_header: Dict[str, Any], jwt_payload: Dict[str, Any]
+) -> bool:
+    return bank().is_token_revoked(
+        UUID(jwt_payload["sub"]), jwt_payload.get("pv", 0)
+    )
+
+
+def is_admin() -> bool:
+    key = current_app.config["ADMIN_API_KEY"]
+    given = request.headers.get("X-Admin-Key")
+    if not key or not given:
+        return False
+    return hmac.compare_digest(given.encode(), key.encode())
+
+
+def consistent_read() -> bool:
+    """
+    Reads go to the balance read model when there is one,
+    unless the client asks for ?consistent=true.
+    """
+    consistent = request.args.get("consistent", "false")
+    return consistent.lower() in ("1", "true", "y", "yes")
+
+
+def idempotent(
+    func: Callable[..., Tuple[Dict[str, Any], int]],
+) -> Callable[..., Any]:
+    """
+    Answers a request made with the Idempotency-Key header of
+    an earlier request of the same account with the response
+    to that request, without loading any account, so that a
+    client can retry a request that timed out without posting
+    it twice. A key can't be used for another request. Requests
+    that failed, or that the client is told to try again with a
+    409, don't keep their key. Replays, and requests turned away
+    for their key, are counted in the request metrics as those
+    of the resource.
+    """
+
+    labels = request_labels(func)
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return func(*args, **kwargs)
+        started = perf_counter()
+        if not 0 < len(key) <= 255:
+            return _answered(
+                labels, started, ({"error": "Invalid Idempotency-Key"}, 400)
+            )
+        account_id = UUID(user().id)
+        fingerprint = sha256(
+            f"{request.method} {request.path} ".encode()
+            + json.dumps(
+                request.get_json(silent=True), sort_keys=True
+            ).encode()
+        ).hexdigest()
+        keys = bank().idempotency_keys
+        result = keys.reserve(account_id, key, fingerprint)
+        if result is not None:
+            if result.status is None:
+                error = "A request with this Idempotency-Key is in progress"
+                return _answered(labels, started, ({"error": error}, 409))
+            if result.fingerprint != fingerprint:
+                error = "Idempotency-Key was used for another request"
+                return _answered(labels, started, ({"error": error}, 422))
+            return _answered(
+                labels,
+                started,
+                (
+                    json.loads(result.body),
+                    result.status,
+                    {"Idempotent-Replayed": "true"},
+                ),
+            )
+        try:
+            body, status = func(*args, **kwargs)
+        except BaseException:
+            keys.release(account_id, key)
+            raise
+        if status == 409:
+            keys.release(account_id, key)
+        else:
+            keys.complete(
+                account_id,
+                key,
+                IdempotentResult(fingerprint, status, json.dumps(body)),
+            )
+        return body, status
+
+    return wrapper
+
+
+def _answered(labels: metrics.Labels, started: float, response: Any) -> Any:
+    # A response made without calling the resource method, whose
+    # handler would have counted it, so it is counted here.
+    record_request(labels, response[1], perf_counter() - started)
+    return response
+
+
+class AccountResource(Resource):
+    @jwt_required()
+    @handler
+    def get(self) -> Tuple[Dict[str, str], int]:
+        identity = user().id
+        balance = bank().get_balance(UUID(identity), consistent=True)
+        return {
+            "balance": str(balance),
+            "identity": identity,
+        }, 200
+
+
+class DepositResource(Resource):
+    @jwt_required()
+    @idempotent
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        data = request.get_json()
+        amount = data["amount"]
+        bank().deposit_funds(UUID(user().id), amount)
+        return {
+            "amount": str(amount),
+        }, 200
+
+
+class WithdrawResource(Resource):
+    @jwt_required()
+    @idempotent
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        data = request.get_json()
+        amount = data["amount"]
+        bank().withdraw_funds(UUID(user().id), amount)
+        return {
+            "message": "success",
+        }, 200
+
+
+def transfer_input(item: Any) -> Optional[Tuple[UUID, int]]:
+    """
+    The account to credit and the amount of a transfer in a
+    request, or None if they are missing or invalid.
+    """
+    if not isinstance(item, dict):
+        return None
+    amount = item.get("amount")
+    if not isinstance(amount, int) or isinstance(amount, bool):
+        return None
+    try:
+        return UUID(item.get("to_account_id")), amount
+    except (TypeError, ValueError):
+        return None
+
+
+class TransferResource(Resource):
+    @jwt_required()
+    @idempotent
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        transfer = transfer_input(request.get_json())
+        if transfer is None:
+            return {"error": "Invalid transfer"}, 400
+        to_account_id, amount = transfer
+        account_id = UUID(user().id)
+        try:
+            bank().transfer_funds(
+                account_id,
+                to_account_id,
+                amount,
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
+        except TRANSFER_ERRORS as err:
+            return {"error": f"Transfer failed: {err}"}, 400
+        return {
+            "message": "success",
+        }, 200
+
+
+class TransferBatchResource(Resource):
+    MAX_TRANSFERS = 1000
+
+    @jwt_required()
+    @handler
+    def post(self) -> Tuple[Dict[str, Any], int]:
+        # Everything is checked before anything is recorded.
+        data = request.get_json()
+        items = data.get("transfers") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not (
+            0 < len(items) <= self.MAX_TRANSFERS
+        ):
+            return {"error": "Invalid transfers"}, 400
+        chunk_size = data.get("chunk_size")
+        if chunk_size is not None and (
+            not isinstance(chunk_size, int)
+            or isinstance(chunk_size, bool)
+            or not 0 < chunk_size <= self.MAX_TRANSFERS
+        ):
+            return {"error": "Invalid chunk_size"}, 400
+        account_id = UUID(user().id)
+        transfers = []
+        for i, item in enumerate(items):
+            transfer = transfer_input(item)
+            if transfer is None:
+                return {"error": f"Invalid transfer {i}"}, 400
+            transfers.append(Transfer(account_id, *transfer))
+        try:
+            results = bank().transfer_funds_batch(transfers, chunk_size)
+        except BatchIncomplete as err:
+            # The transfers of the chunks recorded before the one
+            # that failed stay recorded, and are not to be retried.
+            return {
+                "error": str(err),
+                "recorded": len(err.results),
+                "results": self.results(err.results),
+            }, (409 if isinstance(err.error, IntegrityError) else 500)
+        return {"results": self.results(results)}, 200
+
+    @staticmethod
+    def results(results: List[TransferResult]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "to_account_id": str(result.transfer.credit_account_id),
+                "amount": str(result.transfer.amount_in_cents),
+                "transaction_id": str(result.transaction_id),
+                "message": "success" if result.ok else "error",
+                "error": None if result.ok else str(result.error),
+            }
+            for result in results
+        ]
+
+
+class CloseAccountResource(Resource):
+    @jwt_required()
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        bank().close_account(UUID(user().id))
+        return {
+            "message": "success",
+        }, 200
+
+
+class AccountGetBalanceResource(Resource):
+    @jwt_required()
+    @handler
+    def get(self) -> Tuple[Dict[str, str], int]:
+        balance = bank().get_balance(
+            UUID(user().id), consistent=consistent_read()
+        )
+        return {
+            "balance": str(balance),
+        }, 200
+
+
+class AccountTransactionsResource(Resource):
+    MAX_LIMIT = 500
+
+    @jwt_required()
+    @handler
+    def get(self) -> Tuple[Dict[str, Any], int]:
+        # Pages are read from the transaction history, so the
+        # account's events are never replayed to serve one.
+        account_id = UUID(user().id)
+        try:
+            limit = int(request.args.get("limit", "50"))
+            cursor = request.args.get("cursor")
+            before = int(cursor) if cursor is not None else None
+        except ValueError:
+            return {"error": "Invalid limit or cursor"}, 400
+        if not 0 < limit <= self.MAX_LIMIT or (
+            before is not None and before <= 0
+        ):
+            return {"error": "Invalid limit or cursor"}, 400
+        page = bank().get_transactions(account_id, before, limit)
+        return {
+            "transactions": [
+                {
+                    "id": str(entry.position),
+                    "type": entry.kind,
+                    "amount": str(entry.amount_in_cents),
+                    "timestamp": entry.timestamp.isoformat(),
+                    "counterparty_id": (
+                        str(entry.counterparty_id)
+                        if entry.counterparty_id
+                        else None
+                    ),
+                    "transaction_id": (
+                        str(entry.transaction_id)
+                        if entry.transaction_id
+                        else None
+                    ),
+                }
+                for entry in page.entries
+            ],
+            "next_cursor": (
+                str(page.next_cursor) if page.next_cursor is not None else None
+            ),
+        }, 200
+
+
+class AccountGetOverdraftLimitResource(Resource):
+    @jwt_required()
+    @handler
+    def get(self) -> Tuple[Dict[str, str], int]:
+        overdraft_limit = bank().get_overdraft_limit(
+            UUID(user().id), consistent=consistent_read()
+        )
+        return {
+            "overdraft_limit": str(overdraft_limit),
+        }, 200
+
+
+class AccountSetOverdraftLimitResource(Resource):
+    @jwt_required()
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        data = request.get_json()
+        overdraft_limit = data["overdraft_limit"]
+        bank().set_overdraft_limit(UUID(user().id), overdraft_limit)
+        return {
+            "message": "success",
+        }, 200
+
+
+class AuthResource(Resource):
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        data = request.get_json()
+        email_address = data["email_address"]
+        password = data["password"]
+        account_id = bank().authenticate(email_address, password)
+        return {
+            "message": "success",
+            "access_token": access_token(account_id),
+        }, 200
+
+
+class SignUpResource(Resource):
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        data = request.get_json()
+        full_name = data["full_name"]
+        email_address = data["email_address"]
+        password = data["password"]
+        account_id = bank().open_account(full_name, email_address, password)
+        return {
+            "message": "created",
+            "account_id": str(account_id),
+        }, 201
+
+
+class ChangePasswordResource(Resource):
+    @jwt_required()
+    @handler
+    def post(self) -> Tuple[Dict[str, str], int]:
+        data = request.get_json()
+        old_password = data["old_password"]
+        new_password = data["new_password"]
+        account_id = UUID(user().id)
+        bank().change_password(account_id, old_password, new_password)
+        # Tokens issued before the change are revoked by it.
+        return {
+            "message": "success",
+            "access_token": access_token(account_id),
+        }, 200
+
+
+class ReadinessResource(Resource):
+    def get(self) -> Tuple[Dict[str, bool], int]:
+        # The bank has been constructed, and its read models
+        # caught up, by open_request_scope() by the time a
+        # request gets here. A worker that is shutting down
+        # drains the requests it has, and takes no more.
+        if current_app.config.get("DRAINING"):
+            return {"ready": False}, 503
+        return {"ready": True}, 200
+
+
+class MetricsResource(Resource):
+    def get(self) -> Any:
+        # Only for admins, as the heaviest aggregates are labelled
+        # with the IDs of accounts.
+        if not is_admin():
+            return {"error": "Forbidden"}, 403
+        # Request metrics of this process, then those of its bank,
+        # labelled with the worker that rendered them, if any.
+        labels = metrics.process_labels
+        text = metrics.registry.render(labels)
+        text += bank().collect_metrics().render(labels)
+        return Response(text, content_type=metrics.CONTENT_TYPE)
+
+
+class AdminEventsResource(Resource):
+    @handler
+    def get(self) -> Any:
+        # Streams the event log a section at a time, so memory
+        # stays flat however long it is. A client that is cut
+        # off resumes with ?start= the id after its last line.
+        if not is_admin():
+            return {"error": "Forbidden"}, 403
+        try:
+            start = int(request.args.get("start", "1"))
+        except ValueError:
+            start = 0
+        if start <= 0:
+            return {"error": "Invalid start"}, 400
+        # The id of the last event recorded before the export
+        # started, from which a follower tells how far behind
+        # it is.
+        headers = {
+            "X-Notification-Head": str(bank().recorder.max_notification_id())
+        }
+        chunks = export_events(bank(), start)
+        if request.args.get("gzip", "false").lower() in (
+            "1",
+            "true",
+            "y",
+            "yes",
+        ):
+            return Response(
+                gzip_chunks(chunks),
+                content_type=GZIP_CONTENT_TYPE,
+                headers=headers,
+            )
+        return Response(
+            chunks, content_type=EXPORT_CONTENT_TYPE, headers=headers
+        )
+
+
+RESOURCES = (
+    (ReadinessResource, "/ready"),
+    (MetricsResource, "/metrics"),
+    (AdminEventsResource, "/admin/events"),
+    (AccountResource, "/account"),
+    (DepositResource, "/deposit"),
+    (WithdrawResource, "/withdraw"),
+    (TransferResource, "/transfer"),
+    (TransferBatchResource, "/transfers/batch"),
+    (AuthResource, "/auth"),
+    (SignUpResource, "/signup"),
+    (CloseAccountResource, "/close_account"),
+    (AccountGetBalanceResource, "/account/balance"),
+    (AccountTransactionsResource, "/account/transactions"),
+    (AccountGetOverdraftLimitResource, "/account/overdraft_limit"),
+    (AccountSetOverdraftLimitResource, "/account/overdraft_limit"),
+    (ChangePasswordResource, "/account/change_password"),
+)
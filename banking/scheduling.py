@@ -0,0 +1,196 @@
+# coding=utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.persistence import IntegrityError
+from eventsourcing.utils import get_topic
+
+from banking.domainmodel import StandingOrder
+from banking.projections import NotifiedEvent, Projection
+from banking.utils.periodic import PeriodicJob
+
+if TYPE_CHECKING:  # pragma: no cover
+    from banking.applicationmodel import Bank, StandingOrderResult
+
+Batch = List[Tuple[UUID, List[UUID]]]
+
+
+@dataclass(frozen=True)
+class ScheduledOrder:
+    order_id: UUID
+    debit_account_id: UUID
+    interval_seconds: int
+    next_due_at: datetime
+
+
+class StandingOrderSchedule(Projection):
+    """
+    The standing orders that aren't cancelled, with their
+    debit accounts and next due times, so that the orders due
+    are found without loading any order.
+
+    Each scheduler holds its own in memory, which its first
+    run fills from the log.
+    """
+
+    topics = (
+        get_topic(StandingOrder.Created),
+        get_topic(StandingOrder.Executed),
+        get_topic(StandingOrder.Failed),
+        get_topic(StandingOrder.Cancelled),
+    )
+
+    def __init__(self, app: Application):
+        self.orders: Dict[UUID, ScheduledOrder] = {}
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        return 0
+
+    def due(self, until: datetime) -> List[ScheduledOrder]:
+        return [o for o in self.orders.values() if o.next_due_at <= until]
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        for _, event in events:
+            order_id = event.originator_id
+            if isinstance(event, StandingOrder.Created):
+                self.orders[order_id] = ScheduledOrder(
+                    order_id=order_id,
+                    debit_account_id=event.debit_account_id,
+                    interval_seconds=event.interval_seconds,
+                    next_due_at=event.next_due_at,
+                )
+            elif isinstance(event, StandingOrder.Cancelled):
+                self.orders.pop(order_id, None)
+            else:
+                order = self.orders[order_id]
+                self.orders[order_id] = replace(
+                    order,
+                    next_due_at=order.next_due_at
+                    + timedelta(seconds=order.interval_seconds),
+                )
+        self.position = position
+
+
+@dataclass
+class SchedulerRun:
+    # Orders found due, made, failed, and left due for the
+    # next run after losing every race to save them.
+    due: int = 0
+    executed: int = 0
+    failed: int = 0
+    deferred: int = 0
+    seconds: float = 0.0
+    results: List["StandingOrderResult"] = field(default_factory=list)
+
+    @property
+    def orders_per_second(self) -> float:
+        done = self.executed + self.failed
+        return done / self.seconds if self.seconds else 0.0
+
+
+class StandingOrderScheduler(PeriodicJob):
+    """
+    Runs the standing orders of a bank that are due. The due
+    orders are grouped by debit account, so that each account
+    is loaded once, and the groups are run in batches of about
+    batch_size orders on a pool of worker threads.
+
+    A run makes the orders due now, or by the time it is given.
+
+    Orders are saved with their accounts, and are skipped once
+    they have been run, so schedulers in several processes
+    never make a transfer twice, but only waste their efforts
+    on each other's orders.
+    """
+
+    def __init__(
+        self,
+        app: "Bank",
+        workers: int = 4,
+        batch_size: int = 500,
+        period: float = 60.0,
+    ):
+        if workers <= 0 or batch_size <= 0:
+            raise ValueError("A scheduler needs workers and a batch size")
+        super().__init__(period)
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.schedule = StandingOrderSchedule(app)
+
+    def run_once(self, until: Optional[datetime] = None) -> SchedulerRun:
+        started = perf_counter()
+        if until is None:
+            until = datetime.now(timezone.utc)
+        self.schedule.pull()
+        due = self.schedule.due(until)
+        groups: Dict[UUID, List[UUID]] = {}
+        for order in due:
+            groups.setdefault(order.debit_account_id, []).append(
+                order.order_id
+            )
+
+        run = SchedulerRun(due=len(due))
+        with ThreadPoolExecutor(
+            self.workers, thread_name_prefix="standing-orders"
+        ) as pool:
+            batches = pool.map(
+                lambda batch: self._run_batch(batch, until),
+                self._batches(groups),
+            )
+            for results, deferred in batches:
+                run.results.extend(results)
+                run.deferred += deferred
+        run.failed = sum(1 for result in run.results if not result.ok)
+        run.executed = len(run.results) - run.failed
+        run.seconds = perf_counter() - started
+        return run
+
+    def _batches(self, groups: Dict[UUID, List[UUID]]) -> Iterator[Batch]:
+        # The orders of a debit account all go in one batch, so
+        # that no two workers save the same account at once.
+        batch: Batch = []
+        size = 0
+        for debit_account_id, order_ids in groups.items():
+            batch.append((debit_account_id, order_ids))
+            size += len(order_ids)
+            if size >= self.batch_size:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _run_batch(
+        self, batch: Batch, until: datetime
+    ) -> Tuple[List["StandingOrderResult"], int]:
+        results: List["StandingOrderResult"] = []
+        deferred = 0
+        for debit_account_id, order_ids in batch:
+            for start in range(0, len(order_ids), self.batch_size):
+                chunk = order_ids[start : start + self.batch_size]
+                try:
+                    results.extend(
+                        self.app.execute_standing_orders(
+                            debit_account_id, chunk, until
+                        )
+                    )
+                except IntegrityError:
+                    # The credit accounts were saved by other
+                    # workers, or processes, after every retry.
+                    deferred += len(chunk)
+        return results, deferred
@@ -0,0 +1,396 @@
+# coding=utf-8
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from eventsourcing.utils import strtobool
+from werkzeug.serving import ThreadedWSGIServer
+
+from banking import api
+from banking.concurrency import is_shared_store
+from banking.follower import (
+    EventStream,
+    Follower,
+    Replica,
+    create_follower_app,
+)
+from banking.utils import metrics
+
+
+def check_env(env: Mapping[str, str], workers: int) -> None:
+    """
+    Refuses settings that would give each of several worker
+    processes its own copy of state they need to share.
+    """
+    if workers <= 1:
+        return
+    if not is_shared_store(env):
+        raise ValueError(
+            "Serving with more than one worker needs a shared event store,"
+            " set PERSISTENCE_MODULE=eventsourcing.sqlite and SQLITE_DBNAME"
+            " to the path of a file"
+        )
+    if strtobool(env.get("BALANCE_VIEW", "n")) and not env.get(
+        "BALANCE_VIEW_DBNAME"
+    ):
+        raise ValueError(
+            "Serving with more than one worker needs a shared balance view,"
+            " set BALANCE_VIEW_DBNAME to the path of a file"
+        )
+    if not env.get("IDEMPOTENCY_KEYS_DBNAME"):
+        # A request retried with its key may go to another worker.
+        raise ValueError(
+            "Serving with more than one worker needs shared idempotency"
+            " keys, set IDEMPOTENCY_KEYS_DBNAME to the path of a file"
+        )
+
+
+class PooledWSGIServer(ThreadedWSGIServer):
+    """
+    WSGI server that handles connections on a fixed number
+    of threads, rather than a new thread per connection.
+    Closing it waits for the requests it has.
+    """
+
+    def __init__(self, *args: Any, threads: int, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="request")
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self) -> None:
+        # BaseWSGIServer.__init__ also calls this, before there is a pool.
+        pool: Optional[ThreadPoolExecutor] = getattr(self, "pool", None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+        super().server_close()
+
+
+class Worker:
+    """
+    Serves the API with its own Bank, on a listening socket
+    shared with the other workers. Call stop() from another
+    thread to stop taking requests, and let run() return
+    once the requests in hand are answered.
+
+    Each worker process keeps its own metrics, which it
+    labels with its index, as worker="<index>".
+    """
+
+    def __init__(self, sock: socket.socket, threads: int, index: int = 0):
+        self.sock = sock
+        self.threads = threads
+        self.index = index
+        self.ready = Event()
+        self.server: Optional[PooledWSGIServer] = None
+
+    def run(self) -> None:
+        api.app.config["DRAINING"] = False
+        metrics.process_labels = (("worker", str(self.index)),)
+        api.reset_bank()
+        api.bank()
+        host, port = self.sock.getsockname()[:2]
+        self.server = PooledWSGIServer(
+            host, port, api.app, fd=self.sock.fileno(), threads=self.threads
+        )
+        self.ready.set()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            api.bank().close()
+            api.reset_bank()
+            metrics.process_labels = ()
+
+    def stop(self) -> None:
+        api.app.config["DRAINING"] = True
+        self.ready.wait()
+        assert self.server is not None
+        self.server.shutdown()
+
+
+class Supervisor:
+    """
+    Binds the listening socket, forks the workers that serve
+    on it, numbered from 0, and forks a new worker with the
+    number of one that exits. Call stop()
+    to have run() ask the workers to finish, and kill those
+    that haven't within graceful_timeout seconds.
+
+    A worker that exits within min_uptime seconds of being
+    forked is replaced after a backoff, doubled for each such
+    exit in a row, and run() gives up with a RuntimeError after
+    max_rapid_failures of them in a row.
+    """
+
+    MAX_BACKOFF = 5.0
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        workers: int,
+        threads: int,
+        graceful_timeout: float = 30.0,
+        min_uptime: float = 1.0,
+        max_rapid_failures: int = 5,
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.min_uptime = min_uptime
+        self.max_rapid_failures = max_rapid_failures
+        self.pids: Set[int] = set()
+        self.address: Optional[Tuple[str, int]] = None
+        self.started = Event()
+        self.rapid_failures = 0
+        self._forked_at: Dict[int, float] = {}
+        self._indexes: Dict[int, int] = {}
+        self._next_spawn = 0.0
+        self._stopping = Event()
+
+    def run(self) -> None:
+        sock = socket.create_server((self.host, self.port), backlog=128)
+        self.address = sock.getsockname()[:2]
+        try:
+            while not self._stopping.is_set():
+                if self.rapid_failures >= self.max_rapid_failures:
+                    raise RuntimeError(
+                        f"Workers exited {self.rapid_failures} times in a"
+                        f" row within {self.min_uptime}s of starting"
+                    )
+                while (
+                    len(self.pids) < self.workers
+                    and time.monotonic() >= self._next_spawn
+                ):
+                    free = set(range(self.workers)) - {*self._indexes.values()}
+                    self._spawn(sock, min(free))
+                self.started.set()
+                self._stopping.wait(0.1)
+                self._reap()
+        finally:
+            self._stop_workers()
+            sock.close()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _spawn(self, sock: socket.socket, index: int) -> None:
+        # Blocked until the worker has its own handlers, so that a
+        # signal sent as it starts isn't handled by the copy of the
+        # supervisor's handler that it was forked with.
+        mask = signal.pthread_sigmask(
+            signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT}
+        )
+        try:
+            pid = os.fork()
+            if pid == 0:  # pragma: no cover
+                code = 1
+                try:
+                    self._run_worker(sock, mask, index)
+                    code = 0
+                finally:
+                    os._exit(code)
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        self.pids.add(pid)
+        self._forked_at[pid] = time.monotonic()
+        self._indexes[pid] = index
+
+    def _run_worker(
+        self, sock: socket.socket, mask: Set[signal.Signals], index: int
+    ) -> None:  # pragma: no cover
+        worker = Worker(sock, self.threads, index)
+        signal.signal(
+            signal.SIGTERM,
+            lambda *_: Thread(target=worker.stop, daemon=True).start(),
+        )
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        worker.run()
+
+    def _reap(self) -> None:
+        for pid in list(self.pids):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                self.pids.discard(pid)
+                del self._indexes[pid]
+                now = time.monotonic()
+                if now - self._forked_at.pop(pid) < self.min_uptime:
+                    self.rapid_failures += 1
+                    self._next_spawn = now + min(
+                        0.1 * 2 ** (self.rapid_failures - 1),
+                        self.MAX_BACKOFF,
+                    )
+                else:
+                    self.rapid_failures = 0
+
+    def _stop_workers(self) -> None:
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.pids and time.monotonic() < deadline:
+            time.sleep(0.05)
+            self._reap()
+        for pid in self.pids:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.pids.clear()
+        self._forked_at.clear()
+        self._indexes.clear()
+
+
+def serve_follower(
+    follower: Follower,
+    primary_url: str,
+    host: str,
+    port: int,
+    threads: int,
+    max_lag: float,
+) -> None:
+    """
+    Serves the API of a follower, catching up with the primary
+    in the background, until SIGTERM or SIGINT.
+    """
+    server = PooledWSGIServer(
+        host,
+        port,
+        create_follower_app(follower, primary_url, max_lag),
+        threads=threads,
+    )
+    handlers = {
+        signum: signal.signal(
+            signum,
+            lambda *_: Thread(target=server.shutdown, daemon=True).start(),
+        )
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    follower.start()
+    try:
+        server.serve_forever()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        server.server_close()
+        follower.stop()
+        follower.replica.close()
+
+
+def follow(args: argparse.Namespace) -> int:
+    if args.from_stream:
+        admin_key = os.getenv("ADMIN_API_KEY")
+        if not admin_key:
+            print(
+                "Following the event stream of the primary needs its"
+                " ADMIN_API_KEY",
+                file=sys.stderr,
+            )
+            return 2
+        replica = Replica(env={"PERSISTENCE_MODULE": "eventsourcing.popo"})
+        stream: Optional[EventStream] = EventStream(args.follow, admin_key)
+    else:
+        if not is_shared_store(os.environ):
+            print(
+                "Following the event store of the primary needs"
+                " PERSISTENCE_MODULE=eventsourcing.sqlite and SQLITE_DBNAME"
+                " set to the path of its file, or --from-stream",
+                file=sys.stderr,
+            )
+            return 2
+        replica = Replica()
+        stream = None
+    follower = Follower(replica, stream, period=args.poll_interval)
+    serve_follower(
+        follower, args.follow, args.host, args.port, args.threads, args.max_lag
+    )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Serve the banking API. Without --workers, runs the"
+            " single process development server."
+        )
+    )
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument(
+        "--port", type=int, default=int(os.getenv("PORT", "5000"))
+    )
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_WORKERS", "0"))
+    )
+    parser.add_argument(
+        "--threads", type=int, default=int(os.getenv("WEB_THREADS", "8"))
+    )
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--follow",
+        metavar="PRIMARY_URL",
+        help=(
+            "serve reads as a follower of the primary at this URL, which"
+            " reads that can't be stale are redirected to"
+        ),
+    )
+    parser.add_argument(
+        "--from-stream",
+        action="store_true",
+        help=(
+            "follow the event log the primary streams to admins, rather"
+            " than their shared event store"
+        ),
+    )
+    parser.add_argument(
+        "--max-lag",
+        type=float,
+        default=float(os.getenv("FOLLOWER_MAX_LAG", "5")),
+        help="seconds behind the primary after which reads are redirected",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=float(os.getenv("FOLLOWER_POLL_INTERVAL", "0.5")),
+    )
+    args = parser.parse_args(argv)
+
+    if args.follow:
+        return follow(args)
+
+    if not args.workers:
+        api.app.run(host=args.host, port=args.port, debug=True)
+        return 0
+    try:
+        check_env(os.environ, args.workers)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return 2
+
+    supervisor = Supervisor(
+        args.host,
+        args.port,
+        workers=args.workers,
+        threads=args.threads,
+        graceful_timeout=args.graceful_timeout,
+    )
+    handlers = {
+        signum: signal.signal(signum, lambda *_: supervisor.stop())
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        supervisor.run()
+    except RuntimeError as err:
+        print(err, file=sys.stderr)
+        return 1
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return 0
@@ -0,0 +1,63 @@
+# coding=utf-8
+
+from typing import TYPE_CHECKING, Dict, List, Sequence
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.utils import get_topic
+
+from banking.domainmodel import Account
+from banking.projections import NotifiedEvent, Projection
+from banking.utils.periodic import PeriodicJob
+
+if TYPE_CHECKING:  # pragma: no cover
+    from banking.applicationmodel import Bank
+
+
+class ShardedAccounts(Projection):
+    """
+    The IDs of the accounts that have been sharded, in the
+    order they were first sharded. Only the Sharded events
+    are read, so finding them again after a restart is cheap.
+    """
+
+    topics = (get_topic(Account.Sharded),)
+
+    def __init__(self, app: Application):
+        self.account_ids: List[UUID] = []
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        return 0
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        for _, event in events:
+            if event.originator_id not in self.account_ids:
+                self.account_ids.append(event.originator_id)
+        self.position = position
+
+
+class ShardSweeper(PeriodicJob):
+    """
+    Sweeps the credits held by the shards of every sharded
+    account into the account, so the shards' balances stay
+    small and debits of the account have less to sweep.
+    """
+
+    def __init__(self, app: "Bank", period: float = 60.0):
+        super().__init__(period)
+        self.app = app
+        self.sharded = ShardedAccounts(app)
+
+    def run_once(self) -> Dict[UUID, int]:
+        """
+        Sweeps every sharded account, and returns the amounts
+        swept into the accounts that had credits to sweep.
+        """
+        self.sharded.pull()
+        swept = {}
+        for account_id in self.sharded.account_ids:
+            amount_in_cents = self.app.sweep_account(account_id)
+            if amount_in_cents:
+                swept[account_id] = amount_in_cents
+        return swept
@@ -0,0 +1,89 @@
+# coding=utf-8
+
+from typing import Dict, List, Sequence
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.persistence import IntegrityError
+
+from banking.projections import NotifiedEvent, Projection
+from banking.utils.periodic import PeriodicJob
+
+
+class LastVersions(Projection):
+    """
+    The version of the last event of every aggregate in the
+    notification log, held in memory only, so a new writer
+    reads the whole log on its first pass.
+    """
+
+    def __init__(self, app: Application):
+        self.versions: Dict[UUID, int] = {}
+        super().__init__(app)
+
+    def load_position(self) -> int:
+        return 0
+
+    def process(self, events: Sequence[NotifiedEvent], position: int) -> None:
+        for notification, _ in events:
+            self.versions[notification.originator_id] = (
+                notification.originator_version
+            )
+        self.position = position
+
+
+class SnapshotWriter(PeriodicJob):
+    """
+    Snapshots every aggregate whose history has grown by at
+    least `threshold` events since its last snapshot, so that
+    loading it only replays the events recorded after that.
+    Snapshots taken by a writer in another process sharing the
+    event store are found, and not taken again.
+    """
+
+    def __init__(
+        self,
+        app: Application,
+        threshold: int,
+        period: float = 60.0,
+    ):
+        if threshold <= 0:
+            raise ValueError(f"Invalid snapshot threshold {threshold}")
+        super().__init__(period)
+        self.app = app
+        self.threshold = threshold
+        self.last_versions = LastVersions(app)
+        self.snapshot_versions: Dict[UUID, int] = {}
+
+    def run_once(self) -> List[UUID]:
+        """
+        Reads the notifications recorded since the previous
+        pass and snapshots the aggregates that are due.
+        Returns the IDs of the aggregates that were snapshotted.
+        """
+        self.last_versions.pull()
+        snapshotted = []
+        for account_id, version in self.last_versions.versions.items():
+            if version - self._snapshot_version(account_id) >= self.threshold:
+                try:
+                    self.app.take_snapshot(account_id, version=version)
+                except IntegrityError:
+                    # Taken by the writer of another process
+                    # sharing the event store.
+                    pass
+                else:
+                    snapshotted.append(account_id)
+                self.snapshot_versions[account_id] = version
+        return snapshotted
+
+    def _snapshot_version(self, account_id: UUID) -> int:
+        try:
+            return self.snapshot_versions[account_id]
+        except KeyError:
+            assert self.app.snapshots is not None
+            snapshots = list(
+                self.app.snapshots.get(account_id, desc=True, limit=1)
+            )
+            version = snapshots[0].originator_version if snapshots else 0
+            self.snapshot_versions[account_id] = version
+            return version
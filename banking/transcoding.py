@@ -0,0 +1,328 @@
+# coding=utf-8
+
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.persistence import (
+    ApplicationRecorder,
+    JSONTranscoder,
+    Mapper,
+    Transcoder,
+)
+
+TRANSCODERS = ("json", "compact")
+
+# The first byte of a compact encoding. JSON state always
+# starts with "{", so a store can hold both.
+COMPACT = 0x01
+COMPRESSED = 0x02
+
+# Strings stored as their index in this table: the field names
+# of the events and snapshots of the domain model, and its
+# topics. Strings may be added at the end, but never removed
+# or reordered, or stored events would decode differently.
+INTERNED: Tuple[str, ...] = (
+    "timestamp",
+    "originator_topic",
+    "full_name",
+    "email_address",
+    "password",
+    "amount_in_cents",
+    "to_account_id",
+    "transaction_id",
+    "account_id",
+    "password_hash",
+    "new_password",
+    "shards",
+    "index",
+    "class_version",
+    "topic",
+    "state",
+    "_id",
+    "_version",
+    "_created_on",
+    "_modified_on",
+    "balance",
+    "is_closed",
+    "overdraft_limit",
+    "banking.domainmodel:Account",
+    "banking.domainmodel:AccountShard",
+    "debit_account_id",
+    "credit_account_id",
+    "interval_seconds",
+    "next_due_at",
+    "is_cancelled",
+    "reason",
+    "banking.domainmodel:StandingOrder",
+    "day",
+    "accounts",
+    "interest_rate",
+    "overdraft_rate",
+    "posted",
+    "banking.domainmodel:InterestAccrual",
+)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Tags of the encoded values.
+_NONE, _TRUE, _FALSE, _INT, _STR, _INTERNED = 0, 1, 2, 3, 4, 5
+_UUID, _DATETIME, _LIST, _DICT, _FLOAT, _BYTES, _CUSTOM = (
+    6,
+    7,
+    8,
+    9,
+    10,
+    11,
+    12,
+)
+
+
+class CompactTranscoder(Transcoder):
+    """
+    Transcoder that encodes event state in a compact binary
+    form: UUIDs as their 16 bytes, integers and timestamps as
+    varints, and field names and topics as their index in
+    INTERNED. Other types are encoded with the transcodings
+    registered for them, as by the JSON transcoder.
+
+    Encodings of at least compression_threshold bytes are
+    compressed with zlib, if that makes them smaller. State
+    recorded as JSON is still decoded, so a store written by
+    the default transcoder can switch to this one as it is.
+    """
+
+    def __init__(self, compression_threshold: Optional[int] = None):
+        super().__init__()
+        self.compression_threshold = compression_threshold
+        self.json = JSONTranscoder()
+        self.interned = {s: i for i, s in enumerate(INTERNED)}
+        self.encoders: Dict[type, Callable[[bytearray, Any], None]] = {
+            type(None): lambda out, _: out.append(_NONE),
+            bool: lambda out, v: out.append(_TRUE if v else _FALSE),
+            int: self._encode_int,
+            str: self._encode_str,
+            UUID: self._encode_uuid,
+            datetime: self._encode_datetime,
+            list: self._encode_list,
+            tuple: self._encode_list,
+            dict: self._encode_dict,
+            float: self._encode_float,
+            bytes: self._encode_bytes,
+        }
+
+    def register(self, transcoding: Any) -> None:
+        super().register(transcoding)
+        self.json.register(transcoding)
+
+    def encode(self, obj: Any) -> bytes:
+        out = bytearray([COMPACT])
+        self._encode(out, obj)
+        threshold = self.compression_threshold
+        if threshold is not None and len(out) >= threshold:
+            compressed = bytes([COMPRESSED]) + zlib.compress(out[1:])
+            if len(compressed) < len(out):
+                return compressed
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Any:
+        marker = data[0]
+        if marker == COMPACT:
+            return self._decode(data, 1)[0]
+        if marker == COMPRESSED:
+            return self._decode(zlib.decompress(data[1:]), 0)[0]
+        return self.json.decode(data)
+
+    def _encode(self, out: bytearray, value: Any) -> None:
+        encoder = self.encoders.get(type(value))
+        if encoder is not None:
+            encoder(out, value)
+            return
+        self._encode_custom(out, value)
+
+    def _encode_custom(self, out: bytearray, value: Any) -> None:
+        try:
+            transcoding = self.types[type(value)]
+        except KeyError:
+            raise TypeError(
+                f"Object of type {type(value)} is not serializable. Please "
+                "define and register a custom transcoding for this type."
+            ) from None
+        out.append(_CUSTOM)
+        self._encode_str(out, transcoding.name)
+        self._encode(out, transcoding.encode(value))
+
+    def _encode_int(self, out: bytearray, value: int) -> None:
+        out.append(_INT)
+        _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+
+    def _encode_str(self, out: bytearray, value: str) -> None:
+        index = self.interned.get(value)
+        if index is not None:
+            out.append(_INTERNED)
+            _write_varint(out, index)
+        else:
+            encoded = value.encode("utf8")
+            out.append(_STR)
+            _write_varint(out, len(encoded))
+            out += encoded
+
+    def _encode_uuid(self, out: bytearray, value: UUID) -> None:
+        out.append(_UUID)
+        out += value.bytes
+
+    def _encode_datetime(self, out: bytearray, value: datetime) -> None:
+        # Only UTC timestamps, the kind the domain model
+        # records, are sure to decode as they were.
+        if value.tzinfo is not timezone.utc:
+            self._encode_custom(out, value)
+            return
+        out.append(_DATETIME)
+        micros = (value - EPOCH) // MICROSECOND
+        _write_varint(out, micros << 1 if micros >= 0 else (-micros << 1) - 1)
+
+    def _encode_list(self, out: bytearray, value: Any) -> None:
+        out.append(_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            self._encode(out, item)
+
+    def _encode_dict(self, out: bytearray, value: Dict[Any, Any]) -> None:
+        out.append(_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            self._encode(out, key)
+            self._encode(out, item)
+
+    def _encode_float(self, out: bytearray, value: float) -> None:
+        out.append(_FLOAT)
+        out += struct.pack(">d", value)
+
+    def _encode_bytes(self, out: bytearray, value: bytes) -> None:
+        out.append(_BYTES)
+        _write_varint(out, len(value))
+        out += value
+
+    def _decode(self, data: bytes, pos: int) -> Tuple[Any, int]:
+        tag = data[pos]
+        pos += 1
+        if tag == _INTERNED:
+            index, pos = _read_varint(data, pos)
+            return INTERNED[index], pos
+        if tag == _INT or tag == _DATETIME:
+            zigzag, pos = _read_varint(data, pos)
+            value = zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+            if tag == _DATETIME:
+                return EPOCH + value * MICROSECOND, pos
+            return value, pos
+        if tag == _STR or tag == _BYTES:
+            length, pos = _read_varint(data, pos)
+            raw = data[pos : pos + length]
+            return (
+                raw.decode("utf8") if tag == _STR else bytes(raw)
+            ), pos + length
+        if tag == _UUID:
+            return UUID(bytes=bytes(data[pos : pos + 16])), pos + 16
+        if tag == _DICT:
+            length, pos = _read_varint(data, pos)
+            result: Dict[Any, Any] = {}
+            for _ in range(length):
+                # Most keys are interned field names.
+                if data[pos] == _INTERNED and data[pos + 1] < 0x80:
+                    key = INTERNED[data[pos + 1]]
+                    pos += 2
+                else:
+                    key, pos = self._decode(data, pos)
+                result[key], pos = self._decode(data, pos)
+            return result, pos
+        if tag == _LIST:
+            length, pos = _read_varint(data, pos)
+            items: List[Any] = []
+            for _ in range(length):
+                item, pos = self._decode(data, pos)
+                items.append(item)
+            return items, pos
+        if tag == _NONE or tag == _TRUE or tag == _FALSE:
+            return (None, True, False)[tag], pos
+        if tag == _FLOAT:
+            return struct.unpack_from(">d", data, pos)[0], pos + 8
+        if tag == _CUSTOM:
+            name, pos = self._decode(data, pos)
+            encoded, pos = self._decode(data, pos)
+            try:
+                transcoding = self.names[name]
+            except KeyError:
+                raise TypeError(
+                    f"Data serialized with name '{name}' is not"
+                    " deserializable. Please register a custom transcoding"
+                    " for this type."
+                ) from None
+            return transcoding.decode(encoded), pos
+        raise ValueError(f"Unknown tag {tag} at {pos - 1}")
+
+
+def construct_transcoder(
+    name: str, compression_threshold: Optional[int] = None
+) -> Transcoder:
+    if name == "json":
+        return JSONTranscoder()
+    if name == "compact":
+        return CompactTranscoder(compression_threshold)
+    raise ValueError(f"Unknown event transcoder {name!r}")
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def migrate_events(
+    app: Application, recorder: ApplicationRecorder, mapper: Mapper
+) -> Iterator[int]:
+    """
+    Copies the events of the app's notification log, in order,
+    a section at a time, to an empty recorder, encoding them
+    with the given mapper, and yields the number copied after
+    each section. Snapshots are not copied; they are taken
+    again as the new store is used.
+    """
+    if recorder.max_notification_id():
+        raise ValueError("Events can only be migrated to an empty store")
+    section_size = app.notification_log.section_size
+    start, copied = 1, 0
+    while True:
+        notifications = app.notification_log.select(
+            start=start, limit=section_size
+        )
+        if not notifications:
+            return
+        recorder.insert_events(
+            [
+                mapper.to_stored_event(
+                    app.mapper.to_domain_event(notification)
+                )
+                for notification in notifications
+            ]
+        )
+        copied += len(notifications)
+        yield copied
+        if len(notifications) < section_size:
+            return
+        start = notifications[-1].id + 1
@@ -0,0 +1,38 @@
+from hashlib import blake2b
+from math import ceil, log
+from typing import Iterator
+
+
+class BloomFilter:
+    """
+    Set membership test that never gives false negatives,
+    and gives false positives at about error_rate once
+    capacity items have been added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError(
+                f"Invalid capacity {capacity} or error rate {error_rate}"
+            )
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing: derive all positions from two 64-bit hashes.
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
@@ -1,31 +1,78 @@
 from functools import wraps
+from time import perf_counter
 
 from eventsourcing.application import AggregateNotFound
 from werkzeug.exceptions import BadRequest
 
-from typing import Any, Callable, Dict, Tuple, Union
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 from werkzeug.exceptions import BadRequest
 from eventsourcing.application import AggregateNotFound
+from eventsourcing.persistence import IntegrityError
+from banking.applicationmodel import EmailAlreadyRegistered
 from banking.domainmodel import (
     AccountClosedError,
     BadCredentials,
     InsufficientFundsError,
     InvalidDeposit,
 )
+from banking.utils.metrics import Labels, registry
 from functools import wraps
 
 
+def request_labels(func: Callable[..., Any]) -> Labels:
+    # The labels of the requests a resource method handles,
+    # e.g. DepositResource, POST.
+    resource = func.__qualname__.split(".")[0]
+    return (("resource", resource), ("method", func.__name__.upper()))
+
+
+def record_request(labels: Labels, status: int, seconds: float, error: Optional[Exception] = None) -> None:
+    registry.observe("banking_http_request_duration_seconds", seconds, labels)
+    registry.inc("banking_http_requests_total", (*labels, ("status", str(status))))
+    if error is not None:
+        registry.inc(
+            "banking_http_errors_total",
+            (*labels, ("exception", type(error).__name__)),
+        )
+
+
 def handler(func: Callable[..., Union[Dict[str, Any], Tuple[Dict[str, Any], int]]]) -> Callable[..., Union[Dict[str, Any], Tuple[Dict[str, Any], int]]]:
+    # Counts requests and their errors, and times them, in the
+    # metrics registry.
+    labels = request_labels(func)
+
     @wraps(func)
     def wrapper(*args: Any, **kwargs: Any) -> Union[Dict[str, Any], Tuple[Dict[str, Any], int]]:
+        started = perf_counter()
+        status = 500
+        error: Optional[Exception] = None
         try:
-            return func(*args, **kwargs)
+            response = func(*args, **kwargs)
+            status = response[1] if isinstance(response, tuple) else 200
+            return response
         except AccountClosedError as err:
+            error, status = err, 400
             return {"error": str(err)}, 400
         except InsufficientFundsError as err:
+            error, status = err, 400
             return {"error": str(err)}, 400
         except BadCredentials as err:
+            error, status = err, 401
             return {"error": str(err)}, 401
         except InvalidDeposit as err:
+            error, status = err, 400
             return {"error": str(err)}, 400
+        except EmailAlreadyRegistered as err:
+            error, status = err, 409
+            return {"error": str(err)}, 409
+        except IntegrityError as err:
+            error, status = err, 409
+            return {
+                "error": "Account was changed concurrently, try again"
+            }, 409
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            record_request(labels, status, perf_counter() - started, error)
     return wrapper
@@ -0,0 +1,260 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds, in seconds, of the latency buckets. Finer than
+# the usual defaults at the low end, since most bank operations
+# take well under a millisecond.
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Upper bounds of the buckets of counts, like events replayed.
+COUNT_BUCKETS: Tuple[float, ...] = (
+    0,
+    1,
+    2,
+    5,
+    10,
+    20,
+    50,
+    100,
+    200,
+    500,
+    1000,
+    2000,
+    5000,
+    10000,
+)
+
+DESCRIPTIONS: Dict[str, Tuple[str, str]] = {
+    "banking_http_requests_total": (
+        "counter",
+        "Requests handled, by resource, method and status code.",
+    ),
+    "banking_http_errors_total": (
+        "counter",
+        "Exceptions raised while handling requests, by type.",
+    ),
+    "banking_http_request_duration_seconds": (
+        "histogram",
+        "Time spent handling requests, by resource and method.",
+    ),
+    "banking_command_duration_seconds": (
+        "histogram",
+        "Time spent in Bank commands, retries included.",
+    ),
+    "banking_repository_get_duration_seconds": (
+        "histogram",
+        "Time spent loading aggregates from the repository.",
+    ),
+    "banking_save_duration_seconds": (
+        "histogram",
+        "Time spent saving aggregates.",
+    ),
+    "banking_events_replayed": (
+        "histogram",
+        "Events replayed by each repository get, snapshots included.",
+    ),
+    "banking_deserialize_duration_seconds": (
+        "histogram",
+        "Time each repository get spent deserializing events.",
+    ),
+    "banking_recorder_insert_duration_seconds": (
+        "histogram",
+        "Time each save spent inserting events, serializing excluded.",
+    ),
+    "banking_aggregates_per_request": (
+        "histogram",
+        "Aggregates loaded or saved by each request.",
+    ),
+    "banking_heaviest_aggregate_get_seconds": (
+        "gauge",
+        "Total time spent loading the aggregates slowest to load.",
+    ),
+    "banking_heaviest_aggregate_events_replayed": (
+        "gauge",
+        "Total events replayed to load the aggregates slowest to load.",
+    ),
+    "banking_commands_total": ("counter", "Bank commands run."),
+    "banking_command_attempts_total": (
+        "counter",
+        "Attempts made at Bank commands.",
+    ),
+    "banking_command_conflicts_total": (
+        "counter",
+        "Attempts at Bank commands that conflicted when saving.",
+    ),
+    "banking_command_retried_total": (
+        "counter",
+        "Bank commands that needed more than one attempt.",
+    ),
+    "banking_command_exhausted_total": (
+        "counter",
+        "Bank commands that conflicted on every attempt.",
+    ),
+    "banking_aggregate_cache_hits_total": (
+        "counter",
+        "Aggregates found in the cache.",
+    ),
+    "banking_aggregate_cache_misses_total": (
+        "counter",
+        "Aggregates not found in the cache.",
+    ),
+    "banking_aggregate_cache_evictions_total": (
+        "counter",
+        "Aggregates evicted from the cache.",
+    ),
+}
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets, and keeps their
+    sum, so a scraper can work out rates and percentiles.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms, keyed by name and labels,
+    that render in the Prometheus text exposition format. The
+    names are described in DESCRIPTIONS. Recording takes one
+    lock, and allocates only for labels seen the first time.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, labels: Labels = (), amount: float = 1) -> None:
+        with self.lock:
+            values = self.values.get(name)
+            if values is None:
+                values = self.values[name] = {}
+            values[labels] = values.get(labels, 0) + amount
+
+    def set(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self.lock:
+            self.values.setdefault(name, {})[labels] = value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Labels = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        with self.lock:
+            histograms = self.histograms.get(name)
+            if histograms is None:
+                histograms = self.histograms[name] = {}
+            histogram = histograms.get(labels)
+            if histogram is None:
+                histogram = histograms[labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def remove(self, name: str) -> None:
+        """Forgets the values of the name, whatever their labels."""
+        with self.lock:
+            self.values.pop(name, None)
+
+    def render(self, extra_labels: Labels = ()) -> str:
+        """
+        The metrics in the text exposition format, with the
+        extra labels before the labels of every series.
+        """
+        lines: List[str] = []
+        with self.lock:
+            for name in sorted(self.values):
+                _describe(lines, name, "untyped")
+                for labels, value in sorted(self.values[name].items()):
+                    labels = (*extra_labels, *labels)
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name in sorted(self.histograms):
+                _describe(lines, name, "histogram")
+                for labels, histogram in sorted(
+                    self.histograms[name].items(), key=lambda item: item[0]
+                ):
+                    labels = (*extra_labels, *labels)
+                    cumulative = 0
+                    for bound, count in zip(
+                        (*histogram.buckets, "+Inf"), histogram.counts
+                    ):
+                        cumulative += count
+                        le = bound if isinstance(bound, str) else f"{bound:g}"
+                        lines.append(
+                            f"{name}_bucket"
+                            f"{_format_labels((*labels, ('le', le)))}"
+                            f" {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {histogram.sum:g}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)}"
+                        f" {histogram.count}"
+                    )
+        return "".join(line + "\n" for line in lines)
+
+
+def _describe(lines: List[str], name: str, default_type: str) -> None:
+    metric_type, help = DESCRIPTIONS.get(name, (default_type, ""))
+    if help:
+        lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            key,
+            value.replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+# Metrics of the requests handled by this process.
+registry = Metrics()
+
+# Labels that tell this process apart from the others serving
+# the same API, added to every series it renders: the worker
+# label a Worker forked by a Supervisor sets.
+process_labels: Labels = ()
@@ -0,0 +1,185 @@
+import hmac
+from abc import ABC, abstractmethod
+from base64 import b64decode, b64encode
+from hashlib import scrypt, sha512
+from os import urandom
+from threading import Lock
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from concurrent.futures import ProcessPoolExecutor
+
+T = TypeVar("T")
+
+
+class PasswordHasher(ABC):
+    """
+    Turns passwords into encoded hashes that start with the
+    name of their algorithm, "<algorithm>$...", so hashes made
+    by different hashers can be told apart when verifying.
+    """
+
+    algorithm: str
+
+    @abstractmethod
+    def hash(self, password: str) -> str:
+        pass
+
+    @abstractmethod
+    def verify(self, password: str, encoded: str) -> bool:
+        pass
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return False
+
+
+class SHA512Hasher(PasswordHasher):
+    """
+    Unsalted SHA-512 hex digests, as stored before hashes
+    named their algorithm. Kept to verify those hashes.
+    """
+
+    algorithm = "sha512"
+
+    def hash(self, password: str) -> str:
+        return sha512(password.encode()).hexdigest()
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return hmac.compare_digest(self.hash(password), encoded)
+
+
+class ScryptHasher(PasswordHasher):
+    """
+    Salted scrypt, encoded as "scrypt$n$r$p$salt$key".
+    Hashes made with other cost parameters need a rehash.
+    """
+
+    algorithm = "scrypt"
+
+    def __init__(self, n: int = 2**14, r: int = 8, p: int = 1):
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def hash(self, password: str) -> str:
+        salt = urandom(16)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return "$".join(
+            [
+                self.algorithm,
+                str(self.n),
+                str(self.r),
+                str(self.p),
+                b64encode(salt).decode(),
+                b64encode(key).decode(),
+            ]
+        )
+
+    def verify(self, password: str, encoded: str) -> bool:
+        try:
+            (n, r, p), salt, key = self._decode(encoded)
+            derived = self._derive(password, salt, n, r, p)
+        except ValueError:
+            # A malformed or truncated hash, or cost parameters
+            # scrypt refuses, matches no password.
+            return False
+        return hmac.compare_digest(derived, key)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return self._decode(encoded)[0] != (self.n, self.r, self.p)
+
+    @staticmethod
+    def _decode(encoded: str) -> Tuple[Tuple[int, int, int], bytes, bytes]:
+        _, n, r, p, salt, key = encoded.split("$")
+        return (int(n), int(r), int(p)), b64decode(salt), b64decode(key)
+
+    @staticmethod
+    def _derive(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        return scrypt(
+            password.encode(),
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            maxmem=256 * n * r + 2**20,
+            dklen=32,
+        )
+
+
+HASHERS: Dict[str, Callable[[], PasswordHasher]] = {
+    SHA512Hasher.algorithm: SHA512Hasher,
+    ScryptHasher.algorithm: ScryptHasher,
+}
+
+
+def construct_password_hasher(algorithm: str) -> PasswordHasher:
+    try:
+        return HASHERS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Unknown password hasher {algorithm!r}")
+
+
+def get_algorithm(encoded: str) -> str:
+    algorithm, separator, _ = encoded.partition("$")
+    return algorithm if separator else SHA512Hasher.algorithm
+
+
+class Passwords:
+    """
+    Hashes new passwords with the preferred hasher, and
+    verifies stored hashes with the hasher named in them.
+
+    With workers, hashing and verifying run in a pool of
+    that many processes, so a slow key derivation keeps a
+    CPU busy without holding up the threads that serve
+    other requests. The pool is started on first use.
+    """
+
+    def __init__(self, hasher: PasswordHasher, workers: int = 0):
+        self.hasher = hasher
+        self.hashers = {
+            algorithm: construct() for algorithm, construct in HASHERS.items()
+        }
+        self.hashers[hasher.algorithm] = hasher
+        self.workers = workers
+        self._pool: Optional["ProcessPoolExecutor"] = None
+        self._lock = Lock()
+
+    def hash(self, password: str) -> str:
+        return self._run(self.hasher.hash, password)
+
+    def verify(self, password: str, encoded: str) -> bool:
+        hasher = self.hashers.get(get_algorithm(encoded))
+        if hasher is None:
+            return False
+        return self._run(hasher.verify, password, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return get_algorithm(
+            encoded
+        ) != self.hasher.algorithm or self.hasher.needs_rehash(encoded)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.workers <= 0:
+            return fn(*args)
+        with self._lock:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._pool = ProcessPoolExecutor(self.workers)
+            pool = self._pool
+        return pool.submit(fn, *args).result()
@@ -0,0 +1,45 @@
+import logging
+from abc import ABC, abstractmethod
+from threading import Event, Thread
+from typing import Any, Optional
+
+
+class PeriodicJob(ABC):
+    """
+    Background job that runs a pass, run_once(), every `period`
+    seconds in a daemon thread, from start() until stop(). A
+    pass that raises is logged, and the job carries on with the
+    next pass, so a passing fault doesn't stop it for good.
+    """
+
+    def __init__(self, period: float):
+        self.period = period
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+
+    @abstractmethod
+    def run_once(self) -> Any:
+        pass
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.period):
+            try:
+                self.run_once()
+            except Exception:
+                # Logged as coming from the module of the job.
+                logging.getLogger(type(self).__module__).exception(
+                    "%s failed, trying again in %s seconds",
+                    type(self).__name__,
+                    self.period,
+                )
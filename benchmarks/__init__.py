@@ -0,0 +1,5 @@
+# coding=utf-8
+"""
+Benchmarks for the banking application, run with
+python -m benchmarks.<name>.
+"""
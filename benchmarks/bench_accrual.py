@@ -0,0 +1,152 @@
+# coding=utf-8
+"""
+Time of a day's interest and fee accrual over every account with
+AccrualEngine, against a loop of Bank.deposit_funds and
+Bank.withdraw_funds over a sample of the accounts, extrapolated to
+all of them. One account in ten is overdrawn.
+
+    python -m benchmarks.bench_accrual
+    python -m benchmarks.bench_accrual --accounts 1000000 --sample 2000 \
+        --persistence-module eventsourcing.sqlite
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import date
+from typing import Dict, Iterator, List
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+from banking.accrual import AccrualEngine
+from banking.applicationmodel import Bank, NewAccount
+from banking.domainmodel import Account
+
+INTEREST_RATE = 0.05
+OVERDRAFT_RATE = 0.2
+
+
+def _new_accounts(accounts: int) -> Iterator[NewAccount]:
+    for i in range(accounts):
+        yield NewAccount(f"Saver {i}", f"saver{i}@example.com", "pw")
+
+
+def _setup(app: Bank, accounts: int, batch_size: int) -> List[UUID]:
+    app.open_accounts_bulk(_new_accounts(accounts), batch_size=batch_size)
+    account_ids = [
+        uuid5(NAMESPACE_URL, new_account.email_address)
+        for new_account in _new_accounts(accounts)
+    ]
+    # Balances are set with events, as the accrual does, so
+    # that setting up a million accounts takes seconds too.
+    events: List[Account.Event] = []
+    for i, account_id in enumerate(account_ids):
+        if i % 10:
+            events.append(
+                Account.Credited(
+                    originator_id=account_id,
+                    originator_version=2,
+                    timestamp=Account.Event.create_timestamp(),
+                    amount_in_cents=100_000 + i % 10_000,
+                )
+            )
+        else:
+            events.append(
+                Account.OverdraftLimitChanged(
+                    originator_id=account_id,
+                    originator_version=2,
+                    timestamp=Account.Event.create_timestamp(),
+                    account_id=account_id,
+                    amount_in_cents=50_000,
+                )
+            )
+            events.append(
+                Account.Debited(
+                    originator_id=account_id,
+                    originator_version=3,
+                    timestamp=Account.Event.create_timestamp(),
+                    amount_in_cents=20_000 + i % 10_000,
+                )
+            )
+        if len(events) >= batch_size:
+            app.save(*events)
+            events = []
+    app.save(*events)
+    return account_ids
+
+
+def _loop(app: Bank, account_ids: List[UUID]) -> None:
+    for account_id in account_ids:
+        account = app.get_account(account_id)
+        if account.balance > 0:
+            app.deposit_funds(
+                account_id, int(account.balance * INTEREST_RATE / 365) or 1
+            )
+        else:
+            app.withdraw_funds(
+                account_id, int(-account.balance * OVERDRAFT_RATE / 365) or 1
+            )
+
+
+def run(
+    accounts: int, sample: int, batch_size: int, persistence_module: str
+) -> Dict[str, float]:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": persistence_module,
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if persistence_module == "eventsourcing.sqlite":
+            env["SQLITE_DBNAME"] = os.path.join(tmpdir, "bank.db")
+        app = Bank(env=env)
+        started = time.perf_counter()
+        account_ids = _setup(app, accounts, batch_size)
+        setup_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        engine = AccrualEngine(app, batch_size=batch_size)
+        engine.ledger.pull()
+        ledger_seconds = time.perf_counter() - started
+        report = engine.run(date(2024, 1, 1), INTEREST_RATE, OVERDRAFT_RATE)
+        assert report.credited + report.debited == accounts, report
+
+        started = time.perf_counter()
+        _loop(app, account_ids[:sample])
+        loop_seconds = (time.perf_counter() - started) * accounts / sample
+        app.close()
+    return {
+        "setup_seconds": setup_seconds,
+        "ledger_seconds": ledger_seconds,
+        "accrual_seconds": report.seconds,
+        "accounts_per_second": accounts / report.seconds,
+        "loop_seconds": loop_seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--sample", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--persistence-module", default="eventsourcing.popo")
+    args = parser.parse_args()
+    result = run(
+        args.accounts, args.sample, args.batch_size, args.persistence_module
+    )
+    print(f"accounts set up in {result['setup_seconds']:.2f}s")
+    print(f"ledger built in {result['ledger_seconds']:.2f}s")
+    print(
+        f"accrual: {result['accrual_seconds']:.2f}s"
+        f" ({result['accounts_per_second']:.0f} accounts/s)"
+    )
+    print(
+        f"loop of deposits and withdrawals: {result['loop_seconds']:.2f}s"
+        f" (extrapolated from {args.sample} accounts)"
+    )
+
+
+if __name__ == "__main__":
+    main()
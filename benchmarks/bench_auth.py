@@ -0,0 +1,89 @@
+# coding=utf-8
+"""
+Bank.authenticate throughput from concurrent request threads, with
+scrypt hashed inline and in a pool of PASSWORD_HASH_WORKERS processes.
+A reader thread measures the latency of balance reads meanwhile, to
+show how much password hashing holds up other requests.
+
+    python -m benchmarks.bench_auth --threads 8 --logins 200 --workers 0 2 4
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from banking.applicationmodel import Bank
+
+
+def _read_latencies(app: Bank, stop: threading.Event) -> List[float]:
+    account_id = app.open_account("Reader", "reader@example.com", "reader")
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        app.get_balance(account_id)
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.001)
+    return latencies
+
+
+def run(
+    threads: int, logins: int, workers: List[int]
+) -> List[Dict[str, float]]:
+    results = []
+    for worker_count in workers:
+        app = Bank(env={"PASSWORD_HASH_WORKERS": str(worker_count)})
+        emails = [f"user{i}@example.com" for i in range(threads)]
+        for email_address in emails:
+            app.open_account("User", email_address, "password")
+
+        stop = threading.Event()
+        with ThreadPoolExecutor(threads + 1) as executor:
+            reader = executor.submit(_read_latencies, app, stop)
+            started = time.perf_counter()
+            list(
+                executor.map(
+                    lambda i: app.authenticate(
+                        emails[i % threads], "password"
+                    ),
+                    range(logins),
+                )
+            )
+            elapsed = time.perf_counter() - started
+            stop.set()
+            latencies = reader.result()
+        app.close()
+        results.append(
+            {
+                "workers": worker_count,
+                "logins_per_second": logins / elapsed,
+                "read_p50_ms": statistics.median(latencies) * 1e3,
+                "read_max_ms": max(latencies) * 1e3,
+            }
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    args = parser.parse_args()
+    print(
+        f"{'workers':>8} {'logins/s':>10}"
+        f" {'read p50 ms':>12} {'read max ms':>12}"
+    )
+    for row in run(args.threads, args.logins, args.workers):
+        print(
+            f"{row['workers']:>8} "
+            f"{row['logins_per_second']:>10.1f} "
+            f"{row['read_p50_ms']:>12.3f} "
+            f"{row['read_max_ms']:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# coding=utf-8
+"""
+Throughput and latency of the Bank operations, with the POPO and SQLite
+persistence modules, swept over account history length and number of
+accounts. Results are printed as a table, and can be written as JSON
+and compared with the results of an earlier run.
+
+    python -m benchmarks.bench_bank --output results.json
+    python -m benchmarks.bench_bank --histories 0 100 --accounts 10 1000 \
+        --ops 500
+    python -m benchmarks.bench_bank --compare baseline.json results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+from uuid import UUID
+
+from banking.applicationmodel import Bank
+from benchmarks.stats import summarize
+
+PERSISTENCE_MODULES = ["eventsourcing.popo", "eventsourcing.sqlite"]
+OPERATIONS = [
+    "open_account",
+    "deposit_funds",
+    "withdraw_funds",
+    "transfer_funds",
+    "get_balance",
+]
+
+
+def _bank(persistence_module: str, tmpdir: str, password_hasher: str) -> Bank:
+    env = {
+        "PERSISTENCE_MODULE": persistence_module,
+        "PASSWORD_HASHER": password_hasher,
+    }
+    if persistence_module == "eventsourcing.sqlite":
+        fd, path = tempfile.mkstemp(suffix=".db", dir=tmpdir)
+        os.close(fd)
+        env["SQLITE_DBNAME"] = path
+    return Bank(env=env)
+
+
+def _open_accounts(app: Bank, accounts: int, history: int) -> List[UUID]:
+    account_ids = []
+    for i in range(accounts):
+        account_id = app.open_account("Bench", f"bench{i}@example.com", "pw")
+        account = app.get_account(account_id)
+        # Enough funds for every debit the benchmark makes.
+        account.credit(10**9)
+        for _ in range(history):
+            account.credit(1)
+        app.save(account)
+        account_ids.append(account_id)
+    return account_ids
+
+
+def _time(ops: int, op: Callable[[int], Any]) -> Dict[str, float]:
+    latencies = []
+    started = time.perf_counter()
+    for i in range(ops):
+        op_started = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - op_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def _measure(
+    app: Bank, account_ids: List[UUID], ops: int
+) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(0)
+
+    def pick() -> UUID:
+        return rng.choice(account_ids)
+
+    def pick_two() -> List[UUID]:
+        return rng.sample(account_ids, 2)
+
+    return {
+        "open_account": _time(
+            ops,
+            lambda i: app.open_account("New", f"new{i}@example.com", "pw"),
+        ),
+        "deposit_funds": _time(ops, lambda i: app.deposit_funds(pick(), 100)),
+        "withdraw_funds": _time(
+            ops, lambda i: app.withdraw_funds(pick(), 100)
+        ),
+        "transfer_funds": _time(
+            ops, lambda i: app.transfer_funds(*pick_two(), 100 + i)
+        ),
+        "get_balance": _time(ops, lambda i: app.get_balance(pick())),
+    }
+
+
+def run(
+    histories: List[int],
+    accounts: List[int],
+    ops: int,
+    password_hasher: str = "sha512",
+) -> Dict[str, Any]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for module in PERSISTENCE_MODULES:
+            for history in histories:
+                for account_count in accounts:
+                    app = _bank(module, tmpdir, password_hasher)
+                    account_ids = _open_accounts(
+                        app, max(2, account_count), history
+                    )
+                    for operation, stats in _measure(
+                        app, account_ids, ops
+                    ).items():
+                        results.append(
+                            {
+                                "persistence": module,
+                                "history": history,
+                                "accounts": account_count,
+                                "operation": operation,
+                                **stats,
+                            }
+                        )
+                    app.close()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ops": ops,
+        "password_hasher": password_hasher,
+        "results": results,
+    }
+
+
+def _key(row: Dict[str, Any]) -> str:
+    return (
+        f"{row['persistence']:<22} {row['history']:>8} {row['accounts']:>8} "
+        f"{row['operation']:<16}"
+    )
+
+
+HEADER = (
+    f"{'persistence':<22} {'history':>8} {'accounts':>8} {'operation':<16}"
+)
+
+
+def print_results(report: Dict[str, Any]) -> None:
+    print(f"{HEADER} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in report["results"]:
+        print(
+            f"{_key(row)} {row['ops_per_second']:>10.0f} "
+            f"{row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f}"
+            f" {row['p99_ms']:>9.3f}"
+        )
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> int:
+    """
+    Prints the change in throughput and p99 latency of every
+    benchmark in both runs, and returns how many of them got
+    slower by more than the threshold fraction.
+    """
+    before = {_key(row): row for row in baseline["results"]}
+    regressions = 0
+    print(f"{HEADER} {'ops/s':>9} {'p99':>9}")
+    for row in current["results"]:
+        key = _key(row)
+        if key not in before:
+            continue
+        throughput = row["ops_per_second"] / before[key]["ops_per_second"] - 1
+        p99 = (
+            row["p99_ms"] / before[key]["p99_ms"] - 1
+            if before[key]["p99_ms"]
+            else 0.0
+        )
+        regressed = throughput < -threshold or p99 > threshold
+        regressions += regressed
+        print(
+            f"{key} {throughput:>+9.1%} {p99:>+9.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--histories", type=int, nargs="+", default=[0, 100, 1000]
+    )
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10, 1000])
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument(
+        "--password-hasher",
+        default="sha512",
+        help="hasher for open_account (bench_auth measures password hashing)",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two JSON result files instead of running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="fraction by which a compared result may get slower",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
+
+    report = run(args.histories, args.accounts, args.ops, args.password_hasher)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""
+Throughput of Bank.transfer_funds_batch against a loop of
+Bank.transfer_funds, with the POPO and SQLite persistence modules.
+
+    python -m benchmarks.bench_batch_transfers --transfers 2000 --payees 200
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from banking.applicationmodel import Bank, Transfer
+
+PERSISTENCE_MODULES = ["eventsourcing.popo", "eventsourcing.sqlite"]
+
+
+def _bank(persistence_module: str, tmpdir: str, name: str) -> Bank:
+    # Account setup is not what is measured, so skip the slow hasher.
+    env = {
+        "PERSISTENCE_MODULE": persistence_module,
+        "PASSWORD_HASHER": "sha512",
+    }
+    if persistence_module == "eventsourcing.sqlite":
+        env["SQLITE_DBNAME"] = os.path.join(tmpdir, f"{name}.db")
+    return Bank(env=env)
+
+
+def _payroll(app: Bank, transfers: int, payees: int) -> List[Transfer]:
+    employer = app.open_account("Employer", "employer@example.com", "pw")
+    app.deposit_funds(employer, transfers * 100)
+    employees: List[UUID] = [
+        app.open_account(f"E{i}", f"employee{i}@example.com", "pw")
+        for i in range(payees)
+    ]
+    return [
+        Transfer(employer, employees[i % payees], 100)
+        for i in range(transfers)
+    ]
+
+
+def run(
+    transfers: int, payees: int, chunk_size: int
+) -> List[Tuple[str, str, float]]:
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for module in PERSISTENCE_MODULES:
+            timings: Dict[str, float] = {}
+
+            app = _bank(module, tmpdir, "loop")
+            payroll = _payroll(app, transfers, payees)
+            started = time.perf_counter()
+            for t in payroll:
+                app.transfer_funds(
+                    t.debit_account_id, t.credit_account_id, t.amount_in_cents
+                )
+            timings["loop"] = time.perf_counter() - started
+            app.close()
+
+            app = _bank(module, tmpdir, "batch")
+            payroll = _payroll(app, transfers, payees)
+            started = time.perf_counter()
+            app.transfer_funds_batch(payroll)
+            timings["batch"] = time.perf_counter() - started
+            app.close()
+
+            app = _bank(module, tmpdir, "chunked")
+            payroll = _payroll(app, transfers, payees)
+            started = time.perf_counter()
+            app.transfer_funds_batch(payroll, chunk_size=chunk_size)
+            timings[f"batch/{chunk_size}"] = time.perf_counter() - started
+            app.close()
+
+            for mode, elapsed in timings.items():
+                rows.append((module, mode, transfers / elapsed))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--payees", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+    print(f"{'persistence':<22} {'mode':<12} {'transfers/s':>12}")
+    for module, mode, throughput in run(
+        args.transfers, args.payees, args.chunk_size
+    ):
+        print(f"{module:<22} {mode:<12} {throughput:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# coding=utf-8
+"""
+Credits per second from many threads crediting one account, with the
+account unsharded and spread over shards, and the share of attempts
+that conflicted and had to be retried.
+
+    python -m benchmarks.bench_hot_account --threads 16 --credits 50 \
+        --shards 0 4 16
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from banking.applicationmodel import Bank
+from banking.concurrency import RetryStats
+
+
+def run(
+    threads: int, credits: int, shards: List[int]
+) -> List[Dict[str, float]]:
+    results = []
+    for shard_count in shards:
+        app = Bank(
+            env={
+                "PASSWORD_HASHER": "sha512",
+                "COMMAND_RETRY_ATTEMPTS": "1000",
+                "COMMAND_RETRY_BACKOFF": "0.001",
+            }
+        )
+        merchant = app.open_account("Merchant", "merchant@example.com", "pw")
+        if shard_count:
+            app.shard_account(merchant, shard_count)
+        app.retry_stats = RetryStats()
+
+        def credit(_: int) -> None:
+            for _ in range(credits):
+                app.deposit_funds(merchant, 1)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(credit, range(threads)))
+        elapsed = time.perf_counter() - started
+        assert app.get_balance(merchant) == threads * credits
+        results.append(
+            {
+                "shards": shard_count,
+                "credits_per_second": threads * credits / elapsed,
+                "conflict_rate": app.retry_stats.conflict_rate,
+            }
+        )
+        app.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--credits", type=int, default=50)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 4, 16])
+    args = parser.parse_args()
+    print(f"{'shards':>8} {'credits/s':>10} {'conflicts':>10}")
+    for row in run(args.threads, args.credits, args.shards):
+        print(
+            f"{row['shards']:>8} "
+            f"{row['credits_per_second']:>10.0f} "
+            f"{row['conflict_rate']:>9.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# coding=utf-8
+"""
+Cost of the metrics instrumentation: the time taken to record a counter
+and a histogram observation, from one thread and from several, the time
+the request handler adds to a resource method, and how much slower
+deposit_funds is with the Bank's metrics than with metrics that record
+nothing.
+
+    python -m benchmarks.bench_metrics --calls 100000 --threads 4
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Sequence, Tuple
+
+from banking.applicationmodel import Bank
+from banking.utils.http_errors import handler
+from banking.utils.metrics import LATENCY_BUCKETS, Labels, Metrics
+
+
+class NullMetrics(Metrics):
+    def inc(self, name: str, labels: Labels = (), amount: float = 1) -> None:
+        pass
+
+    def set(self, name: str, value: float, labels: Labels = ()) -> None:
+        pass
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Labels = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        pass
+
+
+def _per_call(calls: int, op: Callable[[], Any]) -> float:
+    """Seconds per call of op, the best of three runs."""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(calls):
+            op()
+        best = min(best, (time.perf_counter() - started) / calls)
+    return best
+
+
+def _threaded_per_call(
+    calls: int, threads: int, op: Callable[[], Any]
+) -> float:
+    """Wall-clock seconds per call, with the calls split across threads."""
+    per_thread = calls // threads
+    with ThreadPoolExecutor(threads) as executor:
+        started = time.perf_counter()
+        list(
+            executor.map(
+                lambda _: [op() for _ in range(per_thread)], range(threads)
+            )
+        )
+        return (time.perf_counter() - started) / (per_thread * threads)
+
+
+class Resource:
+    def get(self) -> Tuple[Dict[str, str], int]:
+        return {"message": "success"}, 200
+
+
+def _deposit_latency(metrics: Metrics, deposits: int) -> float:
+    app = Bank(env={"PASSWORD_HASHER": "sha512"})
+    app.metrics = metrics
+    app.repository.metrics = metrics
+    # Enough accounts that their histories stay short.
+    account_ids = [
+        app.open_account("Bench", f"bench{i}@example.com", "pw")
+        for i in range(max(1, deposits // 10))
+    ]
+    latencies = []
+    for i in range(deposits):
+        started = time.perf_counter()
+        app.deposit_funds(account_ids[i % len(account_ids)], 100)
+        latencies.append(time.perf_counter() - started)
+    app.close()
+    return statistics.median(latencies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--deposits", type=int, default=2000)
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    labels = (("resource", "Bench"), ("method", "GET"))
+    inc = lambda: metrics.inc("bench_total", labels)  # noqa: E731
+    observe = lambda: metrics.observe(
+        "bench_seconds", 0.001, labels
+    )  # noqa: E731
+    resource = Resource()
+    handled = handler(Resource.get)
+
+    print(f"{'operation':<40} {'us/call':>9}")
+    for name, seconds in [
+        ("Metrics.inc", _per_call(args.calls, inc)),
+        ("Metrics.observe", _per_call(args.calls, observe)),
+        (
+            f"Metrics.observe, {args.threads} threads",
+            _threaded_per_call(args.calls, args.threads, observe),
+        ),
+        ("resource method", _per_call(args.calls, resource.get)),
+        (
+            "resource method with handler",
+            _per_call(args.calls, lambda: handled(resource)),
+        ),
+    ]:
+        print(f"{name:<40} {seconds * 1e6:>9.2f}")
+
+    # Alternate the runs, and take the best of each, so that
+    # warming up doesn't count against either.
+    without = with_metrics = float("inf")
+    for _ in range(3):
+        without = min(without, _deposit_latency(NullMetrics(), args.deposits))
+        with_metrics = min(
+            with_metrics, _deposit_latency(Metrics(), args.deposits)
+        )
+    print()
+    print(f"deposit_funds p50 without metrics {without * 1e6:>9.1f} us")
+    print(f"deposit_funds p50 with metrics    {with_metrics * 1e6:>9.1f} us")
+    print(f"overhead {with_metrics / without - 1:>+34.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""
+Time of a Reconciler run over the log of a SQLite store, with
+several numbers of worker processes folding ranges of the log.
+Each account has a number of credits and debits, and one in ten
+has an overdraft limit that it uses.
+
+    python -m benchmarks.bench_reconciliation
+    python -m benchmarks.bench_reconciliation --accounts 100000 \
+        --events-per-account 10 --workers 1,2,4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, List, Tuple
+from uuid import NAMESPACE_URL, uuid5
+
+from banking.applicationmodel import Bank, NewAccount
+from banking.domainmodel import Account
+from banking.reconciliation import Reconciler
+
+
+def _new_accounts(accounts: int) -> Iterator[NewAccount]:
+    for i in range(accounts):
+        yield NewAccount(f"Saver {i}", f"saver{i}@example.com", "pw")
+
+
+def _setup(
+    app: Bank, accounts: int, events_per_account: int, batch_size: int
+) -> None:
+    app.open_accounts_bulk(_new_accounts(accounts), batch_size=batch_size)
+    # Events are saved directly, as the accrual saves them, so
+    # that setting up a large log takes seconds too.
+    events: List[Account.Event] = []
+    for i, new_account in enumerate(_new_accounts(accounts)):
+        account_id = uuid5(NAMESPACE_URL, new_account.email_address)
+        version = 1
+        overdrawn = i % 10 == 0
+        if overdrawn:
+            version += 1
+            events.append(
+                Account.OverdraftLimitChanged(
+                    originator_id=account_id,
+                    originator_version=version,
+                    timestamp=Account.Event.create_timestamp(),
+                    account_id=account_id,
+                    amount_in_cents=50_000,
+                )
+            )
+        for j in range(events_per_account):
+            version += 1
+            event_class = Account.Debited if j % 2 else Account.Credited
+            events.append(
+                event_class(
+                    originator_id=account_id,
+                    originator_version=version,
+                    timestamp=Account.Event.create_timestamp(),
+                    amount_in_cents=1_100 if j % 2 and overdrawn else 1_000,
+                )
+            )
+        if len(events) >= batch_size:
+            app.save(*events)
+            events = []
+    app.save(*events)
+
+
+def run(
+    accounts: int,
+    events_per_account: int,
+    workers: List[int],
+    batch_size: int,
+    balance_view: bool,
+) -> Tuple[int, List[Dict[str, float]]]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = {
+            "PASSWORD_HASHER": "sha512",
+            "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+            "SQLITE_DBNAME": os.path.join(tmpdir, "bank.db"),
+        }
+        if balance_view:
+            env["BALANCE_VIEW"] = "y"
+        app = Bank(env=env)
+        _setup(app, accounts, events_per_account, batch_size)
+        notifications = app.recorder.max_notification_id()
+        rows = []
+        for count in workers:
+            started = time.perf_counter()
+            fold = Reconciler(app, workers=count).fold(notifications)
+            fold_seconds = time.perf_counter() - started
+            report = Reconciler(app, workers=count).run()
+            # Overdrawn accounts go below zero only within their limits.
+            assert report.ok, report.discrepancies[:1]
+            assert report.accounts == accounts
+            assert len(fold.accounts) == accounts
+            rows.append(
+                {
+                    "workers": count,
+                    "fold_seconds": fold_seconds,
+                    "seconds": report.seconds,
+                    "notifications_per_second": notifications / fold_seconds,
+                }
+            )
+        app.close()
+    return notifications, rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--accounts", type=int, default=20_000)
+    parser.add_argument("--events-per-account", type=int, default=10)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--balance-view",
+        action="store_true",
+        help="compare with a balance read model rather than the accounts",
+    )
+    args = parser.parse_args()
+    notifications, rows = run(
+        args.accounts,
+        args.events_per_account,
+        [int(w) for w in args.workers.split(",")],
+        args.batch_size,
+        args.balance_view,
+    )
+    print(f"{notifications} notifications, {os.cpu_count()} cores")
+    print(
+        f"{'workers':>8} {'fold s':>8} {'total s':>8} {'notifications/s':>16}"
+    )
+    for row in rows:
+        print(
+            f"{row['workers']:>8} {row['fold_seconds']:>8.2f}"
+            f" {row['seconds']:>8.2f} {row['notifications_per_second']:>16.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Account load time against history length, with and without snapshots.
+
+    python -m benchmarks.bench_snapshotting
+    PERSISTENCE_MODULE=eventsourcing.sqlite SQLITE_DBNAME=:memory: \
+        python -m benchmarks.bench_snapshotting --lengths 100 1000 10000
+"""
+
+import argparse
+import time
+from typing import Dict, List
+from uuid import UUID
+
+from banking.applicationmodel import Bank
+
+
+def _account_with_history(app: Bank, email_address: str, length: int) -> UUID:
+    account_id = app.open_account("Bench", email_address, "bench")
+    account = app.get_account(account_id)
+    for _ in range(length):
+        account.credit(1)
+    app.save(account)
+    return account_id
+
+
+def _time_loads(app: Bank, account_id: UUID, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        app.get_account(account_id)
+    return (time.perf_counter() - started) / repeat
+
+
+def run(lengths: List[int], repeat: int) -> List[Dict[str, float]]:
+    results = []
+    for length in lengths:
+        plain = Bank()
+        plain_id = _account_with_history(plain, "plain@example.com", length)
+        snapshotted = Bank(env={"IS_SNAPSHOTTING_ENABLED": "y"})
+        snapshot_id = _account_with_history(
+            snapshotted, "snapshot@example.com", length
+        )
+        snapshotted.take_snapshot(snapshot_id)
+        results.append(
+            {
+                "history_length": length,
+                "without_snapshot_ms": (
+                    _time_loads(plain, plain_id, repeat) * 1e3
+                ),
+                "with_snapshot_ms": (
+                    _time_loads(snapshotted, snapshot_id, repeat) * 1e3
+                ),
+            }
+        )
+        plain.close()
+        snapshotted.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[10, 100, 1000, 10000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(
+        f"{'events':>10} {'replay ms':>12} {'snapshot ms':>12} {'speedup':>8}"
+    )
+    for row in run(args.lengths, args.repeat):
+        print(
+            f"{row['history_length']:>10} "
+            f"{row['without_snapshot_ms']:>12.3f} "
+            f"{row['with_snapshot_ms']:>12.3f} "
+            f"{row['without_snapshot_ms'] / row['with_snapshot_ms']:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
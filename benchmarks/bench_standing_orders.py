@@ -0,0 +1,140 @@
+# coding=utf-8
+"""
+Throughput of a StandingOrderScheduler run over many due
+standing orders, with several numbers of worker threads. Some
+payers can't pay, and some payees are closed, so that failed
+orders are part of the run.
+
+    python -m benchmarks.bench_standing_orders
+    python -m benchmarks.bench_standing_orders --orders 10000 --payers 100 \
+        --workers 1,4,8 --persistence-module eventsourcing.sqlite
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from banking.applicationmodel import Bank
+from banking.scheduling import StandingOrderScheduler
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DAY = 24 * 60 * 60
+
+
+def _setup(
+    app: Bank, orders: int, payers: int, payees: int, runs: int
+) -> Tuple[int, float]:
+    payer_ids: List[UUID] = [
+        app.open_account("Payer", f"payer{i}@example.com", "pw")
+        for i in range(payers)
+    ]
+    payee_ids: List[UUID] = [
+        app.open_account("Payee", f"payee{i}@example.com", "pw")
+        for i in range(payees)
+    ]
+    per_payer = -(-orders // payers)
+    # One payer in twenty is left without funds.
+    for i, payer_id in enumerate(payer_ids):
+        if i % 20:
+            app.deposit_funds(payer_id, per_payer * 100 * runs)
+    started = time.perf_counter()
+    for i in range(orders):
+        app.create_standing_order(
+            payer_ids[i % payers], payee_ids[i % payees], 100, DAY, START
+        )
+    created_seconds = time.perf_counter() - started
+    # One payee in a hundred closes, and its orders are cancelled.
+    for payee_id in payee_ids[::100]:
+        app.close_account(payee_id)
+    return orders, created_seconds
+
+
+def run(
+    orders: int,
+    payers: int,
+    payees: int,
+    workers: List[int],
+    batch_size: int,
+    persistence_module: str,
+    cache_maxsize: str,
+) -> Tuple[float, List[Dict[str, float]]]:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": persistence_module,
+    }
+    if cache_maxsize:
+        env["AGGREGATE_CACHE_MAXSIZE"] = cache_maxsize
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if persistence_module == "eventsourcing.sqlite":
+            env["SQLITE_DBNAME"] = os.path.join(tmpdir, "bank.db")
+        app = Bank(env=env)
+        created, created_seconds = _setup(
+            app, orders, payers, payees, len(workers)
+        )
+        rows = []
+        # Every order is due again at each run, a day later.
+        for i, count in enumerate(workers):
+            scheduler = StandingOrderScheduler(
+                app, workers=count, batch_size=batch_size
+            )
+            result = scheduler.run_once(START + timedelta(days=i))
+            rows.append(
+                {
+                    "workers": count,
+                    "due": result.due,
+                    "executed": result.executed,
+                    "failed": result.failed,
+                    "deferred": result.deferred,
+                    "seconds": result.seconds,
+                    "orders_per_second": result.orders_per_second,
+                }
+            )
+        app.close()
+    return created / created_seconds, rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--payers", type=int, default=1000)
+    parser.add_argument("--payees", type=int, default=5000)
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--persistence-module", default="eventsourcing.popo")
+    parser.add_argument(
+        "--cache-maxsize",
+        default="",
+        help="cache this many accounts and orders (0 is unbounded)",
+    )
+    args = parser.parse_args()
+    created_per_second, rows = run(
+        args.orders,
+        args.payers,
+        args.payees,
+        [int(w) for w in args.workers.split(",")],
+        args.batch_size,
+        args.persistence_module,
+        args.cache_maxsize,
+    )
+    print(f"orders created: {created_per_second:.0f}/s")
+    print(
+        f"{'workers':>8} {'due':>8} {'executed':>9} {'failed':>7}"
+        f" {'deferred':>9} {'seconds':>8} {'orders/s':>9}"
+    )
+    for row in rows:
+        print(
+            f"{row['workers']:>8} {row['due']:>8} {row['executed']:>9}"
+            f" {row['failed']:>7} {row['deferred']:>9}"
+            f" {row['seconds']:>8.2f} {row['orders_per_second']:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# coding=utf-8
+"""
+Cold start of the API: the time to import banking.api, to create its
+app, which imports Flask and the Bank, and to answer the first
+request, which constructs the Bank, each measured in a new
+interpreter. The first request is measured again against a SQLite
+store of --accounts accounts, with a credit and a debit each, as the
+Bank catches its read models up with the log when it is constructed.
+The medians are checked against budgets, and the run exits 1 if any
+of them is over its budget, so that a change that makes startup
+slower fails.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 20 --import-budget-ms 50 \
+        --persistence-module eventsourcing.sqlite --importtime
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Iterator, List, Tuple
+from uuid import NAMESPACE_URL, uuid5
+
+from banking.applicationmodel import Bank, NewAccount
+from banking.domainmodel import Account
+
+# Run in the new interpreter, which prints its timings as JSON.
+CHILD = """
+import json
+from time import perf_counter
+
+started = perf_counter()
+import banking.api
+imported = perf_counter()
+client = banking.api.create_app().test_client()
+created = perf_counter()
+assert client.get("/api/v1/ready").status_code == 200
+first = perf_counter()
+client.get("/api/v1/ready")
+second = perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1e3,
+    "create_app_ms": (created - imported) * 1e3,
+    "first_request_ms": (first - created) * 1e3,
+    "second_request_ms": (second - first) * 1e3,
+}))
+"""
+
+
+def _child_env(
+    persistence_module: str, tmpdir: str, db_name: str = "bank.db"
+) -> Dict[str, str]:
+    env = dict(
+        os.environ,
+        PASSWORD_HASHER="sha512",
+        PERSISTENCE_MODULE=persistence_module,
+    )
+    if persistence_module == "eventsourcing.sqlite":
+        env["SQLITE_DBNAME"] = os.path.join(tmpdir, db_name)
+    return env
+
+
+def _new_accounts(accounts: int) -> Iterator[NewAccount]:
+    for i in range(accounts):
+        yield NewAccount(f"Saver {i}", f"saver{i}@example.com", "pw")
+
+
+def populate(env: Dict[str, str], accounts: int) -> int:
+    """
+    Opens the accounts, with a credit and a debit each, and
+    returns the number of events recorded.
+    """
+    app = Bank(env=env)
+    app.open_accounts_bulk(_new_accounts(accounts))
+    # Saved directly, as the accrual saves them, so that
+    # setting up a large store takes seconds too.
+    events: List[Account.Event] = []
+    for new_account in _new_accounts(accounts):
+        account_id = uuid5(NAMESPACE_URL, new_account.email_address)
+        for version, event_class in (
+            (2, Account.Credited),
+            (3, Account.Debited),
+        ):
+            events.append(
+                event_class(
+                    originator_id=account_id,
+                    originator_version=version,
+                    timestamp=Account.Event.create_timestamp(),
+                    amount_in_cents=1_000,
+                )
+            )
+        if len(events) >= 10_000:
+            app.save(*events)
+            events = []
+    app.save(*events)
+    count = app.recorder.max_notification_id()
+    app.close()
+    return count
+
+
+def run(
+    runs: int, persistence_module: str, accounts: int = 0
+) -> Dict[str, float]:
+    samples: Dict[str, List[float]] = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stores = [("", _child_env(persistence_module, tmpdir))]
+        if accounts:
+            env = _child_env("eventsourcing.sqlite", tmpdir, "populated.db")
+            populate(env, accounts)
+            stores.append(("populated_", env))
+        for _ in range(runs):
+            for prefix, env in stores:
+                output = subprocess.run(
+                    [sys.executable, "-c", CHILD],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                for name, value in json.loads(output).items():
+                    samples.setdefault(prefix + name, []).append(value)
+    return {
+        name: statistics.median(values) for name, values in samples.items()
+    }
+
+
+def slowest_imports(count: int) -> List[Tuple[float, str]]:
+    """
+    The modules imported directly by banking.api that took
+    longest to import, with what they imported in turn.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import banking.api"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        # Two spaces deeper than banking.api itself.
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(cumulative) / 1e3, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--persistence-module", default="eventsourcing.popo")
+    parser.add_argument(
+        "--accounts",
+        type=int,
+        default=10_000,
+        help="accounts of the populated store, none to skip it",
+    )
+    parser.add_argument("--import-budget-ms", type=float, default=50.0)
+    parser.add_argument(
+        "--first-request-budget-ms",
+        type=float,
+        default=400.0,
+        help="for creating the app and answering its first request",
+    )
+    parser.add_argument(
+        "--populated-first-request-budget-ms",
+        type=float,
+        default=350.0,
+        help="for answering the first request with the populated store",
+    )
+    parser.add_argument("--output", help="write the medians to this JSON file")
+    parser.add_argument(
+        "--importtime",
+        action="store_true",
+        help="also list the slowest imports of banking.api",
+    )
+    args = parser.parse_args()
+    result = run(args.runs, args.persistence_module, args.accounts)
+    for name, value in result.items():
+        print(f"{name:>28} {value:>9.1f}")
+    if args.importtime:
+        for milliseconds, name in slowest_imports(10):
+            print(f"{milliseconds:>9.1f} ms  {name}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    over = []
+    if result["import_ms"] > args.import_budget_ms:
+        over.append(f"import {result['import_ms']:.1f}ms")
+    first_request_ms = result["create_app_ms"] + result["first_request_ms"]
+    if first_request_ms > args.first_request_budget_ms:
+        over.append(f"first request {first_request_ms:.1f}ms")
+    populated_ms = result.get("populated_first_request_ms", 0.0)
+    if populated_ms > args.populated_first_request_budget_ms:
+        over.append(f"first request when populated {populated_ms:.1f}ms")
+    if over:
+        print(f"over budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""
+On-disk size, save throughput and account load time of the event
+transcoders, on SQLite: the default JSON transcoder, the compact
+binary one, and the compact one with zlib compression of larger
+events.
+
+    python -m benchmarks.bench_transcoding
+    python -m benchmarks.bench_transcoding --accounts 50 --events 2000 \
+        --compression-threshold 64
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List
+from uuid import UUID, uuid4
+
+from banking.applicationmodel import Bank
+
+
+def _size(dbname: str) -> int:
+    return sum(
+        os.path.getsize(path)
+        for path in (dbname, dbname + "-wal")
+        if os.path.exists(path)
+    )
+
+
+def _run_one(
+    env: Dict[str, str], dbname: str, accounts: int, events: int, repeat: int
+) -> Dict[str, float]:
+    app = Bank(
+        env={
+            "PASSWORD_HASHER": "sha512",
+            "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+            "SQLITE_DBNAME": dbname,
+            **env,
+        }
+    )
+    account_ids: List[UUID] = [
+        app.open_account("Bench", f"bench{i}@example.com", "bench")
+        for i in range(accounts)
+    ]
+    for account_id in account_ids:
+        app.deposit_funds(account_id, 1_000_000)
+    loaded = [app.get_account(account_id) for account_id in account_ids]
+
+    # One event per save, deposits and transfers, as the API does.
+    started = time.perf_counter()
+    for i in range(events):
+        account = loaded[i % accounts]
+        if i % 4:
+            account.credit(100)
+        else:
+            account.transfer_validation(uuid4(), 1, uuid4())
+        app.save(account)
+    save_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for account_id in account_ids:
+            app.repository.get(account_id)
+    load_seconds = (time.perf_counter() - started) / repeat / accounts
+
+    recorded = events + 2 * accounts
+    state_bytes = sum(
+        len(notification.state)
+        for notification in app.recorder.select_notifications(1, recorded)
+    )
+    app.close()
+    return {
+        "state_bytes_per_event": state_bytes / recorded,
+        "file_kib": _size(dbname) / 1024,
+        "saves_per_second": events / save_seconds,
+        "load_ms": load_seconds * 1e3,
+    }
+
+
+def run(
+    accounts: int, events: int, repeat: int, compression_threshold: int
+) -> Dict[str, Dict[str, float]]:
+    configs = {
+        "json": {},
+        "compact": {"EVENT_TRANSCODER": "compact"},
+        "compact+zlib": {
+            "EVENT_TRANSCODER": "compact",
+            "EVENT_COMPRESSION_THRESHOLD": str(compression_threshold),
+        },
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, env in configs.items():
+            dbname = os.path.join(tmpdir, f"{name}.db")
+            results[name] = _run_one(env, dbname, accounts, events, repeat)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compression-threshold", type=int, default=128)
+    args = parser.parse_args()
+    results = run(
+        args.accounts, args.events, args.repeat, args.compression_threshold
+    )
+    print(
+        f"{'transcoder':>14} {'bytes/event':>12} {'file KiB':>10}"
+        f" {'saves/s':>10} {'load ms':>10}"
+    )
+    for name, row in results.items():
+        print(
+            f"{name:>14} {row['state_bytes_per_event']:>12.1f}"
+            f" {row['file_kib']:>10.1f} {row['saves_per_second']:>10.0f}"
+            f" {row['load_ms']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# coding=utf-8
+"""
+Load generator for the banking API. Simulates concurrent users who each
+sign up, log in, and then make a mix of deposits, withdrawals, transfers
+and balance reads, and reports throughput, error rates and latency
+histograms per endpoint.
+
+Runs against the Flask app in this process by default, or against a
+live server with --url.
+
+    python -m benchmarks.loadgen --users 20 --requests 50
+    python -m benchmarks.loadgen --url http://127.0.0.1:5000 --users 50 \\
+        --mix deposit=4,withdraw=2,transfer=2,balance=10 --json results.json
+"""
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.stats import LatencyHistogram
+
+API_V1_PREFIX = "/api/v1"
+DEFAULT_MIX = "deposit=4,withdraw=2,transfer=2,balance=10"
+
+
+class Client(ABC):
+    @abstractmethod
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None,
+        token: Optional[str] = None,
+    ) -> Tuple[int, Any]:
+        pass
+
+    @staticmethod
+    def headers(token: Optional[str]) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+
+class FlaskClient(Client):
+    """Requests the Flask app in this process."""
+
+    def __init__(self) -> None:
+        from banking.api import app
+
+        self.client = app.test_client()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None,
+        token: Optional[str] = None,
+    ) -> Tuple[int, Any]:
+        response = self.client.open(
+            API_V1_PREFIX + path,
+            method=method,
+            data=json.dumps(body) if body is not None else None,
+            headers=self.headers(token),
+        )
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient(Client):
+    """Requests a live server, on one kept-alive connection."""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/") + API_V1_PREFIX
+        self.connection: Optional[http.client.HTTPConnection] = None
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None,
+        token: Optional[str] = None,
+    ) -> Tuple[int, Any]:
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=30
+                )
+            try:
+                self.connection.request(
+                    method,
+                    self.prefix + path,
+                    body=json.dumps(body) if body is not None else None,
+                    headers=self.headers(token),
+                )
+                response = self.connection.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed the kept-alive connection.
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+            try:
+                return response.status, json.loads(data)
+            except ValueError:
+                return response.status, None
+        raise AssertionError("unreachable")
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.statuses: Dict[int, int] = {}
+        self.latency = LatencyHistogram()
+
+    def record(self, status: int, seconds: float) -> None:
+        self.requests += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status >= 400:
+            self.errors += 1
+        self.latency.record(seconds)
+
+    def merge(self, other: "EndpointStats") -> None:
+        self.requests += other.requests
+        self.errors += other.errors
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency.merge(other.latency)
+
+
+class User:
+    """
+    One simulated user. Keeps its own stats, so users don't
+    contend on shared counters while the load is running.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        account_ids: List[str],
+        lock: threading.Lock,
+        rng: random.Random,
+    ):
+        self.client = client
+        self.account_ids = account_ids
+        self.lock = lock
+        self.rng = rng
+        self.stats: Dict[str, EndpointStats] = {}
+        self.token: Optional[str] = None
+        self.account_id: Optional[str] = None
+
+    def call(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[int, Any]:
+        started = time.perf_counter()
+        try:
+            status, data = self.client.request(method, path, body, self.token)
+        except OSError:
+            status, data = 599, None
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        stats.record(status, time.perf_counter() - started)
+        return status, data
+
+    def start(self, run_id: str, index: int) -> bool:
+        email_address = f"load-{run_id}-{index}@example.com"
+        password = f"password-{index}"
+        status, data = self.call(
+            "signup",
+            "POST",
+            "/signup",
+            {
+                "full_name": f"Load {index}",
+                "email_address": email_address,
+                "password": password,
+            },
+        )
+        if status != 201:
+            return False
+        self.account_id = data["account_id"]
+        status, data = self.call(
+            "auth",
+            "POST",
+            "/auth",
+            {"email_address": email_address, "password": password},
+        )
+        if status != 200:
+            return False
+        self.token = data["access_token"]
+        with self.lock:
+            self.account_ids.append(str(self.account_id))
+        return True
+
+    def act(self, action: str) -> None:
+        if action == "deposit":
+            self.call(
+                "deposit",
+                "POST",
+                "/deposit",
+                {"amount": self.rng.randint(100, 1000)},
+            )
+        elif action == "withdraw":
+            self.call(
+                "withdraw",
+                "POST",
+                "/withdraw",
+                {"amount": self.rng.randint(1, 100)},
+            )
+        elif action == "transfer":
+            with self.lock:
+                to_account_id = self.rng.choice(self.account_ids)
+            if to_account_id == self.account_id:
+                return
+            self.call(
+                "transfer",
+                "POST",
+                "/transfer",
+                {
+                    "to_account_id": to_account_id,
+                    "amount": self.rng.randint(1, 100),
+                },
+            )
+        elif action == "balance":
+            self.call("balance", "GET", "/account/balance")
+        else:
+            raise ValueError(f"Unknown action {action!r}")
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        action, _, weight = item.partition("=")
+        weights[action.strip()] = int(weight)
+    return weights
+
+
+def run(
+    client_factory: Any,
+    users: int,
+    requests: int,
+    mix: Dict[str, int],
+    seed: int = 0,
+) -> Dict[str, Any]:
+    run_id = uuid.uuid4().hex[:8]
+    account_ids: List[str] = []
+    lock = threading.Lock()
+    actions = list(mix)
+    weights = [mix[a] for a in actions]
+
+    def simulate(index: int) -> Dict[str, EndpointStats]:
+        user = User(
+            client_factory(), account_ids, lock, random.Random(seed + index)
+        )
+        if user.start(run_id, index):
+            # Fund the account, so most withdrawals and transfers succeed.
+            user.act("deposit")
+            for action in user.rng.choices(actions, weights, k=requests):
+                user.act(action)
+        return user.stats
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(users) as executor:
+        per_user = list(executor.map(simulate, range(users)))
+    elapsed = time.perf_counter() - started
+
+    endpoints: Dict[str, EndpointStats] = {}
+    for stats in per_user:
+        for endpoint, endpoint_stats in stats.items():
+            endpoints.setdefault(endpoint, EndpointStats()).merge(
+                endpoint_stats
+            )
+    total = EndpointStats()
+    for endpoint_stats in endpoints.values():
+        total.merge(endpoint_stats)
+
+    def report(stats: EndpointStats) -> Dict[str, Any]:
+        return {
+            "requests": stats.requests,
+            "errors": stats.errors,
+            "error_rate": (
+                stats.errors / stats.requests if stats.requests else 0.0
+            ),
+            "requests_per_second": stats.requests / elapsed,
+            "statuses": {str(k): v for k, v in sorted(stats.statuses.items())},
+            **stats.latency.distribution(),
+        }
+
+    return {
+        "users": users,
+        "requests_per_user": requests,
+        "mix": mix,
+        "elapsed_seconds": elapsed,
+        "endpoints": {e: report(s) for e, s in sorted(endpoints.items())},
+        "total": report(total),
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['users']} users, {result['total']['requests']} requests"
+        f" in {result['elapsed_seconds']:.1f}s"
+        f" ({result['total']['requests_per_second']:.0f} requests/s)"
+    )
+    print(
+        f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>8}"
+        f" {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'p99.9 ms':>9}"
+        f" {'max ms':>8}"
+    )
+    rows = list(result["endpoints"].items()) + [("total", result["total"])]
+    for endpoint, row in rows:
+        print(
+            f"{endpoint:<10} {row['requests']:>9} {row['error_rate']:>7.1%}"
+            f" {row['requests_per_second']:>8.0f} {row['p50_ms']:>8.2f}"
+            f" {row['p90_ms']:>8.2f} {row['p99_ms']:>8.2f}"
+            f" {row['p99.9_ms']:>9.2f} {row['max_ms']:>8.2f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--url", help="base URL of a live server")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=50,
+        help="requests per user after login",
+    )
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help="weights of the actions of each user",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=None,
+        help="exit 1 if the overall error rate is higher",
+    )
+    args = parser.parse_args(argv)
+
+    url = args.url
+    result = run(
+        (lambda: HTTPClient(url)) if url else FlaskClient,
+        args.users,
+        args.requests,
+        parse_mix(args.mix),
+        args.seed,
+    )
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if (
+        args.max_error_rate is not None
+        and result["total"]["error_rate"] > args.max_error_rate
+    ):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Latency statistics shared by the benchmarks.
+"""
+
+import math
+from typing import Dict, Sequence
+
+
+def percentile(samples: Sequence[float], p: float) -> float:
+    """
+    The p-th percentile of the samples, by the nearest-rank
+    method, so it is always one of the samples.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: Sequence[float], elapsed: float) -> Dict[str, float]:
+    """
+    Throughput and latency percentiles, in milliseconds, of
+    operations that took `latencies` seconds each and
+    `elapsed` seconds in all.
+    """
+    return {
+        "count": len(latencies),
+        "ops_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p95_ms": percentile(latencies, 95) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "max_ms": max(latencies, default=0.0) * 1e3,
+    }
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in buckets about 1% wide, in the manner
+    of an HdrHistogram with two significant digits, so that
+    percentiles of any number of samples are kept in a small,
+    fixed amount of memory, and histograms kept by separate
+    threads can be merged.
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.base = 1 + precision
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        bucket = int(math.log(max(seconds * 1e6, 1.0), self.base))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> float:
+        """The upper edge, in seconds, of the bucket of the p-th percentile."""
+        rank = max(1, math.ceil(p / 100 * self.total))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.base ** (bucket + 1) / 1e6, self.max)
+        return 0.0
+
+    def distribution(
+        self, percentiles: Sequence[float] = (50, 75, 90, 95, 99, 99.9)
+    ) -> Dict[str, float]:
+        """Latency in milliseconds at each of the percentiles, and the max."""
+        result = {f"p{p:g}_ms": self.percentile(p) * 1e3 for p in percentiles}
+        result["max_ms"] = self.max * 1e3
+        return result
@@ -3,6 +3,7 @@
 
 import logging
 import os
+import sys
 
 logging.basicConfig(
     format=os.getenv(
@@ -12,7 +13,7 @@ logging.basicConfig(
     force=True,
 )
 
-from banking.api import app as bankingapi
+from banking.serving import main
 
 if __name__ == "__main__":
-    bankingapi.run(debug=True)
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Fixtures shared by the banking tests."""
+
+import json
+import typing
+from uuid import UUID
+
+import pytest
+
+from banking.applicationmodel import Bank
+
+API_V1_PREFIX = "/api/v1"
+CONTENT_TYPE = "application/json"
+
+
+@pytest.fixture
+def make_bank() -> typing.Callable[..., Bank]:
+    """Constructs banks with the cheap password hasher."""
+
+    def make_bank(**env: str) -> Bank:
+        return Bank(env={"PASSWORD_HASHER": "sha512", **env})
+
+    return make_bank
+
+
+@pytest.fixture
+def open_account() -> typing.Callable[..., UUID]:
+    """Opens an account named after its holder, with optional deposits."""
+
+    def open_account(app: Bank, name: str, deposits: int = 0) -> UUID:
+        account_id = app.open_account(
+            full_name=name,
+            email_address=f"{name}@example.com",
+            password=name,
+        )
+        for _ in range(deposits):
+            app.deposit_funds(account_id, 100)
+        return account_id
+
+    return open_account
+
+
+@pytest.fixture
+def signup_and_login() -> typing.Callable[[typing.Any, str], str]:
+    """Signs up through the API and returns an access token."""
+
+    def signup_and_login(client: typing.Any, email_address: str) -> str:
+        response = client.post(
+            API_V1_PREFIX + "/signup",
+            data=json.dumps(
+                {
+                    "full_name": email_address,
+                    "email_address": email_address,
+                    "password": "secret",
+                }
+            ),
+            content_type=CONTENT_TYPE,
+        )
+        assert response.status_code == 201
+        response = client.post(
+            API_V1_PREFIX + "/auth",
+            data=json.dumps(
+                {"email_address": email_address, "password": "secret"}
+            ),
+            content_type=CONTENT_TYPE,
+        )
+        assert response.status_code == 200
+        return str(response.json["access_token"])
+
+    return signup_and_login
@@ -0,0 +1,232 @@
+# coding=utf-8
+
+import typing
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pytest
+from eventsourcing.persistence import IntegrityError
+
+from banking.accrual import AccountLedger, AccrualEngine
+from banking.applicationmodel import Bank
+from banking.cli import main
+from banking.domainmodel import Account, InterestAccrual
+
+DAY = date(2024, 1, 1)
+
+
+def test_account_ledger(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    sue = app.open_account("Sue", "sue@example.com", "sue")
+    app.deposit_funds(alice, 500)
+    app.set_overdraft_limit(bob, 100)
+    app.transfer_funds(bob, alice, 60)
+    app.close_account(sue)
+    app.shard_account(alice, 2)
+    app.deposit_funds(alice, 40)
+
+    # Arrays that are full grow as accounts are opened.
+    ledger = AccountLedger(app, capacity=1)
+    ledger.pull()
+    assert len(ledger) == 3
+    assert ledger.account_ids == [alice, bob, sue]
+    # The credit held by a shard of alice is kept apart.
+    assert ledger.balances[:3].tolist() == [560, -60, 0]
+    assert ledger.shard_balances[:3].tolist() == [40, 0, 0]
+    assert ledger.overdraft_limits[:3].tolist() == [0, 100, 0]
+    assert ledger.is_closed[:3].tolist() == [False, False, True]
+    assert ledger.versions[:3].tolist() == [
+        app.get_account(a).version for a in (alice, bob, sue)
+    ]
+
+    app.sweep_account(alice)
+    ledger.pull()
+    assert (ledger.balances[0], ledger.shard_balances[0]) == (600, 0)
+
+
+def test_accrual(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    saver = app.open_account("Saver", "saver@example.com", "saver")
+    debtor = app.open_account("Debtor", "debtor@example.com", "debtor")
+    spender = app.open_account("Spender", "spender@example.com", "spender")
+    closed = app.open_account("Closed", "closed@example.com", "closed")
+    app.deposit_funds(saver, 366_00)
+    app.set_overdraft_limit(debtor, 10_000)
+    app.withdraw_funds(debtor, 3700)
+    app.set_overdraft_limit(spender, 1000)
+    app.withdraw_funds(spender, 995)
+    app.deposit_funds(closed, 365_00)
+    app.close_account(closed)
+
+    engine = AccrualEngine(app, batch_size=3)
+    report = engine.run(DAY, 0.1, 3.65)
+    assert (report.accounts, report.credited, report.debited) == (4, 1, 2)
+    # The fee of the spender is capped at what is left of the
+    # overdraft, and the closed account accrues nothing.
+    assert (report.interest_in_cents, report.fees_in_cents) == (10, 42)
+    assert app.get_balance(saver) == 366_10
+    assert app.get_balance(debtor) == -3737
+    assert app.get_balance(spender) == -1000
+    assert app.get_balance(closed) == 365_00
+    assert app.get_transactions(saver).entries[0].amount_in_cents == 10
+    accrual = app.repository.get(InterestAccrual.create_id("2024-01-01"))
+    assert (accrual.accounts, accrual.posted) == (4, 4)
+
+    # A day is accrued once, with the rates it started with.
+    report = engine.run(DAY, 0.1, 3.65)
+    assert (report.credited, report.debited) == (0, 0)
+    assert app.get_balance(saver) == 366_10
+    with pytest.raises(ValueError):
+        engine.run(DAY, 0.2, 3.65)
+
+    with pytest.raises(ValueError):
+        AccrualEngine(app, batch_size=0)
+
+
+def test_accrual_with_balance_view(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank(BALANCE_VIEW="y")
+    saver = app.open_account("Saver", "saver@example.com", "saver")
+    debtor = app.open_account("Debtor", "debtor@example.com", "debtor")
+    app.deposit_funds(saver, 366_00)
+    app.set_overdraft_limit(debtor, 10_000)
+    app.withdraw_funds(debtor, 3700)
+
+    report = AccrualEngine(app).run(DAY, 0.1, 3.65)
+    assert (report.interest_in_cents, report.fees_in_cents) == (10, 37)
+    assert app.get_balance(saver) == 366_10
+    assert app.get_balance(debtor) == -3737
+    app.deposit_funds(saver, 5)
+    assert app.get_balance(saver) == app.get_balance(saver, consistent=True)
+
+
+def test_accrual_of_sharded_account(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    saver = app.open_account("Saver", "saver@example.com", "saver")
+    app.set_overdraft_limit(saver, 1000_00)
+    app.shard_account(saver, 4)
+    app.withdraw_funds(saver, 500_00)
+    app.deposit_funds(saver, 10_000_00)
+    # The account is in credit with the deposit held by a shard.
+    assert app.get_account(saver).balance == -500_00
+    assert app.get_balance(saver) == 9500_00
+
+    report = AccrualEngine(app).run(DAY, 0.365, 3.65)
+    assert (report.credited, report.debited) == (1, 0)
+    assert (report.interest_in_cents, report.fees_in_cents) == (950, 0)
+    assert app.get_balance(saver) == 9509_50
+
+
+def test_accrual_is_resumed(
+    monkeypatch: pytest.MonkeyPatch, make_bank: typing.Callable[..., Bank]
+) -> None:
+    app = make_bank()
+    accounts = [
+        app.open_account(f"A{i}", f"resumed{i}@example.com", "pw")
+        for i in range(5)
+    ]
+    for account_id in accounts:
+        app.deposit_funds(account_id, 366_00)
+    save = app.save
+    saves: typing.List[int] = []
+
+    def save_then_fail(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        saves.append(1)
+        if len(saves) > 1:
+            raise RuntimeError("Stopped")
+        return save(*args, **kwargs)
+
+    monkeypatch.setattr(app, "save", save_then_fail)
+    with pytest.raises(RuntimeError):
+        AccrualEngine(app, batch_size=2).run(DAY, 0.01, 0.0)
+    monkeypatch.undo()
+
+    # Accounts opened meanwhile aren't in the accrual.
+    app.open_account("Late", "late@example.com", "pw")
+    report = AccrualEngine(app, batch_size=2).run(DAY, 0.01, 0.0)
+    assert (report.accounts, report.credited) == (5, 3)
+    assert [app.get_balance(a) for a in accounts] == [366_01] * 5
+
+
+def test_accrual_conflicts(
+    monkeypatch: pytest.MonkeyPatch, make_bank: typing.Callable[..., Bank]
+) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 365_00)
+    engine = AccrualEngine(app, attempts=2)
+    save = app.save
+
+    def deposit_then_save(*args: typing.Any) -> typing.Any:
+        # Alice moves on after the ledger has read her.
+        save(
+            Account.Credited(
+                originator_id=alice,
+                originator_version=app.get_account(alice).version + 1,
+                timestamp=Account.Event.create_timestamp(),
+                amount_in_cents=365_00,
+            )
+        )
+        return save(*args)
+
+    # The batch is computed again, from her new balance.
+    monkeypatch.setattr(app, "save", deposit_then_save)
+    with pytest.raises(IntegrityError):
+        engine.run(DAY, 0.0365, 0.0)
+    monkeypatch.undo()
+    assert app.get_balance(alice) == 1095_00
+
+    saves: typing.List[int] = []
+
+    def deposit_once_then_save(*args: typing.Any) -> typing.Any:
+        saves.append(1)
+        if len(saves) == 1:
+            return deposit_then_save(*args)
+        return save(*args)
+
+    monkeypatch.setattr(app, "save", deposit_once_then_save)
+    report = engine.run(DAY, 0.0365, 0.0)
+    monkeypatch.undo()
+    assert (report.conflicts, report.interest_in_cents) == (1, 14)
+    assert app.get_balance(alice) == 1460_14
+    assert np.all(engine.ledger.balances[:1] == [1460_00])
+
+
+def test_accrue_interest_command(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setenv("PASSWORD_HASHER", "sha512")
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 366_00)
+    app.close()
+
+    argv = [
+        "accrue-interest",
+        "--interest-rate",
+        "0.1",
+        "--overdraft-rate",
+        "1",
+    ]
+    assert main(argv + ["--day", "2024-01-01"]) == 0
+    assert capsys.readouterr().out == (
+        "2024-01-01: 1 accounts, 1 credited 10 in interest,"
+        " 0 debited 0 in fees\n"
+    )
+    assert main(argv) == 0
+    assert f"{datetime.now(timezone.utc).date()}: 1 accounts" in (
+        capsys.readouterr().out
+    )
+    argv[2] = "0.2"
+    assert main(argv + ["--day", "2024-01-01"]) == 1
+    assert "other rates" in capsys.readouterr().err
@@ -1,7 +1,12 @@
 # coding=utf-8
 """Test banking API."""
 import json
-from banking.api import app
+import typing
+
+from eventsourcing.persistence import IntegrityError
+
+from banking.api import app, bank
+from banking.concurrency import RetryPolicy
 
 API_V1_PREFIX = "/api/v1"
 CONTENT_TYPE = "application/json"
@@ -142,21 +147,19 @@ def test_open_account() -> None:
     )
     assert response_alice.status_code == 200
 
-    # get alice balance
+    # alice token is revoked with her account
     response_alice = client.get(
         API_V1_PREFIX+"/account/balance",
         headers={"Authorization": f"Bearer {token}"},
     )
-    assert response_alice.status_code == 200
-    assert response_alice.json["balance"] == str(0)
+    assert response_alice.status_code == 401
+    assert response_alice.json["msg"] == "Token has been revoked"
 
-    # get alice overdraft limit
     response_alice = client.get(
         API_V1_PREFIX+"/account/overdraft_limit",
         headers={"Authorization": f"Bearer {token}"},
     )
-    assert response_alice.status_code == 200
-    assert response_alice.json["overdraft_limit"] == str(0)
+    assert response_alice.status_code == 401
 
     # set bob overdraft limit
     data_overdraft_limit = {
@@ -184,6 +187,20 @@ def test_open_account() -> None:
     )
     assert response_bob.status_code == 200
     assert response_bob.json["message"] == "success"
+    new_token_bob = response_bob.json["access_token"]
+
+    # bob old token is revoked by the change, the new one works
+    response_bob = client.get(
+        API_V1_PREFIX+"/account/balance",
+        headers={"Authorization": f"Bearer {token_bob}"},
+    )
+    assert response_bob.status_code == 401
+    token_bob = new_token_bob
+    response_bob = client.get(
+        API_V1_PREFIX+"/account/balance",
+        headers={"Authorization": f"Bearer {token_bob}"},
+    )
+    assert response_bob.status_code == 200
 
     # fail set alice overdraft limit
     data_overdraft_limit = {
@@ -195,7 +212,7 @@ def test_open_account() -> None:
         content_type=CONTENT_TYPE,
         headers={"Authorization": f"Bearer {token}"},
     )
-    assert response_alice.status_code == 400
+    assert response_alice.status_code == 401
 
     # fail bob withdraw
     data_withdraw = {
@@ -237,3 +254,267 @@ def test_open_account() -> None:
     )
 
     assert response_alice.status_code == 401
+
+
+def test_repository_gets_per_request(
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = app.test_client()
+    token = signup_and_login(client, "carol@example.com")
+    token_dave = signup_and_login(client, "dave@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+    identity_dave = client.get(
+        API_V1_PREFIX+"/account",
+        headers={"Authorization": f"Bearer {token_dave}"},
+    ).json["identity"]
+
+    def repository_gets(
+        method: str, path: str, data: typing.Any = None
+    ) -> int:
+        bank().repository.gets.clear()
+        response = client.open(
+            API_V1_PREFIX+path,
+            method=method,
+            data=json.dumps(data) if data is not None else None,
+            content_type=CONTENT_TYPE,
+            headers=headers,
+        )
+        assert response.status_code == 200
+        return sum(bank().repository.gets.values())
+
+    assert repository_gets("GET", "/account") == 1
+    assert repository_gets("GET", "/account/balance") == 1
+    assert repository_gets("GET", "/account/overdraft_limit") == 1
+    assert repository_gets("GET", "/account/balance?consistent=true") == 1
+    assert repository_gets("POST", "/deposit", {"amount": 100}) == 1
+    assert repository_gets("POST", "/withdraw", {"amount": 10}) == 1
+    assert repository_gets(
+        "POST", "/transfer", {"amount": 10, "to_account_id": identity_dave}
+    ) == 2
+    assert repository_gets(
+        "POST", "/account/overdraft_limit", {"overdraft_limit": 100}
+    ) == 1
+    assert repository_gets(
+        "POST",
+        "/account/change_password",
+        {"old_password": "secret", "new_password": "secret"},
+    ) == 1
+
+
+def test_transfer_batch(
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = app.test_client()
+    token = signup_and_login(client, "erin@example.com")
+    token_frank = signup_and_login(client, "frank@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+    identity_frank = client.get(
+        API_V1_PREFIX+"/account",
+        headers={"Authorization": f"Bearer {token_frank}"},
+    ).json["identity"]
+
+    response = client.post(
+        API_V1_PREFIX+"/deposit",
+        data=json.dumps({"amount": 1000}),
+        content_type=CONTENT_TYPE,
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    data_batch = {
+        "transfers": [
+            {"amount": 300, "to_account_id": identity_frank},
+            {"amount": 5000, "to_account_id": identity_frank},
+            {"amount": 300, "to_account_id": identity_frank},
+        ],
+        "chunk_size": 2,
+    }
+    response = client.post(
+        API_V1_PREFIX+"/transfers/batch",
+        data=json.dumps(data_batch),
+        content_type=CONTENT_TYPE,
+        headers=headers,
+    )
+    assert response.status_code == 200
+    results = response.json["results"]
+    assert [r["message"] for r in results] == ["success", "error", "success"]
+    assert results[0]["error"] is None
+    assert results[1]["error"].startswith("Insufficient funds")
+    assert results[2]["to_account_id"] == identity_frank
+    assert results[2]["amount"] == "300"
+
+    response = client.get(API_V1_PREFIX+"/account/balance", headers=headers)
+    assert response.json["balance"] == "400"
+
+
+def test_deposit_conflict(
+    monkeypatch: typing.Any,
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = app.test_client()
+    token = signup_and_login(client, "gina@example.com")
+
+    def insert_events(*args: typing.Any, **kwargs: typing.Any) -> None:
+        raise IntegrityError()
+
+    monkeypatch.setattr(bank().recorder, "insert_events", insert_events)
+    monkeypatch.setattr(
+        bank(), "retry_policy", RetryPolicy(attempts=2, backoff=0)
+    )
+    response = client.post(
+        API_V1_PREFIX+"/deposit",
+        data=json.dumps({"amount": 100}),
+        content_type=CONTENT_TYPE,
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 409
+
+
+def test_transfer_errors(
+    monkeypatch: typing.Any,
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = app.test_client()
+    token = signup_and_login(client, "hank@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def transfer(data: typing.Any) -> typing.Any:
+        return client.post(
+            API_V1_PREFIX+"/transfer",
+            data=json.dumps(data),
+            content_type=CONTENT_TYPE,
+            headers=headers,
+        )
+
+    identity = "00000000-0000-0000-0000-000000000000"
+    for data in (
+        [],
+        {"amount": 10},
+        {"amount": "10", "to_account_id": identity},
+        {"amount": True, "to_account_id": identity},
+        {"amount": 10, "to_account_id": "nobody"},
+    ):
+        response = transfer(data)
+        assert response.status_code == 400
+        assert response.json["error"] == "Invalid transfer"
+
+    # Errors of the transfer itself are 400s, the rest are not.
+    response = transfer({"amount": 10, "to_account_id": identity})
+    assert response.status_code == 400
+    assert response.json["error"].startswith("Transfer failed: ")
+
+    def insert_events(*args: typing.Any, **kwargs: typing.Any) -> None:
+        raise IntegrityError()
+
+    token_ivy = signup_and_login(client, "ivy@example.com")
+    identity_ivy = client.get(
+        API_V1_PREFIX+"/account",
+        headers={"Authorization": f"Bearer {token_ivy}"},
+    ).json["identity"]
+    client.post(
+        API_V1_PREFIX+"/deposit",
+        data=json.dumps({"amount": 100}),
+        content_type=CONTENT_TYPE,
+        headers=headers,
+    )
+    monkeypatch.setattr(bank().recorder, "insert_events", insert_events)
+    monkeypatch.setattr(bank(), "retry_policy", RetryPolicy(attempts=1))
+    response = transfer({"amount": 0, "to_account_id": identity_ivy})
+    assert response.status_code == 400
+    response = transfer({"amount": 10, "to_account_id": identity_ivy})
+    assert response.status_code == 409
+
+
+def test_transfer_batch_validation(
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = app.test_client()
+    token = signup_and_login(client, "jack@example.com")
+    identity = "00000000-0000-0000-0000-000000000000"
+    transfer = {"amount": 10, "to_account_id": identity}
+    for data, error in (
+        ({}, "Invalid transfers"),
+        ({"transfers": []}, "Invalid transfers"),
+        ({"transfers": [transfer] * 1001}, "Invalid transfers"),
+        ({"transfers": [transfer], "chunk_size": 0}, "Invalid chunk_size"),
+        ({"transfers": [transfer], "chunk_size": "2"}, "Invalid chunk_size"),
+        ({"transfers": [transfer, {"amount": 1.5}]}, "Invalid transfer 1"),
+    ):
+        response = client.post(
+            API_V1_PREFIX+"/transfers/batch",
+            data=json.dumps(data),
+            content_type=CONTENT_TYPE,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 400
+        assert response.json["error"] == error
+    assert bank().get_transactions(bank().get_account_id_by_email(
+        "jack@example.com"
+    )).entries == []
+
+
+def test_transfer_batch_incomplete(
+    monkeypatch: typing.Any,
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = app.test_client()
+    token = signup_and_login(client, "kate@example.com")
+    token_liam = signup_and_login(client, "liam@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+    identity_liam = client.get(
+        API_V1_PREFIX+"/account",
+        headers={"Authorization": f"Bearer {token_liam}"},
+    ).json["identity"]
+    client.post(
+        API_V1_PREFIX+"/deposit",
+        data=json.dumps({"amount": 1000}),
+        content_type=CONTENT_TYPE,
+        headers=headers,
+    )
+
+    insert_events = bank().recorder.insert_events
+    errors: typing.List[typing.Optional[Exception]] = []
+
+    def insert_events_or_fail(
+        *args: typing.Any, **kwargs: typing.Any
+    ) -> typing.Any:
+        error = errors.pop(0)
+        if error is not None:
+            raise error
+        return insert_events(*args, **kwargs)
+
+    def post_batch() -> typing.Any:
+        return client.post(
+            API_V1_PREFIX+"/transfers/batch",
+            data=json.dumps(
+                {
+                    "transfers": [
+                        {"amount": 100, "to_account_id": identity_liam},
+                        {"amount": 200, "to_account_id": identity_liam},
+                    ],
+                    "chunk_size": 1,
+                }
+            ),
+            content_type=CONTENT_TYPE,
+            headers=headers,
+        )
+
+    # The response says which transfers were recorded, rather
+    # than to try them all again.
+    monkeypatch.setattr(
+        bank().recorder, "insert_events", insert_events_or_fail
+    )
+    monkeypatch.setattr(bank(), "retry_policy", RetryPolicy(attempts=1))
+    errors[:] = [None, IntegrityError()]
+    response = post_batch()
+    assert response.status_code == 409
+    assert response.json["recorded"] == 1
+    assert [r["amount"] for r in response.json["results"]] == ["100"]
+    errors[:] = [None, RuntimeError("disk full")]
+    response = post_batch()
+    assert response.status_code == 500
+    assert response.json["recorded"] == 1
+    monkeypatch.undo()
+
+    response = client.get(API_V1_PREFIX+"/account/balance", headers=headers)
+    assert response.json["balance"] == "800"
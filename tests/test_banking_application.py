@@ -1,12 +1,20 @@
 # coding=utf-8
 
 import typing
-from uuid import UUID
+from uuid import UUID, uuid4
 
 import pytest
+from eventsourcing.persistence import IntegrityError
 
-from banking.applicationmodel import Bank, AccountNotFoundError
+from banking.applicationmodel import (
+    AccountNotFoundError,
+    Bank,
+    BatchIncomplete,
+    Transfer,
+)
+from banking.concurrency import RetryPolicy
 from banking.domainmodel import (
+    Account,
     AccountClosedError,
     InsufficientFundsError,
     BadCredentials,
@@ -377,3 +385,204 @@ def test_password() -> None:
     app.validate_password(alice, "alice2")
     with pytest.raises(BadCredentials):
         app.validate_password(alice, "alice")
+
+
+def test_request_scope() -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    # Outside a request scope every load hits the repository.
+    app.repository.gets.clear()
+    app.get_balance(alice)
+    app.get_balance(alice)
+    assertEqual(app.repository.gets[alice], 2)
+
+    # Inside a request scope each account is loaded once.
+    app.repository.gets.clear()
+    with app.request_scope():
+        assertEqual(app.get_balance(alice), 20000)
+        app.deposit_funds(credit_account_id=alice, amount_in_cents=100)
+        app.transfer_funds(
+            debit_account_id=alice,
+            credit_account_id=bob,
+            amount_in_cents=100,
+        )
+        assertEqual(app.get_balance(alice), 20000)
+        assertEqual(app.get_balance(bob), 300)
+    assertEqual(app.repository.gets[alice], 1)
+    assertEqual(app.repository.gets[bob], 1)
+
+    # Each scope has its own identity map.
+    app.repository.gets.clear()
+    with app.request_scope():
+        app.get_balance(alice)
+    with app.request_scope():
+        app.get_balance(alice)
+    assertEqual(app.repository.gets[alice], 2)
+
+
+def test_request_scope_after_failures() -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    with app.request_scope():
+        # A command that fails half way leaves pending
+        # events, so the account is reloaded.
+        account = app.get_account(alice)
+        account.credit(100)
+        assert app.get_account(alice) is not account
+        assertEqual(app.get_balance(alice), 20000)
+
+        # A failed save forgets the mapped accounts.
+        account = app.get_account(alice)
+        stale = app.repository.get(bob)
+        app.deposit_funds(credit_account_id=bob, amount_in_cents=100)
+        account.credit(100)
+        stale.credit(100)
+        with pytest.raises(IntegrityError):
+            app.save(account, stale)
+        assert app.get_account(alice) is not account
+        assertEqual(app.get_balance(alice), 20000)
+        assertEqual(app.get_balance(bob), 300)
+
+    # Saving outside a request scope fails the same way.
+    stale = app.repository.get(bob)
+    app.deposit_funds(credit_account_id=bob, amount_in_cents=100)
+    stale.credit(100)
+    with pytest.raises(IntegrityError):
+        app.save(stale)
+
+
+def test_transfer_batch() -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    sue = _create_sue(app)
+    app.close_account(sue)
+    nobody = UUID("00000000-0000-0000-0000-000000000000")
+
+    app.repository.gets.clear()
+    results = app.transfer_funds_batch(
+        [
+            Transfer(alice, bob, 5000),
+            Transfer(bob, alice, 100),
+            Transfer(alice, bob, 100000),
+            Transfer(alice, nobody, 100),
+            Transfer(nobody, alice, 100),
+            Transfer(alice, alice, 100),
+            Transfer(alice, bob, -100),
+            Transfer(sue, alice, 100),
+            Transfer(alice, bob, 5000),
+        ]
+    )
+
+    # Each account was loaded once (missing accounts each time).
+    assertEqual(app.repository.gets[alice], 1)
+    assertEqual(app.repository.gets[bob], 1)
+    assertEqual(app.repository.gets[nobody], 2)
+
+    assertEqual([result.ok for result in results], [
+        True, True, False, False, False, False, False, False, True,
+    ])
+    assert isinstance(results[2].error, InsufficientFundsError)
+    assert isinstance(results[3].error, AccountNotFoundError)
+    assertEqual(results[3].error.account_id, nobody)
+    assert isinstance(results[4].error, AccountNotFoundError)
+    assert isinstance(results[5].error, TransactionError)
+    assert isinstance(results[6].error, InvalidAmount)
+    assert isinstance(results[7].error, AccountClosedError)
+    assertEqual(results[0].transfer, Transfer(alice, bob, 5000))
+
+    assertEqual(app.get_balance(alice), 10100)
+    assertEqual(app.get_balance(bob), 10100)
+
+
+def test_transfer_batch_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    # Every chunk is recorded in its own transaction.
+    notification_id = app.recorder.max_notification_id()
+    results = app.transfer_funds_batch(
+        [Transfer(alice, bob, 100) for _ in range(5)], chunk_size=2
+    )
+    assert all(result.ok for result in results)
+    assertEqual(app.recorder.max_notification_id() - notification_id, 15)
+    assertEqual(app.get_balance(alice), 19500)
+    assertEqual(app.get_balance(bob), 700)
+
+    # A chunk that conflicts is run again.
+    insert_events = app.recorder.insert_events
+    conflicts: typing.List[bool] = []
+
+    def insert_events_or_conflict(
+        *args: typing.Any, **kwargs: typing.Any
+    ) -> typing.Any:
+        if conflicts.pop(0):
+            raise IntegrityError()
+        return insert_events(*args, **kwargs)
+
+    monkeypatch.setattr(
+        app.recorder, "insert_events", insert_events_or_conflict
+    )
+    monkeypatch.setattr(
+        app, "retry_policy", RetryPolicy(attempts=2, backoff=0)
+    )
+    conflicts[:] = [False, True, False]
+    results = app.transfer_funds_batch(
+        [Transfer(alice, bob, 100), Transfer(alice, bob, 100)], chunk_size=1
+    )
+    assertEqual(conflicts, [])
+    assert all(result.ok for result in results)
+
+    # A chunk that can't be recorded fails with the results of
+    # the earlier chunks, which stay recorded.
+    conflicts[:] = [False, True, True]
+    with pytest.raises(BatchIncomplete) as excinfo:
+        app.transfer_funds_batch(
+            [Transfer(alice, bob, 100), Transfer(bob, alice, 50)], chunk_size=1
+        )
+    assertEqual(
+        [r.transfer for r in excinfo.value.results],
+        [Transfer(alice, bob, 100)],
+    )
+    assert isinstance(excinfo.value.error, IntegrityError)
+    # Nothing was recorded, so the batch can be run again as it is.
+    conflicts[:] = [True, True]
+    with pytest.raises(IntegrityError):
+        app.transfer_funds_batch([Transfer(alice, bob, 100)])
+    monkeypatch.undo()
+    assertEqual(app.get_balance(alice), 19200)
+    assertEqual(app.get_balance(bob), 1000)
+
+    with pytest.raises(ValueError):
+        app.transfer_funds_batch([Transfer(alice, bob, 100)], chunk_size=0)
+    assertEqual(app.transfer_funds_batch([]), [])
+
+
+def test_save() -> None:
+    app = Bank()
+    alice = Account(uuid4(), "Alice", "alice@example.com", "alice")
+    bob = _create_bob(app)
+    credited = Account.Credited(
+        originator_id=bob,
+        originator_version=app.get_account(bob).version + 1,
+        timestamp=Account.Event.create_timestamp(),
+        amount_in_cents=50,
+    )
+
+    # Aggregates, events, and None, are recorded in order.
+    recordings = app.save(alice, None, credited)
+    assertEqual(
+        [type(r.domain_event) for r in recordings],
+        [Account.Opened, Account.Credited],
+    )
+    assertEqual(app.get_account(alice.id).full_name, "Alice")
+    assertEqual(app.get_balance(bob), 250)
@@ -0,0 +1,138 @@
+# coding=utf-8
+
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.cache import (
+    CacheStats,
+    CountingLRUCache,
+    FIFOCache,
+    construct_cache,
+)
+
+
+def test_cache_disabled_by_default() -> None:
+    app = Bank()
+    assert app.repository.cache is None
+    assert app.repository.cache_stats is None
+
+
+def test_lru_cache(open_account: typing.Callable[..., UUID]) -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": "2"})
+    assert isinstance(app.repository.cache, CountingLRUCache)
+
+    # Saving puts accounts in the cache.
+    alice = open_account(app, "alice")
+    bob = open_account(app, "bob")
+    assert app.get_balance(alice) == 0
+    assert app.get_balance(bob) == 0
+    assert app.repository.cache_stats == CacheStats(hits=2)
+
+    # Reading alice makes bob the least recently used.
+    assert app.get_balance(alice) == 0
+    sue = open_account(app, "sue")
+    assert app.repository.cache_stats == CacheStats(hits=3, evictions=1)
+    assert app.get_balance(bob) == 0
+    assert app.repository.cache_stats == CacheStats(
+        hits=3, misses=1, evictions=2
+    )
+
+    # Commands update the cached account.
+    app.deposit_funds(credit_account_id=bob, amount_in_cents=100)
+    assert app.get_balance(bob) == 100
+    assert app.get_balance(sue) == 0
+
+    # Mutating a loaded account doesn't corrupt the cache.
+    account = app.get_account(bob)
+    account.credit(100)
+    assert app.get_balance(bob) == 100
+
+
+def test_lru_cache_counts_across_threads() -> None:
+    cache = CountingLRUCache(maxsize=8)
+    keys = [uuid4() for _ in range(16)]
+
+    def read_and_write(i: int) -> None:
+        for key in keys:
+            try:
+                cache.get(key)
+            except KeyError:
+                cache.put(key, i)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(read_and_write, range(8)))
+
+    # No count is lost to a race between the threads.
+    stats = cache.stats
+    assert stats.hits + stats.misses == 8 * 16
+    # Each eviction made room for a key put after a miss.
+    assert 0 < stats.evictions <= stats.misses - 8
+
+
+def test_fifo_cache(open_account: typing.Callable[..., UUID]) -> None:
+    app = Bank(
+        env={"AGGREGATE_CACHE_MAXSIZE": "2", "AGGREGATE_CACHE_POLICY": "FIFO"}
+    )
+    assert isinstance(app.repository.cache, FIFOCache)
+
+    alice = open_account(app, "alice")
+    bob = open_account(app, "bob")
+
+    # Reading alice doesn't save her from eviction.
+    assert app.get_balance(alice) == 0
+    open_account(app, "sue")
+    assert app.get_balance(bob) == 0
+    assert app.get_balance(alice) == 0
+    assert app.repository.cache_stats == CacheStats(
+        hits=2, misses=1, evictions=2
+    )
+
+    # Evicting explicitly.
+    cache = app.repository.cache
+    assert cache.get(alice, evict=True).id == alice
+    with pytest.raises(KeyError):
+        cache.get(alice)
+
+
+def test_unbounded_cache() -> None:
+    cache = construct_cache(0, "lru")
+    assert isinstance(cache, FIFOCache)
+    for _ in range(10):
+        cache.put(uuid4(), object())
+    assert cache.stats.evictions == 0
+    assert len(cache.cache) == 10
+
+    with pytest.raises(ValueError):
+        construct_cache(10, "random")
+
+
+def test_cache_shared_store(
+    tmp_path: Path, open_account: typing.Callable[..., UUID]
+) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "cache.db"),
+        "AGGREGATE_CACHE_MAXSIZE": "10",
+    }
+    worker1 = Bank(env=env)
+    worker2 = Bank(env=env)
+
+    alice = open_account(worker1, "alice")
+    assert worker1.get_balance(alice) == 0
+    assert worker2.get_balance(alice) == 0
+
+    # A cached account is fast-forwarded with events
+    # that another process recorded in the shared store.
+    worker2.deposit_funds(credit_account_id=alice, amount_in_cents=100)
+    assert worker1.get_balance(alice) == 100
+    worker1.withdraw_funds(debit_account_id=alice, amount_in_cents=30)
+    assert worker2.get_balance(alice) == 70
+    assert worker1.repository.cache_stats == CacheStats(hits=3)
+
+    worker1.close()
+    worker2.close()
@@ -0,0 +1,147 @@
+# coding=utf-8
+
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from eventsourcing.persistence import IntegrityError
+
+from banking.applicationmodel import Bank
+from banking.concurrency import LockStripes, RetryPolicy
+
+
+def _deposit_concurrently(
+    apps: typing.List[Bank],
+    account_id: typing.Any,
+    threads: int,
+    deposits: int,
+) -> None:
+    def deposit(i: int) -> None:
+        for _ in range(deposits):
+            apps[i % len(apps)].deposit_funds(account_id, 1)
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(deposit, range(threads)))
+
+
+def test_concurrent_deposits_are_not_lost() -> None:
+    app = Bank(
+        env={
+            "COMMAND_RETRY_ATTEMPTS": "1000",
+            "COMMAND_RETRY_BACKOFF": "0.001",
+        }
+    )
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    _deposit_concurrently([app], alice, threads=8, deposits=20)
+
+    assert app.get_balance(alice) == 160
+    assert app.retry_stats.commands == 160
+    assert app.retry_stats.exhausted == 0
+    assert (
+        app.retry_stats.attempts
+        == app.retry_stats.commands + app.retry_stats.conflicts
+    )
+
+
+def test_concurrent_deposits_across_processes(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+        "COMMAND_RETRY_ATTEMPTS": "1000",
+        "COMMAND_RETRY_BACKOFF": "0.001",
+        "ACCOUNT_LOCK_STRIPES": "16",
+    }
+    worker1 = Bank(env=env)
+    worker2 = Bank(env=env)
+    alice = worker1.open_account("Alice", "alice@example.com", "alice")
+
+    # Each worker serializes its own threads, and retries
+    # when it loses a save to the other worker.
+    _deposit_concurrently([worker1, worker2], alice, threads=8, deposits=20)
+
+    assert worker1.get_balance(alice) == 160
+    assert worker2.get_balance(alice) == 160
+    worker1.close()
+    worker2.close()
+
+
+def test_lock_stripes() -> None:
+    app = Bank(
+        env={"ACCOUNT_LOCK_STRIPES": "4", "COMMAND_RETRY_ATTEMPTS": "1"}
+    )
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 1000)
+    app.deposit_funds(bob, 1000)
+
+    # Transfers both ways take the same locks in the same
+    # order, so they neither deadlock nor conflict.
+    def transfer(i: int) -> None:
+        for _ in range(10):
+            if i % 2:
+                app.transfer_funds(alice, bob, 1)
+            else:
+                app.transfer_funds(bob, alice, 1)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(transfer, range(8)))
+
+    assert app.get_balance(alice) == 1000
+    assert app.get_balance(bob) == 1000
+    assert app.retry_stats.conflicts == 0
+
+    with pytest.raises(ValueError):
+        LockStripes(0)
+
+
+def test_retry_on_conflict() -> None:
+    app = Bank(
+        env={"COMMAND_RETRY_ATTEMPTS": "3", "COMMAND_RETRY_BACKOFF": "0"}
+    )
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert app.retry_stats.conflict_rate == 0.0
+    assert app.retry_stats.retry_rate == 0.0
+
+    insert_events = app.recorder.insert_events
+    conflicts = [IntegrityError()]
+
+    def conflicting_insert_events(
+        *args: typing.Any, **kwargs: typing.Any
+    ) -> typing.Any:
+        if conflicts:
+            raise conflicts.pop()
+        return insert_events(*args, **kwargs)
+
+    app.recorder.insert_events = conflicting_insert_events  # type: ignore
+
+    # A conflict is retried with the account reloaded.
+    with app.request_scope():
+        app.deposit_funds(alice, 100)
+    assert app.get_balance(alice) == 100
+    assert app.retry_stats.commands == 1
+    assert app.retry_stats.attempts == 2
+    assert app.retry_stats.retry_rate == 1.0
+    assert app.retry_stats.conflict_rate == 0.5
+
+    # Attempts are bounded.
+    conflicts.extend(IntegrityError() for _ in range(3))
+    with pytest.raises(IntegrityError):
+        app.withdraw_funds(alice, 100)
+    assert app.get_balance(alice) == 100
+    assert app.retry_stats.commands == 2
+    assert app.retry_stats.retried == 2
+    assert app.retry_stats.exhausted == 1
+
+    # Commands that don't conflict are not retried.
+    with pytest.raises(ValueError):
+        app.withdraw_funds(alice, -1)
+    assert app.retry_stats.attempts == 5
+
+
+def test_retry_policy_delay() -> None:
+    policy = RetryPolicy(backoff=0.01, max_backoff=0.05)
+    for attempt in range(1, 10):
+        assert 0 <= policy.delay(attempt) <= min(0.05, 0.01 * 2**attempt)
+    assert RetryPolicy(backoff=0).delay(1) == 0
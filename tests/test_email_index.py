@@ -0,0 +1,219 @@
+# coding=utf-8
+
+import json
+from pathlib import Path
+
+import pytest
+
+from banking.api import app as bankingapi
+from banking.applicationmodel import Bank, EmailAlreadyRegistered
+from banking.domainmodel import BadCredentials
+from banking.projections import EmailIndex, InMemoryEmailView, SQLiteEmailView
+from banking.utils.bloom import BloomFilter
+
+
+def test_bloom_filter() -> None:
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    added = [f"user{i}@example.com" for i in range(1000)]
+    for email_address in added:
+        bloom_filter.add(email_address)
+
+    # No false negatives, and about 1% false positives.
+    assert all(email_address in bloom_filter for email_address in added)
+    false_positives = sum(
+        f"other{i}@example.com" in bloom_filter for i in range(10000)
+    )
+    assert false_positives < 300
+
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=0)
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, error_rate=1)
+
+
+def test_email_index() -> None:
+    app = Bank()
+
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert app.email_index.lookup("alice@example.com") == alice
+
+    # Signing up twice is refused without loading the account.
+    app.repository.gets.clear()
+    with pytest.raises(EmailAlreadyRegistered):
+        app.open_account("Alice", "alice@example.com", "alice")
+
+    # Unknown emails are refused without loading an account.
+    with pytest.raises(BadCredentials):
+        app.authenticate("bob@example.com", "bob")
+    assert sum(app.repository.gets.values()) == 0
+
+    assert app.authenticate("alice@example.com", "alice") == alice
+
+
+def test_shared_in_memory_email_view() -> None:
+    app = Bank()
+    view = InMemoryEmailView()
+    index1 = EmailIndex(app, view, BloomFilter(capacity=100))
+    index2 = EmailIndex(app, view, BloomFilter(capacity=100))
+
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert index2.lookup("alice@example.com", catch_up=True) == alice
+
+    # The first index finds the view moved on, and refills its filter.
+    assert index1.get("alice@example.com") is None
+    assert index1.lookup("alice@example.com", catch_up=True) == alice
+    assert index1.position == index2.position
+
+
+def test_email_index_shared_store(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+    }
+    worker1 = Bank(env=env)
+    worker2 = Bank(env=env)
+
+    # Accounts opened by another process are found.
+    alice = worker1.open_account("Alice", "alice@example.com", "alice")
+    assert worker2.authenticate("alice@example.com", "alice") == alice
+
+    # An account opened by another process after the lookup
+    # is still refused, when the save conflicts.
+    lookup = worker2.email_index.lookup
+    worker2.email_index.lookup = lambda *args, **kwargs: None  # type: ignore
+    worker1.open_account("Bob", "bob@example.com", "bob")
+    with pytest.raises(EmailAlreadyRegistered):
+        worker2.open_account("Bob", "bob@example.com", "bob")
+    worker2.email_index.lookup = lookup  # type: ignore
+
+    # A new process rebuilds the index from the event store,
+    # when it is first looked up in.
+    worker3 = Bank(env=env)
+    assert worker3.email_index.position == 0
+    assert worker3.email_index.lookup("alice@example.com") == alice
+    assert (
+        worker3.email_index.position == worker3.recorder.max_notification_id()
+    )
+
+    worker1.close()
+    worker2.close()
+    worker3.close()
+
+
+def test_sqlite_email_index_with_bloom_filter(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+        "EMAIL_INDEX_DBNAME": str(tmp_path / "emails.db"),
+        "EMAIL_INDEX_BLOOM_CAPACITY": "1000",
+    }
+    worker1 = Bank(env=env)
+    alice = worker1.open_account("Alice", "alice@example.com", "alice")
+    assert worker1.email_index.bloom_filter is not None
+    assert "alice@example.com" in worker1.email_index.bloom_filter
+
+    # The Bloom filter answers for unknown addresses.
+    view = worker1.email_index.view
+    assert isinstance(view, SQLiteEmailView)
+    assert worker1.email_index.get("bob@example.com") is None
+    assert worker1.email_index.get_many(["bob@example.com"]) == {}
+    assert worker1.email_index.get_many(
+        ["alice@example.com", "bob@example.com"]
+    ) == {"alice@example.com": alice}
+
+    # A restarted process refills its filter from the saved view.
+    worker1.close()
+    worker1 = Bank(env=env)
+    assert worker1.email_index.get("alice@example.com") == alice
+
+    # A process sharing the view refills its filter when the
+    # view was moved on by another process.
+    worker2 = Bank(env=env)
+    bob = worker2.open_account("Bob", "bob@example.com", "bob")
+    assert worker1.email_index.get("bob@example.com") is None
+    assert worker1.email_index.lookup("bob@example.com", catch_up=True) == bob
+
+    # Addresses ruled out by the filter are answered without
+    # catching up, and logging in catches up.
+    carol = worker2.open_account("Carol", "carol@example.com", "carol")
+    position = worker1.email_index.position
+    assert worker1.email_index.lookup("carol@example.com") is None
+    assert worker1.email_index.position == position
+    with pytest.raises(EmailAlreadyRegistered):
+        worker1.open_account("Carol", "carol@example.com", "carol")
+    assert worker1.authenticate("carol@example.com", "carol") == carol
+
+    worker1.close()
+    worker2.close()
+
+
+def test_email_index_skips_writes(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+        "EMAIL_INDEX_DBNAME": str(tmp_path / "emails.db"),
+        "PASSWORD_HASHER": "sha512",
+    }
+    app = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    index = app.email_index
+    assert index.view.get_position() == 1
+
+    # Saves without an account opened move the position on
+    # without writing to the view.
+    app.deposit_funds(alice, 100)
+    app.deposit_funds(alice, 100)
+    assert index.position == 3
+    assert index.view.get_position() == 1
+    assert index.saved_position == 1
+
+    # The next account opened records the position.
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    assert index.view.get_position() == 4
+    assert index.saved_position == 4
+    assert index.get("bob@example.com") == bob
+
+    # A process sharing the view reads the skipped
+    # notifications again, and finds nothing in them.
+    app.deposit_funds(alice, 100)
+    other = Bank(env=env)
+    other.email_index.pull()
+    assert other.email_index.position == 5
+    assert other.email_index.view.get_position() == 5
+    # Which conflicts with the position this process saved.
+    carol = app.open_account("Carol", "carol@example.com", "carol")
+    assert index.view.get_position() == 6
+    assert other.email_index.lookup("carol@example.com") == carol
+
+    app.close()
+    other.close()
+
+
+def test_signup_twice() -> None:
+    client = bankingapi.test_client()
+    data_new_account = {
+        "full_name": "Grace",
+        "email_address": "grace@example.com",
+        "password": "grace",
+    }
+    response = client.post(
+        "/api/v1/signup",
+        data=json.dumps(data_new_account),
+        content_type="application/json",
+    )
+    assert response.status_code == 201
+    response = client.post(
+        "/api/v1/signup",
+        data=json.dumps(data_new_account),
+        content_type="application/json",
+    )
+    assert response.status_code == 409
+
+    response = client.post(
+        "/api/v1/auth",
+        data=json.dumps(
+            {"email_address": "nobody@example.com", "password": "x"}
+        ),
+        content_type="application/json",
+    )
+    assert response.status_code == 401
@@ -0,0 +1,190 @@
+# coding=utf-8
+
+import json
+import logging
+import typing
+from uuid import UUID
+
+import pytest
+
+from banking import api
+from banking.applicationmodel import Bank
+from banking.repository import EventStoreStats, MappingStats, track_mapping
+
+API_V1_PREFIX = "/api/v1"
+
+
+def test_request_stats(
+    make_bank: typing.Callable[..., Bank],
+    open_account: typing.Callable[..., UUID],
+) -> None:
+    app = make_bank()
+    alice = open_account(app, "alice", deposits=9)
+    bob = open_account(app, "bob")
+
+    with app.request_scope() as stats:
+        app.transfer_funds(alice, bob, 100)
+        app.get_balance(alice)
+
+    # Alice's 10 events and Bob's 1, each loaded once.
+    assert stats.gets == 2
+    assert stats.events_replayed == 11
+    assert stats.replayed == {alice: 10, bob: 1}
+    assert stats.aggregates == {alice, bob}
+    # The transfer, its debit and its credit, saved together.
+    assert stats.saves == 1
+    assert stats.events_saved == 3
+    assert stats.get_seconds >= stats.deserialize_seconds > 0
+    assert stats.insert_seconds > 0
+
+    summary = stats.summary()
+    assert summary.startswith("gets=2; replayed=11; get_ms=")
+    assert "; saves=1; saved=3; insert_ms=" in summary
+    assert summary.endswith(f"; aggregates=2; heaviest={alice}:10")
+
+    # Outside a request there are no stats to keep.
+    app.get_balance(alice)
+    assert stats.gets == 2
+
+
+def test_empty_request_stats(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    with app.request_scope() as stats:
+        pass
+    assert stats == EventStoreStats()
+    assert stats.summary() == (
+        "gets=0; replayed=0; get_ms=0.000; deserialize_ms=0.000; saves=0;"
+        " saved=0; insert_ms=0.000; aggregates=0"
+    )
+    histogram = app.metrics.histograms["banking_aggregates_per_request"][()]
+    assert histogram.counts[0] == 1
+
+
+def test_replayed_from_snapshot(
+    make_bank: typing.Callable[..., Bank],
+    open_account: typing.Callable[..., UUID],
+) -> None:
+    app = make_bank(SNAPSHOTTING_INTERVAL="5")
+    alice = open_account(app, "alice", deposits=6)
+
+    with app.request_scope() as stats:
+        app.get_balance(alice)
+    # The snapshot at version 5, then versions 6 and 7.
+    assert stats.events_replayed == 3
+
+
+def test_replayed_from_cache(
+    make_bank: typing.Callable[..., Bank],
+    open_account: typing.Callable[..., UUID],
+) -> None:
+    app = make_bank(AGGREGATE_CACHE_MAXSIZE="10")
+    alice = open_account(app, "alice", deposits=4)
+
+    with app.request_scope() as stats:
+        app.get_balance(alice)
+    # The cached account is current, so there is nothing to replay.
+    assert stats.gets == 1
+    assert stats.events_replayed == 0
+
+
+def test_failed_get_is_recorded(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    missing = UUID(int=1)
+    with app.request_scope() as stats:
+        with pytest.raises(Exception):
+            app.repository.get(missing)
+    assert stats.gets == 1
+    assert stats.events_replayed == 0
+    assert app.repository.replayed[missing] == 0
+
+
+def test_track_mapping(
+    make_bank: typing.Callable[..., Bank],
+    open_account: typing.Callable[..., UUID],
+) -> None:
+    app = make_bank()
+    alice = open_account(app, "alice", deposits=2)
+    stored_events = list(app.recorder.select_events(alice))
+
+    # Mapping is only counted inside track_mapping().
+    with track_mapping() as mapping:
+        for stored_event in stored_events:
+            app.mapper.to_domain_event(stored_event)
+    assert mapping.events == 3
+    assert mapping.seconds > 0
+    app.mapper.to_domain_event(stored_events[0])
+    assert mapping.events == 3
+    assert MappingStats().events == 0
+
+
+def test_heaviest(
+    make_bank: typing.Callable[..., Bank],
+    open_account: typing.Callable[..., UUID],
+) -> None:
+    app = make_bank()
+    alice = open_account(app, "alice", deposits=50)
+    bob = open_account(app, "bob", deposits=1)
+    app.repository.get_seconds.clear()
+    app.repository.replayed.clear()
+    for _ in range(3):
+        app.get_balance(alice)
+        app.get_balance(bob)
+
+    heaviest = app.repository.heaviest(1)
+    assert len(heaviest) == 1
+    assert heaviest[0][:2] == (alice, 153)
+    assert [row[0] for row in app.repository.heaviest()] == [alice, bob]
+
+    metrics = app.collect_metrics()
+    events = metrics.values["banking_heaviest_aggregate_events_replayed"]
+    assert events == (
+        {
+            (("aggregate_id", str(alice)),): 153,
+            (("aggregate_id", str(bob)),): 6,
+        }
+    )
+    # Aggregates no longer among the heaviest are forgotten.
+    app.repository.get_seconds.pop(bob)
+    events = app.collect_metrics().values[
+        "banking_heaviest_aggregate_events_replayed"
+    ]
+    assert list(events) == [(("aggregate_id", str(alice)),)]
+    text = metrics.render()
+    assert "# TYPE banking_events_replayed histogram" in text
+    assert 'banking_events_replayed_bucket{le="0"} 0' in text
+    assert "# TYPE banking_recorder_insert_duration_seconds histogram" in text
+
+
+def test_event_store_header(
+    monkeypatch: typing.Any, caplog: typing.Any
+) -> None:
+    client = api.app.test_client()
+    response = client.post(
+        API_V1_PREFIX + "/signup",
+        data=json.dumps(
+            {
+                "full_name": "Stats",
+                "email_address": "stats@example.com",
+                "password": "stats",
+            }
+        ),
+        content_type="application/json",
+    )
+    assert response.status_code == 201
+    assert "X-Event-Store" not in response.headers
+
+    monkeypatch.setitem(api.app.config, "EVENT_STORE_STATS_HEADER", True)
+    with caplog.at_level(logging.DEBUG, logger="banking.resources"):
+        response = client.post(
+            API_V1_PREFIX + "/auth",
+            data=json.dumps(
+                {"email_address": "stats@example.com", "password": "stats"}
+            ),
+            content_type="application/json",
+        )
+    assert response.status_code == 200
+    header = response.headers["X-Event-Store"]
+    account_id = api.bank().get_account_id_by_email("stats@example.com")
+    assert header.startswith("gets=1; replayed=1; ")
+    assert header.endswith(f"; heaviest={account_id}:1")
+    assert f"POST {API_V1_PREFIX}/auth {header}" in caplog.messages
@@ -0,0 +1,245 @@
+# coding=utf-8
+
+import gzip
+import io
+import json
+import typing
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from banking import api
+from banking.applicationmodel import Bank
+from banking.cli import main
+from banking.domainmodel import StandingOrder
+from banking.exporting import (
+    REDACTED,
+    export_events,
+    gzip_chunks,
+    read_event,
+    resume_point,
+)
+from banking.utils.passwords import Passwords, construct_password_hasher
+
+API_V1_PREFIX = "/api/v1"
+
+
+def _lines(data: bytes) -> typing.List[typing.Dict[str, typing.Any]]:
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def test_export_events(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    for amount in range(1, 5):
+        app.deposit_funds(alice, amount)
+    app.notification_log.section_size = 2
+
+    # One chunk per section of the notification log.
+    chunks = list(export_events(app))
+    assert [chunk.count(b"\n") for chunk in chunks] == [2, 2, 1]
+    lines = _lines(b"".join(chunks))
+    assert [line["id"] for line in lines] == [1, 2, 3, 4, 5]
+    assert {line["originator_id"] for line in lines} == {str(alice)}
+    assert [line["originator_version"] for line in lines] == [1, 2, 3, 4, 5]
+    assert lines[0]["topic"].endswith("Account.Opened")
+    assert lines[0]["state"]["email_address"] == "alice@example.com"
+    assert lines[4]["state"]["amount_in_cents"] == 4
+    assert "originator_id" not in lines[4]["state"]
+    assert lines[4]["state"]["timestamp"] > lines[0]["state"]["timestamp"]
+
+    # Resuming after the last id exported gives the rest.
+    assert _lines(b"".join(export_events(app, start=4))) == lines[3:]
+    assert list(export_events(app, start=6)) == []
+
+
+def test_read_event(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 100)
+    app.transfer_funds(alice, bob, 30)
+    app.create_standing_order(
+        alice, bob, 10, 3600, datetime(2024, 1, 1, tzinfo=timezone.utc)
+    )
+    app.change_password(alice, "alice", "alice2")
+
+    # The events of an export are the events that were
+    # recorded, less their secrets, with the values JSON
+    # doesn't have read back as the types they were.
+    notifications = app.notification_log.select(start=1, limit=10)
+    events = [
+        read_event(line) for line in _lines(b"".join(export_events(app)))
+    ]
+    recorded = [app.mapper.to_domain_event(n) for n in notifications]
+    assert [type(e) for e in events] == [type(e) for e in recorded]
+    assert [e.__dict__ for e in events] == (
+        [
+            {k: v for k, v in e.__dict__.items() if k not in REDACTED}
+            for e in recorded
+        ]
+    )
+    (created,) = [e for e in events if type(e) is StandingOrder.Created]
+    assert created.next_due_at == datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_export_leaves_out_secrets(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.change_password(alice, "alice", "alice2")
+    app.passwords = Passwords(construct_password_hasher("scrypt"))
+    app.authenticate("alice@example.com", "alice2")
+    hashes = [e.__dict__.get("password") for e in app.events.get(alice)] + [
+        e.__dict__.get("password_hash") for e in app.events.get(alice)
+    ]
+    hashes = [h for h in hashes if h]
+    assert len(hashes) == 3
+
+    data = b"".join(export_events(app))
+    lines = _lines(data)
+    assert [line["topic"].split(".")[-1] for line in lines] == [
+        "Opened",
+        "PasswordChanged",
+        "PasswordRehashed",
+    ]
+    for line in lines:
+        assert not REDACTED & set(line["state"])
+    for password_hash in hashes:
+        assert password_hash.encode() not in data
+
+
+def test_gzip_chunks() -> None:
+    chunks = [b"a\n", b"b\n", b"c\n"]
+    compressed = list(gzip_chunks(chunks))
+    assert gzip.decompress(b"".join(compressed)) == b"a\nb\nc\n"
+
+    # What was yielded before the stream is cut short can be read.
+    decompressor = zlib.decompressobj(wbits=31)
+    assert decompressor.decompress(b"".join(compressed[:2])) == b"a\nb\n"
+
+
+def test_resume_point() -> None:
+    complete = b'{"id":1}\n{"id":2}\n'
+    assert resume_point(io.BytesIO(complete), False) == (2, len(complete))
+    # A line that was cut short is written again.
+    assert resume_point(io.BytesIO(complete + b'{"id":'), False) == (
+        2,
+        len(complete),
+    )
+    assert resume_point(io.BytesIO(b""), False) == (None, 0)
+
+    compressed = b"".join(gzip_chunks([complete]))
+    assert resume_point(io.BytesIO(compressed), True) == (2, len(compressed))
+    cut_short = b"".join(list(gzip_chunks([complete, b'{"id":3}\n']))[:1])
+    with pytest.raises(ValueError, match="after notification 2"):
+        resume_point(io.BytesIO(cut_short), True)
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_export_events_command(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    compressed: bool,
+) -> None:
+    monkeypatch.setenv("PASSWORD_HASHER", "sha512")
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 100)
+    path = tmp_path / ("events.jsonl.gz" if compressed else "events.jsonl")
+    read = gzip.decompress if compressed else (lambda data: data)
+
+    assert main(["export-events", str(path)]) == 0
+    assert [line["id"] for line in _lines(read(path.read_bytes()))] == [1, 2]
+
+    # Resuming appends the events recorded since.
+    app.deposit_funds(alice, 200)
+    app.close()
+    assert main(["export-events", str(path), "--resume"]) == 0
+    lines = _lines(read(path.read_bytes()))
+    assert [line["id"] for line in lines] == [1, 2, 3]
+    assert lines[2]["state"]["amount_in_cents"] == 200
+
+    # Exports start where they are told to, unless resumed
+    # from a file with events in it.
+    other = tmp_path / "other.jsonl"
+    other.write_bytes(b"")
+    assert main(["export-events", str(other), "--start", "3", "--resume"]) == 0
+    assert _lines(other.read_bytes()) == lines[2:]
+
+
+def test_export_events_command_stdout(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsysbinary: pytest.CaptureFixture[bytes],
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = make_bank()
+    app.open_account("Alice", "alice@example.com", "alice")
+    app.close()
+
+    # The log is read without constructing a Bank.
+    monkeypatch.setattr("banking.cli.Bank", None)
+    assert main(["export-events", "-", "--gzip"]) == 0
+    lines = _lines(gzip.decompress(capsysbinary.readouterr().out))
+    assert [line["id"] for line in lines] == [1]
+
+
+def test_export_events_command_cut_short(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    path = tmp_path / "events.jsonl.gz"
+    path.write_bytes(b"".join(list(gzip_chunks([b'{"id":1}\n']))[:1]))
+    assert main(["export-events", str(path), "--resume"]) == 1
+    assert "cut short after notification 1" in capsys.readouterr().err
+
+
+def test_admin_events_endpoint(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = api.app.test_client()
+    client.post(
+        API_V1_PREFIX + "/signup",
+        data=json.dumps(
+            {
+                "full_name": "Export",
+                "email_address": "export@example.com",
+                "password": "export",
+            }
+        ),
+        content_type="application/json",
+    )
+    url = API_V1_PREFIX + "/admin/events"
+    headers = {"X-Admin-Key": "secret"}
+
+    # Without a key configured, nobody is an admin.
+    assert client.get(url, headers=headers).status_code == 403
+    monkeypatch.setitem(api.app.config, "ADMIN_API_KEY", "secret")
+    response = client.get(url, headers={"X-Admin-Key": "wrong"})
+    assert response.status_code == 403
+    assert response.json == {"error": "Forbidden"}
+    assert client.get(url).status_code == 403
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.content_type == "application/x-ndjson"
+    lines = _lines(response.data)
+    assert [line["id"] for line in lines] == list(range(1, len(lines) + 1))
+    account_id = str(api.bank().get_account_id_by_email("export@example.com"))
+    assert account_id in {line["originator_id"] for line in lines}
+
+    response = client.get(
+        url + f"?start={len(lines)}&gzip=true", headers=headers
+    )
+    assert response.content_type == "application/gzip"
+    assert _lines(gzip.decompress(response.data)) == lines[-1:]
+
+    for query in ("start=0", "start=x"):
+        response = client.get(url + f"?{query}", headers=headers)
+        assert response.status_code == 400
+        assert response.json == {"error": "Invalid start"}
@@ -0,0 +1,305 @@
+# coding=utf-8
+
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import typing
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+from flask_jwt_extended import create_access_token  # type: ignore
+from werkzeug.serving import make_server
+
+from banking import api
+from banking.applicationmodel import Bank
+from banking.follower import (
+    EventStream,
+    Follower,
+    Replica,
+    create_follower_app,
+)
+from banking.serving import main
+
+API_V1_PREFIX = "/api/v1"
+PRIMARY_URL = "http://primary:5000"
+
+
+@pytest.fixture
+def store_env(tmp_path: Path) -> typing.Dict[str, str]:
+    return {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+
+
+@pytest.fixture
+def primary_url(monkeypatch: pytest.MonkeyPatch) -> typing.Iterator[str]:
+    monkeypatch.setitem(api.app.config, "ADMIN_API_KEY", "secret")
+    server = make_server("127.0.0.1", 0, api.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.port}"
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_follower_of_store(store_env: typing.Dict[str, str]) -> None:
+    app = Bank(env={**store_env, "EVENT_TRANSCODER": "compact"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 100)
+
+    follower = Follower(Replica(env=store_env))
+    lag = follower.lag()
+    assert (lag.position, lag.head, lag.seconds) == (0, 0, None)
+    assert follower.run_once() == 2
+    row = follower.get(alice)
+    assert row is not None
+    assert row.balance == 100
+
+    # Events recorded by the primary are read at the next pass.
+    app.set_overdraft_limit(alice, 50)
+    app.close_account(alice)
+    assert follower.run_once() == 2
+    row = follower.get(alice)
+    assert row is not None
+    assert (row.overdraft_limit, row.is_closed) == (50, True)
+    assert follower.replica.token_revocations.is_revoked(alice, 0)
+    lag = follower.lag()
+    assert (lag.position, lag.head, lag.notifications) == (4, 4, 0)
+    assert lag.seconds is not None and lag.seconds < 1
+    app.close()
+    follower.replica.close()
+
+
+def test_follower_of_store_with_standing_order(
+    store_env: typing.Dict[str, str],
+) -> None:
+    app = Bank(env=store_env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 100)
+    app.create_standing_order(
+        alice, bob, 10, 60, datetime(2024, 1, 1, tzinfo=timezone.utc)
+    )
+    app.deposit_funds(alice, 5)
+
+    follower = Follower(Replica(env=store_env))
+    assert follower.run_once() == 5
+    row = follower.get(alice)
+    assert row is not None
+    assert row.balance == 105
+    assert follower.lag().notifications == 0
+    app.close()
+    follower.replica.close()
+
+
+def test_follower_of_stream(
+    primary_url: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    client = api.app.test_client()
+    client.post(
+        API_V1_PREFIX + "/signup",
+        data=json.dumps(
+            {
+                "full_name": "Follow",
+                "email_address": "follow@example.com",
+                "password": "follow",
+            }
+        ),
+        content_type="application/json",
+    )
+    account_id = api.bank().get_account_id_by_email("follow@example.com")
+    assert account_id is not None
+    api.bank().deposit_funds(account_id, 250)
+
+    stream = EventStream(primary_url, "secret", section_size=2)
+    follower = Follower(Replica(), stream)
+    follower.run_once()
+    head = api.bank().recorder.max_notification_id()
+    assert stream.position == head
+    # The replica is a copy of the primary's log.
+    assert follower.replica.recorder.max_notification_id() == head
+    row = follower.get(account_id)
+    assert row is not None
+    assert row.balance == 250
+
+    api.bank().deposit_funds(account_id, 50)
+    assert follower.run_once() == 1
+    row = follower.get(account_id)
+    assert row is not None
+    assert row.balance == 300
+    # With nothing new, nothing is copied.
+    assert follower.run_once() == 0
+    lag = follower.lag()
+    assert (lag.position, lag.notifications) == (head + 1, 0)
+
+    # Until the follower has what the primary had recorded, it
+    # is behind, and has been since it last caught up.
+    monkeypatch.setattr(stream, "copy_to", lambda replica: head + 6)
+    follower.run_once()
+    behind = follower.lag()
+    assert behind.notifications == 5
+    assert lag.seconds is not None and behind.seconds is not None
+    assert behind.seconds >= lag.seconds
+
+    # Without the admin key, the primary refuses the stream.
+    with pytest.raises(OSError):
+        EventStream(primary_url, "wrong").copy_to(Replica())
+
+
+def test_follower_thread(
+    primary_url: str, caplog: pytest.LogCaptureFixture
+) -> None:
+    follower = Follower(
+        Replica(), EventStream(primary_url, "secret"), period=0.01
+    )
+    follower.start()
+    deadline = time.monotonic() + 10
+    while follower.lag().seconds is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    follower.stop()
+
+    # A primary that can't be reached is tried again at the
+    # next pass.
+    follower.stream = EventStream("http://127.0.0.1:9", "secret")
+    with caplog.at_level(logging.WARNING, logger="banking.follower"):
+        follower.start()
+        while "Follower failed" not in caplog.text:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        follower.stop()
+    follower.stop()
+
+
+def _get(
+    client: typing.Any, path: str, token: str
+) -> typing.Tuple[int, typing.Any, typing.Optional[str]]:
+    response = client.get(
+        API_V1_PREFIX + path, headers={"Authorization": f"Bearer {token}"}
+    )
+    return (
+        response.status_code,
+        response.json,
+        response.headers.get("Location"),
+    )
+
+
+def test_follower_app(store_env: typing.Dict[str, str]) -> None:
+    bank = Bank(env=store_env)
+    alice = bank.open_account("Alice", "alice@example.com", "alice")
+    bank.deposit_funds(alice, 100)
+    bank.set_overdraft_limit(alice, 20)
+    follower = Follower(Replica(env=store_env))
+    app = create_follower_app(follower, PRIMARY_URL + "/", max_lag=60)
+    client = app.test_client()
+
+    def token(account_id: UUID, password_version: int = 0) -> str:
+        with app.app_context():
+            return str(
+                create_access_token(
+                    identity=str(account_id),
+                    additional_claims={"pv": password_version},
+                )
+            )
+
+    alice_token = token(alice)
+
+    # Until it has caught up, the follower isn't ready, and
+    # redirects every read to the primary.
+    assert client.get(API_V1_PREFIX + "/ready").status_code == 503
+    location = PRIMARY_URL + "/api/v1/account/balance"
+    assert _get(client, "/account/balance", alice_token) == (
+        307,
+        {"location": location},
+        location,
+    )
+
+    follower.run_once()
+    assert client.get(API_V1_PREFIX + "/ready").status_code == 200
+    assert _get(client, "/account", alice_token)[:2] == (
+        200,
+        {"balance": "100", "identity": str(alice)},
+    )
+    assert _get(client, "/account/balance", alice_token)[:2] == (
+        200,
+        {"balance": "100"},
+    )
+    assert _get(client, "/account/overdraft_limit", alice_token)[:2] == (
+        200,
+        {"overdraft_limit": "20"},
+    )
+    response = client.get(API_V1_PREFIX + "/replication")
+    assert response.json["position"] == 3
+    assert response.json["lag_notifications"] == 0
+    assert response.json["lag_seconds"] < 60
+
+    # Reads that can't be stale, and reads of accounts the
+    # follower hasn't seen yet, are redirected to the primary.
+    status, _, location = _get(
+        client, "/account/balance?consistent=true", alice_token
+    )
+    assert (status, location) == (
+        307,
+        PRIMARY_URL + "/api/v1/account/balance?consistent=true",
+    )
+    assert _get(client, "/account", token(uuid4()))[0] == 307
+
+    # As are all reads, once the follower is too far behind.
+    follower.caught_up_at = time.monotonic() - 61
+    assert _get(client, "/account/overdraft_limit", alice_token)[0] == 307
+
+    # Tokens revoked at the primary are refused, once the
+    # follower has read the events that revoked them.
+    bank.change_password(alice, "alice", "alice2")
+    follower.run_once()
+    status, body, _ = _get(client, "/account/balance", alice_token)
+    assert (status, body) == (401, {"msg": "Token has been revoked"})
+    assert _get(client, "/account/balance", token(alice, 4))[0] == 200
+    bank.close()
+    follower.replica.close()
+
+
+def _serve_until_sigterm(argv: typing.List[str]) -> int:
+    sigterm = signal.getsignal(signal.SIGTERM)
+
+    def terminate() -> None:
+        while signal.getsignal(signal.SIGTERM) is sigterm:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    thread = threading.Thread(target=terminate)
+    thread.start()
+    try:
+        return main(argv)
+    finally:
+        thread.join()
+        assert signal.getsignal(signal.SIGTERM) is sigterm
+
+
+def test_main(
+    store_env: typing.Dict[str, str],
+    primary_url: str,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    argv = ["--follow", primary_url, "--port", "0", "--poll-interval", "0.01"]
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.popo")
+    assert main(argv) == 2
+    assert "SQLITE_DBNAME" in capsys.readouterr().err
+    assert main(argv + ["--from-stream"]) == 2
+    assert "ADMIN_API_KEY" in capsys.readouterr().err
+
+    for name, value in store_env.items():
+        monkeypatch.setenv(name, value)
+    assert _serve_until_sigterm(argv) == 0
+    monkeypatch.setenv("ADMIN_API_KEY", "secret")
+    assert _serve_until_sigterm(argv + ["--from-stream"]) == 0
@@ -0,0 +1,220 @@
+# coding=utf-8
+
+import json
+import typing
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+from eventsourcing.persistence import IntegrityError
+
+from banking import api
+from banking.applicationmodel import Bank
+from banking.idempotency import IdempotentResult, construct_idempotency_store
+from banking.utils.metrics import registry
+
+API_V1_PREFIX = "/api/v1"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db_name(
+    request: pytest.FixtureRequest, tmp_path: Path
+) -> typing.Optional[str]:
+    return str(tmp_path / "keys.db") if request.param == "sqlite" else None
+
+
+def test_idempotency_store(db_name: typing.Optional[str]) -> None:
+    store = construct_idempotency_store(db_name, ttl=60)
+    alice, bob = uuid4(), uuid4()
+    assert store.reserve(alice, "k1", "f1") is None
+    # A key is reserved until its request is answered.
+    assert store.reserve(alice, "k1", "f1") == IdempotentResult("f1", None, "")
+    # Keys are scoped by account.
+    assert store.reserve(bob, "k1", "f2") is None
+
+    store.complete(alice, "k1", IdempotentResult("f1", 200, '{"amount": "5"}'))
+    assert store.reserve(alice, "k1", "f1") == IdempotentResult(
+        "f1", 200, '{"amount": "5"}'
+    )
+    store.release(bob, "k1")
+    assert store.reserve(bob, "k1", "f3") is None
+    store.close()
+
+
+def test_idempotency_store_expiry(db_name: typing.Optional[str]) -> None:
+    store = construct_idempotency_store(db_name, ttl=0, lease=0)
+    alice = uuid4()
+    assert store.reserve(alice, "k1", "f1") is None
+    # A reservation that outlived its lease is taken again.
+    assert store.reserve(alice, "k1", "f1") is None
+    store.complete(alice, "k1", IdempotentResult("f1", 200, "{}"))
+    assert store.reserve(alice, "k2", "f2") is None
+    assert store.reserve(alice, "k1", "f1") is None
+    store.close()
+
+
+def test_bank_idempotency_keys(tmp_path: Path) -> None:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "IDEMPOTENCY_KEYS_DBNAME": str(tmp_path / "keys.db"),
+        "IDEMPOTENCY_KEY_TTL": "10",
+    }
+    app = Bank(env=env)
+    assert app.idempotency_keys.ttl == 10
+    alice = uuid4()
+    app.idempotency_keys.reserve(alice, "k1", "f1")
+    app.idempotency_keys.complete(
+        alice, "k1", IdempotentResult("f1", 200, "{}")
+    )
+    app.close()
+
+    # Keys survive a restart, and are shared by processes.
+    app = Bank(env=env)
+    assert app.idempotency_keys.reserve(alice, "k1", "f1") == IdempotentResult(
+        "f1", 200, "{}"
+    )
+    app.close()
+
+
+def _post(
+    client: typing.Any,
+    path: str,
+    data: typing.Dict[str, typing.Any],
+    token: str,
+    key: typing.Optional[str] = None,
+) -> typing.Any:
+    headers = {"Authorization": f"Bearer {token}"}
+    if key is not None:
+        headers["Idempotency-Key"] = key
+    return client.post(
+        API_V1_PREFIX + path,
+        data=json.dumps(data),
+        content_type="application/json",
+        headers=headers,
+    )
+
+
+def _balance(client: typing.Any, token: str) -> str:
+    response = client.get(
+        API_V1_PREFIX + "/account/balance",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    return str(response.json["balance"])
+
+
+def test_idempotent_requests(
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = api.app.test_client()
+    alice = signup_and_login(client, "idempotent1@example.com")
+    bob = signup_and_login(client, "idempotent2@example.com")
+    bob_id = api.bank().get_account_id_by_email("idempotent2@example.com")
+
+    response = _post(client, "/deposit", {"amount": 100}, alice, "d1")
+    assert (response.status_code, response.json) == (200, {"amount": "100"})
+    assert "Idempotent-Replayed" not in response.headers
+
+    # A retry is answered as the request was, without
+    # loading the account, and isn't posted again.
+    api.bank().repository.gets.clear()
+    response = _post(client, "/deposit", {"amount": 100}, alice, "d1")
+    assert (response.status_code, response.json) == (200, {"amount": "100"})
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert sum(api.bank().repository.gets.values()) == 0
+    # And counted with the requests of the resource.
+    labels = (
+        ("resource", "DepositResource"),
+        ("method", "POST"),
+        ("status", "200"),
+    )
+    requests = registry.values["banking_http_requests_total"]
+    counted = requests[labels]
+    _post(client, "/deposit", {"amount": 100}, alice, "d1")
+    assert requests[labels] == counted + 1
+    assert _balance(client, alice) == "100"
+
+    # Failures are answered again too.
+    response = _post(client, "/withdraw", {"amount": 500}, alice, "w1")
+    assert response.status_code == 400
+    replayed = _post(client, "/withdraw", {"amount": 500}, alice, "w1")
+    assert (replayed.status_code, replayed.json) == (400, response.json)
+    assert _balance(client, alice) == "100"
+
+    # Transfers of the same amount with different keys are
+    # different transactions.
+    transfer = {"amount": 10, "to_account_id": str(bob_id)}
+    for key in ("t1", "t2", "t1"):
+        response = _post(client, "/transfer", transfer, alice, key)
+        assert response.status_code == 200
+    assert _balance(client, alice) == "80"
+    assert _balance(client, bob) == "20"
+    transactions = client.get(
+        API_V1_PREFIX + "/account/transactions",
+        headers={"Authorization": f"Bearer {bob}"},
+    ).json["transactions"]
+    assert len({t["transaction_id"] for t in transactions}) == 2
+
+    # Without a key, nothing is deduplicated.
+    for _ in range(2):
+        _post(client, "/deposit", {"amount": 1}, bob, None)
+    assert _balance(client, bob) == "22"
+
+
+def test_idempotency_key_errors(
+    monkeypatch: pytest.MonkeyPatch,
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = api.app.test_client()
+    alice = signup_and_login(client, "idempotent3@example.com")
+    alice_id = api.bank().get_account_id_by_email("idempotent3@example.com")
+    assert alice_id is not None
+
+    response = _post(client, "/deposit", {"amount": 1}, alice, "")
+    assert (response.status_code, response.json) == (
+        400,
+        {"error": "Invalid Idempotency-Key"},
+    )
+    response = _post(client, "/deposit", {"amount": 1}, alice, "x" * 256)
+    assert response.status_code == 400
+
+    # A key is for one request only.
+    _post(client, "/deposit", {"amount": 1}, alice, "k1")
+    labels = (
+        ("resource", "DepositResource"),
+        ("method", "POST"),
+        ("status", "422"),
+    )
+    counted = registry.values["banking_http_requests_total"].get(labels, 0)
+    response = _post(client, "/deposit", {"amount": 2}, alice, "k1")
+    assert response.status_code == 422
+    assert (
+        registry.values["banking_http_requests_total"][labels] == counted + 1
+    )
+    response = _post(client, "/withdraw", {"amount": 1}, alice, "k1")
+    assert response.status_code == 422
+
+    # A retry while the request is processed is turned away.
+    api.bank().idempotency_keys.reserve(alice_id, "k2", "?")
+    response = _post(client, "/deposit", {"amount": 1}, alice, "k2")
+    assert response.status_code == 409
+    assert "in progress" in response.json["error"]
+
+    # Requests that fail, or are to be tried again, can be
+    # made again with the same key.
+    def conflict(*args: typing.Any) -> None:
+        raise IntegrityError()
+
+    monkeypatch.setattr(api.bank(), "deposit_funds", conflict)
+    response = _post(client, "/deposit", {"amount": 5}, alice, "k3")
+    assert response.status_code == 409
+
+    def fail(*args: typing.Any) -> None:
+        raise RuntimeError()
+
+    monkeypatch.setattr(api.bank(), "deposit_funds", fail)
+    response = _post(client, "/deposit", {"amount": 5}, alice, "k3")
+    assert response.status_code == 500
+    monkeypatch.undo()
+    response = _post(client, "/deposit", {"amount": 5}, alice, "k3")
+    assert response.status_code == 200
+    assert _balance(client, alice) == "6"
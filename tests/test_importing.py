@@ -0,0 +1,142 @@
+# coding=utf-8
+
+import io
+import json
+import typing
+from pathlib import Path
+
+import pytest
+
+from banking.applicationmodel import Bank, BulkOpenReport, NewAccount
+from banking.cli import main
+from banking.importing import read_accounts
+
+
+def _new_accounts(count: int) -> typing.Iterator[NewAccount]:
+    for i in range(count):
+        yield NewAccount(
+            full_name=f"User {i}",
+            email_address=f"user{i}@example.com",
+            password=f"password{i}",
+        )
+
+
+def test_open_accounts_bulk(monkeypatch: pytest.MonkeyPatch) -> None:
+    app = Bank()
+    existing = app.open_account("User 3", "user3@example.com", "password3")
+    reports: typing.List[BulkOpenReport] = []
+
+    def progress(report: BulkOpenReport) -> None:
+        reports.append(BulkOpenReport(report.opened, report.duplicates))
+
+    accounts = list(_new_accounts(10))
+    report = app.open_accounts_bulk(
+        iter(accounts + accounts[:2]), batch_size=4, progress=progress
+    )
+
+    assert report.opened == 9
+    assert report.duplicates == 3
+    assert report.duplicate_sample == [
+        "user3@example.com",
+        "user0@example.com",
+        "user1@example.com",
+    ]
+    assert report.processed == 12
+    assert [r.processed for r in reports] == [4, 8, 12]
+
+    # The imported accounts can log in, the existing one is unchanged.
+    user0 = app.authenticate("user0@example.com", "password0")
+    assert app.get_balance(user0) == 0
+    assert app.get_account(existing).version == 1
+
+    # Only a sample of the duplicates is kept.
+    monkeypatch.setattr(BulkOpenReport, "MAX_SAMPLE", 2)
+    report = app.open_accounts_bulk(iter(accounts), batch_size=4)
+    assert report.duplicates == 10
+    assert report.duplicate_sample == [
+        "user0@example.com",
+        "user1@example.com",
+    ]
+
+    # An empty stream opens nothing.
+    assert app.open_accounts_bulk(iter([])) == BulkOpenReport()
+
+
+def test_open_accounts_bulk_hash_workers() -> None:
+    app = Bank()
+    report = app.open_accounts_bulk(_new_accounts(20), hash_workers=2)
+    assert report.opened == 20
+    app.authenticate("user19@example.com", "password19")
+
+
+def test_read_accounts() -> None:
+    csv_file = io.StringIO(
+        "full_name,email_address,password\n"
+        "Alice,alice@example.com,alice\n"
+        "Bob,bob@example.com,bob\n"
+    )
+    jsonl_file = io.StringIO(
+        json.dumps(
+            {
+                "full_name": "Alice",
+                "email_address": "alice@example.com",
+                "password": "alice",
+            }
+        )
+        + "\n\n"
+        + json.dumps(
+            {
+                "full_name": "Bob",
+                "email_address": "bob@example.com",
+                "password": "bob",
+            }
+        )
+        + "\n"
+    )
+    expected = [
+        NewAccount("Alice", "alice@example.com", "alice"),
+        NewAccount("Bob", "bob@example.com", "bob"),
+    ]
+    assert list(read_accounts(csv_file, "csv")) == expected
+    assert list(read_accounts(jsonl_file, "jsonl")) == expected
+    with pytest.raises(ValueError):
+        list(read_accounts(io.StringIO(""), "xml"))
+
+
+def test_import_accounts_command(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    path = tmp_path / "accounts.csv"
+    path.write_text(
+        "full_name,email_address,password\n"
+        + "".join(f"User {i},user{i}@example.com,pw{i}\n" for i in range(5))
+    )
+
+    assert main(["import-accounts", str(path), "--batch-size", "2"]) == 0
+    captured = capsys.readouterr()
+    assert captured.out == "5 processed, 5 opened, 0 duplicates\n"
+    assert "2 processed, 2 opened, 0 duplicates" in captured.err
+
+    # Importing again reports every row as a duplicate.
+    assert main(["import-accounts", str(path), "--format", "csv"]) == 0
+    captured = capsys.readouterr()
+    assert captured.out == "5 processed, 0 opened, 5 duplicates\n"
+    assert "duplicate: user4@example.com" in captured.err
+    assert "more duplicates" not in captured.err
+
+    # Past the sample, the other duplicates are counted.
+    monkeypatch.setattr(BulkOpenReport, "MAX_SAMPLE", 2)
+    assert main(["import-accounts", str(path)]) == 0
+    captured = capsys.readouterr()
+    assert captured.out == "5 processed, 0 opened, 5 duplicates\n"
+    assert "duplicate: user1@example.com" in captured.err
+    assert "duplicate: user2@example.com" not in captured.err
+    assert "and 3 more duplicates" in captured.err
+
+    app = Bank()
+    app.authenticate("user4@example.com", "pw4")
+    app.close()
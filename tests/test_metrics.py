@@ -0,0 +1,225 @@
+# coding=utf-8
+
+import json
+import typing
+
+import pytest
+
+from banking.api import app, bank
+from banking.applicationmodel import Bank
+from banking.domainmodel import InsufficientFundsError
+from banking.utils.http_errors import handler
+from banking.utils.metrics import CONTENT_TYPE, Histogram, Metrics, registry
+
+API_V1_PREFIX = "/api/v1"
+
+
+def test_histogram() -> None:
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    # Observations on a bucket's upper bound fall in that bucket.
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 2.65
+
+
+def test_render() -> None:
+    metrics = Metrics()
+    assert metrics.render() == ""
+
+    metrics.inc("banking_commands_total")
+    metrics.inc("banking_commands_total", amount=2)
+    metrics.set("custom_gauge", 1.5, (("name", 'say "hi"\\\n'),))
+    metrics.observe("banking_save_duration_seconds", 0.0002)
+    metrics.observe("banking_save_duration_seconds", 20.0)
+    lines = metrics.render().splitlines()
+
+    assert "# HELP banking_commands_total Bank commands run." in lines
+    assert "# TYPE banking_commands_total counter" in lines
+    assert "banking_commands_total 3" in lines
+    # Names without a description have no help, and are untyped.
+    assert "# TYPE custom_gauge untyped" in lines
+    assert 'custom_gauge{name="say \\"hi\\"\\\\\\n"} 1.5' in lines
+    # Buckets are cumulative.
+    assert "# TYPE banking_save_duration_seconds histogram" in lines
+    assert 'banking_save_duration_seconds_bucket{le="0.0001"} 0' in lines
+    assert 'banking_save_duration_seconds_bucket{le="0.00025"} 1' in lines
+    assert 'banking_save_duration_seconds_bucket{le="10"} 1' in lines
+    assert 'banking_save_duration_seconds_bucket{le="+Inf"} 2' in lines
+    assert "banking_save_duration_seconds_sum 20.0002" in lines
+    assert "banking_save_duration_seconds_count 2" in lines
+
+
+def test_render_labelled_histograms() -> None:
+    metrics = Metrics()
+    metrics.observe("h", 1.0, (("command", "b"),))
+    metrics.observe("h", 1.0, (("command", "a"),))
+    lines = metrics.render().splitlines()
+    assert lines[0] == "# TYPE h histogram"
+    assert lines[1] == 'h_bucket{command="a",le="0.0001"} 0'
+    assert 'h_count{command="a"} 1' in lines
+    assert 'h_count{command="b"} 1' in lines
+
+    # Extra labels come before those of each series.
+    lines = metrics.render((("worker", "1"),)).splitlines()
+    assert lines[1] == 'h_bucket{worker="1",command="a",le="0.0001"} 0'
+    assert 'h_count{worker="1",command="b"} 1' in lines
+    metrics.inc("c")
+    assert 'c{worker="1"} 1' in metrics.render((("worker", "1"),))
+
+
+def _count(metrics: Metrics, name: str, labels: typing.Any = ()) -> int:
+    return metrics.histograms[name][labels].count
+
+
+def test_bank_metrics(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    account_id = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(account_id, 100)
+    with pytest.raises(InsufficientFundsError):
+        app.withdraw_funds(account_id, 200)
+
+    metrics = app.collect_metrics()
+    command = "banking_command_duration_seconds"
+    assert _count(metrics, command, (("command", "deposit_funds"),)) == 1
+    # Commands that fail are timed too.
+    assert _count(metrics, command, (("command", "withdraw_funds"),)) == 1
+    assert _count(metrics, "banking_repository_get_duration_seconds") == sum(
+        app.repository.gets.values()
+    )
+    # Opening the account, and the deposit.
+    assert _count(metrics, "banking_save_duration_seconds") == 2
+    assert metrics.values["banking_commands_total"][()] == 1
+    assert metrics.values["banking_command_attempts_total"][()] == 1
+    assert "banking_aggregate_cache_hits_total" not in metrics.values
+
+
+def test_bank_metrics_with_cache(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank(AGGREGATE_CACHE_MAXSIZE="1")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.get_balance(bob)
+    app.get_balance(alice)
+
+    metrics = app.collect_metrics()
+    assert metrics.values["banking_aggregate_cache_hits_total"][()] == 1
+    assert metrics.values["banking_aggregate_cache_misses_total"][()] == 1
+    assert metrics.values["banking_aggregate_cache_evictions_total"][()] == 2
+
+
+def test_repository_without_metrics(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    app.repository.metrics = None
+    account_id = app.open_account("Alice", "alice@example.com", "alice")
+    assert app.get_balance(account_id) == 0
+    assert "banking_repository_get_duration_seconds" not in (
+        app.metrics.histograms
+    )
+
+
+class ExampleResource:
+    @handler
+    def get(self) -> typing.Dict[str, str]:
+        return {"message": "success"}
+
+    @handler
+    def post(self) -> typing.Tuple[typing.Dict[str, str], int]:
+        raise InsufficientFundsError(0, 100)
+
+    @handler
+    def delete(self) -> typing.Dict[str, str]:
+        raise KeyError("amount")
+
+
+def test_handler_records_requests() -> None:
+    resource = ExampleResource()
+    labels = (("resource", "ExampleResource"),)
+    requests = "banking_http_requests_total"
+    errors = "banking_http_errors_total"
+
+    assert resource.get() == {"message": "success"}
+    assert (
+        registry.values[requests][
+            (*labels, ("method", "GET"), ("status", "200"))
+        ]
+    ) == 1
+    assert resource.post() == (
+        {"error": "Insufficient funds: balance 0 < amount 100"},
+        400,
+    )
+    assert (
+        registry.values[requests][
+            (*labels, ("method", "POST"), ("status", "400"))
+        ]
+    ) == 1
+    assert (
+        registry.values[errors][
+            (
+                *labels,
+                ("method", "POST"),
+                ("exception", "InsufficientFundsError"),
+            )
+        ]
+    ) == 1
+
+    # Exceptions that aren't mapped to a response are re-raised,
+    # and counted as internal server errors.
+    with pytest.raises(KeyError):
+        resource.delete()
+    assert (
+        registry.values[requests][
+            (*labels, ("method", "DELETE"), ("status", "500"))
+        ]
+    ) == 1
+    assert (
+        registry.values[errors][
+            (*labels, ("method", "DELETE"), ("exception", "KeyError"))
+        ]
+    ) == 1
+    assert (
+        registry.histograms["banking_http_request_duration_seconds"][
+            (*labels, ("method", "GET"))
+        ].count
+    ) == 1
+
+
+def test_metrics_endpoint(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(app.config, "ADMIN_API_KEY", "secret")
+    client = app.test_client()
+    client.post(
+        API_V1_PREFIX + "/auth",
+        data=json.dumps(
+            {"email_address": "nobody@example.com", "password": "x"}
+        ),
+        content_type="application/json",
+    )
+
+    # The metrics are refused without the admin key.
+    response = client.get(API_V1_PREFIX + "/metrics")
+    assert response.status_code == 403
+    response = client.get(
+        API_V1_PREFIX + "/metrics", headers={"X-Admin-Key": "wrong"}
+    )
+    assert response.status_code == 403
+
+    response = client.get(
+        API_V1_PREFIX + "/metrics", headers={"X-Admin-Key": "secret"}
+    )
+    assert response.status_code == 200
+    assert response.content_type == CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert (
+        'banking_http_errors_total{resource="AuthResource",method="POST",'
+        'exception="BadCredentials"}' in text
+    )
+    assert "# TYPE banking_http_request_duration_seconds histogram" in text
+    assert "# TYPE banking_commands_total counter" in text
+    assert (
+        bank().metrics.values["banking_commands_total"][()]
+        == bank().retry_stats.commands
+    )
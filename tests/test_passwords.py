@@ -0,0 +1,158 @@
+# coding=utf-8
+
+import typing
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from eventsourcing.persistence import IntegrityError, StoredEvent
+from eventsourcing.utils import get_topic
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account, BadCredentials
+from banking.utils.passwords import (
+    Passwords,
+    ScryptHasher,
+    SHA512Hasher,
+    construct_password_hasher,
+    get_algorithm,
+)
+
+
+def test_hashers() -> None:
+    scrypt = ScryptHasher(n=2**10)
+    encoded = scrypt.hash("alice")
+    assert get_algorithm(encoded) == "scrypt"
+    assert scrypt.verify("alice", encoded)
+    assert not scrypt.verify("bob", encoded)
+
+    # Salted, and rehashed when the cost changes.
+    assert scrypt.hash("alice") != encoded
+    assert not scrypt.needs_rehash(encoded)
+    assert ScryptHasher(n=2**11).needs_rehash(encoded)
+
+    legacy = SHA512Hasher().hash("alice")
+    assert get_algorithm(legacy) == "sha512"
+    assert SHA512Hasher().verify("alice", legacy)
+    assert not SHA512Hasher().needs_rehash(legacy)
+
+    assert isinstance(construct_password_hasher("sha512"), SHA512Hasher)
+    with pytest.raises(ValueError):
+        construct_password_hasher("md5")
+
+
+def test_passwords() -> None:
+    passwords = Passwords(ScryptHasher(n=2**10))
+    legacy = SHA512Hasher().hash("alice")
+    assert passwords.verify("alice", legacy)
+    assert passwords.needs_rehash(legacy)
+    assert not passwords.needs_rehash(passwords.hash("alice"))
+
+    # Hashes of unknown algorithms never match.
+    assert not passwords.verify("alice", "md5$alice")
+
+    # Nor do malformed or truncated hashes.
+    encoded = passwords.hash("alice")
+    for malformed in (
+        encoded[:-10],
+        encoded.rsplit("$", 1)[0],
+        encoded.replace("$8$", "$x$"),
+        encoded.replace("$1024$", "$1000$"),
+        "scrypt$",
+    ):
+        assert not passwords.verify("alice", malformed)
+
+
+def test_malformed_hash_is_bad_credentials() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    account = app.get_account(alice)
+    account.change_password(account.password[:20])
+    app.save(account)
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "alice")
+
+
+def test_passwords_workers() -> None:
+    passwords = Passwords(ScryptHasher(n=2**10), workers=2)
+    encoded = passwords.hash("alice")
+    assert passwords.verify("alice", encoded)
+    assert not passwords.verify("bob", encoded)
+    passwords.close()
+    passwords.close()
+
+
+def test_bank_password_hash_workers() -> None:
+    app = Bank(env={"PASSWORD_HASH_WORKERS": "2"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert app.authenticate("alice@example.com", "alice") == alice
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "bob")
+    app.close()
+
+
+def test_rehash_on_login(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+    }
+    legacy_app = Bank(env={**env, "PASSWORD_HASHER": "sha512"})
+    alice = legacy_app.open_account("Alice", "alice@example.com", "alice")
+    bob = legacy_app.open_account("Bob", "bob@example.com", "bob")
+    assert legacy_app.authenticate("alice@example.com", "alice") == alice
+    legacy_hash = legacy_app.get_account(alice).password
+    assert get_algorithm(legacy_hash) == "sha512"
+
+    # Old hashes are verified, and replaced on login.
+    app = Bank(env=env)
+    assert app.authenticate("alice@example.com", "alice") == alice
+    assert get_algorithm(app.get_account(alice).password) == "scrypt"
+    assert app.authenticate("alice@example.com", "alice") == alice
+    assert [type(e).__name__ for e in app.events.get(alice)] == [
+        "Opened",
+        "PasswordRehashed",
+    ]
+
+    # Losing the rehash to another request still logs in.
+    def insert_events(*args: typing.Any, **kwargs: typing.Any) -> None:
+        raise IntegrityError()
+
+    app.recorder.insert_events = insert_events  # type: ignore
+    assert app.authenticate("bob@example.com", "bob") == bob
+    assert get_algorithm(legacy_app.get_account(bob).password) == "sha512"
+
+    legacy_app.close()
+    app.close()
+
+
+def test_upcast_password_changed() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    # Version 1 of the event recorded the new password itself.
+    app.recorder.insert_events(
+        [
+            StoredEvent(
+                originator_id=alice,
+                originator_version=2,
+                topic=get_topic(Account.PasswordChanged),
+                state=app.mapper.transcoder.encode(
+                    {
+                        "timestamp": datetime.now(timezone.utc),
+                        "new_password": "alice2",
+                    }
+                ),
+            )
+        ]
+    )
+    assert get_algorithm(app.get_account(alice).password) == "sha512"
+    assert app.authenticate("alice@example.com", "alice2") == alice
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "alice")
+
+    # New versions only record the hash.
+    app.change_password(alice, "alice2", "alice3")
+    event = list(app.events.get(alice))[-1]
+    assert isinstance(event, Account.PasswordChanged)
+    assert get_algorithm(event.password_hash) == "scrypt"
+    assert app.authenticate("alice@example.com", "alice3") == alice
@@ -0,0 +1,174 @@
+# coding=utf-8
+
+import typing
+from pathlib import Path
+from uuid import UUID
+
+import pytest
+
+from banking.applicationmodel import AccountNotFoundError, Bank
+from banking.projections import (
+    AccountBalance,
+    BalanceProjection,
+    InMemoryBalanceView,
+    ProjectionConflict,
+    SQLiteBalanceView,
+)
+
+
+def _create_alice_and_bob(app: Bank) -> typing.Tuple[UUID, UUID]:
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(credit_account_id=alice, amount_in_cents=10000)
+    app.transfer_funds(
+        debit_account_id=alice, credit_account_id=bob, amount_in_cents=2500
+    )
+    app.set_overdraft_limit(account_id=bob, amount_in_cents=500)
+    app.withdraw_funds(debit_account_id=bob, amount_in_cents=2800)
+    app.close_account(alice)
+    return alice, bob
+
+
+def test_balance_view() -> None:
+    app = Bank(env={"BALANCE_VIEW": "y"})
+    assert app.balances is not None
+
+    alice, bob = _create_alice_and_bob(app)
+
+    # Saves are applied to the view as they happen.
+    assert app.balances.get(alice) == (
+        AccountBalance(
+            account_id=alice,
+            balance=7500,
+            overdraft_limit=0,
+            is_closed=True,
+            version=5,
+        )
+    )
+    assert app.balances.get(bob) == (
+        AccountBalance(
+            account_id=bob,
+            balance=-300,
+            overdraft_limit=500,
+            is_closed=False,
+            version=4,
+        )
+    )
+    assert app.balances.position == app.recorder.max_notification_id()
+
+    # Reads come from the view, unless they must be consistent.
+    app.repository.gets.clear()
+    assert app.get_balance(bob) == -300
+    assert app.get_overdraft_limit(bob) == 500
+    assert sum(app.repository.gets.values()) == 0
+    assert app.get_balance(bob, consistent=True) == -300
+    assert app.get_overdraft_limit(bob, consistent=True) == 500
+    assert sum(app.repository.gets.values()) == 2
+
+    with pytest.raises(AccountNotFoundError):
+        app.get_balance(UUID("00000000-0000-0000-0000-000000000000"))
+    with pytest.raises(AccountNotFoundError):
+        app.get_overdraft_limit(UUID("00000000-0000-0000-0000-000000000000"))
+
+
+def test_balance_view_catches_up(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+    }
+    writer = Bank(env=env)
+    alice, bob = _create_alice_and_bob(writer)
+
+    # A new view catches up from the start of the log.
+    view_env = dict(env, BALANCE_VIEW_DBNAME=str(tmp_path / "view.db"))
+    reader = Bank(env=view_env)
+    assert reader.balances is not None
+    assert reader.get_balance(alice) == 7500
+    assert reader.get_balance(bob) == -300
+    position = reader.balances.position
+    reader.close()
+
+    # After a restart, the view resumes from its saved position.
+    writer.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    reader = Bank(env=view_env)
+    assert reader.balances is not None
+    assert reader.get_balance(bob) == 0
+    assert reader.balances.position == position + 1
+
+    # Events recorded by other processes are picked up by pull().
+    writer.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    assert reader.get_balance(bob) == 0
+    assert reader.balances.pull() == 1
+    assert reader.get_balance(bob) == 300
+
+    # Or by the next save in this process.
+    writer.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    reader.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    assert reader.get_balance(bob) == 900
+
+    reader.close()
+    writer.close()
+
+
+def test_shared_balance_view(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "events.db"),
+        "BALANCE_VIEW_DBNAME": str(tmp_path / "view.db"),
+    }
+    worker1 = Bank(env=env)
+    worker2 = Bank(env=env)
+
+    alice, bob = _create_alice_and_bob(worker1)
+    assert worker2.get_balance(alice) == 7500
+
+    # Each event is applied to the shared view exactly once.
+    worker2.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    worker1.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    worker2.deposit_funds(credit_account_id=bob, amount_in_cents=300)
+    assert worker1.get_balance(bob) == 600
+    assert worker2.get_balance(bob) == 600
+    assert worker1.balances.pull() == 0  # type: ignore
+    assert worker2.get_balance(bob) == 600
+
+    worker1.close()
+    worker2.close()
+
+
+def test_view_refuses_stale_position(tmp_path: Path) -> None:
+    app = Bank()
+    row = AccountBalance(
+        account_id=UUID("00000000-0000-0000-0000-000000000000"),
+        balance=0,
+        overdraft_limit=0,
+        is_closed=False,
+        version=1,
+    )
+    for view in [
+        InMemoryBalanceView(),
+        SQLiteBalanceView(str(tmp_path / "v.db")),
+    ]:
+        view.put([row], 2, 0)
+        with pytest.raises(ProjectionConflict):
+            view.put([row], 3, 1)
+        assert view.get_position() == 2
+        view.close()
+
+    # Projections whose shared view moved on reload the position.
+    app.notification_log.section_size = 2
+    view = SQLiteBalanceView(str(tmp_path / "shared.db"))
+    projection1 = BalanceProjection(app, view)
+    projection2 = BalanceProjection(app, view)
+    alice, bob = _create_alice_and_bob(app)
+    assert projection1.pull() == 9
+    assert projection2.pull() == 0
+    assert projection2.position == projection1.position
+
+    account = app.get_account(alice)
+    account.credit(100)
+    recordings = app.save(account)
+    projection1.receive(recordings)
+    projection2.receive(recordings)
+    assert projection2.position == projection1.position
+    assert projection2.get(alice).balance == 7600  # type: ignore
+    view.close()
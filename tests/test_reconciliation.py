@@ -0,0 +1,262 @@
+# coding=utf-8
+
+import typing
+from dataclasses import replace
+from pathlib import Path
+from uuid import UUID
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.cli import main
+from banking.domainmodel import Account
+from banking.projections import InMemoryBalanceView
+from banking import reconciliation
+from banking.reconciliation import (
+    LogReader,
+    RangeFold,
+    Reconciler,
+    fold_range,
+)
+
+
+def _record(
+    app: Bank, event_class: type, originator_id: UUID, **kwargs: typing.Any
+) -> None:
+    # Saved without the account, which would refuse a debit
+    # past its overdraft limit, and can't be replayed after.
+    *_, last = app.events.get(originator_id)
+    app.save(
+        event_class(
+            originator_id=originator_id,
+            originator_version=last.originator_version + 1,
+            timestamp=Account.Event.create_timestamp(),
+            **kwargs,
+        )
+    )
+
+
+def _debit(app: Bank, account_id: UUID, amount_in_cents: int) -> None:
+    _record(app, Account.Debited, account_id, amount_in_cents=amount_in_cents)
+
+
+def _setup(app: Bank) -> typing.Tuple[UUID, UUID]:
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 500)
+    app.set_overdraft_limit(bob, 100)
+    app.transfer_funds(bob, alice, 80)
+    app.shard_account(alice, 2)
+    app.deposit_funds(alice, 40)
+    app.deposit_funds(alice, 60)
+    app.sweep_account(alice)
+    app.deposit_funds(alice, 5)
+    app.withdraw_funds(alice, 680)
+    app.set_overdraft_limit(bob, 0)
+    app.deposit_funds(bob, 80)
+    return alice, bob
+
+
+def test_folds_of_ranges_are_merged(
+    monkeypatch: pytest.MonkeyPatch, make_bank: typing.Callable[..., Bank]
+) -> None:
+    # Ranges are read a few notifications at a time.
+    monkeypatch.setattr(reconciliation, "SECTION_SIZE", 2)
+    app = make_bank()
+    alice, bob = _setup(app)
+    # Bob goes past his limit before and after it is changed.
+    _debit(app, bob, 30)
+    _record(
+        app,
+        Account.OverdraftLimitChanged,
+        bob,
+        account_id=bob,
+        amount_in_cents=50,
+    )
+    _record(app, Account.Credited, bob, amount_in_cents=30)
+    _debit(app, bob, 60)
+    stop = app.recorder.max_notification_id()
+
+    whole = fold_range(app, 1, stop)
+    assert (whole.accounts[alice].balance, whole.accounts[bob].balance) == (
+        app.get_balance(alice),
+        -60,
+    )
+    assert whole.accounts[alice].swept == 105
+    assert whole.shard_swept == 105
+    assert not whole.accounts[alice].went_past_overdraft_limit
+    assert whole.accounts[bob].went_past_overdraft_limit
+
+    for i in range(1, stop):
+        for j in range(i, stop):
+            fold = fold_range(app, 1, i)
+            fold.merge(fold_range(app, i + 1, j))
+            fold.merge(fold_range(app, j + 1, stop))
+            assert fold == whole
+
+    empty = RangeFold(stop + 1, stop + 1)
+    assert fold_range(app, stop + 1, stop + 1) == empty
+
+
+def test_reconcile(make_bank: typing.Callable[..., Bank]) -> None:
+    for env in ({}, {"BALANCE_VIEW": "y"}):
+        app = make_bank(**env)
+        alice, bob = _setup(app)
+        report = Reconciler(app).run()
+        assert report.ok
+        assert (report.position, report.accounts, report.skipped) == (
+            app.recorder.max_notification_id(),
+            2,
+            0,
+        )
+        assert (
+            report.credits_in_cents,
+            report.debits_in_cents,
+            report.balances_in_cents,
+        ) == (765, 760, 5)
+        assert (report.swept_in_cents, report.swept_from_shards_in_cents) == (
+            105,
+            105,
+        )
+        assert report.discrepancies == []
+
+
+def test_discrepancies(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank(BALANCE_VIEW="y")
+    alice, bob = _setup(app)
+    sue = app.open_account("Sue", "sue@example.com", "sue")
+    app.set_overdraft_limit(sue, 10)
+    debited = app.get_account(sue).version + 1
+    _debit(app, sue, 25)
+    dan = app.open_account("Dan", "dan@example.com", "dan")
+    assert app.balances is not None
+    view = app.balances.view
+    assert isinstance(view, InMemoryBalanceView)
+    view.rows[alice] = replace(view.rows[alice], balance=7)
+    bob_version = view.rows[bob].version
+    view.rows[bob] = replace(view.rows[bob], version=bob_version - 2)
+    del view.rows[dan]
+
+    report = Reconciler(app, ranges_per_worker=3).run()
+    assert not report.ok
+    assert (
+        [
+            (d.account_id, d.kind, d.expected, d.actual)
+            for d in report.discrepancies
+        ]
+    ) == (
+        [
+            (alice, "balance", 5, 7),
+            (bob, "version", bob_version, bob_version - 2),
+            (sue, "overdraft", -10, -25),
+            (dan, "version", 1, 0),
+        ]
+    )
+    balance, version, overdraft, _ = report.discrepancies
+    assert [
+        (e.kind, e.amount_in_cents, e.balance) for e in balance.events
+    ] == (
+        [
+            ("Credited", 500, 500),
+            ("Credited", 80, 580),
+            ("CreditsSwept", 100, 680),
+            ("CreditsSwept", 5, 685),
+            ("Debited", 680, 5),
+        ]
+    )
+    assert [(e.kind, e.overdraft_limit) for e in version.events] == [
+        ("OverdraftLimitChanged", 0),
+        ("Credited", 0),
+    ]
+    assert (
+        [
+            (e.version, e.kind, e.balance, e.overdraft_limit)
+            for e in overdraft.events
+        ]
+    ) == [(debited, "Debited", -25, 10)]
+    # Credited 765 + 0, debited 760 + 25, with alice's 7.
+    assert report.balances_in_cents == 7 + 0 - 25
+
+    # The account can't be replayed without a balance read model.
+    app.balances = None
+    report = Reconciler(app).run()
+    assert [(d.account_id, d.kind) for d in report.discrepancies] == [
+        (sue, "overdraft")
+    ]
+
+
+def test_accounts_that_move_on_are_skipped(
+    monkeypatch: pytest.MonkeyPatch,
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    alice, bob = _setup(app)
+    reconciler = Reconciler(app)
+    fold = reconciler.fold
+
+    def fold_then_deposit(stop: int) -> RangeFold:
+        folded = fold(stop)
+        app.deposit_funds(bob, 10)
+        return folded
+
+    monkeypatch.setattr(reconciler, "fold", fold_then_deposit)
+    report = reconciler.run()
+    assert report.ok
+    assert (report.accounts, report.skipped) == (2, 1)
+    assert report.balances_in_cents == 5
+
+
+def test_reconcile_in_processes(tmp_path: Path) -> None:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "EVENT_TRANSCODER": "compact",
+    }
+    app = Bank(env=env)
+    _setup(app)
+    stop = app.recorder.max_notification_id()
+    reader = LogReader(env)
+    assert fold_range(reader, 1, stop) == fold_range(app, 1, stop)
+    reader.close()
+
+    report = Reconciler(app, workers=2).run()
+    report.seconds = 0.0
+    expected = Reconciler(app).run()
+    expected.seconds = 0.0
+    assert report == expected
+    assert report.ok
+    app.close()
+
+
+def test_reconcile_command(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setenv("PASSWORD_HASHER", "sha512")
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = Bank()
+    alice, bob = _setup(app)
+    n = app.recorder.max_notification_id()
+    app.close()
+
+    assert main(["reconcile", "--workers", "1"]) == 0
+    assert capsys.readouterr().out == (
+        f"{n} notifications, 2 accounts: 765 credited - 760 debited"
+        " = 5 in balances, 0 discrepancies\n"
+    )
+
+    app = Bank()
+    version = app.get_account(bob).version + 1
+    _debit(app, bob, 100)
+    app.close()
+    assert main(["reconcile"]) == 1
+    captured = capsys.readouterr()
+    assert captured.out.endswith("1 discrepancies\n")
+    lines = captured.err.splitlines()
+    assert lines[0] == f"{bob}: overdraft expected 0, was -100"
+    assert lines[1].startswith(
+        f"  v{version} Debited 100 balance -100 limit 0 at "
+    )
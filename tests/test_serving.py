@@ -0,0 +1,282 @@
+# coding=utf-8
+
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import typing
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from banking import api
+from banking.serving import Supervisor, Worker, check_env, main
+from banking.utils import metrics
+
+
+def _request(
+    address: typing.Tuple[str, int],
+    path: str,
+    data: typing.Optional[typing.Dict[str, str]] = None,
+) -> typing.Tuple[int, typing.Any]:
+    request = urllib.request.Request(
+        f"http://{address[0]}:{address[1]}/api/v1{path}",
+        data=json.dumps(data).encode() if data is not None else None,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read())
+
+
+def _wait_ready(address: typing.Tuple[str, int]) -> None:
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            if _request(address, "/ready")[0] == 200:
+                return
+        except OSError:
+            pass
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def _signup(address: typing.Tuple[str, int], email_address: str) -> int:
+    status, _ = _request(
+        address,
+        "/signup",
+        {
+            "full_name": "User",
+            "email_address": email_address,
+            "password": "pw",
+        },
+    )
+    return status
+
+
+@pytest.fixture
+def shared_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "events.db"))
+    monkeypatch.setenv("PASSWORD_HASHER", "sha512")
+
+
+def test_check_env() -> None:
+    check_env({}, workers=1)
+    with pytest.raises(ValueError):
+        check_env({}, workers=2)
+    with pytest.raises(ValueError):
+        check_env(
+            {
+                "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+                "SQLITE_DBNAME": "file:bank?mode=memory&cache=shared",
+            },
+            workers=2,
+        )
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": "bank.db",
+    }
+    with pytest.raises(ValueError, match="IDEMPOTENCY_KEYS_DBNAME"):
+        check_env(env, workers=2)
+    env["IDEMPOTENCY_KEYS_DBNAME"] = "keys.db"
+    check_env(env, workers=2)
+    with pytest.raises(ValueError):
+        check_env({**env, "BALANCE_VIEW": "y"}, workers=2)
+    check_env(
+        {**env, "BALANCE_VIEW": "y", "BALANCE_VIEW_DBNAME": "balances.db"},
+        workers=2,
+    )
+
+
+def test_worker(monkeypatch: pytest.MonkeyPatch) -> None:
+    sock = socket.create_server(("127.0.0.1", 0))
+    address = sock.getsockname()
+    worker = Worker(sock, threads=4, index=3)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    worker.ready.wait()
+
+    _wait_ready(address)
+    with ThreadPoolExecutor(8) as executor:
+        statuses = list(
+            executor.map(
+                lambda i: _signup(address, f"worker{i}@example.com"), range(16)
+            )
+        )
+    assert statuses == [201] * 16
+    assert _signup(address, "worker0@example.com") == 409
+
+    # Its metrics are labelled with its index.
+    monkeypatch.setitem(api.app.config, "ADMIN_API_KEY", "secret")
+    request = urllib.request.Request(
+        f"http://{address[0]}:{address[1]}/api/v1/metrics",
+        headers={"X-Admin-Key": "secret"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        text = response.read().decode()
+    assert 'banking_http_requests_total{worker="3",' in text
+    assert 'banking_commands_total{worker="3"}' in text
+
+    # A stopping worker says it's not ready, and finishes.
+    worker.stop()
+    client = api.app.test_client()
+    assert client.get("/api/v1/ready").status_code == 503
+    thread.join()
+    assert metrics.process_labels == ()
+    api.app.config["DRAINING"] = False
+    assert client.get("/api/v1/ready").status_code == 200
+    sock.close()
+
+
+def _run_supervisor(
+    supervisor: Supervisor, check: typing.Callable[[], None]
+) -> None:
+    errors = []
+
+    def run_check() -> None:
+        try:
+            supervisor.started.wait()
+            check()
+        except BaseException as err:  # pragma: no cover
+            errors.append(err)
+        finally:
+            supervisor.stop()
+
+    thread = threading.Thread(target=run_check)
+    thread.start()
+    supervisor.run()
+    thread.join()
+    assert errors == []
+    assert supervisor.pids == set()
+
+
+def test_supervisor(shared_store: None) -> None:
+    supervisor = Supervisor("127.0.0.1", 0, workers=2, threads=2)
+
+    def check() -> None:
+        assert supervisor.address is not None
+        _wait_ready(supervisor.address)
+
+        # Accounts opened in one worker are seen by the others.
+        assert _signup(supervisor.address, "alice@example.com") == 201
+        for _ in range(4):
+            assert _signup(supervisor.address, "alice@example.com") == 409
+
+        # A worker that dies is replaced, by one with its index.
+        assert sorted(supervisor._indexes.values()) == [0, 1]
+        pids = set(supervisor.pids)
+        os.kill(pids.pop(), signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while supervisor.pids & pids == supervisor.pids:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert sorted(supervisor._indexes.values()) == [0, 1]
+        _wait_ready(supervisor.address)
+
+    _run_supervisor(supervisor, check)
+
+
+def test_supervisor_kills_slow_workers(shared_store: None) -> None:
+    supervisor = Supervisor(
+        "127.0.0.1", 0, workers=1, threads=1, graceful_timeout=0
+    )
+    _run_supervisor(supervisor, lambda: None)
+
+
+def test_main(
+    shared_store: None,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    runs = []
+    monkeypatch.setattr(api.app, "run", lambda **kwargs: runs.append(kwargs))
+    assert main(["--port", "5001"]) == 0
+    assert runs == [{"host": "127.0.0.1", "port": 5001, "debug": True}]
+
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.popo")
+    assert main(["--workers", "2"]) == 2
+    assert "shared event store" in capsys.readouterr().err
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    assert main(["--workers", "2"]) == 2
+    assert "IDEMPOTENCY_KEYS_DBNAME" in capsys.readouterr().err
+    monkeypatch.setenv(
+        "IDEMPOTENCY_KEYS_DBNAME", str(tmp_path / "idempotency.db")
+    )
+
+    # SIGTERM stops the supervisor.
+    sigterm = signal.getsignal(signal.SIGTERM)
+
+    def terminate() -> None:
+        while signal.getsignal(signal.SIGTERM) is sigterm:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    thread = threading.Thread(target=terminate)
+    thread.start()
+    assert main(["--workers", "2", "--port", "0"]) == 0
+    thread.join()
+    assert signal.getsignal(signal.SIGTERM) is sigterm
+
+    # Workers that keep exiting as they start are given up on.
+    def exit_at_once(*args: typing.Any) -> None:
+        os._exit(1)
+
+    monkeypatch.setattr(Supervisor, "_run_worker", exit_at_once)
+    assert main(["--workers", "1", "--port", "0"]) == 1
+    assert "Workers exited 5 times in a row" in capsys.readouterr().err
+    assert signal.getsignal(signal.SIGTERM) is sigterm
+
+
+def test_supervisor_backs_off(shared_store: None) -> None:
+    supervisor = Supervisor(
+        "127.0.0.1", 0, workers=1, threads=1, max_rapid_failures=3
+    )
+    forks = []
+    spawn = supervisor._spawn
+
+    def count_forks(sock: socket.socket, index: int) -> None:
+        forks.append(time.monotonic())
+        spawn(sock, index)
+
+    # Each worker reports whether SIGTERM was blocked as it started.
+    read_end, write_end = os.pipe()
+
+    def exit_at_once(*args: typing.Any) -> None:
+        blocked = signal.pthread_sigmask(signal.SIG_BLOCK, [])
+        os.write(write_end, b"y" if signal.SIGTERM in blocked else b"n")
+        os._exit(1)
+
+    supervisor._spawn = count_forks  # type: ignore
+    supervisor._run_worker = exit_at_once  # type: ignore
+    with pytest.raises(RuntimeError):
+        supervisor.run()
+    assert len(forks) == 3
+    # Each worker is forked after a longer backoff than the last.
+    assert forks[1] - forks[0] >= 0.1
+    assert forks[2] - forks[1] >= 0.2
+    assert supervisor.pids == set()
+    os.close(write_end)
+    assert os.read(read_end, 10) == b"yyy"
+    os.close(read_end)
+    # The signals are unblocked in the supervisor.
+    assert signal.SIGTERM not in signal.pthread_sigmask(signal.SIG_BLOCK, [])
+
+    # A worker that stayed up past min_uptime resets the count.
+    pid = os.fork()
+    if not pid:  # pragma: no cover
+        os._exit(0)
+    supervisor.pids.add(pid)
+    supervisor._indexes[pid] = 0
+    supervisor._forked_at[pid] = time.monotonic() - supervisor.min_uptime
+    while supervisor.pids:
+        supervisor._reap()
+    assert supervisor.rapid_failures == 0
@@ -0,0 +1,163 @@
+# coding=utf-8
+
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import pytest
+
+from banking.applicationmodel import AccountNotFoundError, Bank, Transfer
+from banking.domainmodel import (
+    AccountShard,
+    InsufficientFundsError,
+    InvalidDeposit,
+)
+from banking.sharding import ShardSweeper
+
+
+def _shard_balances(app: Bank, account_id: typing.Any) -> typing.List[int]:
+    account = app.get_account(account_id)
+    return [
+        app.repository.get(AccountShard.create_id(account_id, i)).balance
+        for i in range(account.shards)
+    ]
+
+
+def test_sharded_credits() -> None:
+    app = Bank(env={"BALANCE_VIEW": "y"})
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(merchant, 100)
+    app.deposit_funds(alice, 1000)
+
+    app.shard_account(merchant, 4)
+    version = app.get_account(merchant).version
+
+    # Credits go to the shards, and balances are the sum.
+    for _ in range(10):
+        app.deposit_funds(merchant, 10)
+    app.transfer_funds(alice, merchant, 100)
+    assert app.get_account(merchant).version == version
+    assert app.get_account(merchant).balance == 100
+    assert sum(_shard_balances(app, merchant)) == 200
+    assert app.get_balance(merchant) == 300
+    assert app.get_balance(merchant, consistent=True) == 300
+
+    # Debits see the credits held by the shards.
+    app.withdraw_funds(merchant, 150)
+    assert app.get_account(merchant).balance == 150
+    assert sum(_shard_balances(app, merchant)) == 0
+    with pytest.raises(InsufficientFundsError):
+        app.transfer_funds(merchant, alice, 200)
+    app.deposit_funds(merchant, 50)
+    app.transfer_funds(merchant, alice, 200)
+    assert app.get_balance(merchant) == 0
+    assert app.get_balance(merchant, consistent=True) == 0
+    assert app.get_balance(alice) == 1100
+
+    with pytest.raises(InvalidDeposit):
+        app.deposit_funds(merchant, 0)
+
+
+def test_shard_account() -> None:
+    app = Bank()
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+
+    with pytest.raises(AccountNotFoundError):
+        app.shard_account(uuid4(), 2)
+    with pytest.raises(ValueError):
+        app.shard_account(merchant, 0)
+
+    app.shard_account(merchant, 2)
+    app.shard_account(merchant, 3)
+    assert _shard_balances(app, merchant) == [0, 0, 0]
+    with pytest.raises(ValueError):
+        app.shard_account(merchant, 2)
+
+
+def test_sweep_account() -> None:
+    app = Bank()
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    app.shard_account(merchant, 2)
+    for _ in range(5):
+        app.deposit_funds(merchant, 10)
+
+    assert app.sweep_account(merchant) == 50
+    assert app.sweep_account(merchant) == 0
+    assert app.get_account(merchant).balance == 50
+    assert app.get_balance(merchant) == 50
+
+
+def test_batch_transfers_from_sharded_account() -> None:
+    app = Bank()
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.shard_account(merchant, 2)
+    app.deposit_funds(merchant, 100)
+    app.deposit_funds(merchant, 100)
+
+    results = app.transfer_funds_batch(
+        [Transfer(merchant, alice, 150), Transfer(alice, merchant, 50)]
+    )
+    assert all(result.ok for result in results)
+    assert app.get_balance(merchant) == 100
+    assert app.get_account(merchant).balance == 100
+    assert app.get_balance(alice) == 100
+
+
+def test_shard_sweeper() -> None:
+    app = Bank()
+    app.notification_log.section_size = 3
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    other = app.open_account("Other", "other@example.com", "other")
+    app.shard_account(merchant, 2)
+    app.shard_account(merchant, 3)
+    app.shard_account(other, 2)
+    app.deposit_funds(merchant, 10)
+    app.deposit_funds(merchant, 10)
+
+    sweeper = ShardSweeper(app)
+    assert sweeper.run_once() == {merchant: 20}
+    assert sweeper.sharded.account_ids == [merchant, other]
+    assert sweeper.run_once() == {}
+
+    # Stopping a sweeper that was never started is a no-op.
+    sweeper.stop()
+
+
+def test_background_shard_sweeper() -> None:
+    app = Bank(env={"SHARD_SWEEP_PERIOD": "0.01"})
+    assert app.shard_sweeper is not None
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    app.shard_account(merchant, 2)
+    app.deposit_funds(merchant, 10)
+
+    deadline = time.monotonic() + 5
+    while app.get_account(merchant).balance != 10:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    app.close()
+    assert app.shard_sweeper._thread is None
+
+
+def test_concurrent_credits_to_sharded_account() -> None:
+    app = Bank(
+        env={
+            "COMMAND_RETRY_ATTEMPTS": "1000",
+            "COMMAND_RETRY_BACKOFF": "0.001",
+        }
+    )
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    app.shard_account(merchant, 8)
+
+    def credit(_: int) -> None:
+        for _ in range(20):
+            app.deposit_funds(merchant, 1)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(credit, range(8)))
+
+    assert app.get_balance(merchant) == 160
+    assert app.retry_stats.exhausted == 0
@@ -0,0 +1,149 @@
+# coding=utf-8
+
+import logging
+import time
+import typing
+from uuid import UUID
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.snapshotting import SnapshotWriter
+
+
+def _create_alice_with_deposits(app: Bank, deposits: int) -> UUID:
+    alice = app.open_account(
+        full_name="Alice",
+        email_address="alice@example.com",
+        password="alice",
+    )
+    for _ in range(deposits):
+        app.deposit_funds(credit_account_id=alice, amount_in_cents=100)
+    return alice
+
+
+def _snapshot_versions(app: Bank, account_id: UUID) -> typing.List[int]:
+    assert app.snapshots is not None
+    return [s.originator_version for s in app.snapshots.get(account_id)]
+
+
+def test_snapshotting_disabled_by_default() -> None:
+    app = Bank()
+    assert app.snapshots is None
+    assert app.snapshot_writer is None
+    app.close()
+
+
+def test_snapshotting_interval() -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "5"})
+
+    alice = _create_alice_with_deposits(app, 11)
+
+    # Snapshots are taken as part of saving every 5th event.
+    assert _snapshot_versions(app, alice) == [5, 10]
+
+    # Loading replays the latest snapshot and the events after it.
+    assert app.get_balance(alice) == 1100
+    app.withdraw_funds(debit_account_id=alice, amount_in_cents=100)
+    assert app.get_balance(alice) == 1000
+
+
+def test_snapshot_writer() -> None:
+    app = Bank(env={"IS_SNAPSHOTTING_ENABLED": "y"})
+    app.notification_log.section_size = 3
+    writer = SnapshotWriter(app, threshold=10)
+
+    alice = _create_alice_with_deposits(app, 5)
+    bob = app.open_account(
+        full_name="Bob",
+        email_address="bob@example.com",
+        password="bob",
+    )
+
+    # Nothing has grown past the threshold yet.
+    assert writer.run_once() == []
+
+    # Alice grows past the threshold and is snapshotted once.
+    for _ in range(5):
+        app.deposit_funds(credit_account_id=alice, amount_in_cents=100)
+    assert writer.run_once() == [alice]
+    assert writer.run_once() == []
+    assert _snapshot_versions(app, alice) == [11]
+    assert _snapshot_versions(app, bob) == []
+    assert app.get_balance(alice) == 1000
+
+    # A new writer picks up the existing snapshots.
+    writer = SnapshotWriter(app, threshold=10)
+    assert writer.run_once() == []
+    assert writer.last_versions.position == app.recorder.max_notification_id()
+
+    # Snapshots already taken by another writer are skipped.
+    for _ in range(10):
+        app.deposit_funds(credit_account_id=alice, amount_in_cents=100)
+    other_writer = SnapshotWriter(app, threshold=10)
+    other_writer.snapshot_versions[alice] = 11
+    assert writer.run_once() == [alice]
+    assert other_writer.run_once() == []
+    assert _snapshot_versions(app, alice) == [11, 21]
+
+    # Stopping a writer that was never started is a no-op.
+    writer.stop()
+
+    with pytest.raises(ValueError):
+        SnapshotWriter(app, threshold=0)
+
+
+def test_background_snapshot_writer() -> None:
+    app = Bank(
+        env={
+            "SNAPSHOTTING_THRESHOLD": "3",
+            "SNAPSHOTTING_PERIOD": "0.01",
+        }
+    )
+    assert app.snapshot_writer is not None
+
+    alice = _create_alice_with_deposits(app, 3)
+
+    deadline = time.monotonic() + 5
+    while not _snapshot_versions(app, alice):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert _snapshot_versions(app, alice) == [4]
+
+    app.close()
+    assert app.snapshot_writer._thread is None
+
+
+def test_background_snapshot_writer_carries_on_after_error(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    app = Bank(
+        env={
+            "SNAPSHOTTING_THRESHOLD": "3",
+            "SNAPSHOTTING_PERIOD": "0.01",
+        }
+    )
+    take_snapshot = app.take_snapshot
+    errors: typing.List[Exception] = []
+
+    def take_snapshot_failing_once(
+        *args: typing.Any, **kwargs: typing.Any
+    ) -> None:
+        if not errors:
+            errors.append(OSError("disk I/O error"))
+            raise errors[0]
+        take_snapshot(*args, **kwargs)
+
+    monkeypatch.setattr(app, "take_snapshot", take_snapshot_failing_once)
+
+    # The pass that failed is logged, and the next one snapshots.
+    with caplog.at_level(logging.ERROR, logger="banking.snapshotting"):
+        alice = _create_alice_with_deposits(app, 3)
+        deadline = time.monotonic() + 5
+        while not _snapshot_versions(app, alice):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    assert len(errors) == 1
+    assert "SnapshotWriter failed" in caplog.text
+    assert "disk I/O error" in caplog.text
+    app.close()
@@ -0,0 +1,196 @@
+# coding=utf-8
+
+import time
+import typing
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+from eventsourcing.persistence import IntegrityError
+
+from banking.applicationmodel import (
+    AccountNotFoundError,
+    Bank,
+    StandingOrderNotFoundError,
+)
+from banking.domainmodel import (
+    AccountClosedError,
+    InsufficientFundsError,
+    InvalidAmount,
+)
+from banking.scheduling import StandingOrderScheduler
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DAY = 24 * 60 * 60
+
+
+def test_create_standing_order(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    order_id = app.create_standing_order(alice, bob, 100, DAY, NOW)
+    order = app.get_standing_order(order_id)
+    assert (
+        order.debit_account_id,
+        order.credit_account_id,
+        order.amount_in_cents,
+    ) == (alice, bob, 100)
+    assert order.next_due_at == NOW
+    assert not order.is_cancelled
+
+    with pytest.raises(ValueError):
+        app.create_standing_order(alice, alice, 100, DAY, NOW)
+    with pytest.raises(InvalidAmount):
+        app.create_standing_order(alice, bob, 0, DAY, NOW)
+    with pytest.raises(ValueError):
+        app.create_standing_order(alice, bob, 100, 0, NOW)
+    unknown = uuid4()
+    with pytest.raises(AccountNotFoundError):
+        app.create_standing_order(alice, unknown, 100, DAY, NOW)
+    app.close_account(bob)
+    with pytest.raises(AccountClosedError):
+        app.create_standing_order(alice, bob, 100, DAY, NOW)
+
+    app.cancel_standing_order(order_id)
+    app.cancel_standing_order(order_id)
+    assert app.get_standing_order(order_id).is_cancelled
+    assert app.repository.get(order_id).version == 2
+    with pytest.raises(StandingOrderNotFoundError):
+        app.get_standing_order(unknown)
+
+
+def test_standing_orders_with_balance_view(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank(BALANCE_VIEW="y")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 1000)
+    order_id = app.create_standing_order(alice, bob, 100, DAY, NOW)
+    app.deposit_funds(alice, 5)
+    assert app.get_balance(alice) == 1005
+    app.execute_standing_orders(alice, [order_id], NOW)
+    app.cancel_standing_order(order_id)
+    assert (app.get_balance(alice), app.get_balance(bob)) == (905, 100)
+    assert app.balances is not None
+    assert app.balances.position == app.recorder.max_notification_id()
+
+
+def test_execute_standing_orders(
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    carol = app.open_account("Carol", "carol@example.com", "carol")
+    app.deposit_funds(alice, 150)
+    rent = app.create_standing_order(alice, bob, 100, DAY, NOW)
+    gift = app.create_standing_order(alice, carol, 30, DAY, NOW)
+    later = app.create_standing_order(
+        alice, carol, 10, DAY, NOW + timedelta(days=1)
+    )
+
+    results = app.execute_standing_orders(alice, [rent, gift, later], NOW)
+    assert [r.order_id for r in results] == [rent, gift]
+    assert all(r.ok for r in results)
+    assert app.get_balance(alice) == 20
+    assert app.get_balance(bob) == 100
+    order = app.get_standing_order(rent)
+    assert order.next_due_at == NOW + timedelta(days=1)
+
+    # Orders already made are skipped.
+    assert app.execute_standing_orders(alice, [rent], NOW) == []
+
+    # An order that can't be paid is due again the next time,
+    # one to a closed account is cancelled.
+    app.close_account(carol)
+    results = app.execute_standing_orders(
+        alice, [rent, gift], NOW + timedelta(days=1)
+    )
+    assert isinstance(results[0].error, InsufficientFundsError)
+    assert isinstance(results[1].error, AccountClosedError)
+    assert not app.get_standing_order(rent).is_cancelled
+    assert app.get_standing_order(rent).next_due_at == NOW + timedelta(days=2)
+    assert app.get_standing_order(gift).is_cancelled
+    assert app.get_balance(alice) == 20
+
+    # Each due transfer has its own transaction.
+    app.deposit_funds(alice, 100)
+    results = app.execute_standing_orders(
+        alice, [rent], NOW + timedelta(days=2)
+    )
+    transactions = app.get_transactions(bob).entries
+    assert len({t.transaction_id for t in transactions}) == 2
+    assert transactions[0].transaction_id == results[0].transaction_id
+
+
+def test_scheduler(
+    monkeypatch: pytest.MonkeyPatch, make_bank: typing.Callable[..., Bank]
+) -> None:
+    app = make_bank()
+    payers = [
+        app.open_account("Payer", f"payer{i}@example.com", "payer")
+        for i in range(4)
+    ]
+    payees = [
+        app.open_account("Payee", f"payee{i}@example.com", "payee")
+        for i in range(3)
+    ]
+    for payer in payers[:3]:
+        app.deposit_funds(payer, 1000)
+    orders = [
+        app.create_standing_order(payer, payee, 100, DAY, NOW)
+        for payer in payers
+        for payee in payees
+    ]
+    app.cancel_standing_order(orders[0])
+    scheduler = StandingOrderScheduler(app, workers=2, batch_size=2)
+
+    # Nothing is due before the orders are.
+    run = scheduler.run_once(NOW - timedelta(seconds=1))
+    assert (run.due, run.executed, run.failed) == (0, 0, 0)
+
+    run = scheduler.run_once(NOW)
+    assert (run.due, run.executed, run.failed, run.deferred) == (11, 8, 3, 0)
+    assert run.orders_per_second > 0
+    assert app.get_balance(payers[0]) == 800
+    assert app.get_balance(payers[1]) == 700
+    assert app.get_balance(payers[3]) == 0
+    assert app.get_balance(payees[0]) == 200
+    assert app.get_balance(payees[1]) == 300
+
+    # The orders are due again after their interval.
+    assert scheduler.run_once(NOW).due == 0
+    assert scheduler.run_once(NOW + timedelta(days=1)).due == 11
+
+    # Orders saved by another worker after every retry are
+    # left due for the next run.
+    def conflict(*args: typing.Any) -> None:
+        raise IntegrityError()
+
+    monkeypatch.setattr(app, "execute_standing_orders", conflict)
+    run = scheduler.run_once(NOW + timedelta(days=2))
+    assert (run.due, run.deferred, run.executed) == (11, 11, 0)
+    assert len(scheduler.schedule.due(NOW + timedelta(days=2))) == 11
+
+    with pytest.raises(ValueError):
+        StandingOrderScheduler(app, workers=0)
+
+
+def test_scheduler_thread(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank(STANDING_ORDER_PERIOD="0.01", STANDING_ORDER_WORKERS="1")
+    assert app.standing_order_scheduler is not None
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit_funds(alice, 100)
+    order_id = app.create_standing_order(
+        alice, bob, 10, DAY, datetime.now(timezone.utc)
+    )
+    deadline = time.monotonic() + 10
+    while app.get_balance(bob) != 10:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    app.close()
+    assert app.get_standing_order(order_id).version == 2
+    # Stopping a stopped scheduler does nothing.
+    app.standing_order_scheduler.stop()
@@ -0,0 +1,92 @@
+# coding=utf-8
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from banking import api
+
+
+def test_import_is_lazy() -> None:
+    # In a new interpreter, as this one has imported everything.
+    code = """
+import sys
+import banking.api as api
+assert api._app is None and api._bank is None
+lazy = [
+    "flask",
+    "flask_jwt_extended",
+    "flask_restful",
+    "banking.applicationmodel",
+    "banking.resources",
+    "tabnanny",
+    "concurrent.futures.process",
+    "banking.scheduling",
+    "banking.sharding",
+    "banking.snapshotting",
+]
+print([name for name in lazy if name in sys.modules])
+assert api.app is api.app
+assert api._bank is None
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).parent.parent,
+    )
+    assert (result.returncode, result.stderr) == (0, "")
+    assert result.stdout == "[]\n"
+
+
+def test_create_app() -> None:
+    app = api.create_app({"ADMIN_API_KEY": "secret", "DRAINING": True})
+    assert app is not api.app
+    assert app.config["SECRET_KEY"] == api.SECRET_KEY
+    assert app.config["ADMIN_API_KEY"] == "secret"
+    response = app.test_client().get("/api/v1/ready")
+    assert (response.status_code, response.json) == (503, {"ready": False})
+    response = api.app.test_client().get("/api/v1/ready")
+    assert response.status_code == 200
+    with pytest.raises(AttributeError):
+        api.application
+
+
+def test_bench_startup(tmp_path: Path) -> None:
+    # Only that it runs and checks its budgets, as the timings
+    # of a test run say little.
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.bench_startup",
+        "--runs",
+        "1",
+        "--accounts",
+        "20",
+        "--output",
+        str(tmp_path / "startup.json"),
+    ]
+    budgets = [
+        "--import-budget-ms",
+        "60000",
+        "--first-request-budget-ms",
+        "60000",
+        "--populated-first-request-budget-ms",
+        "60000",
+    ]
+    cwd = Path(__file__).parent.parent
+    result = subprocess.run(
+        command + budgets, capture_output=True, text=True, cwd=cwd
+    )
+    assert (result.returncode, result.stderr) == (0, "")
+    medians = json.loads((tmp_path / "startup.json").read_text())
+    assert {"import_ms", "populated_first_request_ms"} <= set(medians)
+
+    result = subprocess.run(
+        command + budgets[:-1] + ["0"], capture_output=True, text=True, cwd=cwd
+    )
+    assert result.returncode == 1
+    assert "over budget: first request when populated" in result.stdout
@@ -0,0 +1,134 @@
+# coding=utf-8
+
+import json
+import typing
+from pathlib import Path
+
+import pytest
+
+from banking import api
+from banking.applicationmodel import Bank
+
+API_V1_PREFIX = "/api/v1"
+
+
+def test_token_revocations(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    assert app.password_version(alice) == 0
+    assert not app.is_token_revoked(alice, 0)
+
+    app.deposit_funds(alice, 100)
+    app.change_password(alice, "alice", "alice2")
+    # The version of the PasswordChanged event.
+    assert app.password_version(alice) == 3
+    assert app.is_token_revoked(alice, 0)
+    assert not app.is_token_revoked(alice, 3)
+
+    app.close_account(bob)
+    assert app.is_token_revoked(bob, 0)
+    assert not app.is_token_revoked(alice, 3)
+
+
+def test_rehash_does_not_revoke(tmp_path: Path) -> None:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    app = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.close()
+
+    app = Bank(env={**env, "PASSWORD_HASHER": "scrypt"})
+    app.authenticate("alice@example.com", "alice")
+    assert app.get_account(alice).password.startswith("scrypt$")
+    assert app.password_version(alice) == 0
+    assert not app.is_token_revoked(alice, 0)
+    app.close()
+
+
+def test_revoked_by_another_process(tmp_path: Path) -> None:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    app = Bank(env=env)
+    other = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert not other.is_token_revoked(alice, 0)
+
+    app.close_account(alice)
+    assert other.is_token_revoked(alice, 0)
+
+    # A new process reads the revocations when first asked.
+    third = Bank(env=env)
+    assert third.token_revocations.position == 0
+    assert third.is_token_revoked(alice, 0)
+    app.close()
+    other.close()
+    third.close()
+
+
+def test_identity_from_token(
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = api.app.test_client()
+    token = signup_and_login(client, "token1@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # The account is only loaded by the command itself.
+    api.bank().repository.gets.clear()
+    response = client.post(
+        API_V1_PREFIX + "/deposit",
+        data=json.dumps({"amount": 100}),
+        content_type="application/json",
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert sum(api.bank().repository.gets.values()) == 1
+
+    # Reading the history doesn't load the account at all.
+    api.bank().repository.gets.clear()
+    response = client.get(
+        API_V1_PREFIX + "/account/transactions", headers=headers
+    )
+    assert response.status_code == 200
+    assert sum(api.bank().repository.gets.values()) == 0
+
+    # Errors of tokens are answered by the JWTManager, others
+    # by the Api, as they were.
+    response = client.get(API_V1_PREFIX + "/account/balance")
+    assert response.status_code == 401
+    assert response.json == {"msg": "Missing Authorization Header"}
+    response = client.get(
+        API_V1_PREFIX + "/account/balance",
+        headers={"Authorization": "Bearer not-a-token"},
+    )
+    assert response.status_code == 422
+    assert client.get(API_V1_PREFIX + "/deposit").status_code == 405
+
+
+def test_closed_while_authorized(
+    monkeypatch: pytest.MonkeyPatch,
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = api.app.test_client()
+    token = signup_and_login(client, "token2@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(API_V1_PREFIX + "/close_account", headers=headers)
+    assert response.status_code == 200
+
+    # A request that was authorized just before the account was
+    # closed, in another process, is refused by the account.
+    monkeypatch.setattr(api.bank(), "is_token_revoked", lambda *args: False)
+    response = client.post(
+        API_V1_PREFIX + "/deposit",
+        data=json.dumps({"amount": 100}),
+        content_type="application/json",
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert "closed" in response.json["error"]
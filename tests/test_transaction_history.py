@@ -0,0 +1,289 @@
+# coding=utf-8
+
+import json
+import typing
+from pathlib import Path
+from uuid import UUID
+
+import pytest
+
+from banking.api import app as flask_app
+from banking.applicationmodel import Bank, Transfer
+from banking.projections import (
+    InMemoryTransactionView,
+    ProjectionConflict,
+    SQLiteTransactionView,
+    TransactionHistory,
+    construct_transaction_view,
+)
+
+API_V1_PREFIX = "/api/v1"
+
+
+def _env(tmp_path: Path, sqlite: bool) -> typing.Dict[str, str]:
+    env = {"PASSWORD_HASHER": "sha512"}
+    if sqlite:
+        env.update(
+            PERSISTENCE_MODULE="eventsourcing.sqlite",
+            SQLITE_DBNAME=str(tmp_path / "events.db"),
+            TRANSACTION_HISTORY_DBNAME=str(tmp_path / "history.db"),
+        )
+    return env
+
+
+def _history(
+    app: Bank, account_id: UUID
+) -> typing.List[typing.Tuple[str, int, typing.Optional[UUID]]]:
+    page = app.get_transactions(account_id, limit=100)
+    assert page.next_cursor is None
+    return [
+        (e.kind, e.amount_in_cents, e.counterparty_id) for e in page.entries
+    ]
+
+
+def _activity(
+    app: Bank, open_account: typing.Callable[..., UUID]
+) -> typing.Tuple[UUID, UUID]:
+    alice = open_account(app, "alice")
+    bob = open_account(app, "bob")
+    app.deposit_funds(alice, 1000)
+    app.transfer_funds(alice, bob, 300)
+    app.withdraw_funds(bob, 100)
+    # Credits to a sharded account are recorded by its shards.
+    app.shard_account(bob, 2)
+    app.transfer_funds(alice, bob, 50)
+    app.deposit_funds(bob, 7)
+    app.transfer_funds_batch(
+        [Transfer(bob, alice, 20), Transfer(bob, alice, 20)]
+    )
+    return alice, bob
+
+
+@pytest.mark.parametrize("sqlite", [False, True])
+def test_history(
+    tmp_path: Path,
+    sqlite: bool,
+    open_account: typing.Callable[..., UUID],
+) -> None:
+    app = Bank(env=_env(tmp_path, sqlite))
+    alice, bob = _activity(app, open_account)
+    # Built when it is first read, from the start of the log.
+    assert app._transaction_history is None
+
+    # Transfers are entered once, not again as debits and credits.
+    assert _history(app, alice) == (
+        [
+            ("transfer_in", 20, bob),
+            ("transfer_in", 20, bob),
+            ("transfer_out", 50, bob),
+            ("transfer_out", 300, bob),
+            ("credit", 1000, None),
+        ]
+    )
+    assert _history(app, bob) == (
+        [
+            ("transfer_out", 20, alice),
+            ("transfer_out", 20, alice),
+            ("credit", 7, None),
+            ("transfer_in", 50, alice),
+            ("debit", 100, None),
+            ("transfer_in", 300, alice),
+        ]
+    )
+    entries = app.get_transactions(alice).entries
+    assert not any(entry.pending for entry in entries)
+    assert entries[-1].transaction_id is None
+    assert entries[-2].transaction_id is not None
+    assert entries[0].timestamp > entries[-1].timestamp
+    assert app.get_transactions(UUID(int=1)).entries == []
+
+    if sqlite:
+        # The history resumes from its saved position.
+        app.close()
+        app = Bank(env=_env(tmp_path, sqlite))
+        assert app.transaction_history.pull() == 0
+        assert len(_history(app, bob)) == 6
+    app.close()
+
+
+@pytest.mark.parametrize("sqlite", [False, True])
+def test_pages(
+    tmp_path: Path, sqlite: bool, open_account: typing.Callable[..., UUID]
+) -> None:
+    app = Bank(env=_env(tmp_path, sqlite))
+    alice = open_account(app, "alice")
+    for amount in range(1, 8):
+        app.deposit_funds(alice, amount)
+
+    amounts = []
+    cursor = None
+    while True:
+        page = app.get_transactions(alice, cursor, limit=3)
+        amounts.append([e.amount_in_cents for e in page.entries])
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert amounts == [[7, 6, 5], [4, 3, 2], [1]]
+
+    # A page that ends with the history has no next page.
+    page = app.get_transactions(alice, limit=7)
+    assert len(page.entries) == 7
+    assert page.next_cursor is None
+    app.close()
+
+
+@pytest.mark.parametrize("sqlite", [False, True])
+def test_transfers_settled_across_sections(
+    tmp_path: Path,
+    sqlite: bool,
+    open_account: typing.Callable[..., UUID],
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    alice, bob = _activity(app, open_account)
+
+    # Process one notification at a time, so every debit and
+    # credit of a transfer settles an entry saved earlier.
+    app.notification_log.section_size = 1
+    history = TransactionHistory(
+        app,
+        construct_transaction_view(
+            str(tmp_path / "history.db") if sqlite else None
+        ),
+    )
+    history.pull()
+    for account_id in (alice, bob):
+        assert history.page(
+            account_id, limit=100
+        ) == app.transaction_history.page(account_id, limit=100)
+
+
+def test_reverse_transfers_in_batch(
+    open_account: typing.Callable[..., UUID],
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    alice, carol = open_account(app, "alice"), open_account(app, "carol")
+    app.deposit_funds(alice, 100)
+    app.transfer_funds_batch(
+        [Transfer(alice, carol, 100), Transfer(carol, alice, 100)]
+    )
+    app.deposit_funds(alice, 100)
+    assert _history(app, alice) == (
+        [
+            ("credit", 100, None),
+            ("transfer_in", 100, carol),
+            ("transfer_out", 100, carol),
+            ("credit", 100, None),
+        ]
+    )
+    assert _history(app, carol) == [
+        ("transfer_out", 100, alice),
+        ("transfer_in", 100, alice),
+    ]
+    for account_id in (alice, carol):
+        entries = app.get_transactions(account_id).entries
+        assert not any(entry.pending for entry in entries)
+
+
+def test_transfers_recorded_without_transaction_ids(
+    open_account: typing.Callable[..., UUID],
+    make_bank: typing.Callable[..., Bank],
+) -> None:
+    app = make_bank()
+    alice, bob = open_account(app, "alice"), open_account(app, "bob")
+    app.deposit_funds(alice, 100)
+    # As transfers were recorded before their debits and
+    # credits carried the transaction ID.
+    from_account, to_account = app.get_account(alice), app.get_account(bob)
+    from_account.transfer_validation(bob, 30, UUID(int=1))
+    from_account.debit(30)
+    to_account.credit(30)
+    app.save(from_account, to_account)
+    app.deposit_funds(bob, 30)
+    assert _history(app, bob) == [
+        ("credit", 30, None),
+        ("transfer_in", 30, alice),
+    ]
+    entries = app.get_transactions(bob).entries
+    assert not any(entry.pending for entry in entries)
+
+
+@pytest.mark.parametrize("sqlite", [False, True])
+def test_view_conflict(tmp_path: Path, sqlite: bool) -> None:
+    view = construct_transaction_view(
+        str(tmp_path / "history.db") if sqlite else None
+    )
+    view.put([], [], 5, 0)
+    with pytest.raises(ProjectionConflict):
+        view.put([], [], 6, 4)
+    assert view.get_position() == 5
+
+
+def test_construct_transaction_view(tmp_path: Path) -> None:
+    assert isinstance(
+        construct_transaction_view(None), InMemoryTransactionView
+    )
+    view = construct_transaction_view(str(tmp_path / "history.db"))
+    assert isinstance(view, SQLiteTransactionView)
+    assert view.get_position() == 0
+    view.close()
+
+
+def test_transactions_endpoint(
+    signup_and_login: typing.Callable[[typing.Any, str], str],
+) -> None:
+    client = flask_app.test_client()
+    token = signup_and_login(client, "history1@example.com")
+    other_token = signup_and_login(client, "history2@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+    other_id = client.get(
+        API_V1_PREFIX + "/account",
+        headers={"Authorization": f"Bearer {other_token}"},
+    ).json["identity"]
+
+    for amount in (100, 200):
+        client.post(
+            API_V1_PREFIX + "/deposit",
+            data=json.dumps({"amount": amount}),
+            content_type="application/json",
+            headers=headers,
+        )
+    client.post(
+        API_V1_PREFIX + "/transfer",
+        data=json.dumps({"amount": 50, "to_account_id": other_id}),
+        content_type="application/json",
+        headers=headers,
+    )
+
+    response = client.get(
+        API_V1_PREFIX + "/account/transactions?limit=2", headers=headers
+    )
+    assert response.status_code == 200
+    transactions = response.json["transactions"]
+    assert [(t["type"], t["amount"]) for t in transactions] == [
+        ("transfer_out", "50"),
+        ("credit", "200"),
+    ]
+    assert transactions[0]["counterparty_id"] == other_id
+    assert transactions[0]["transaction_id"] is not None
+    assert transactions[1]["counterparty_id"] is None
+    assert transactions[1]["transaction_id"] is None
+    assert response.json["next_cursor"] == transactions[1]["id"]
+
+    cursor = response.json["next_cursor"]
+    response = client.get(
+        API_V1_PREFIX + f"/account/transactions?limit=2&cursor={cursor}",
+        headers=headers,
+    )
+    assert [
+        (t["type"], t["amount"]) for t in response.json["transactions"]
+    ] == [("credit", "100")]
+    assert response.json["next_cursor"] is None
+
+    for query in ("limit=0", "limit=501", "limit=x", "cursor=0", "cursor=x"):
+        response = client.get(
+            API_V1_PREFIX + f"/account/transactions?{query}", headers=headers
+        )
+        assert response.status_code == 400
+        assert response.json == {"error": "Invalid limit or cursor"}
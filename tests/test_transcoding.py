@@ -0,0 +1,184 @@
+# coding=utf-8
+
+import os
+import typing
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+from eventsourcing.application import Application
+
+from banking.applicationmodel import Bank
+from banking.cli import main
+from banking.transcoding import (
+    COMPACT,
+    COMPRESSED,
+    CompactTranscoder,
+    construct_transcoder,
+    migrate_events,
+)
+
+
+def _transcoder(
+    compression_threshold: typing.Optional[int] = None,
+) -> CompactTranscoder:
+    transcoder = CompactTranscoder(compression_threshold)
+    Application().register_transcodings(transcoder)
+    return transcoder
+
+
+def test_round_trip() -> None:
+    transcoder = _transcoder()
+    state = {
+        "timestamp": datetime.now(timezone.utc),
+        "to_account_id": uuid4(),
+        "amount_in_cents": 12345,
+        "negative": -(2**70),
+        "zero": 0,
+        "flags": [None, True, False],
+        "unicode": "zażółć",
+        "nested": {"password_hash": "x" * 200, 1: 1.5},
+        "bytes": b"\x00\xff",
+        "before_epoch": datetime(1900, 1, 1, tzinfo=timezone.utc),
+        "local": datetime(2020, 1, 1, tzinfo=timezone(timedelta(hours=2))),
+        "decimal": Decimal("1.10"),
+    }
+    encoded = transcoder.encode(state)
+    assert encoded[0] == COMPACT
+    assert transcoder.decode(encoded) == state
+    # Tuples come back as lists, as they do from JSON.
+    assert transcoder.decode(transcoder.encode({"t": (1, 2)})) == {"t": [1, 2]}
+
+
+def test_smaller_than_json() -> None:
+    transcoder = _transcoder()
+    json = construct_transcoder("json")
+    Application().register_transcodings(json)
+    state = {
+        "timestamp": datetime.now(timezone.utc),
+        "to_account_id": uuid4(),
+        "amount_in_cents": 100,
+        "transaction_id": uuid4(),
+    }
+    # The marker and the dict, then the timestamp, the UUIDs and the
+    # amount, each after its interned field name.
+    assert len(transcoder.encode(state)) == 1 + 2 + 11 + 2 * 19 + 5
+    assert len(json.encode(state)) > 4 * len(transcoder.encode(state))
+
+    # State recorded as JSON is still read.
+    assert transcoder.decode(json.encode(state)) == state
+
+
+def test_compression() -> None:
+    transcoder = _transcoder(compression_threshold=100)
+    large = {"full_name": "a" * 200}
+    encoded = transcoder.encode(large)
+    assert encoded[0] == COMPRESSED
+    assert len(encoded) < 100
+    assert transcoder.decode(encoded) == large
+    # Below the threshold, or where it wouldn't help, it isn't compressed.
+    assert transcoder.encode({"full_name": "a" * 50})[0] == COMPACT
+    incompressible = {"bytes": os.urandom(200)}
+    encoded = transcoder.encode(incompressible)
+    assert encoded[0] == COMPACT
+    assert transcoder.decode(encoded) == incompressible
+
+
+def test_errors() -> None:
+    transcoder = _transcoder()
+    with pytest.raises(TypeError):
+        transcoder.encode({"set": {1}})
+    with pytest.raises(TypeError):
+        CompactTranscoder().decode(transcoder.encode({"d": Decimal(1)}))
+    with pytest.raises(ValueError):
+        transcoder.decode(bytes([COMPACT, 99]))
+    with pytest.raises(ValueError):
+        construct_transcoder("xml")
+
+
+@pytest.mark.parametrize("threshold", ["", "64"])
+def test_bank(tmp_path: Path, threshold: str) -> None:
+    env = {
+        "PASSWORD_HASHER": "sha512",
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    # A store written as JSON carries on with compact events.
+    app = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit_funds(alice, 100)
+    app.close()
+
+    env.update(
+        EVENT_TRANSCODER="compact",
+        EVENT_COMPRESSION_THRESHOLD=threshold,
+        SNAPSHOTTING_INTERVAL="3",
+    )
+    app = Bank(env=env)
+    assert isinstance(app.mapper.transcoder, CompactTranscoder)
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.transfer_funds(alice, bob, 30)
+    app.deposit_funds(alice, 5)
+    app.close()
+
+    app = Bank(env=env)
+    assert app.get_balance(alice) == 75
+    assert app.get_balance(bob) == 30
+    assert app.snapshots is not None
+    snapshot = next(app.snapshots.get(alice, desc=True, limit=1))
+    assert snapshot.originator_version == 3
+    app.authenticate("bob@example.com", "bob")
+    markers = {n.state[0] for n in app.recorder.select_notifications(1, 10)}
+    assert ord("{") in markers and COMPACT in markers
+    app.close()
+
+
+def test_migrate_events(make_bank: typing.Callable[..., Bank]) -> None:
+    app = make_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    for amount in range(1, 6):
+        app.deposit_funds(alice, amount)
+    app.notification_log.section_size = 3
+    target = make_bank(EVENT_TRANSCODER="compact")
+
+    # A section at a time, until a section comes back empty.
+    copied = migrate_events(app, target.recorder, target.mapper)
+    assert list(copied) == [3, 6]
+    assert target.repository.get(alice).balance == 15
+    assert target.recorder.select_notifications(1, 1)[0].state[0] == COMPACT
+
+
+def test_migrate_events_command(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setenv("PASSWORD_HASHER", "sha512")
+    monkeypatch.setenv("PERSISTENCE_MODULE", "eventsourcing.sqlite")
+    monkeypatch.setenv("SQLITE_DBNAME", str(tmp_path / "bank.db"))
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    for amount in range(1, 6):
+        app.deposit_funds(alice, amount)
+    app.close()
+
+    target = str(tmp_path / "compact.db")
+    assert (
+        main(["migrate-events", target, "--compression-threshold", "64"]) == 0
+    )
+    assert capsys.readouterr().out == "6 events copied\n"
+
+    # The new store has the same events, in the same order.
+    app = Bank(env={"SQLITE_DBNAME": target, "EVENT_TRANSCODER": "compact"})
+    assert app.get_balance(alice) == 15
+    notifications = app.recorder.select_notifications(1, 10)
+    assert [n.originator_version for n in notifications] == [1, 2, 3, 4, 5, 6]
+    assert notifications[0].state[0] == COMPRESSED
+    assert notifications[1].state[0] == COMPACT
+    app.close()
+
+    # Events are only migrated to an empty store.
+    assert main(["migrate-events", target]) == 1
+    assert "empty store" in capsys.readouterr().err